@@ -1,22 +1,55 @@
+import concurrent.futures
 import shlex
+import threading
 from abc import abstractmethod
 from pathlib import Path
 
 from modules.cloud.BaseFileSync import BaseFileSync
+from modules.cloud.ChunkedFileTransfer import ChunkedFileTransfer, SSHChunkRemote
 from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
 
 import fabric
 
+#files changed shortly before an incremental scan can have an older timestamp than the scan, due to
+#timestamp granularity and clock differences between processes. They are listed again by the next scan
+SCAN_CURSOR_MARGIN=10
+#every n-th scan of a directory lists all files again, to remove deleted files from the manifest
+FULL_SCAN_INTERVAL=60
+
 
 class BaseSSHFileSync(BaseFileSync):
     def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
         super().__init__(config, secrets)
         self.sync_connection=fabric.Connection(host=secrets.host,port=secrets.port,user=secrets.user)
+        #bounds the number of connections that transfer batches of files at the same time, over all directories.
+        #Batches always use their own connection, sync_connection is only used by the calling thread
+        self.connection_slots=threading.BoundedSemaphore(max(config.sync_streams,1))
+
+        #remote manifests of synced directories, and the remote time of their last scan
+        self.__manifests={}
+        self.__scan_cursors={}
+        self.__scan_counts={}
+
+        #large files are transferred in content addressed chunks, which makes transfers resumable
+        self.chunk_remote=SSHChunkRemote(config,secrets)
+        self.chunked_transfer=ChunkedFileTransfer(
+            remote=self.chunk_remote,
+            remote_chunk_dir=f'{config.remote_dir}/.chunks',
+            local_chunk_dir=config.transfer_cache_dir,
+            chunk_size=config.transfer_chunk_size * 1024 * 1024,
+            workers=config.transfer_workers,
+            compress=config.transfer_compression,
+        )
 
     def close(self):
+        self.chunk_remote.close()
         if self.sync_connection:
             self.sync_connection.close()
 
+    def __is_chunked(self,size: int):
+        chunked_size=self.config.sync_resume_size * 1024 * 1024
+        return chunked_size > 0 and size >= chunked_size
+
     @abstractmethod
     def upload_files(self,local_files,remote_dir: Path):
         pass
@@ -40,7 +73,10 @@ class BaseSSHFileSync(BaseFileSync):
 
         self.sync_connection.open()
         self.sync_connection.run(f'mkdir -p {shlex.quote(remote.parent.as_posix())}',in_stream=False)
-        self.upload_file(local_file=local,remote_file=remote)
+        if self.__is_chunked(local.stat().st_size):
+            self.chunked_transfer.upload(local_file=local,remote_file=remote)
+        else:
+            self.upload_file(local_file=local,remote_file=remote)
 
 
     def sync_up_dir(self,local : Path,remote: Path,recursive: bool,sync_info=None):
@@ -52,7 +88,11 @@ class BaseSSHFileSync(BaseFileSync):
         for local_entry in local.iterdir():
             if local_entry.is_file():
                 remote_entry=remote/local_entry.name
-                if self.__needs_upload(local=local_entry,remote=remote_entry,sync_info=sync_info):
+                if not self.__needs_upload(local=local_entry,remote=remote_entry,sync_info=sync_info):
+                    continue
+                if self.__is_chunked(local_entry.stat().st_size):
+                    self.chunked_transfer.upload(local_file=local_entry,remote_file=remote_entry)
+                else:
                     files.append(local_entry)
             elif recursive and local_entry.is_dir():
                 self.sync_up_dir(local=local_entry,remote=remote/local_entry.name,recursive=True,sync_info=sync_info)
@@ -64,38 +104,91 @@ class BaseSSHFileSync(BaseFileSync):
         if not self.__needs_download(local=local,remote=remote,sync_info=sync_info):
             return
         local.parent.mkdir(parents=True,exist_ok=True)
-        self.download_file(local_file=local,remote_file=remote)
+        if self.__is_chunked(sync_info[remote]['size']):
+            self.chunked_transfer.download(local_file=local,remote_file=remote)
+        else:
+            self.download_file(local_file=local,remote_file=remote)
 
     def sync_down_dir(self,local : Path,remote : Path,filter=None):
-        sync_info=self.__get_sync_info(remote)
+        try:
+            self.__sync_down_dir(local=local,remote=remote,filter=filter)
+        except Exception:
+            #the manifest may contain files that were deleted remotely. Start again with a full scan
+            self.__manifests.pop(remote,None)
+            raise
+
+    def __sync_down_dir(self,local : Path,remote : Path,filter=None):
+        sync_info=self.__get_manifest(remote)
         dirs={}
+        large_files=[]
         for remote_entry in sync_info:
             local_entry=local / remote_entry.relative_to(remote)
             if ((filter is not None and not filter(remote_entry))
                 or not self.__needs_download(local=local_entry,remote=remote_entry,sync_info=sync_info)):
                 continue
 
+            if self.__is_chunked(sync_info[remote_entry]['size']):
+                large_files.append((local_entry,remote_entry))
+                continue
+
             if local_entry.parent not in dirs:
                 dirs[local_entry.parent]=[]
             dirs[local_entry.parent].append(remote_entry)
 
-        for dir,files in dirs.items():
+        for dir in set(dirs.keys()) | {local_file.parent for local_file,_ in large_files}:
             dir.mkdir(parents=True,exist_ok=True)
-            self.download_files(local_dir=dir,remote_files=files)
 
+        #directories and large files are transferred concurrently, each one in its own stream
+        futures=[]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(self.config.sync_streams,1)) as executor:
+            for dir,files in dirs.items():
+                futures.append(executor.submit(self.download_files,local_dir=dir,remote_files=files))
+            for local_file,remote_file in large_files:
+                futures.append(executor.submit(
+                    self.chunked_transfer.download,local_file=local_file,remote_file=remote_file))
+
+        for future in futures:
+            if (exception:=future.exception()):
+                raise exception
+
+    def __get_manifest(self,remote : Path):
+        #the first scan lists all files. Later scans only list files that changed since the previous scan, by their
+        #status change time: files moved into the directory keep their old modification time, but get a new ctime
+        scan_count=self.__scan_counts.get(remote,0)
+        self.__scan_counts[remote]=scan_count + 1
+
+        if remote not in self.__manifests or scan_count % FULL_SCAN_INTERVAL == 0:
+            manifest,remote_time=self.__scan(remote)
+        else:
+            changes,remote_time=self.__scan(remote,newer_than=self.__scan_cursors[remote] - SCAN_CURSOR_MARGIN)
+            manifest=self.__manifests[remote]
+            manifest.update(changes)
+
+        self.__manifests[remote]=manifest
+        self.__scan_cursors[remote]=remote_time
+        return manifest
 
     def __get_sync_info(self,remote : Path):
-        cmd = f'find {shlex.quote(remote.as_posix())} -type f -exec stat --printf "%n\\t%s\\t%Y\\n"' + ' {} \\;'
+        info,_=self.__scan(remote)
+        return info
+
+    def __scan(self,remote : Path,newer_than: float | None=None):
+        #a single find process prints all entries, instead of starting one stat process per file.
+        #The remote time is printed first, it is the cursor for the next incremental scan
+        newer=f' -newerct @{newer_than:.3f}' if newer_than is not None else ''
+        cmd=f'date +%s.%N && find {shlex.quote(remote.as_posix())} -type f{newer} -printf "%p\\t%s\\t%T@\\n"'
         self.sync_connection.open()
         result=self.sync_connection.run(cmd,warn=True,hide=True,in_stream=False)
+        lines=result.stdout.splitlines()
+        remote_time=float(lines[0])
         info={}
-        for line in result.stdout.splitlines():
+        for line in lines[1:]:
             sp=line.split('\t')
             info[Path(sp[0])]={
                     'size': int(sp[1]),
-                    'mtime': int(sp[2])
+                    'mtime': float(sp[2])
                 }
-        return info
+        return info,remote_time
 
     @staticmethod
     def __needs_upload(local : Path,remote : Path,sync_info):
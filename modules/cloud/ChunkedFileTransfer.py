@@ -0,0 +1,234 @@
+import concurrent.futures
+import contextlib
+import hashlib
+import inspect
+import io
+import json
+import os
+import shlex
+import threading
+from abc import ABCMeta, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+
+from modules.cloud import chunk_store
+from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
+
+import fabric
+
+
+class ChunkRemote(metaclass=ABCMeta):
+    """
+    The remote side of a chunked transfer. All methods can be called from several threads at the same time.
+    """
+
+    @abstractmethod
+    def run_chunk_store(self, args: list[str]) -> dict:
+        """
+        Runs the chunk_store module on the remote host with the given arguments, and returns its parsed output.
+        """
+
+    @abstractmethod
+    def put_bytes(self, data: bytes, remote_path: str):
+        pass
+
+    @abstractmethod
+    def read_range(self, remote_path: str, offset: int, length: int) -> bytes:
+        pass
+
+
+class SSHChunkRemote(ChunkRemote):
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
+        self.config = config
+        self.secrets = secrets
+        # connections are returned to the pool after every call, so there are never more connections than calls
+        # running at the same time, no matter how many threads make them
+        self.__idle_connections = []
+        self.__connections_lock = threading.Lock()
+        self.__source = inspect.getsource(chunk_store)
+
+    @contextlib.contextmanager
+    def __connection(self) -> Iterator[fabric.Connection]:
+        with self.__connections_lock:
+            connection = self.__idle_connections.pop() if self.__idle_connections else None
+        if connection is None:
+            connection = fabric.Connection(host=self.secrets.host, port=self.secrets.port, user=self.secrets.user)
+
+        try:
+            connection.open()
+            yield connection
+        finally:
+            with self.__connections_lock:
+                self.__idle_connections.append(connection)
+
+    def run_chunk_store(self, args: list[str]) -> dict:
+        # the OneTrainer venv can read compressed chunks, the system python is only a fallback
+        venv_python = shlex.quote(f"{self.config.onetrainer_dir}/venv/bin/python")
+        python = f"$(test -x {venv_python} && echo {venv_python} || echo python3)"
+        cmd = f"{python} - {' '.join(shlex.quote(arg) for arg in args)}"
+        with self.__connection() as connection:
+            result = connection.run(cmd, hide=True, in_stream=io.StringIO(self.__source))
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def put_bytes(self, data: bytes, remote_path: str):
+        with self.__connection() as connection:
+            sftp = connection.sftp()
+            sftp.putfo(io.BytesIO(data), remote_path + chunk_store.PARTIAL_SUFFIX)
+            sftp.posix_rename(remote_path + chunk_store.PARTIAL_SUFFIX, remote_path)
+
+    def read_range(self, remote_path: str, offset: int, length: int) -> bytes:
+        with self.__connection() as connection, connection.sftp().open(remote_path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def close(self):
+        with self.__connections_lock:
+            for connection in self.__idle_connections:
+                connection.close()
+            self.__idle_connections = []
+
+
+class LocalChunkRemote(ChunkRemote):
+    """
+    A loopback remote that runs the chunk_store module in this process, on paths of the local file system. Used to
+    test chunked transfers without a remote host.
+    """
+
+    def __init__(self, can_compress: bool = True):
+        self.can_compress = can_compress
+
+    def run_chunk_store(self, args: list[str]) -> dict:
+        output = chunk_store.run(args)
+        output["can_compress"] = output["can_compress"] and self.can_compress
+        # the same serialization as the output of a remote process
+        return json.loads(json.dumps(output))
+
+    def put_bytes(self, data: bytes, remote_path: str):
+        with open(remote_path + chunk_store.PARTIAL_SUFFIX, "wb") as f:
+            f.write(data)
+        os.replace(remote_path + chunk_store.PARTIAL_SUFFIX, remote_path)
+
+    def read_range(self, remote_path: str, offset: int, length: int) -> bytes:
+        with open(remote_path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+
+class ChunkedFileTransfer:
+    """
+    Transfers large files as content addressed chunks.
+
+    The sending side splits the file into chunks named by their sha256 hash. Only chunks that are not already present
+    on the receiving side are transferred, so an interrupted transfer continues where it stopped, and repeated
+    chunks are only sent once. Uploaded chunks are compressed with zstd if both sides support it and the chunk gets
+    smaller. Downloads only hash the remote file, and read the missing chunks directly from it by their offset, so the
+    remote host doesn't write a second copy of the file. The receiving side verifies every chunk and assembles the file
+    in a single pass.
+    """
+
+    def __init__(
+            self,
+            remote: ChunkRemote,
+            remote_chunk_dir: str,
+            local_chunk_dir: str,
+            chunk_size: int,
+            workers: int,
+            compress: bool,
+    ):
+        self.remote = remote
+        self.remote_chunk_dir = remote_chunk_dir
+        self.local_chunk_dir = local_chunk_dir
+        self.chunk_size = chunk_size
+        self.workers = max(workers, 1)
+        self.compress = compress
+
+    def __run_parallel(self, fn, tasks: list):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(fn, task) for task in tasks]
+        for future in futures:
+            if (exception := future.exception()):
+                raise exception
+
+    def upload(self, local_file: Path, remote_file: Path):
+        print(f"Uploading {str(local_file)} in chunks...")
+        listing = self.remote.run_chunk_store(["list", self.remote_chunk_dir])
+        present = {chunk_store.chunk_digest(name): name for name in listing["result"]}
+        compress = self.compress and listing["can_compress"] and chunk_store.can_compress()
+
+        chunk_count = max((local_file.stat().st_size + self.chunk_size - 1) // self.chunk_size, 1)
+        chunks = [None] * chunk_count
+        # repeated chunks hashed at the same time by several workers are only uploaded by the first one,
+        # the others wait for the name of the uploaded chunk
+        uploads = {}
+        uploaded = [0]
+        lock = threading.Lock()
+
+        def upload_chunk(index: int):
+            with open(local_file, "rb") as f:
+                f.seek(index * self.chunk_size)
+                data = f.read(self.chunk_size)
+
+            digest = hashlib.sha256(data).hexdigest()
+            with lock:
+                name = present.get(digest)
+                upload = uploads.get(digest)
+                is_uploader = name is None and upload is None
+                if is_uploader:
+                    upload = uploads[digest] = concurrent.futures.Future()
+
+            if is_uploader:
+                try:
+                    digest, payload, compressed = chunk_store.encode_chunk(data, compress)
+                    name = chunk_store.chunk_file_name(digest, compressed)
+                    self.remote.put_bytes(payload, f"{self.remote_chunk_dir}/{name}")
+                except Exception as e:
+                    upload.set_exception(e)
+                    raise
+                upload.set_result(name)
+                with lock:
+                    uploaded[0] += 1
+            elif name is None:
+                name = upload.result()
+            chunks[index] = name
+
+        self.__run_parallel(upload_chunk, list(range(chunk_count)))
+        print(f"Uploaded {uploaded[0]} of {chunk_count} chunks of {str(local_file)}")
+
+        manifest = {
+            "chunk_dir": self.remote_chunk_dir,
+            "chunks": chunks,
+            "target": remote_file.as_posix(),
+            "remove_chunks": True,
+        }
+        manifest_path = f"{self.remote_chunk_dir}/{hashlib.sha256(remote_file.as_posix().encode()).hexdigest()}.json"
+        self.remote.put_bytes(json.dumps(manifest).encode(), manifest_path)
+        self.remote.run_chunk_store(["assemble", manifest_path])
+
+    def download(self, local_file: Path, remote_file: Path):
+        print(f"\nDownloading {str(local_file)} in chunks...")
+        listing = self.remote.run_chunk_store(["hash", remote_file.as_posix(), str(self.chunk_size)])
+        digests = listing["result"]["digests"]
+
+        os.makedirs(self.local_chunk_dir, exist_ok=True)
+        present = {chunk_store.chunk_digest(name) for name in chunk_store.list_chunks(self.local_chunk_dir)}
+
+        # repeated chunks are only read once, from their first offset
+        missing = {}
+        for index, digest in enumerate(digests):
+            if digest not in present and digest not in missing:
+                missing[digest] = index * self.chunk_size
+
+        def download_chunk(digest: str):
+            data = self.remote.read_range(remote_file.as_posix(), missing[digest], self.chunk_size)
+            # fails if the remote file was changed after it was hashed
+            data = chunk_store.decode_chunk(digest, data, compressed=False)
+            # chunks are stored uncompressed locally, they are only read once to assemble the file
+            chunk_store.write_chunk(self.local_chunk_dir, data, compress=False)
+
+        self.__run_parallel(download_chunk, list(missing.keys()))
+        print(f"Downloaded {len(missing)} of {len(digests)} chunks of {str(local_file)}")
+
+        local_chunks = [chunk_store.find_chunk(self.local_chunk_dir, digest) for digest in digests]
+        chunk_store.assemble_file(self.local_chunk_dir, local_chunks, str(local_file))
+
+        chunk_store.remove_chunks(self.local_chunk_dir, local_chunks)
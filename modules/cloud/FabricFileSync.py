@@ -10,8 +10,11 @@ class FabricFileSync(BaseSSHFileSync):
     def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
         super().__init__(config,secrets)
 
+    def __connect(self):
+        return fabric.Connection(host=self.secrets.host,port=self.secrets.port,user=self.secrets.user)
+
     def __upload_batch(self,local_files,remote_dir : Path):
-        with fabric.Connection(host=self.secrets.host,port=self.secrets.port,user=self.secrets.user) as connection:
+        with self.connection_slots, self.__connect() as connection:
             for local_file in local_files:
                 self.__put(connection,local_file=local_file,remote_file=remote_dir / local_file.name)
 
@@ -26,13 +29,14 @@ class FabricFileSync(BaseSSHFileSync):
                 max_batch_size=100)
 
     def __download_batch(self,local_dir : Path,remote_files):
-        with fabric.Connection(host=self.secrets.host,port=self.secrets.port,user=self.secrets.user) as connection:
+        with self.connection_slots, self.__connect() as connection:
             for remote_file in remote_files:
                 self.__get(connection,local_file=local_dir / remote_file.name,remote_file=remote_file)
 
     def download_files(self,local_dir : Path,remote_files):
+        #directories are downloaded concurrently, so even a single file can't use the shared sync_connection
         if len(remote_files) == 1:
-            self.__get(self.sync_connection,local_file=local_dir/remote_files[0].name,remote_file=remote_files[0])
+            self.__download_batch(local_dir=local_dir,remote_files=remote_files)
         else:
             self._run_batches(
                 lambda remote_files:self.__download_batch(local_dir=local_dir,remote_files=remote_files),
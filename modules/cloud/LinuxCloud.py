@@ -1,12 +1,11 @@
-import pickle
 import shlex
 import threading
-import time
 from pathlib import Path
 
 from modules.cloud.BaseCloud import BaseCloud
 from modules.cloud.FabricFileSync import FabricFileSync
 from modules.cloud.NativeSCPFileSync import NativeSCPFileSync
+from modules.cloud.SSHCallbackStream import SSHCallbackStream
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
 from modules.util.commands.TrainCommands import TrainCommands
 from modules.util.config.TrainConfig import TrainConfig
@@ -22,12 +21,12 @@ class LinuxCloud(BaseCloud):
         super().__init__(config)
         self.connection=None
         self.callback_connection=None
-        self.command_connection=None
+        self.callback_stream=None
         self.tensorboard_tunnel_stop=None
 
         name=config.cloud.run_id if config.cloud.detach_trainer else get_string_timestamp()
         self.callback_file=f'{config.cloud.remote_dir}/{name}.callback'
-        self.command_pipe=f'{config.cloud.remote_dir}/{name}.command'
+        self.command_file=f'{config.cloud.remote_dir}/{name}.command'
         self.config_file=f'{config.cloud.remote_dir}/{name}.json'
         self.exit_status_file=f'{config.cloud.remote_dir}/{name}.exit'
         self.log_file=f'{config.cloud.remote_dir}/{name}.log'
@@ -47,12 +46,9 @@ class LinuxCloud(BaseCloud):
             self.connection=fabric.Connection(host=secrets.host,port=secrets.port,user=secrets.user)
             self.connection.open()
 
+            #callbacks and commands share one long-lived channel on a separate connection, so they are not delayed by file transfers:
             self.callback_connection=fabric.Connection(host=secrets.host,port=secrets.port,user=secrets.user)
-
-            self.command_connection=fabric.Connection(host=secrets.host,port=secrets.port,user=secrets.user)
-            #the command connection isn't used for long periods of time; prevent remote from closing it:
-            self.command_connection.open()
-            self.command_connection.transport.set_keepalive(30)
+            self.callback_stream=SSHCallbackStream(self.callback_connection,config.onetrainer_dir,self.callback_file,self.command_file)
 
             match config.file_sync:
                 case CloudFileSync.NATIVE_SCP:
@@ -64,15 +60,9 @@ class LinuxCloud(BaseCloud):
             if self.connection:
                 self.connection.close()
                 self.connection=None
-            if self.command_connection:
-                self.command_connection.close()
             raise
 
 
-    def setup(self):
-        super().setup()
-        self.connection.run(f'mkfifo {shlex.quote(self.command_pipe)}',warn=True,hide=True,in_stream=False)
-
     def _install_onetrainer(self, update: bool=False):
         config=self.config.cloud
         parent=Path(config.onetrainer_dir).parent.as_posix()
@@ -112,10 +102,10 @@ class LinuxCloud(BaseCloud):
     def close(self):
         if self.tensorboard_tunnel_stop is not None:
             self.tensorboard_tunnel_stop.set()
+        if self.callback_stream:
+            self.callback_stream.close()
         if self.callback_connection:
             self.callback_connection.close()
-        if self.command_connection:
-            self.command_connection.close()
         if self.file_sync:
             self.file_sync.close()
         if self.connection:
@@ -147,14 +137,15 @@ class LinuxCloud(BaseCloud):
 
         cmd+=f' && {config.onetrainer_dir}/run-cmd.sh train_remote --config-path={shlex.quote(self.config_file)} \
                                                                    --callback-path={shlex.quote(self.callback_file)} \
-                                                                   --command-path={shlex.quote(self.command_pipe)}'
+                                                                   --command-path={shlex.quote(self.command_file)}'
 
         if config.detach_trainer:
             self.connection.run(f'rm -f {self.exit_status_file}',in_stream=False)
 
             cmd=f"({cmd} ; exit_status=$? ; echo $exit_status > {self.exit_status_file}; exit $exit_status)"
 
-            #if the callback file still exists 10 seconds after the trainer has exited, the client must be detached, because the clients reads and deletes this file:
+            #if the callback file still exists 10 seconds after the trainer has exited, the client must be detached,
+            #because the client removes this file after it has received the end of the callback stream:
             cmd+=f" && (sleep 10 && test -f {shlex.quote(self.callback_file)} && {self._get_action_cmd(config.on_detached_finish)} || true) \
                     || (sleep 10 && test -f {shlex.quote(self.callback_file)} && {self._get_action_cmd(config.on_detached_error)})"
 
@@ -175,66 +166,21 @@ class LinuxCloud(BaseCloud):
 
 
 
+    def upload_config(self,commands : TrainCommands=None):
+        #a new trainer is started; remove the callbacks and commands of a previous run with the same id:
+        self.connection.run(f'rm -f {shlex.quote(self.callback_file)} {shlex.quote(self.callback_file)}.offset \
+                                  {shlex.quote(self.command_file)}',in_stream=False)
+        super().upload_config(commands)
+
     def exec_callback(self,callbacks : TrainCallbacks):
-        #callbacks are a file instead of a named pipe, because of the blocking behaviour of linux pipes:
+        #the trainer writes callbacks to a file instead of a pipe, because of the blocking behaviour of linux pipes:
         #writing to pipes on the cloud can slow down training, and would cause issues in case
-        #of a detached cloud trainer.
-        #
-        #use 'rename' as the atomic operation, to avoid race conditions between reader and writer:
-
-        file=f'{shlex.quote(self.callback_file)}'
-        cmd=f'mv "{file}" "{file}.read" \
-           && cat "{file}.read" \
-           && rm "{file}.read"'
-
-        self.callback_connection.open()
-        in_file,out_file,err_file=self.callback_connection.client.exec_command(cmd)
-
-        try:
-            while True:
-                try:
-                    while not out_file.channel.recv_ready() and not out_file.channel.exit_status_ready():
-                        #even though reading from out_file is blocking, it doesn't block if there
-                        #is *no* data available yet, which results in an unpickling error.
-                        #wait until there is at least some data before reading:
-                        time.sleep(0.1)
-                    name=pickle.load(out_file)
-                except EOFError:
-                    return
-                params=pickle.load(out_file)
-
-                fun=getattr(callbacks,name)
-                fun(*params)
-        finally:
-            in_file.close()
-            out_file.close()
-            err_file.close()
-
+        #of a detached cloud trainer. The callback stream follows this file and forwards new callbacks immediately.
+        self.callback_stream.receive(callbacks,timeout=1.0)
 
     def send_commands(self,commands : TrainCommands):
-        try:
-            self.command_connection.open()
-            in_file,out_file,err_file=self.command_connection.client.exec_command(
-                f'test -e {shlex.quote(self.command_pipe)} \
-                && cat > {shlex.quote(self.command_pipe)}'
-            )
-            try:
-                pickle.dump(commands,in_file)
-                in_file.flush()
-                in_file.channel.shutdown_write()
-            finally:
-                in_file.close()
-                out_file.close()
-                err_file.close()
-
-            commands.reset()
-        except Exception:
-            if not self.command_connection.is_connected:
-                print("\n\nCommand SSH connection lost. Attempting to reconnect...")
-                self.command_connection.open()
-                self.send_commands(commands)
-            else:
-                raise
+        self.callback_stream.send_commands(commands)
+        commands.reset()
 
     def _upload_config_file(self,local : Path):
         self.file_sync.sync_up_file(local,Path(self.config_file))
@@ -18,7 +18,8 @@ class NativeSCPFileSync(BaseSSHFileSync):
         args=self.base_args.copy()
         args.extend(str(file) for file in local_files)
         args.append(f"{self.secrets.user}@{self.secrets.host}:{remote_dir.as_posix()}")
-        subprocess.run(args).check_returncode()
+        with self.connection_slots:
+            subprocess.run(args).check_returncode()
 
     def upload_files(self,local_files,remote_dir : Path):
         self._run_batches(
@@ -31,7 +32,8 @@ class NativeSCPFileSync(BaseSSHFileSync):
         args=self.base_args.copy()
         args.extend(f"{self.secrets.user}@{self.secrets.host}:{file.as_posix()}" for file in remote_files)
         args.append(local_dir)
-        subprocess.run(args).check_returncode()
+        with self.connection_slots:
+            subprocess.run(args).check_returncode()
 
     def download_files(self,local_dir : Path,remote_files):
         self._run_batches(
@@ -0,0 +1,121 @@
+import inspect
+import pickle
+import shlex
+import threading
+import time
+
+from modules.cloud import callback_stream
+from modules.util.callbacks.TrainCallbacks import TrainCallbacks
+from modules.util.commands.TrainCommands import TrainCommands
+
+import fabric
+import paramiko
+
+
+class SSHCallbackStream:
+    """
+    The client side of the callback stream of a cloud trainer.
+
+    The follower of the callback_stream module runs on the remote host in a single SSH channel, which stays open for
+    the whole training run. Callbacks are received from stdout of that channel, and commands are sent to its stdin.
+    If the channel is lost, it is opened again on the next call, and continues after the last acknowledged message.
+    """
+
+    def __init__(self, connection: fabric.Connection, onetrainer_dir: str, stream_file: str, command_file: str):
+        self.connection = connection
+
+        # the follower only needs the standard library, the system python is a fallback if there is no venv yet
+        venv_python = shlex.quote(f"{onetrainer_dir}/venv/bin/python")
+        python = f"$(test -x {venv_python} && echo {venv_python} || echo python3)"
+        self.__cmd = (
+            f"{python} -u -c {shlex.quote(inspect.getsource(callback_stream))} follow "
+            f"{shlex.quote(stream_file)} {shlex.quote(command_file)}"
+        )
+
+        self.__lock = threading.Lock()
+        self.__channel = None
+        self.__buffer = bytearray()
+        self.__ended = False
+
+    def __open(self):
+        # must be called with the lock held
+        if self.__channel is None or self.__channel.closed:
+            self.connection.open()
+            transport = self.connection.client.get_transport()
+            # the channel can be idle for a long time, prevent the remote from closing it
+            transport.set_keepalive(30)
+            channel = transport.open_session()
+            channel.exec_command(self.__cmd)
+            self.__channel = channel
+            self.__buffer = bytearray()
+        return self.__channel
+
+    def __close_channel(self, channel):
+        with self.__lock:
+            if self.__channel is channel:
+                self.__channel = None
+        channel.close()
+
+    def __send(self, channel, kind: int, name: str, payload: bytes):
+        channel.sendall(callback_stream.encode_frame(kind, name, payload))
+
+    def receive(self, callbacks: TrainCallbacks, timeout: float):
+        """
+        Receives callbacks for up to timeout seconds, and passes them to callbacks.
+        """
+        if self.__ended:
+            time.sleep(timeout)
+            return
+
+        with self.__lock:
+            channel = self.__open()
+
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            channel.settimeout(remaining)
+            try:
+                data = channel.recv(callback_stream.READ_SIZE)
+            except TimeoutError:
+                return
+
+            if not data:
+                exit_status = channel.recv_exit_status()
+                error = channel.recv_stderr(65536).decode(errors="replace") if channel.recv_stderr_ready() else ""
+                self.__close_channel(channel)
+                if exit_status != 0:
+                    raise RuntimeError(f"callback stream exited with status {exit_status}: {error}")
+                return
+
+            self.__buffer += data
+            for frame in callback_stream.decode_frames(self.__buffer):
+                match frame.kind:
+                    case callback_stream.KIND_OFFSET:
+                        with self.__lock:
+                            self.__send(channel, callback_stream.KIND_ACK, "", frame.payload)
+                    case callback_stream.KIND_END:
+                        self.__ended = True
+                    case callback_stream.KIND_PROGRESS | callback_stream.KIND_STATUS | callback_stream.KIND_SAMPLE:
+                        fun = getattr(callbacks, frame.name)
+                        fun(*pickle.loads(frame.payload))
+
+    def __send_command(self, payload: bytes):
+        with self.__lock:
+            self.__send(self.__open(), callback_stream.KIND_COMMAND, "commands", payload)
+
+    def send_commands(self, commands: TrainCommands):
+        payload = pickle.dumps(commands)
+        try:
+            self.__send_command(payload)
+        except (OSError, EOFError, paramiko.SSHException):
+            print("\n\nCallback stream SSH connection lost. Attempting to reconnect...")
+            with self.__lock:
+                if self.__channel is not None:
+                    self.__channel.close()
+                    self.__channel = None
+            self.__send_command(payload)
+
+    def close(self):
+        with self.__lock:
+            if self.__channel is not None:
+                self.__channel.close()
+                self.__channel = None
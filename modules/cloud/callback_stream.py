@@ -0,0 +1,287 @@
+"""
+Framed message stream between a cloud trainer and the local client.
+
+The remote trainer appends messages to a stream file using a StreamWriter. The client runs this module on the remote
+host over a single long-lived SSH channel, which follows the stream file and forwards new messages to stdout. Commands
+and acknowledgements are sent back to stdin of the same channel:
+
+    python -c <source> follow <stream_file> <command_file>
+
+Because the trainer only ever writes to a local file, a slow or detached client can never block training. If the
+client falls behind, progress messages that have been superseded by a newer message of the same name are skipped.
+Acknowledged offsets are stored next to the stream file, so a reattached client continues after the last message
+that was processed. When the trainer has finished and the client acknowledged the end of the stream, the stream file is
+removed. If it still exists after the trainer has exited, no client is attached.
+
+This module only depends on the standard library, because it is also executed with the remote python interpreter.
+"""
+import collections
+import contextlib
+import os
+import struct
+import sys
+import threading
+
+MAGIC = b"OT"
+VERSION = 1
+
+# magic, version, kind, name length, payload length
+HEADER = struct.Struct(">2sBBHI")
+OFFSET = struct.Struct(">Q")
+
+KIND_PROGRESS = 1  # only the latest message of each name is relevant
+KIND_STATUS = 2
+KIND_SAMPLE = 3
+KIND_COMMAND = 4
+KIND_OFFSET = 5  # follower to client: stream offset after all previously forwarded messages
+KIND_ACK = 6  # client to follower: all messages up to this stream offset were processed
+KIND_END = 7  # the trainer has finished, no other messages follow
+
+OFFSET_SUFFIX = ".offset"
+POLL_INTERVAL = 0.05
+READ_SIZE = 1024 * 1024
+
+
+class Frame:
+    def __init__(self, kind: int, name: str, payload: bytes, end: int = 0):
+        self.kind = kind
+        self.name = name
+        self.payload = payload
+        # stream offset after this frame
+        self.end = end
+
+
+def encode_frame(kind: int, name: str, payload: bytes = b"") -> bytes:
+    name_bytes = name.encode()
+    return HEADER.pack(MAGIC, VERSION, kind, len(name_bytes), len(payload)) + name_bytes + payload
+
+
+def decode_frames(buffer: bytearray, offset: int = 0) -> list[Frame]:
+    """
+    Decodes all complete frames at the start of buffer, and removes them from the buffer.
+    """
+    frames = []
+    position = 0
+    while len(buffer) - position >= HEADER.size:
+        magic, version, kind, name_length, payload_length = HEADER.unpack_from(buffer, position)
+        if magic != MAGIC:
+            raise ValueError("corrupted message stream")
+        if version != VERSION:
+            raise ValueError(f"unsupported message stream version {version}, update OneTrainer on both sides")
+
+        name_start = position + HEADER.size
+        payload_start = name_start + name_length
+        end = payload_start + payload_length
+        if end > len(buffer):
+            break
+
+        frames.append(Frame(
+            kind,
+            bytes(buffer[name_start:payload_start]).decode(),
+            bytes(buffer[payload_start:end]),
+            offset + end,
+        ))
+        position = end
+
+    del buffer[:position]
+    return frames
+
+
+class StreamWriter:
+    """
+    Appends frames to a stream file from a background thread. write() never blocks on file IO. Progress frames are
+    coalesced if they are written faster than the file can take them, other frames are dropped if more than
+    max_pending_bytes are waiting.
+
+    The stream file is owned by the background thread, which closes it after close() was called and the end frame
+    was written. The writer can be used as a context manager.
+    """
+
+    def __init__(self, path: str, max_pending_bytes: int = 256 * 1024 * 1024):
+        self.max_pending_bytes = max_pending_bytes
+
+        self.__file = open(path, "wb")  # noqa: SIM115
+        self.__condition = threading.Condition()
+        self.__pending = collections.deque()
+        self.__pending_bytes = 0
+        self.__latest_progress = {}
+        self.__closed = False
+
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def write(self, kind: int, name: str, payload: bytes):
+        frame = encode_frame(kind, name, payload)
+        with self.__condition:
+            if self.__closed:
+                return
+            if kind == KIND_PROGRESS:
+                self.__latest_progress[name] = frame
+            elif kind != KIND_STATUS and self.__pending_bytes + len(frame) > self.max_pending_bytes:
+                print(f"message stream is full, dropping {name}")
+                return
+            else:
+                self.__pending.append(frame)
+                self.__pending_bytes += len(frame)
+            self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__latest_progress and not self.__closed:
+                    self.__condition.wait()
+                frames = list(self.__pending) + list(self.__latest_progress.values())
+                self.__pending.clear()
+                self.__pending_bytes = 0
+                self.__latest_progress.clear()
+                closed = self.__closed
+
+            for frame in frames:
+                self.__file.write(frame)
+            if closed:
+                self.__file.write(encode_frame(KIND_END, ""))
+            self.__file.flush()
+
+            if closed:
+                self.__file.close()
+                return
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StreamReader:
+    """
+    Reads the frames that were appended to a stream file since the last call, without blocking.
+
+    The stream file is opened by the first read() after it was created, and stays open until close() is called. The
+    reader can be used as a context manager.
+    """
+
+    def __init__(self, path: str, offset: int = 0):
+        self.path = path
+        self.offset = offset
+        self.__buffer = bytearray()
+        self.__file = None
+
+    def read(self) -> list[Frame]:
+        if self.__file is None:
+            try:
+                self.__file = open(self.path, "rb")  # noqa: SIM115
+            except FileNotFoundError:
+                return []
+            self.__file.seek(self.offset)
+
+        while data := self.__file.read(READ_SIZE):
+            self.__buffer += data
+
+        frames = decode_frames(self.__buffer, self.offset)
+        if frames:
+            self.offset = frames[-1].end
+        return frames
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_offset(path: str) -> int:
+    try:
+        with open(path + OFFSET_SUFFIX) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_offset(path: str, offset: int):
+    with open(path + OFFSET_SUFFIX + ".partial", "w") as f:
+        f.write(str(offset))
+    os.replace(path + OFFSET_SUFFIX + ".partial", path + OFFSET_SUFFIX)
+
+
+def skip_superseded_progress(frames: list[Frame]) -> list[Frame]:
+    last_progress = {frame.name: i for i, frame in enumerate(frames) if frame.kind == KIND_PROGRESS}
+    return [
+        frame for i, frame in enumerate(frames)
+        if frame.kind != KIND_PROGRESS or last_progress[frame.name] == i
+    ]
+
+
+def follow(stream_path: str, command_path: str):
+    disconnected = threading.Event()
+    finished = threading.Event()
+    end_offset = [None]
+
+    def receive():
+        buffer = bytearray()
+        with open(command_path, "ab") as command_file:
+            while data := os.read(sys.stdin.fileno(), READ_SIZE):
+                buffer += data
+                for frame in decode_frames(buffer):
+                    if frame.kind == KIND_COMMAND:
+                        command_file.write(encode_frame(frame.kind, frame.name, frame.payload))
+                        command_file.flush()
+                    elif frame.kind == KIND_ACK:
+                        offset = OFFSET.unpack(frame.payload)[0]
+                        write_offset(stream_path, offset)
+                        if end_offset[0] is not None and offset >= end_offset[0]:
+                            finished.set()
+        disconnected.set()
+
+    receive_thread = threading.Thread(target=receive, daemon=True)
+    receive_thread.start()
+
+    out = sys.stdout.buffer
+    with StreamReader(stream_path, read_offset(stream_path)) as reader:
+        while not disconnected.is_set() and not finished.is_set():
+            frames = reader.read()
+            if not frames:
+                disconnected.wait(POLL_INTERVAL)
+                continue
+
+            ended = any(frame.kind == KIND_END for frame in frames)
+            if ended:
+                end_offset[0] = reader.offset
+
+            for frame in skip_superseded_progress(frames):
+                out.write(encode_frame(frame.kind, frame.name, frame.payload))
+            out.write(encode_frame(KIND_OFFSET, "", OFFSET.pack(reader.offset)))
+            out.flush()
+
+            if ended:
+                # wait for the client to process everything before the stream is removed
+                while not disconnected.is_set() and not finished.wait(POLL_INTERVAL):
+                    pass
+
+    if finished.is_set():
+        for path in [stream_path, stream_path + OFFSET_SUFFIX, command_path]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def main(args: list[str]):
+    command = args[0]
+    if command == "follow":
+        follow(args[1], args[2])
+    else:
+        raise ValueError(f"unknown command {command}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
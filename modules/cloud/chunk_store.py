@@ -0,0 +1,155 @@
+"""
+Content addressed chunk storage used by chunked cloud transfers.
+
+This module only depends on the standard library and the optional zstandard package, because it is also sent to the
+remote host and executed there with the remote python interpreter:
+
+    python - list <chunk_dir>
+    python - hash <file> <chunk_size>
+    python - assemble <manifest_file>
+    python - remove <chunk_dir> <digest>...
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_SUFFIX = ".zst"
+PARTIAL_SUFFIX = ".partial"
+
+# chunks are only stored compressed if that saves at least 10%. Model weights barely compress
+COMPRESSION_RATIO_THRESHOLD = 0.9
+
+
+def can_compress() -> bool:
+    return zstandard is not None
+
+
+def chunk_file_name(digest: str, compressed: bool) -> str:
+    return digest + (COMPRESSED_SUFFIX if compressed else "")
+
+
+def chunk_digest(file_name: str) -> str:
+    return file_name.removesuffix(COMPRESSED_SUFFIX)
+
+
+def encode_chunk(data: bytes, compress: bool) -> tuple[str, bytes, bool]:
+    digest = hashlib.sha256(data).hexdigest()
+    if compress and zstandard is not None:
+        compressed_data = zstandard.ZstdCompressor(level=3).compress(data)
+        if len(compressed_data) < len(data) * COMPRESSION_RATIO_THRESHOLD:
+            return digest, compressed_data, True
+    return digest, data, False
+
+
+def decode_chunk(digest: str, payload: bytes, compressed: bool) -> bytes:
+    if compressed:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read compressed chunks")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+
+    if hashlib.sha256(payload).hexdigest() != digest:
+        raise ValueError(f"chunk {digest} is damaged")
+    return payload
+
+
+def list_chunks(chunk_dir: str) -> list[str]:
+    if not os.path.isdir(chunk_dir):
+        return []
+    return [name for name in os.listdir(chunk_dir) if not name.endswith(PARTIAL_SUFFIX)]
+
+
+def find_chunk(chunk_dir: str, digest: str) -> str | None:
+    for compressed in [False, True]:
+        name = chunk_file_name(digest, compressed)
+        if os.path.isfile(os.path.join(chunk_dir, name)):
+            return name
+    return None
+
+
+def write_chunk(chunk_dir: str, data: bytes, compress: bool) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    name = find_chunk(chunk_dir, digest)
+    if name is not None:
+        return name
+
+    digest, payload, compressed = encode_chunk(data, compress)
+    name = chunk_file_name(digest, compressed)
+    path = os.path.join(chunk_dir, name)
+    with open(path + PARTIAL_SUFFIX, "wb") as f:
+        f.write(payload)
+    os.replace(path + PARTIAL_SUFFIX, path)
+    return name
+
+
+def read_chunk(chunk_dir: str, name: str) -> bytes:
+    with open(os.path.join(chunk_dir, name), "rb") as f:
+        payload = f.read()
+    return decode_chunk(chunk_digest(name), payload, name.endswith(COMPRESSED_SUFFIX))
+
+
+def hash_file(path: str, chunk_size: int) -> dict:
+    # only the digests are returned, the chunks are read directly from the file by their offset
+    stat = os.stat(path)
+    digests = []
+    with open(path, "rb") as f:
+        while data := f.read(chunk_size):
+            digests.append(hashlib.sha256(data).hexdigest())
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "digests": digests,
+    }
+
+
+def assemble_file(chunk_dir: str, chunks: list[str], target: str):
+    target_dir = os.path.dirname(os.path.abspath(target))
+    os.makedirs(target_dir, exist_ok=True)
+    with open(target + PARTIAL_SUFFIX, "wb") as f:
+        for name in chunks:
+            f.write(read_chunk(chunk_dir, name))
+    os.replace(target + PARTIAL_SUFFIX, target)
+
+
+def remove_chunks(chunk_dir: str, chunks: list[str]):
+    for name in set(chunks):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(chunk_dir, name))
+
+
+def run(args: list[str]) -> dict:
+    command = args[0]
+    if command == "list":
+        os.makedirs(args[1], exist_ok=True)
+        result = list_chunks(args[1])
+    elif command == "hash":
+        result = hash_file(args[1], int(args[2]))
+    elif command == "assemble":
+        with open(args[1], "r") as f:
+            manifest = json.load(f)
+        assemble_file(manifest["chunk_dir"], manifest["chunks"], manifest["target"])
+        if manifest.get("remove_chunks", False):
+            remove_chunks(manifest["chunk_dir"], manifest["chunks"])
+        os.remove(args[1])
+        result = None
+    elif command == "remove":
+        remove_chunks(args[1], args[2:])
+        result = None
+    else:
+        raise ValueError(f"unknown command {command}")
+
+    return {"result": result, "can_compress": can_compress()}
+
+
+def main(args: list[str]):
+    print(json.dumps(run(args)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,14 +1,22 @@
 import json
 from abc import ABCMeta
 
+from modules.module.BatchingTextEncoderWrapper import BatchingTextEncoderWrapper
+from modules.module.BatchingVaeWrapper import BatchingVaeWrapper
+from modules.module.LatentStoreVaeWrapper import LatentStoreVaeWrapper
 from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.LatentStore import LatentStore
 from modules.util.TrainProgress import TrainProgress
 
 from mgds.MGDS import MGDS
 from mgds.PipelineModule import PipelineState
 
 import torch
+from torch import nn
+
+# each latent store directory is only opened once, and shared by all data loaders
+_latent_stores: dict[str, LatentStore] = {}
 
 
 class DataLoaderMgdsMixin(metaclass=ABCMeta):
@@ -48,3 +56,40 @@ class DataLoaderMgdsMixin(metaclass=ABCMeta):
         )
 
         return ds
+
+    def _caching_vae(
+            self,
+            config: TrainConfig,
+            vae: nn.Module,
+    ) -> nn.Module | BatchingVaeWrapper | LatentStoreVaeWrapper:
+        if not config.latent_caching:
+            return vae
+
+        # During latent caching, the data loader threads encode images concurrently. These calls can be batched.
+        # A batch can never contain more images than there are threads.
+        max_batch_size = min(config.caching_batch_size, config.dataloader_threads)
+        if max_batch_size > 1:
+            vae = BatchingVaeWrapper(vae, max_batch_size=max_batch_size)
+
+        # Images found in the shared latent store are not passed to the vae, and never enter a batch
+        if config.latent_store:
+            max_bytes = int(config.latent_store_size * 1024 ** 3)
+            latent_store = _latent_stores.get(config.latent_store_dir)
+            if latent_store is None:
+                latent_store = LatentStore(config.latent_store_dir, max_bytes)
+                _latent_stores[config.latent_store_dir] = latent_store
+            latent_store.max_bytes = max_bytes
+            vae = LatentStoreVaeWrapper(vae, latent_store)
+
+        return vae
+
+    def _caching_text_encoder(
+            self,
+            config: TrainConfig,
+            text_encoder: nn.Module,
+    ) -> nn.Module | BatchingTextEncoderWrapper:
+        # Prompts are encoded concurrently by the data loader threads as well
+        max_batch_size = min(config.caching_batch_size, config.dataloader_threads)
+        if config.latent_caching and max_batch_size > 1:
+            return BatchingTextEncoderWrapper(text_encoder, max_batch_size=max_batch_size)
+        return text_encoder
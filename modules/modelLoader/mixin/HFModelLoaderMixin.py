@@ -1,12 +1,13 @@
 import json
 import os
-
 from abc import ABCMeta
 from itertools import repeat
 
 from modules.util.enum.DataType import DataType
 from modules.util.quantization_util import (
+    get_quantization_cache_path,
     is_quantized_parameter,
+    load_quantization_cache,
     replace_linear_with_fp8_layers,
     replace_linear_with_int8_layers,
     replace_linear_with_nf4_layers,
@@ -18,7 +19,8 @@ from torch import nn
 import accelerate
 import huggingface_hub
 from huggingface_hub.utils import EntryNotFoundError
-from safetensors.torch import load_file
+from safetensors import safe_open
+
 
 class HFModelLoaderMixin(metaclass=ABCMeta):
     def __init__(self):
@@ -75,7 +77,6 @@ class HFModelLoaderMixin(metaclass=ABCMeta):
         else:
             safetensors_filenames = [model_filename]
 
-        state_dict = {}
         is_torch_pickle = False
 
         if is_local:
@@ -105,53 +106,94 @@ class HFModelLoaderMixin(metaclass=ABCMeta):
                 )]
                 is_torch_pickle = True
 
+        quantization_cache_path = get_quantization_cache_path(
+            sub_module, dtype, train_dtype, keep_in_fp32_modules, full_filenames, subfolder,
+        )
+        if quantization_cache_path is not None and os.path.isfile(quantization_cache_path):
+            print(f"Loading quantized weights from cache {quantization_cache_path}")
+            load_quantization_cache(sub_module, quantization_cache_path)
+            return sub_module
+
+        # the quantized weights are written to the cache after quantize_layers() is called during the model setup
+        sub_module.quantization_cache_path = quantization_cache_path
+
         if is_torch_pickle:
+            state_dict = {}
             for f in full_filenames:
                 file_state_dict = torch.load(f, weights_only=True)
                 while 'state_dict' in file_state_dict:
                     file_state_dict = file_state_dict['state_dict']
                 state_dict |= file_state_dict
+
+            if hasattr(sub_module, '_convert_deprecated_attention_blocks'):
+                sub_module._convert_deprecated_attention_blocks(state_dict)
+
+            for key, value in state_dict.items():
+                self.__assign_tensor(sub_module, key, value, dtype, train_dtype, keep_in_fp32_modules)
+
+            del state_dict
         else:
+            # Stream the tensors from the memory mapped safetensors files. Only one tensor is loaded at a time,
+            # so the peak memory is bounded by the largest tensor instead of the full checkpoint.
+            key_mapping = {}
             for f in full_filenames:
-                state_dict |= load_file(f)
-
-        if hasattr(sub_module, '_convert_deprecated_attention_blocks'):
-            sub_module._convert_deprecated_attention_blocks(state_dict)
-
-        for key, value in state_dict.items():
-            module = sub_module
-            tensor_name = key
-            module_name = None
-            key_splits = tensor_name.split(".")
-            for split in key_splits[:-1]:
-                module = getattr(module, split)
-                module_name = split
-            tensor_name = key_splits[-1]
-
-            is_buffer = tensor_name in module._buffers
-            if not is_buffer and tensor_name not in module._parameters:
-                continue
-            old_value = module._buffers[tensor_name] if is_buffer else module._parameters[tensor_name]
-
-            if torch.is_floating_point(old_value):
-                old_type = type(old_value)
-                if not is_quantized_parameter(module, tensor_name):
-                    if dtype.is_quantized() or module_name in keep_in_fp32_modules:
-                        value = value.to(dtype=train_dtype.torch_dtype())
-                    else:
-                        value = value.to(dtype=dtype.torch_dtype())
-
-                new_value = old_type(value)
-
-                if is_buffer:
-                    module._buffers[tensor_name].data = new_value
-                else:
-                    module._parameters[tensor_name] = new_value
+                with safe_open(f, framework="pt", device="cpu") as file:
+                    key_mapping |= {key: key for key in file.keys()}  # noqa: SIM118
+
+            if hasattr(sub_module, '_convert_deprecated_attention_blocks'):
+                # the conversion only renames keys, so it can be applied to a mapping of the original key names
+                sub_module._convert_deprecated_attention_blocks(key_mapping)
+            original_key_mapping = {original_key: key for key, original_key in key_mapping.items()}
 
-        del state_dict
+            for f in full_filenames:
+                with safe_open(f, framework="pt", device="cpu") as file:
+                    for original_key in file.keys():  # noqa: SIM118
+                        key = original_key_mapping.get(original_key)
+                        if key is not None:
+                            value = file.get_tensor(original_key)
+                            self.__assign_tensor(sub_module, key, value, dtype, train_dtype, keep_in_fp32_modules)
+                            del value
 
         return sub_module
 
+    @staticmethod
+    def __assign_tensor(
+            sub_module: nn.Module,
+            key: str,
+            value: torch.Tensor,
+            dtype: DataType,
+            train_dtype: DataType,
+            keep_in_fp32_modules: list[str],
+    ):
+        module = sub_module
+        tensor_name = key
+        module_name = None
+        key_splits = tensor_name.split(".")
+        for split in key_splits[:-1]:
+            module = getattr(module, split)
+            module_name = split
+        tensor_name = key_splits[-1]
+
+        is_buffer = tensor_name in module._buffers
+        if not is_buffer and tensor_name not in module._parameters:
+            return
+        old_value = module._buffers[tensor_name] if is_buffer else module._parameters[tensor_name]
+
+        if torch.is_floating_point(old_value):
+            old_type = type(old_value)
+            if not is_quantized_parameter(module, tensor_name):
+                if dtype.is_quantized() or module_name in keep_in_fp32_modules:
+                    value = value.to(dtype=train_dtype.torch_dtype())
+                else:
+                    value = value.to(dtype=dtype.torch_dtype())
+
+            new_value = old_type(value)
+
+            if is_buffer:
+                module._buffers[tensor_name].data = new_value
+            else:
+                module._parameters[tensor_name] = new_value
+
     def _load_transformers_sub_module(
             self,
             module_type,
@@ -1,16 +1,21 @@
 import io
 import os
+import traceback
 from abc import ABCMeta, abstractmethod
 from collections.abc import Callable
 from pathlib import Path
 
+from modules.model.BaseModel import BaseModel
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.AudioFormat import AudioFormat
 from modules.util.enum.FileType import FileType
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.VideoFormat import VideoFormat
+from modules.util.PromptEmbeddingCache import PromptEmbeddingCache
+from modules.util.torch_util import torch_gc
 
 import torch
+from torch import Tensor
 from torchvision.io import write_video
 
 from PIL import Image
@@ -48,6 +53,18 @@ class ModelSamplerOutput:
                 return ModelSamplerOutput, (self.file_type, None)
 
 
+class SampleJob:
+    def __init__(
+            self,
+            sample_config: SampleConfig,
+            destination: str,
+            on_sample: Callable[[ModelSamplerOutput], None] = lambda _: None,
+    ):
+        self.sample_config = sample_config
+        self.destination = destination
+        self.on_sample = on_sample
+
+
 class BaseModelSampler(metaclass=ABCMeta):
 
     def __init__(
@@ -60,6 +77,8 @@ class BaseModelSampler(metaclass=ABCMeta):
         self.train_device = train_device
         self.temp_device = temp_device
 
+        self.prompt_embedding_cache = PromptEmbeddingCache()
+
     @abstractmethod
     def sample(
             self,
@@ -73,6 +92,101 @@ class BaseModelSampler(metaclass=ABCMeta):
     ):
         pass
 
+    def sample_multiple(
+            self,
+            sample_jobs: list[SampleJob],
+            image_format: ImageFormat,
+            video_format: VideoFormat,
+            audio_format: AudioFormat,
+            max_batch_size: int = 1,
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        """
+        Samples several prompts at once. Samplers that override this method encode all prompts while the text
+        encoders are on the train device, denoise samples with matching settings as one batch of up to
+        max_batch_size samples, and decode all samples while the vae is on the train device. Every job still uses
+        its own seed and on_sample callback.
+
+        A job that fails is skipped, the other jobs are still sampled.
+
+        The default implementation samples the jobs one after another.
+        """
+        for sample_job in sample_jobs:
+            self.__sample_job(sample_job, image_format, video_format, audio_format, on_update_progress)
+
+    def __sample_job(
+            self,
+            sample_job: SampleJob,
+            image_format: ImageFormat,
+            video_format: VideoFormat,
+            audio_format: AudioFormat,
+            on_update_progress: Callable[[int, int], None],
+    ):
+        try:
+            self.sample(
+                sample_config=sample_job.sample_config,
+                destination=sample_job.destination,
+                image_format=image_format,
+                video_format=video_format,
+                audio_format=audio_format,
+                on_sample=sample_job.on_sample,
+                on_update_progress=on_update_progress,
+            )
+        except Exception:
+            self._print_sample_error()
+
+    @staticmethod
+    def _print_sample_error():
+        traceback.print_exc()
+        print("Error during sampling, proceeding without sampling")
+
+    @staticmethod
+    def _text_encoder_version(model: BaseModel) -> int | tuple[int, int]:
+        # while text encoders or embeddings are trained, their output changes after every step, and when the ema
+        # weights are swapped in or out
+        if model.parameters is not None and any(
+                "text_encoder" in name or name.startswith("embeddings")
+                for name in model.parameters.unique_name_mapping
+        ):
+            return model.train_progress.global_step + 1, model.ema.weights_version if model.ema else 0
+        return 0
+
+    def _encode_prompts_cached(
+            self,
+            model: BaseModel,
+            keys: list[tuple],
+            encode: Callable[[int], tuple[Tensor | None, ...]],
+            text_encoder_to: Callable[[torch.device], None],
+    ) -> list[tuple[Tensor | None, ...]]:
+        """
+        Returns the text encoder outputs for a list of prompts. Each key must contain the prompt and all settings
+        that change the text encoder output. encode(i) is only called for prompts that are not in the cache, and
+        the text encoders are only moved to the train device if at least one prompt is missing. If encode(i) returns
+        None, the output of that prompt is None and it is not cached.
+        """
+        version = self._text_encoder_version(model)
+        outputs = [self.prompt_embedding_cache.get(key, version) for key in keys]
+
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            text_encoder_to(self.train_device)
+
+            for i in missing:
+                outputs[i] = encode(i)
+                if outputs[i] is not None:
+                    self.prompt_embedding_cache.put(keys[i], version, outputs[i])
+
+            text_encoder_to(self.temp_device)
+            torch_gc()
+
+            self.prompt_embedding_cache.save()
+
+        return [
+            tuple(output.to(device=self.train_device) if output is not None else None for output in prompt_outputs)
+            if prompt_outputs is not None else None
+            for prompt_outputs in outputs
+        ]
+
     @staticmethod
     def quantize_resolution(resolution: int, quantization: int) -> int:
         return round(resolution / quantization) * quantization
@@ -3,7 +3,7 @@ import inspect
 from collections.abc import Callable
 
 from modules.model.FluxModel import FluxModel
-from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput
+from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput, SampleJob
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.AudioFormat import AudioFormat
 from modules.util.enum.FileType import FileType
@@ -48,161 +48,242 @@ class FluxSampler(BaseModelSampler):
         mu = image_seq_len * m + b
         return mu
 
+    @staticmethod
+    def __prompt_cache_key(
+            prompt: str,
+            text_encoder_1_layer_skip: int,
+            text_encoder_2_layer_skip: int,
+            prior_attention_mask: bool,
+    ) -> tuple:
+        return prompt, text_encoder_1_layer_skip, text_encoder_2_layer_skip, prior_attention_mask
+
     @torch.no_grad()
-    def __sample_base(
+    def __sample_base_multiple(
             self,
-            prompt: str,
-            negative_prompt: str,
-            height: int,
-            width: int,
-            seed: int,
-            random_seed: bool,
-            diffusion_steps: int,
-            cfg_scale: float,
-            noise_scheduler: NoiseScheduler,
-            cfg_rescale: float = 0.7,
-            text_encoder_1_layer_skip: int = 0,
-            text_encoder_2_layer_skip: int = 0,
-            force_last_timestep: bool = False,
-            prior_attention_mask: bool = False,
+            sample_jobs: list[SampleJob],
+            image_format: ImageFormat,
+            video_format: VideoFormat,
+            audio_format: AudioFormat,
+            max_batch_size: int = 1,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
-    ) -> ModelSamplerOutput:
+    ):
         with self.model.autocast_context:
-            generator = torch.Generator(device=self.train_device)
-            if random_seed:
-                generator.seed()
-            else:
-                generator.manual_seed(seed)
-
-            noise_scheduler = copy.deepcopy(self.model.noise_scheduler)
             image_processor = self.pipeline.image_processor
             transformer = self.pipeline.transformer
             vae = self.pipeline.vae
             vae_scale_factor = 8
             num_latent_channels = 16
-
-            # prepare prompt
-            self.model.text_encoder_to(self.train_device)
-
-            prompt_embedding, pooled_prompt_embedding = self.model.encode_text(
-                text=prompt,
-                train_device=self.train_device,
-                text_encoder_1_layer_skip=text_encoder_1_layer_skip,
-                text_encoder_2_layer_skip=text_encoder_2_layer_skip,
-                apply_attention_mask=prior_attention_mask,
-            )
-
-            self.model.text_encoder_to(self.temp_device)
-            torch_gc()
-
-            # prepare latent image
-            latent_image = torch.randn(
-                size=(1, num_latent_channels, height // vae_scale_factor, width // vae_scale_factor),
-                generator=generator,
-                device=self.train_device,
-                dtype=torch.float32,
-            )
-
-            image_ids = self.model.prepare_latent_image_ids(
-                height // vae_scale_factor,
-                width // vae_scale_factor,
-                self.train_device,
-                self.model.train_dtype.torch_dtype()
+            train_dtype = self.model.train_dtype.torch_dtype()
+
+            # prepare prompts
+            def encode_prompt(index: int):
+                sample_config = sample_jobs[index].sample_config
+                try:
+                    return self.model.encode_text(
+                        text=sample_config.prompt,
+                        train_device=self.train_device,
+                        text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
+                        text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
+                        apply_attention_mask=sample_config.prior_attention_mask,
+                    )
+                except Exception:
+                    self._print_sample_error()
+                    return None
+
+            prompt_embeddings = self._encode_prompts_cached(
+                self.model,
+                [self.__prompt_cache_key(
+                    sample_job.sample_config.prompt,
+                    sample_job.sample_config.text_encoder_1_layer_skip,
+                    sample_job.sample_config.text_encoder_2_layer_skip,
+                    sample_job.sample_config.prior_attention_mask,
+                ) for sample_job in sample_jobs],
+                encode_prompt,
+                self.model.text_encoder_to,
             )
 
-            latent_image = self.model.pack_latents(
-                latent_image,
-                latent_image.shape[0],
-                latent_image.shape[1],
-                height // vae_scale_factor,
-                width // vae_scale_factor,
-            )
-
-            image_seq_len = latent_image.shape[1]
-
-            # prepare timesteps
-            mu = self.__calculate_shift(
-                image_seq_len,
-                noise_scheduler.config.base_image_seq_len,
-                noise_scheduler.config.max_image_seq_len,
-                noise_scheduler.config.base_shift,
-                noise_scheduler.config.max_shift,
+            # group samples that can be denoised as one batch
+            groups = {}
+            for index, sample_job in enumerate(sample_jobs):
+                if prompt_embeddings[index] is None:
+                    continue
+
+                sample_config = sample_job.sample_config
+                key = (
+                    self.quantize_resolution(sample_config.height, 64),
+                    self.quantize_resolution(sample_config.width, 64),
+                    sample_config.diffusion_steps,
+                    sample_config.force_last_timestep,
+                    prompt_embeddings[index][0].shape[1],
+                )
+                groups.setdefault(key, []).append(index)
+
+            max_batch_size = max(max_batch_size, 1)
+            batches = [
+                (key, indices[i:i + max_batch_size])
+                for key, indices in groups.items()
+                for i in range(0, len(indices), max_batch_size)
+            ]
+
+            total_steps = sum(
+                diffusion_steps + (1 if force_last_timestep else 0)
+                for (_, _, diffusion_steps, force_last_timestep, _), _ in batches
             )
-            noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device, mu=mu)
-            timesteps = noise_scheduler.timesteps
-
-            if force_last_timestep:
-                last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
-                                * (noise_scheduler.config.num_train_timesteps - 1)
-
-                # add the final timestep to force predicting with zero snr
-                timesteps = torch.cat([last_timestep, timesteps])
+            progress = 0
 
             # denoising loop
-            extra_step_kwargs = {}
-            if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
-                extra_step_kwargs["generator"] = generator
-
-            text_ids = torch.zeros(prompt_embedding.shape[1], 3, device=self.train_device)
+            latent_images = [None] * len(sample_jobs)
 
             self.model.transformer_to(self.train_device)
-            for i, timestep in enumerate(tqdm(timesteps, desc="sampling")):
-                latent_model_input = torch.cat([latent_image])
-                expanded_timestep = timestep.expand(latent_model_input.shape[0])
-
-                # handle guidance
-                if transformer.config.guidance_embeds:
-                    guidance = torch.tensor([cfg_scale], device=self.train_device)
-                    guidance = guidance.expand(latent_model_input.shape[0])
-                else:
-                    guidance = None
-
-                # predict the noise residual
-                noise_pred = transformer(
-                    hidden_states=latent_model_input.to(dtype=self.model.train_dtype.torch_dtype()),
-                    timestep=expanded_timestep / 1000,
-                    guidance=guidance.to(dtype=self.model.train_dtype.torch_dtype()),
-                    pooled_projections=pooled_prompt_embedding.to(dtype=self.model.train_dtype.torch_dtype()),
-                    encoder_hidden_states=prompt_embedding.to(dtype=self.model.train_dtype.torch_dtype()),
-                    txt_ids=text_ids.to(dtype=self.model.train_dtype.torch_dtype()),
-                    img_ids=image_ids.to(dtype=self.model.train_dtype.torch_dtype()),
-                    joint_attention_kwargs=None,
-                    return_dict=True
-                ).sample
-
-                # compute the previous noisy sample x_t -> x_t-1
-                latent_image = noise_scheduler.step(
-                    noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
-                )[0]
-
-                on_update_progress(i + 1, len(timesteps))
+            for (height, width, diffusion_steps, force_last_timestep, _), indices in batches:
+                batch_end_progress = progress + diffusion_steps + (1 if force_last_timestep else 0)
+                try:
+                    noise_scheduler = copy.deepcopy(self.model.noise_scheduler)
+
+                    # prepare latent image. The noise of each sample only depends on its own seed
+                    generators = []
+                    latent_image = []
+                    for index in indices:
+                        sample_config = sample_jobs[index].sample_config
+                        generator = torch.Generator(device=self.train_device)
+                        if sample_config.random_seed:
+                            generator.seed()
+                        else:
+                            generator.manual_seed(sample_config.seed)
+                        generators.append(generator)
+
+                        latent_image.append(torch.randn(
+                            size=(1, num_latent_channels, height // vae_scale_factor, width // vae_scale_factor),
+                            generator=generator,
+                            device=self.train_device,
+                            dtype=torch.float32,
+                        ))
+                    latent_image = torch.cat(latent_image)
+
+                    image_ids = self.model.prepare_latent_image_ids(
+                        height // vae_scale_factor,
+                        width // vae_scale_factor,
+                        self.train_device,
+                        train_dtype,
+                    )
+
+                    latent_image = self.model.pack_latents(
+                        latent_image,
+                        latent_image.shape[0],
+                        latent_image.shape[1],
+                        height // vae_scale_factor,
+                        width // vae_scale_factor,
+                    )
+
+                    image_seq_len = latent_image.shape[1]
+
+                    # prepare timesteps
+                    mu = self.__calculate_shift(
+                        image_seq_len,
+                        noise_scheduler.config.base_image_seq_len,
+                        noise_scheduler.config.max_image_seq_len,
+                        noise_scheduler.config.base_shift,
+                        noise_scheduler.config.max_shift,
+                    )
+                    noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device, mu=mu)
+                    timesteps = noise_scheduler.timesteps
+
+                    if force_last_timestep:
+                        last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
+                                        * (noise_scheduler.config.num_train_timesteps - 1)
+
+                        # add the final timestep to force predicting with zero snr
+                        timesteps = torch.cat([last_timestep, timesteps])
+
+                    # the generator is only used by stochastic schedulers. With a list of generators, the noise of
+                    # each sample is created by its own generator
+                    extra_step_kwargs = {}
+                    if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
+                        extra_step_kwargs["generator"] = generators if len(generators) > 1 else generators[0]
+
+                    prompt_embedding = torch.cat([prompt_embeddings[index][0] for index in indices])
+                    pooled_prompt_embedding = torch.cat([prompt_embeddings[index][1] for index in indices])
+                    text_ids = torch.zeros(prompt_embedding.shape[1], 3, device=self.train_device)
+
+                    # handle guidance
+                    if transformer.config.guidance_embeds:
+                        guidance = torch.tensor(
+                            [sample_jobs[index].sample_config.cfg_scale for index in indices],
+                            device=self.train_device,
+                        ).to(dtype=train_dtype)
+                    else:
+                        guidance = None
+
+                    for timestep in tqdm(timesteps, desc="sampling"):
+                        expanded_timestep = timestep.expand(latent_image.shape[0])
+
+                        # predict the noise residual
+                        noise_pred = transformer(
+                            hidden_states=latent_image.to(dtype=train_dtype),
+                            timestep=expanded_timestep / 1000,
+                            guidance=guidance,
+                            pooled_projections=pooled_prompt_embedding.to(dtype=train_dtype),
+                            encoder_hidden_states=prompt_embedding.to(dtype=train_dtype),
+                            txt_ids=text_ids.to(dtype=train_dtype),
+                            img_ids=image_ids.to(dtype=train_dtype),
+                            joint_attention_kwargs=None,
+                            return_dict=True
+                        ).sample
+
+                        # compute the previous noisy sample x_t -> x_t-1
+                        latent_image = noise_scheduler.step(
+                            noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
+                        )[0]
+
+                        progress += 1
+                        on_update_progress(progress, total_steps)
+
+                    latent_image = self.model.unpack_latents(
+                        latent_image,
+                        height // vae_scale_factor,
+                        width // vae_scale_factor,
+                    )
+                    for batch_index, index in enumerate(indices):
+                        latent_images[index] = latent_image[batch_index:batch_index + 1]
+                except Exception:
+                    # only the samples of this batch are skipped
+                    progress = batch_end_progress
+                    self._print_sample_error()
 
             self.model.transformer_to(self.temp_device)
             torch_gc()
 
-            latent_image = self.model.unpack_latents(
-                latent_image,
-                height // vae_scale_factor,
-                width // vae_scale_factor,
-            )
-
             # decode
             self.model.vae_to(self.train_device)
 
-            latents = (latent_image / vae.config.scaling_factor) + vae.config.shift_factor
-            image = vae.decode(latents, return_dict=False)[0]
+            for index, sample_job in enumerate(sample_jobs):
+                if latent_images[index] is None:
+                    continue
 
-            do_denormalize = [True] * image.shape[0]
-            image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
+                try:
+                    latents = (latent_images[index] / vae.config.scaling_factor) + vae.config.shift_factor
+                    image = vae.decode(latents, return_dict=False)[0]
+
+                    do_denormalize = [True] * image.shape[0]
+                    image = image_processor.postprocess(image, output_type='pil', do_denormalize=do_denormalize)
+
+                    sampler_output = ModelSamplerOutput(
+                        file_type=FileType.IMAGE,
+                        data=image[0],
+                    )
+
+                    self.save_sampler_output(
+                        sampler_output, sample_job.destination,
+                        image_format, video_format, audio_format,
+                    )
+
+                    sample_job.on_sample(sampler_output)
+                except Exception:
+                    self._print_sample_error()
 
             self.model.vae_to(self.temp_device)
             torch_gc()
 
-            return ModelSamplerOutput(
-                file_type=FileType.IMAGE,
-                data=image[0],
-            )
-
     def __create_erode_kernel(self, device, dtype=torch.float32):
         kernel_radius = 2
 
@@ -345,18 +426,20 @@ class FluxSampler(BaseModelSampler):
                 )
 
             # prepare prompt
-            self.model.text_encoder_to(self.train_device)
-
-            prompt_embedding, pooled_prompt_embedding = self.model.encode_text(
-                text=prompt,
-                train_device=self.train_device,
-                text_encoder_1_layer_skip=text_encoder_1_layer_skip,
-                text_encoder_2_layer_skip=text_encoder_2_layer_skip,
-                apply_attention_mask=prior_attention_mask,
-            )
-
-            self.model.text_encoder_to(self.temp_device)
-            torch_gc()
+            prompt_embedding, pooled_prompt_embedding = self._encode_prompts_cached(
+                self.model,
+                [self.__prompt_cache_key(
+                    prompt, text_encoder_1_layer_skip, text_encoder_2_layer_skip, prior_attention_mask,
+                )],
+                lambda _: self.model.encode_text(
+                    text=prompt,
+                    train_device=self.train_device,
+                    text_encoder_1_layer_skip=text_encoder_1_layer_skip,
+                    text_encoder_2_layer_skip=text_encoder_2_layer_skip,
+                    apply_attention_mask=prior_attention_mask,
+                ),
+                self.model.text_encoder_to,
+            )[0]
 
             # prepare latent image
             latent_image = torch.randn(
@@ -469,6 +552,24 @@ class FluxSampler(BaseModelSampler):
                 data=image[0],
             )
 
+    def sample_multiple(
+            self,
+            sample_jobs: list[SampleJob],
+            image_format: ImageFormat,
+            video_format: VideoFormat,
+            audio_format: AudioFormat,
+            max_batch_size: int = 1,
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        if self.model_type.has_conditioning_image_input():
+            super().sample_multiple(
+                sample_jobs, image_format, video_format, audio_format, max_batch_size, on_update_progress,
+            )
+        else:
+            self.__sample_base_multiple(
+                sample_jobs, image_format, video_format, audio_format, max_batch_size, on_update_progress,
+            )
+
     def sample(
             self,
             sample_config: SampleConfig,
@@ -479,45 +580,34 @@ class FluxSampler(BaseModelSampler):
             on_sample: Callable[[ModelSamplerOutput], None] = lambda _: None,
             on_update_progress: Callable[[int, int], None] = lambda _, __: None,
     ):
-        if self.model_type.has_conditioning_image_input():
-            sampler_output = self.__sample_inpainting(
-                prompt=sample_config.prompt,
-                negative_prompt=sample_config.negative_prompt,
-                height=self.quantize_resolution(sample_config.height, 64),
-                width=self.quantize_resolution(sample_config.width, 64),
-                seed=sample_config.seed,
-                random_seed=sample_config.random_seed,
-                diffusion_steps=sample_config.diffusion_steps,
-                cfg_scale=sample_config.cfg_scale,
-                noise_scheduler=sample_config.noise_scheduler,
-                cfg_rescale=0.7 if sample_config.force_last_timestep else 0.0,
-                sample_inpainting=sample_config.sample_inpainting,
-                base_image_path=sample_config.base_image_path,
-                mask_image_path=sample_config.mask_image_path,
-                text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
-                text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
-                force_last_timestep=sample_config.force_last_timestep,
-                prior_attention_mask=sample_config.prior_attention_mask,
-                on_update_progress=on_update_progress,
-            )
-        else:
-            sampler_output = self.__sample_base(
-                prompt=sample_config.prompt,
-                negative_prompt=sample_config.negative_prompt,
-                height=self.quantize_resolution(sample_config.height, 64),
-                width=self.quantize_resolution(sample_config.width, 64),
-                seed=sample_config.seed,
-                random_seed=sample_config.random_seed,
-                diffusion_steps=sample_config.diffusion_steps,
-                cfg_scale=sample_config.cfg_scale,
-                noise_scheduler=sample_config.noise_scheduler,
-                cfg_rescale=0.7 if sample_config.force_last_timestep else 0.0,
-                text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
-                text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
-                force_last_timestep=sample_config.force_last_timestep,
-                prior_attention_mask=sample_config.prior_attention_mask,
+        if not self.model_type.has_conditioning_image_input():
+            self.__sample_base_multiple(
+                [SampleJob(sample_config, destination, on_sample)],
+                image_format, video_format, audio_format,
                 on_update_progress=on_update_progress,
             )
+            return
+
+        sampler_output = self.__sample_inpainting(
+            prompt=sample_config.prompt,
+            negative_prompt=sample_config.negative_prompt,
+            height=self.quantize_resolution(sample_config.height, 64),
+            width=self.quantize_resolution(sample_config.width, 64),
+            seed=sample_config.seed,
+            random_seed=sample_config.random_seed,
+            diffusion_steps=sample_config.diffusion_steps,
+            cfg_scale=sample_config.cfg_scale,
+            noise_scheduler=sample_config.noise_scheduler,
+            cfg_rescale=0.7 if sample_config.force_last_timestep else 0.0,
+            sample_inpainting=sample_config.sample_inpainting,
+            base_image_path=sample_config.base_image_path,
+            mask_image_path=sample_config.mask_image_path,
+            text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
+            text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
+            force_last_timestep=sample_config.force_last_timestep,
+            prior_attention_mask=sample_config.prior_attention_mask,
+            on_update_progress=on_update_progress,
+        )
 
         self.save_sampler_output(
             sampler_output, destination,
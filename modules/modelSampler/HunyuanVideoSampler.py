@@ -69,17 +69,17 @@ class HunyuanVideoSampler(BaseModelSampler):
             num_latent_channels = 16
 
             # prepare prompt
-            self.model.text_encoder_to(self.train_device)
-
-            prompt_embedding, pooled_prompt_embedding, prompt_attention_mask = self.model.encode_text(
-                text=prompt,
-                train_device=self.train_device,
-                text_encoder_1_layer_skip=text_encoder_1_layer_skip,
-                text_encoder_2_layer_skip=text_encoder_2_layer_skip,
-            )
-
-            self.model.text_encoder_to(self.temp_device)
-            torch_gc()
+            prompt_embedding, pooled_prompt_embedding, prompt_attention_mask = self._encode_prompts_cached(
+                self.model,
+                [(prompt, text_encoder_1_layer_skip, text_encoder_2_layer_skip)],
+                lambda _: self.model.encode_text(
+                    text=prompt,
+                    train_device=self.train_device,
+                    text_encoder_1_layer_skip=text_encoder_1_layer_skip,
+                    text_encoder_2_layer_skip=text_encoder_2_layer_skip,
+                ),
+                self.model.text_encoder_to,
+            )[0]
 
             # prepare latent image
             num_latent_frames = (num_frames - 1) // vae_temporal_scale_factor + 1
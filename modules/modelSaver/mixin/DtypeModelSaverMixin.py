@@ -7,6 +7,7 @@ from datetime import datetime
 from modules.model.BaseModel import BaseModel
 from modules.util import git_util
 from modules.util.enum.ConfigPart import ConfigPart
+from modules.util.enum.ModelType import ModelType
 from modules.util.modelSpec.ModelSpec import ModelSpec
 
 import torch
@@ -74,9 +75,23 @@ class DtypeModelSaverMixin:
         else:
             config = None
 
+        return DtypeModelSaverMixin.create_safetensors_metadata(
+            model.model_type,
+            model_spec,
+            self.__calculate_safetensors_hash(state_dict),
+            config,
+        )
+
+    @staticmethod
+    def create_safetensors_metadata(
+            model_type: ModelType,
+            model_spec: ModelSpec,
+            hash_sha256: str | None,
+            config: str | None = None,
+    ) -> dict[str, str]:
         # update calculated fields
         model_spec.date = datetime.now().strftime("%Y-%m-%d")
-        model_spec.hash_sha256 = self.__calculate_safetensors_hash(state_dict)
+        model_spec.hash_sha256 = hash_sha256
 
         # assemble the header
         model_spec_dict = model_spec.to_dict()
@@ -88,8 +103,8 @@ class DtypeModelSaverMixin:
             one_trainer_header["ot_config"] = config
 
         kohya_header = {} # needed for the Automatic1111 webui to pick up model versions
-        if model.model_type.is_stable_diffusion_xl():
+        if model_type.is_stable_diffusion_xl():
             kohya_header["ss_base_model_version"] = "sdxl_"
-        elif model.model_type.is_sd_v2():
+        elif model_type.is_sd_v2():
             kohya_header["ss_v2"] = "True"
         return model_spec_dict | one_trainer_header | kohya_header
@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddin
 from modules.modelSetup.mixin.ModelSetupFlowMatchingMixin import ModelSetupFlowMatchingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_clip_encoder_layers,
     enable_checkpointing_for_flux_transformer,
@@ -198,7 +199,7 @@ class BaseFluxSetup(
             deterministic: bool = False,
     ) -> dict:
         with model.autocast_context:
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -372,7 +373,7 @@ class BaseFluxSetup(
 
         return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: FluxModel,
             batch: dict,
@@ -385,4 +386,4 @@ class BaseFluxSetup(
             config=config,
             train_device=self.train_device,
             sigmas=model.noise_scheduler.sigmas.to(device=self.train_device),
-        ).mean()
+        )
@@ -73,6 +73,17 @@ class BaseModelSetup(
         pass
 
     @abstractmethod
+    def calculate_losses(
+            self,
+            model: BaseModel,
+            batch: dict,
+            data: dict,
+            config: TrainConfig,
+    ) -> Tensor:
+        """
+        Returns the loss of every sample in the batch, as a tensor of shape (batch_size,)
+        """
+
     def calculate_loss(
             self,
             model: BaseModel,
@@ -80,7 +91,7 @@ class BaseModelSetup(
             data: dict,
             config: TrainConfig,
     ) -> Tensor:
-        pass
+        return self.calculate_losses(model, batch, data, config).mean()
 
     @abstractmethod
     def after_optimizer_step(
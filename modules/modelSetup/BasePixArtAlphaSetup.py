@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupDiffusionMixin import ModelSetupDiffusio
 from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_basic_transformer_blocks,
     enable_checkpointing_for_t5_encoder_layers,
@@ -155,7 +156,7 @@ class BasePixArtAlphaSetup(
             deterministic: bool = False,
     ) -> dict:
         with model.autocast_context:
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -320,7 +321,7 @@ class BasePixArtAlphaSetup(
         model_output_data['prediction_type'] = model.noise_scheduler.config.prediction_type
         return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: PixArtAlphaModel,
             batch: dict,
@@ -333,4 +334,4 @@ class BasePixArtAlphaSetup(
             config=config,
             train_device=self.train_device,
             betas=model.noise_scheduler.betas.to(device=self.train_device),
-        ).mean()
+        )
@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddin
 from modules.modelSetup.mixin.ModelSetupFlowMatchingMixin import ModelSetupFlowMatchingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_gemma_layers,
     enable_checkpointing_for_sana_transformer,
@@ -165,7 +166,7 @@ class BaseSanaSetup(
             deterministic: bool = False,
     ) -> dict:
         with model.autocast_context:
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -292,7 +293,7 @@ class BaseSanaSetup(
 
         return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: SanaModel,
             batch: dict,
@@ -305,4 +306,4 @@ class BaseSanaSetup(
             config=config,
             train_device=self.train_device,
             betas=model.noise_scheduler.betas.to(device=self.train_device),
-        ).mean()
+        )
@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddin
 from modules.modelSetup.mixin.ModelSetupFlowMatchingMixin import ModelSetupFlowMatchingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_clip_encoder_layers,
     enable_checkpointing_for_stable_diffusion_3_transformer,
@@ -242,7 +243,7 @@ class BaseStableDiffusion3Setup(
             deterministic: bool = False,
     ) -> dict:
         with model.autocast_context:
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -391,7 +392,7 @@ class BaseStableDiffusion3Setup(
 
         return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: StableDiffusion3Model,
             batch: dict,
@@ -404,4 +405,4 @@ class BaseStableDiffusion3Setup(
             config=config,
             train_device=self.train_device,
             sigmas=model.noise_scheduler.sigmas.to(device=self.train_device),
-        ).mean()
+        )
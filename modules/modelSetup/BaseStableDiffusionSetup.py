@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupDiffusionMixin import ModelSetupDiffusio
 from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_basic_transformer_blocks,
     enable_checkpointing_for_clip_encoder_layers,
@@ -163,7 +164,7 @@ class BaseStableDiffusionSetup(
             deterministic: bool = False,
     ) -> dict:
         with model.autocast_context:
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -330,7 +331,7 @@ class BaseStableDiffusionSetup(
             model_output_data['prediction_type'] = model.noise_scheduler.config.prediction_type
             return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: StableDiffusionModel,
             batch: dict,
@@ -343,4 +344,4 @@ class BaseStableDiffusionSetup(
             config=config,
             train_device=self.train_device,
             betas=model.noise_scheduler.betas.to(device=self.train_device),
-        ).mean()
+        )
@@ -9,6 +9,7 @@ from modules.modelSetup.mixin.ModelSetupDiffusionMixin import ModelSetupDiffusio
 from modules.modelSetup.mixin.ModelSetupEmbeddingMixin import ModelSetupEmbeddingMixin
 from modules.modelSetup.mixin.ModelSetupNoiseMixin import ModelSetupNoiseMixin
 from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util import distributed_util
 from modules.util.checkpointing_util import (
     enable_checkpointing_for_clip_encoder_layers,
     enable_checkpointing_for_stable_cascade_blocks,
@@ -195,7 +196,7 @@ class BaseWuerstchenSetup(
             elif model.model_type.is_stable_cascade():
                 scaled_latent_image = latent_image
 
-            batch_seed = 0 if deterministic else train_progress.global_step
+            batch_seed = 0 if deterministic else distributed_util.shard_seed(train_progress.global_step)
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
             rand = Random(batch_seed)
@@ -331,7 +332,7 @@ class BaseWuerstchenSetup(
 
         return model_output_data
 
-    def calculate_loss(
+    def calculate_losses(
             self,
             model: WuerstchenModel,
             batch: dict,
@@ -344,4 +345,4 @@ class BaseWuerstchenSetup(
             config=config,
             train_device=self.train_device,
             alphas_cumprod_fun=self.__alpha_cumprod,
-        ).mean()
+        )
@@ -32,19 +32,30 @@ class AdditionalEmbeddingWrapper(metaclass=ABCMeta):
         self.orig_median_norm = torch.norm(self.orig_module.weight, dim=1).median().item()
 
     def forward(self, x, *args, **kwargs):
-        # ensure that the original weights only contain as many embeddings as the unmodified tokenizer can create
-        orig_module_weight = self.orig_module.weight[0:self.original_token_count]
-        weight = torch.cat(
-            [orig_module_weight] \
-            + [embedding.vector for embedding in self.embeddings],
-            dim=0
+        if len(self.embeddings) == 0:
+            return F.embedding(
+                input=x,
+                weight=self.orig_module.weight,
+            )
+
+        # Look up the original and the additional tokens in separate tables instead of concatenating the full
+        # embedding matrix on every call. Ids are clamped to the range of each table, and the results are merged.
+        # The original weights only contain as many embeddings as the unmodified tokenizer can create.
+        is_additional_token = x >= self.original_token_count
+
+        orig_embeddings = F.embedding(
+            input=x.clamp(max=self.original_token_count - 1),
+            weight=self.orig_module.weight,
         )
 
-        return F.embedding(
-            input=x,
-            weight=weight,
+        additional_weight = torch.cat([embedding.vector for embedding in self.embeddings], dim=0)
+        additional_embeddings = F.embedding(
+            input=(x - self.original_token_count).clamp(min=0, max=additional_weight.shape[0] - 1),
+            weight=additional_weight,
         )
 
+        return torch.where(is_additional_token.unsqueeze(-1), additional_embeddings, orig_embeddings)
+
     def hook_to_module(self):
         if not self.is_applied:
             self.orig_module.forward = self.forward
@@ -1,7 +1,9 @@
+import collections
 import contextlib
 import os
 from abc import ABCMeta, abstractmethod
 from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 from modules.util import path_util
@@ -52,6 +54,12 @@ class CaptionSample:
 
 
 class BaseImageCaptionModel(metaclass=ABCMeta):
+    # number of samples passed to generate_captions at once, if no batch size is set
+    default_batch_size = 1
+
+    # number of threads that load and decode images ahead of the model
+    prefetch_workers = 4
+
     @staticmethod
     def __get_sample_filenames(sample_dir: str, include_subdirectories: bool = False) -> list[str]:
         sample_dir = Path(sample_dir)
@@ -68,6 +76,8 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             self,
             caption_sample: CaptionSample,
             initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
     ) -> str:
         """
         Generates caption for a single CaptionSample
@@ -75,10 +85,49 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
         Args:
             caption_sample (`CaptionSample`): the sample to caption
             initial_caption (`str`): the initial caption
+            caption_prefix (`str`): add this to the start of the generated caption (before initial caption)
+            caption_postfix (`str`): add this to the end of the generated caption
 
         Returns: the generated caption
         """
 
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ) -> list[str]:
+        """
+        Generates captions for a batch of CaptionSamples. Models that support batched inference override this,
+        the default implementation captions one sample at a time.
+
+        Args:
+            caption_samples (`[CaptionSample]`): the samples to caption
+            initial_caption (`str`): the initial caption
+            caption_prefix (`str`): add this to the start of the generated caption (before initial caption)
+            caption_postfix (`str`): add this to the end of the generated caption
+
+        Returns: the generated captions, in the same order as caption_samples
+        """
+        return [
+            self.generate_caption(caption_sample, initial_caption, caption_prefix, caption_postfix)
+            for caption_sample in caption_samples
+        ]
+
+    @staticmethod
+    def __needs_caption(caption_sample: CaptionSample, mode: str) -> bool:
+        existing_caption = caption_sample.get_caption()
+        return not (mode == 'fill' and existing_caption is not None and existing_caption != "")
+
+    @staticmethod
+    def __apply_caption(caption_sample: CaptionSample, predicted_caption: str, mode: str):
+        if mode == 'replace' or mode == 'fill':
+            caption_sample.set_caption(predicted_caption)
+
+        if mode == 'add':
+            caption_sample.add_caption(predicted_caption)
+
     def caption_image(
             self,
             filename: str,
@@ -102,20 +151,48 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
         """
         caption_sample = CaptionSample(filename)
 
-        existing_caption = caption_sample.get_caption()
-        if mode == 'fill' and existing_caption is not None and existing_caption != "":
+        if not self.__needs_caption(caption_sample, mode):
             return
 
         predicted_caption = self.generate_caption(caption_sample, initial_caption, caption_prefix, caption_postfix)
-
-        if mode == 'replace' or mode == 'fill':
-            caption_sample.set_caption(predicted_caption)
-
-        if mode == 'add':
-            caption_sample.add_caption(predicted_caption)
-
+        self.__apply_caption(caption_sample, predicted_caption, mode)
         caption_sample.save_caption()
 
+    def __caption_batch(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str,
+            caption_prefix: str,
+            caption_postfix: str,
+            mode: str,
+            writer: ThreadPoolExecutor,
+            error_callback: Callable[[str], None] | None,
+    ) -> list[Future]:
+        def caption_single(caption_sample: CaptionSample) -> str | None:
+            try:
+                return self.generate_caption(caption_sample, initial_caption, caption_prefix, caption_postfix)
+            except Exception:
+                if error_callback is not None:
+                    error_callback(caption_sample.image_filename)
+                return None
+
+        try:
+            predicted_captions = self.generate_captions(
+                caption_samples, initial_caption, caption_prefix, caption_postfix
+            )
+        except Exception:
+            # caption the samples one by one to find the sample that caused the error
+            predicted_captions = [caption_single(caption_sample) for caption_sample in caption_samples]
+
+        write_futures = []
+        for caption_sample, predicted_caption in zip(caption_samples, predicted_captions, strict=True):
+            # the decoded image is not needed anymore, release it before the caption is written
+            caption_sample.image = None
+            if predicted_caption is not None:
+                self.__apply_caption(caption_sample, predicted_caption, mode)
+                write_futures.append(writer.submit(caption_sample.save_caption))
+        return write_futures
+
     def caption_images(
             self,
             filenames: list[str],
@@ -125,10 +202,15 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode: str = 'fill',
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
+            batch_size: int | None = None,
     ):
         """
         Captions all samples in a list
 
+        Images are loaded and decoded by a thread pool ahead of the model, captioned in batches, and the captions
+        are written in the background. Every caption is written as soon as its batch is done, so an interrupted run
+        continues where it stopped when it is started again in fill mode.
+
         Parameters:
             filenames (`[str]`): a list of sample filenames
             initial_caption (`str`): an initial caption. the generated caption will start with this string
@@ -138,20 +220,78 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
                 - replace: creates a new caption for all samples, even if a caption already exists
                 - fill: creates a new caption for all samples without a caption
                 - add: creates a new caption for all samples, appending if a caption already exists
-            progress_callback (`Callable[[int, int], None]`): called after every processed image
+            progress_callback (`Callable[[int, int], None]`): called after every processed batch of images
             error_callback (`Callable[[str], None]`): called for every exception
+            batch_size (`int`): number of images captioned at once, defaults to the batch size of the model
         """
+        if batch_size is None or batch_size < 1:
+            batch_size = self.default_batch_size
+
+        def load_sample(filename: str) -> CaptionSample | None:
+            caption_sample = CaptionSample(filename)
+            if not self.__needs_caption(caption_sample, mode):
+                return None
+            caption_sample.get_image()
+            return caption_sample
 
         if progress_callback is not None:
             progress_callback(0, len(filenames))
-        for i, filename in enumerate(tqdm(filenames)):
-            try:
-                self.caption_image(filename, initial_caption, caption_prefix, caption_postfix, mode)
-            except Exception:
-                if error_callback is not None:
-                    error_callback(filename)
-            if progress_callback is not None:
-                progress_callback(i + 1, len(filenames))
+
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as loader, \
+                ThreadPoolExecutor(max_workers=1) as writer, \
+                tqdm(total=len(filenames)) as progress_bar:
+            filename_iter = iter(filenames)
+            pending_samples = collections.deque()
+            write_futures = []
+            batch = []
+            processed = 0
+
+            def prefetch():
+                while len(pending_samples) < batch_size + self.prefetch_workers:
+                    filename = next(filename_iter, None)
+                    if filename is None:
+                        return
+                    pending_samples.append((filename, loader.submit(load_sample, filename)))
+
+            def finish(count: int):
+                nonlocal processed
+                processed += count
+                progress_bar.update(count)
+                if progress_callback is not None:
+                    progress_callback(processed, len(filenames))
+
+            def flush():
+                write_futures.extend(self.__caption_batch(
+                    batch, initial_caption, caption_prefix, caption_postfix, mode, writer, error_callback
+                ))
+                finish(len(batch))
+                batch.clear()
+
+            prefetch()
+            while pending_samples:
+                filename, future = pending_samples.popleft()
+                prefetch()
+
+                try:
+                    caption_sample = future.result()
+                except Exception:
+                    caption_sample = None
+                    if error_callback is not None:
+                        error_callback(filename)
+
+                if caption_sample is None:
+                    finish(1)
+                    continue
+
+                batch.append(caption_sample)
+                if len(batch) >= batch_size:
+                    flush()
+
+            if batch:
+                flush()
+
+            for future in write_futures:
+                future.result()
 
     def caption_folder(
             self,
@@ -163,6 +303,7 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
             include_subdirectories: bool = False,
+            batch_size: int | None = None,
     ):
         """
         Captions all samples in a folder
@@ -179,6 +320,7 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
             include_subdirectories (`bool`): whether to include subfolders when processing samples
+            batch_size (`int`): number of images captioned at once, defaults to the batch size of the model
         """
 
         filenames = self.__get_sample_filenames(sample_dir, include_subdirectories)
@@ -190,4 +332,5 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode=mode,
             progress_callback=progress_callback,
             error_callback=error_callback,
+            batch_size=batch_size,
         )
@@ -1,6 +1,8 @@
+import collections
 import os
 from abc import ABCMeta, abstractmethod
 from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 from modules.util import path_util
@@ -114,7 +116,61 @@ class MaskSample:
             mask.save(self.mask_filename)
 
 
+def apply_mask_batch(
+        mode: str,
+        masks: Tensor,
+        has_masks: Tensor,
+        mask_tensor: Tensor,
+        alpha: float,
+        inverted: bool,
+) -> Tensor:
+    """
+    Applies predicted masks to a batch of existing masks, with the same semantics as MaskSample.apply_mask
+
+    Args:
+        mode (`str`): one of replace, fill, add, subtract or blend
+        masks (`Tensor`): the existing masks of shape (B, 1, H, W), ignored where has_masks is False
+        has_masks (`Tensor`): boolean tensor of shape (B, 1, 1, 1), True for samples with an existing mask
+        mask_tensor (`Tensor`): the predicted masks of shape (B, 1, H, W)
+        alpha (`float`): the blending factor to use for modes add, subtract and blend
+        inverted (`bool`): invert the predicted masks for modes add and subtract
+
+    Returns: the new masks
+    """
+    if mode in {'replace', 'fill'}:
+        return alpha * mask_tensor
+    elif mode in {'add', 'subtract'}:
+        if inverted:
+            mask_tensor = 1.0 - mask_tensor
+        combined = masks + alpha * mask_tensor if mode == 'add' else masks - alpha * mask_tensor
+        return torch.where(has_masks, combined, alpha * mask_tensor).clamp_(0, 1)
+    elif mode == 'blend':
+        combined = masks + alpha * mask_tensor
+        if alpha < 0.0:
+            combined -= alpha
+        combined /= 1 + alpha
+        return torch.where(has_masks, combined, alpha * mask_tensor)
+    else:
+        raise ValueError("invalid mode")
+
+
+def save_mask_image(mask: Tensor, filename: str):
+    """
+    Saves a mask of shape (1, H, W), that was already converted to uint8
+    """
+    Image.fromarray(mask.squeeze(0).numpy(), mode='L').convert('RGB').save(filename)
+
+
 class BaseImageMaskModel(metaclass=ABCMeta):
+    # number of samples of the same resolution passed to predict_masks at once, if no batch size is set
+    default_batch_size = 1
+
+    # number of threads that load and decode images ahead of the model
+    prefetch_workers = 4
+
+    # invert the predicted mask for modes add and subtract
+    invert_predicted_mask = False
+
     @staticmethod
     def __get_sample_filenames(sample_dir: str, include_subdirectories: bool = False) -> list[str]:
         sample_dir = Path(sample_dir)
@@ -127,6 +183,81 @@ class BaseImageMaskModel(metaclass=ABCMeta):
         return [str(p) for p in sample_dir.glob(f'{recursive_prefix}*') if __is_supported_image_extension(p)]
 
     @abstractmethod
+    def predict_masks(
+            self,
+            images: list[Image.Image],
+            prompts: list[str],
+            threshold: float = 0.3,
+            smooth_pixels: int = 5,
+            expand_pixels: int = 10,
+    ) -> Tensor:
+        """
+        Predicts the masks for a batch of images. All images have the same resolution.
+
+        Parameters:
+            images (`[Image]`): the images to mask
+            prompts (`[str]`): a list of prompts used to create a mask
+            threshold (`float`): threshold for including pixels in the mask
+            smooth_pixels (`int`): radius of a smoothing operation applied to the generated mask
+            expand_pixels (`int`): amount of expansion of the generated mask in all directions
+
+        Returns: the predicted masks of shape (B, 1, H, W), on the device of the model
+        """
+
+    @staticmethod
+    def __load_sample(filename: str, mode: str) -> MaskSample | None:
+        # the sample is loaded on the cpu, masks are moved to the device as a batch
+        mask_sample = MaskSample(filename, torch.device('cpu'))
+
+        if mode == 'fill' and os.path.exists(mask_sample.mask_filename):
+            return None
+
+        image = mask_sample.get_image()
+        if mode in {'add', 'subtract', 'blend'}:
+            mask = mask_sample.get_mask_tensor()
+            if mask is not None and mask.shape[-2:] != (image.height, image.width):
+                raise ValueError(f"the mask of {filename} does not match the size of the image")
+
+        return mask_sample
+
+    def __mask_batch(
+            self,
+            mask_samples: list[MaskSample],
+            prompts: list[str],
+            mode: str,
+            alpha: float,
+            threshold: float,
+            smooth_pixels: int,
+            expand_pixels: int,
+    ) -> list[tuple[Tensor, str]]:
+        with torch.no_grad():
+            predicted_masks = self.predict_masks(
+                [mask_sample.get_image() for mask_sample in mask_samples],
+                prompts, threshold, smooth_pixels, expand_pixels,
+            )
+
+            has_masks = [mask_sample.mask_tensor is not None for mask_sample in mask_samples]
+            if any(has_masks):
+                masks = torch.cat([
+                    mask_sample.mask_tensor if mask_sample.mask_tensor is not None
+                    else torch.zeros_like(predicted_masks[0:1], device='cpu')
+                    for mask_sample in mask_samples
+                ]).to(predicted_masks.device)
+            else:
+                masks = torch.zeros_like(predicted_masks)
+            has_masks = torch.tensor(has_masks, device=predicted_masks.device).view(-1, 1, 1, 1)
+
+            masks = apply_mask_batch(mode, masks, has_masks, predicted_masks, alpha, self.invert_predicted_mask)
+
+            # same conversion as ToPILImage
+            masks = masks.mul(255).byte().cpu()
+
+        for mask_sample in mask_samples:
+            mask_sample.image = None
+            mask_sample.mask_tensor = None
+
+        return [(mask, mask_sample.mask_filename) for mask, mask_sample in zip(masks, mask_samples, strict=True)]
+
     def mask_image(
             self,
             filename: str,
@@ -154,6 +285,14 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             smooth_pixels (`int`): radius of a smoothing operation applied to the generated mask
             expand_pixels (`int`): amount of expansion of the generated mask in all directions
         """
+        mask_sample = self.__load_sample(filename, mode)
+        if mask_sample is None:
+            return
+
+        for mask, mask_filename in self.__mask_batch(
+                [mask_sample], prompts, mode, alpha, threshold, smooth_pixels, expand_pixels
+        ):
+            save_mask_image(mask, mask_filename)
 
     def mask_images(
             self,
@@ -166,10 +305,14 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             expand_pixels: int = 10,
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
+            batch_size: int | None = None,
     ):
         """
         Masks all samples in a list
 
+        Images are loaded and decoded by a thread pool ahead of the model, grouped by resolution and masked in
+        batches. The masks are written by a background thread.
+
         Parameters:
             filenames (`[str]`): a list of sample filenames
             prompts (`[str]`): a list of prompts used to create a mask
@@ -183,20 +326,102 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             threshold (`float`): threshold for including pixels in the mask
             smooth_pixels (`int`): radius of a smoothing operation applied to the generated mask
             expand_pixels (`int`): amount of expansion of the generated mask in all directions
-            progress_callback (`Callable[[int, int], None]`): called after every processed image
+            progress_callback (`Callable[[int, int], None]`): called after every processed batch of images
             error_callback (`Callable[[str], None]`): called for every exception
+            batch_size (`int`): number of images masked at once, defaults to the batch size of the model
         """
+        if batch_size is None or batch_size < 1:
+            batch_size = self.default_batch_size
 
         if progress_callback is not None:
             progress_callback(0, len(filenames))
-        for i, filename in enumerate(tqdm(filenames)):
-            try:
-                self.mask_image(filename, prompts, mode, alpha, threshold, smooth_pixels, expand_pixels)
-            except Exception:
+
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as loader, \
+                ThreadPoolExecutor(max_workers=1) as writer, \
+                tqdm(total=len(filenames)) as progress_bar:
+            filename_iter = iter(filenames)
+            pending_samples = collections.deque()
+            buckets: dict[tuple[int, int], list[MaskSample]] = {}
+            buffered_samples = 0
+            write_futures: list[tuple[str, Future]] = []
+            processed = 0
+
+            def prefetch():
+                while len(pending_samples) < batch_size + self.prefetch_workers:
+                    filename = next(filename_iter, None)
+                    if filename is None:
+                        return
+                    pending_samples.append((filename, loader.submit(self.__load_sample, filename, mode)))
+
+            def finish(count: int):
+                nonlocal processed
+                processed += count
+                progress_bar.update(count)
+                if progress_callback is not None:
+                    progress_callback(processed, len(filenames))
+
+            def report_error(filename: str):
                 if error_callback is not None:
                     error_callback(filename)
-            if progress_callback is not None:
-                progress_callback(i + 1, len(filenames))
+
+            def mask_single(mask_sample) -> list:
+                try:
+                    return self.__mask_batch(
+                        [mask_sample], prompts, mode, alpha, threshold, smooth_pixels, expand_pixels
+                    )
+                except Exception:
+                    report_error(mask_sample.image_filename)
+                    return []
+
+            def flush(resolution: tuple[int, int]):
+                nonlocal buffered_samples
+                mask_samples = buckets.pop(resolution)
+                buffered_samples -= len(mask_samples)
+
+                try:
+                    masks = self.__mask_batch(
+                        mask_samples, prompts, mode, alpha, threshold, smooth_pixels, expand_pixels
+                    )
+                except Exception:
+                    # mask the samples one by one to find the sample that caused the error
+                    masks = [mask for mask_sample in mask_samples for mask in mask_single(mask_sample)]
+
+                for mask, mask_filename in masks:
+                    write_futures.append((mask_filename, writer.submit(save_mask_image, mask, mask_filename)))
+                finish(len(mask_samples))
+
+            prefetch()
+            while pending_samples:
+                filename, future = pending_samples.popleft()
+                prefetch()
+
+                try:
+                    mask_sample = future.result()
+                except Exception:
+                    report_error(filename)
+                    finish(1)
+                    continue
+
+                if mask_sample is None:
+                    finish(1)
+                    continue
+
+                resolution = (mask_sample.height, mask_sample.width)
+                buckets.setdefault(resolution, []).append(mask_sample)
+                buffered_samples += 1
+
+                if len(buckets[resolution]) >= batch_size:
+                    flush(resolution)
+                elif buffered_samples >= batch_size * 4:
+                    # too many different resolutions, don't keep all decoded images in memory
+                    flush(max(buckets, key=lambda key: len(buckets[key])))
+
+            while buckets:
+                flush(next(iter(buckets)))
+
+            for mask_filename, future in write_futures:
+                if future.exception() is not None:
+                    report_error(mask_filename)
 
     def mask_folder(
             self,
@@ -210,6 +435,7 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
             include_subdirectories: bool = False,
+            batch_size: int | None = None,
     ):
         """
         Masks all samples in a folder
@@ -230,6 +456,7 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             progress_callback (`Callable[[int, int], None]`): called after every processed image
             error_callback (`Callable[[str], None]`): called for every exception
             include_subdirectories (`bool`): whether to include subdirectories when processing samples
+            batch_size (`int`): number of images masked at once, defaults to the batch size of the model
         """
 
         filenames = self.__get_sample_filenames(sample_dir, include_subdirectories)
@@ -243,4 +470,5 @@ class BaseImageMaskModel(metaclass=ABCMeta):
             expand_pixels=expand_pixels,
             progress_callback=progress_callback,
             error_callback=error_callback,
+            batch_size=batch_size,
         )
@@ -1,6 +1,6 @@
 import os
 
-from modules.module.BaseImageMaskModel import BaseImageMaskModel, MaskSample
+from modules.module.BaseImageMaskModel import BaseImageMaskModel
 
 import torch
 from torch import Tensor, nn
@@ -14,6 +14,8 @@ from PIL import Image
 
 
 class BaseRembgModel(BaseImageMaskModel):
+    default_batch_size = 8
+
     def __init__(
             self,
             model_filename: str,
@@ -108,21 +110,14 @@ class BaseRembgModel(BaseImageMaskModel):
 
         return np.expand_dims(tmpImg, 0).astype(np.float32)
 
-    def mask_image(
+    def predict_masks(
             self,
-            filename: str,
+            images: list[Image.Image],
             prompts: list[str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
             threshold: float = 0.3,
             smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
+            expand_pixels: int = 10,
+    ) -> Tensor:
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -131,29 +126,33 @@ class BaseRembgModel(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        image = mask_sample.get_image()
-
-        normalized_image = self.__normalize(
-            image,
-            (0.485, 0.456, 0.406),
-            (0.229, 0.224, 0.225),
-            (320, 320)
-        )
+        normalized_images = np.concatenate([
+            self.__normalize(
+                image,
+                (0.485, 0.456, 0.406),
+                (0.229, 0.224, 0.225),
+                (320, 320)
+            ) for image in images
+        ])
 
         input_name = self.model.get_inputs()[0].name
-        mask = self.model.run(None, {input_name: normalized_image})
+        batch_dim = self.model.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim == 1:
+            # exported with a fixed batch size
+            mask = np.concatenate([
+                self.model.run(None, {input_name: normalized_image[np.newaxis]})[0]
+                for normalized_image in normalized_images
+            ])
+        else:
+            mask = self.model.run(None, {input_name: normalized_images})[0]
 
-        mask = mask[0][:, 0, :, :]
+        mask = mask[:, 0:1, :, :]
 
-        ma = np.max(mask)
-        mi = np.min(mask)
+        ma = np.max(mask, axis=(1, 2, 3), keepdims=True)
+        mi = np.min(mask, axis=(1, 2, 3), keepdims=True)
 
         mask = (mask - mi) / (ma - mi)
-        mask = np.squeeze(mask)
 
         output = torch.from_numpy(mask).to(self.device)
 
-        predicted_mask = self.__process_mask(output, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, False)
-
-        mask_sample.save_mask()
+        return self.__process_mask(output, images[0].height, images[0].width, threshold)
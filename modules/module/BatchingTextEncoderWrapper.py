@@ -0,0 +1,35 @@
+from modules.util.CallBatcher import CallBatcher
+
+import torch
+from torch import nn
+
+
+class BatchingTextEncoderWrapper:
+    """
+    Wraps a text encoder during text caching. The cache is populated by several data loader threads, each of them
+    encoding a single prompt. Concurrent calls with the same token shape and arguments are collected and encoded as
+    one batch, and the output is split again, so every caller receives the same result type as a single prompt call.
+
+    All other attributes are forwarded to the wrapped text encoder.
+    """
+
+    def __init__(
+            self,
+            text_encoder: nn.Module,
+            max_batch_size: int,
+            max_wait_time: float = 0.05,
+    ):
+        self.text_encoder = text_encoder
+        self.__batcher = CallBatcher(
+            self.__encode, max_batch_size, "text caching", "prompts", max_wait_time=max_wait_time,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.text_encoder, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.__batcher(*args, **kwargs)
+
+    def __encode(self, *args, **kwargs):
+        with torch.no_grad():
+            return self.text_encoder(*args, **kwargs)
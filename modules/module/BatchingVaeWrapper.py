@@ -0,0 +1,47 @@
+from modules.util.CallBatcher import CallBatcher
+
+import torch
+from torch import nn
+
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+
+
+class BatchingVaeWrapper:
+    """
+    Wraps a VAE during latent caching. The cache is populated by several data loader threads, each of them
+    encoding a single image. Concurrent encode calls with the same input shape are collected and encoded as one
+    batch, and the output is split again, so every caller receives the same result type as a single image call.
+
+    All other attributes are forwarded to the wrapped VAE.
+    """
+
+    def __init__(
+            self,
+            vae: nn.Module,
+            max_batch_size: int,
+            max_wait_time: float = 0.05,
+    ):
+        self.vae = vae
+        self.__batcher = CallBatcher(
+            self.__encode, max_batch_size, "latent caching", "images",
+            max_wait_time=max_wait_time, split_leaf=self.__split_distribution,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.vae, name)
+
+    def encode(self, x, *args, **kwargs):
+        return self.__batcher(x, *args, **kwargs)
+
+    def __encode(self, *args, **kwargs):
+        with torch.no_grad():
+            return self.vae.encode(*args, **kwargs)
+
+    @staticmethod
+    def __split_distribution(output, index: int) -> DiagonalGaussianDistribution | None:
+        if isinstance(output, DiagonalGaussianDistribution):
+            return DiagonalGaussianDistribution(
+                output.parameters[index:index + 1].clone(),
+                deterministic=output.deterministic,
+            )
+        return None
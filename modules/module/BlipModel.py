@@ -6,6 +6,8 @@ from transformers import BlipForConditionalGeneration, BlipProcessor
 
 
 class BlipModel(BaseImageCaptionModel):
+    default_batch_size = 8
+
     def __init__(self, device: torch.device, dtype: torch.dtype):
         self.device = device
         self.dtype = dtype
@@ -34,3 +36,26 @@ class BlipModel(BaseImageCaptionModel):
         predicted_caption = (caption_prefix + predicted_caption + caption_postfix).strip()
 
         return predicted_caption
+
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ) -> list[str]:
+        # all samples share the same initial caption, so the text inputs don't need padding
+        inputs = self.processor(
+            [caption_sample.get_image() for caption_sample in caption_samples],
+            [initial_caption] * len(caption_samples),
+            return_tensors="pt",
+        )
+        inputs = inputs.to(self.device, self.dtype)
+        with torch.no_grad():
+            outputs = self.model.generate(**inputs)
+        predicted_captions = self.processor.batch_decode(outputs, skip_special_tokens=True)
+
+        return [
+            (caption_prefix + predicted_caption + caption_postfix).strip()
+            for predicted_caption in predicted_captions
+        ]
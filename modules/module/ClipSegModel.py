@@ -1,5 +1,5 @@
 
-from modules.module.BaseImageMaskModel import BaseImageMaskModel, MaskSample
+from modules.module.BaseImageMaskModel import BaseImageMaskModel
 
 import torch
 from torch import Tensor, nn
@@ -7,8 +7,12 @@ from torchvision.transforms import functional
 
 from transformers import CLIPSegForImageSegmentation, CLIPSegProcessor
 
+from PIL import Image
+
 
 class ClipSegModel(BaseImageMaskModel):
+    default_batch_size = 8
+
     def __init__(self, device: torch.device, dtype: torch.dtype):
         self.device = device
         self.dtype = dtype
@@ -56,21 +60,14 @@ class ClipSegModel(BaseImageMaskModel):
 
         return mask
 
-    def mask_image(
+    def predict_masks(
             self,
-            filename: str,
+            images: list[Image.Image],
             prompts: list[str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
             threshold: float = 0.3,
             smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
+            expand_pixels: int = 10,
+    ) -> Tensor:
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -79,12 +76,15 @@ class ClipSegModel(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        inputs = self.processor(text=prompts, images=[mask_sample.get_image()] * len(prompts), padding="max_length",
-                                return_tensors="pt")
+        # every image is combined with every prompt, the masks of all prompts of an image are averaged
+        inputs = self.processor(
+            text=prompts * len(images),
+            images=[image for image in images for _ in prompts],
+            padding="max_length",
+            return_tensors="pt",
+        )
         inputs = inputs.to(self.device)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        predicted_mask = self.__process_mask(outputs.logits, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, False)
+        outputs = self.model(**inputs)
+        logits = outputs.logits.reshape(len(images), len(prompts), *outputs.logits.shape[-2:])
 
-        mask_sample.save_mask()
+        return self.__process_mask(logits, images[0].height, images[0].width, threshold)
@@ -15,6 +15,8 @@ class EMAModuleWrapper:
         self.ema_parameters = [p.clone().detach().to(device) for p in parameters]
 
         self.temp_stored_parameters = None
+        # incremented whenever the parameters are swapped between the ema and the trained weights
+        self.weights_version = 0
 
         self.decay = decay
         self.update_step_interval = update_step_interval
@@ -67,12 +69,14 @@ class EMAModuleWrapper:
         parameters = list(parameters)
         for ema_parameter, parameter in zip(self.ema_parameters, parameters, strict=True):
             parameter.data.copy_(ema_parameter.to(parameter.device).data)
+        self.weights_version += 1
 
     def copy_temp_to(self, parameters: Iterable[torch.nn.Parameter]) -> None:
         for temp_parameter, parameter in zip(self.temp_stored_parameters, parameters, strict=True):
             parameter.data.copy_(temp_parameter.data)
 
         self.temp_stored_parameters = None
+        self.weights_version += 1
 
     def load_state_dict(self, state_dict: dict) -> None:
         self.decay = self.decay if self.decay else state_dict.get("decay", self.decay)
@@ -1,4 +1,5 @@
 import json
+import os
 
 from modules.dataLoader import StableDiffusionFineTuneDataLoader
 from modules.model.BaseModel import BaseModel
@@ -6,17 +7,24 @@ from modules.modelLoader.BaseModelLoader import BaseModelLoader
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.util import create
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.LossScaler import LossScaler
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
 
 import torch
+from torch import Tensor
 
 from tqdm import tqdm
 
 
 class GenerateLossesModel:
     """Based on train args, writes a JSON instead of a model with filenames mapped to losses,
-    in order of decreasing loss."""
+    in order of decreasing loss.
+
+    Losses are calculated per sample in aspect bucketed batches. If more than one timestep is set, the loss of every
+    sample is averaged over that many randomly drawn timesteps, otherwise the fixed deterministic timestep is used.
+    The losses are appended to a JSONL file next to the output while the calculation is running. If that file
+    already exists, samples that are already in it are skipped, so an interrupted run can be resumed."""
     config: TrainConfig
     train_device: torch.device
     temp_device: torch.device
@@ -25,18 +33,65 @@ class GenerateLossesModel:
     data_loader: StableDiffusionFineTuneDataLoader
     model: BaseModel
 
-    def __init__(self, config: TrainConfig, output_path: str):
+    # number of batches whose losses are kept on the device before they are written
+    FLUSH_INTERVAL = 32
+
+    def __init__(self, config: TrainConfig, output_path: str, batch_size: int | None = None, timesteps: int = 1):
         # Create a copy of args because we will mutate
         # the batch size and gradient accumulation steps.
         config = TrainConfig.default_values().from_dict(config.to_dict())
-        config.batch_size = 1
+        if batch_size is not None:
+            config.batch_size = batch_size
         config.gradient_accumulation_steps = 1
+        # losses should not depend on the batch size
+        config.loss_scaler = LossScaler.NONE
 
         self.config = config
         self.output_path = output_path
+        self.stream_path = os.path.splitext(output_path)[0] + ".jsonl"
+        self.timesteps = max(timesteps, 1)
         self.train_device = torch.device(self.config.train_device)
         self.temp_device = torch.device(self.config.temp_device)
 
+    def __load_stream(self) -> dict[str, float]:
+        filename_to_loss: dict[str, float] = {}
+        if not os.path.isfile(self.stream_path):
+            return filename_to_loss
+
+        with open(self.stream_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of an interrupted run can be incomplete
+                    continue
+                if entry.get("timesteps") == self.timesteps:
+                    filename_to_loss[entry["image_path"]] = entry["loss"]
+
+        return filename_to_loss
+
+    def __calculate_losses(self, batch: dict) -> Tensor:
+        losses = None
+        for timestep_index in range(self.timesteps):
+            # every pass uses a different seed, which also draws different timesteps
+            self.model.train_progress.global_step = timestep_index
+            model_output_data = self.model_setup.predict(
+                self.model,
+                batch,
+                self.config,
+                self.model.train_progress,
+                deterministic=self.timesteps == 1,
+            )
+            sample_losses = self.model_setup.calculate_losses(
+                self.model,
+                batch,
+                model_output_data,
+                self.config,
+            ).detach().float()
+            losses = sample_losses if losses is None else losses + sample_losses
+
+        return losses / self.timesteps
+
     def start(self):
         if self.config.train_dtype.enable_tf():
             torch.backends.cuda.matmul.allow_tf32 = True
@@ -81,27 +136,42 @@ class GenerateLossesModel:
 
         self.model_setup.setup_train_device(self.model, self.config)
 
-        filename_loss_list: list[tuple[str, float]] = []
+        filename_to_loss = self.__load_stream()
+        if filename_to_loss:
+            print(f"Resuming with {len(filename_to_loss)} losses from {self.stream_path}")
+
+        pending_paths: list[str] = []
+        pending_losses: list[Tensor] = []
+
+        def flush(stream):
+            if not pending_losses:
+                return
+            # a single device sync for all pending batches
+            losses = torch.cat(pending_losses).cpu().tolist()
+            for image_path, loss in zip(pending_paths, losses, strict=True):
+                filename_to_loss[image_path] = loss
+                stream.write(json.dumps({"image_path": image_path, "loss": loss, "timesteps": self.timesteps}) + "\n")
+            stream.flush()
+            pending_paths.clear()
+            pending_losses.clear()
+
         # Don't really need a backward pass here, so we can make the calculation MUCH faster.
-        with torch.inference_mode():
+        with torch.inference_mode(), open(self.stream_path, "a") as stream:
             for batch in step_tqdm:
-                    model_output_data = self.model_setup.predict(
-                        self.model,
-                        batch,
-                        self.config,
-                        self.model.train_progress,
-                        deterministic=True,
-                    )
-                    loss = self.model_setup.calculate_loss(
-                        self.model,
-                        batch,
-                        model_output_data,
-                        self.config,
-                    )
-                    filename_loss_list.append((batch['image_path'][0], float(loss)))
+                image_paths = list(batch['image_path'])
+                if all(image_path in filename_to_loss for image_path in image_paths):
+                    continue
+
+                pending_paths.extend(image_paths)
+                pending_losses.append(self.__calculate_losses(batch))
+
+                if len(pending_losses) >= self.FLUSH_INTERVAL:
+                    flush(stream)
+
+            flush(stream)
 
         # Sort such that highest loss comes first
-        filename_loss_list.sort(key=lambda x: x[1], reverse=True)
-        filename_to_loss: dict[str, float] = {x[0]: x[1] for x in filename_loss_list}
+        filename_loss_list = sorted(filename_to_loss.items(), key=lambda x: x[1], reverse=True)
+        filename_to_loss = {x[0]: x[1] for x in filename_loss_list}
         with open(self.output_path, "w") as f:
             json.dump(filename_to_loss, f, indent=4)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import threading
+from dataclasses import fields, is_dataclass
+
+from modules.module.BatchingVaeWrapper import BatchingVaeWrapper
+from modules.util.LatentStore import LatentStore
+
+import torch
+from torch import Tensor, nn
+
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution, EncoderOutput
+from diffusers.models.modeling_outputs import AutoencoderKLOutput
+
+LATENT_STORE_VERSION = 1
+
+# the latent store can be shared, so entries are only ever turned into one of these output types
+OUTPUT_TYPES = {
+    "AutoencoderKLOutput": AutoencoderKLOutput,
+    "EncoderOutput": EncoderOutput,
+}
+
+
+class LatentStoreVaeWrapper:
+    """
+    Wraps a VAE during latent caching. Encoded images are looked up in a LatentStore before they are passed to the VAE.
+
+    The key of an entry is the hash of the input image after cropping, scaling and flipping, together with a
+    fingerprint of the VAE weights and the dtypes used for encoding. Images with the same content are found again
+    in other runs, even if the file was renamed, and models that share a VAE share their entries.
+    All other attributes are forwarded to the wrapped VAE.
+    """
+
+    def __init__(
+            self,
+            vae: nn.Module | BatchingVaeWrapper,
+            latent_store: LatentStore,
+    ):
+        self.vae = vae
+        self.latent_store = latent_store
+
+        self.__fingerprint_lock = threading.Lock()
+        self.__vae_fingerprint = None
+
+    def __getattr__(self, name):
+        return getattr(self.vae, name)
+
+    def encode(self, x, *args, **kwargs):
+        if args or kwargs or not isinstance(x, Tensor):
+            return self.vae.encode(x, *args, **kwargs)
+
+        key = self.__key(x)
+        entry = self.latent_store.get(key)
+        if entry is not None:
+            tensors, metadata = entry
+            try:
+                structure = json.loads(metadata["structure"])
+                return self.__unflatten(structure, tensors, x.device)
+            except (KeyError, ValueError, TypeError):
+                # written by an incompatible version, the entry is replaced below
+                pass
+
+        output = self.vae.encode(x)
+
+        tensors = {}
+        structure = self.__flatten(output, "output", tensors)
+        if structure is not None:
+            self.latent_store.put(key, tensors, {"structure": json.dumps(structure)})
+
+        return output
+
+    def __fingerprint(self) -> str:
+        # the vae is hashed lazily, if every image is already in the cache of this run, it is never needed
+        with self.__fingerprint_lock:
+            if self.__vae_fingerprint is None:
+                vae = self.vae.vae if isinstance(self.vae, BatchingVaeWrapper) else self.vae
+                sha = hashlib.sha256()
+                sha.update(f"{type(vae).__module__}.{type(vae).__qualname__}".encode())
+                for name, tensor in vae.state_dict().items():
+                    tensor = tensor.detach().to(device="cpu").contiguous()
+                    sha.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+                    sha.update(tensor.reshape(-1).view(torch.uint8).numpy())
+                self.__vae_fingerprint = sha.hexdigest()
+            return self.__vae_fingerprint
+
+    def __key(self, x: Tensor) -> str:
+        device_type = x.device.type
+        autocast_dtype = torch.get_autocast_dtype(device_type) if torch.is_autocast_enabled(device_type) else None
+
+        sha = hashlib.sha256()
+        sha.update(json.dumps({
+            "version": LATENT_STORE_VERSION,
+            "vae": self.__fingerprint(),
+            "dtype": str(x.dtype),
+            "autocast_dtype": str(autocast_dtype),
+            "shape": list(x.shape),
+        }).encode())
+        sha.update(x.detach().to(device="cpu").contiguous().reshape(-1).view(torch.uint8).numpy())
+        return sha.hexdigest()
+
+    def __flatten(self, output, name: str, tensors: dict[str, Tensor]) -> dict | None:
+        if isinstance(output, DiagonalGaussianDistribution):
+            tensors[name] = output.parameters
+            return {"kind": "gaussian", "tensor": name, "deterministic": output.deterministic}
+        elif isinstance(output, Tensor):
+            tensors[name] = output
+            return {"kind": "tensor", "tensor": name}
+        elif output is None:
+            return {"kind": "none"}
+        elif is_dataclass(output):
+            type_name = type(output).__name__
+            if OUTPUT_TYPES.get(type_name) is not type(output):
+                # unknown output types are encoded every time
+                return None
+
+            structure = {
+                "kind": "dataclass",
+                "type": type_name,
+                "fields": {},
+            }
+            for field in fields(output):
+                field_structure = self.__flatten(getattr(output, field.name), f"{name}.{field.name}", tensors)
+                if field_structure is None:
+                    return None
+                structure["fields"][field.name] = field_structure
+            return structure
+        elif isinstance(output, tuple):
+            items = [self.__flatten(item, f"{name}.{i}", tensors) for i, item in enumerate(output)]
+            if any(item is None for item in items):
+                return None
+            return {"kind": "tuple", "items": items}
+        else:
+            # unknown output types are encoded every time
+            return None
+
+    def __unflatten(self, structure: dict, tensors: dict[str, Tensor], device: torch.device):
+        kind = structure["kind"]
+        if kind == "gaussian":
+            return DiagonalGaussianDistribution(
+                tensors[structure["tensor"]].to(device=device),
+                deterministic=structure["deterministic"],
+            )
+        elif kind == "tensor":
+            return tensors[structure["tensor"]].to(device=device)
+        elif kind == "none":
+            return None
+        elif kind == "dataclass":
+            output_type = OUTPUT_TYPES.get(structure["type"])
+            if output_type is None:
+                raise ValueError(f"latent store entry has an unsupported output type {structure['type']}")
+            return output_type(**{
+                name: self.__unflatten(field_structure, tensors, device)
+                for name, field_structure in structure["fields"].items()
+            })
+        elif kind == "tuple":
+            return tuple(self.__unflatten(item, tensors, device) for item in structure["items"])
+        else:
+            raise ValueError(f"unknown latent store entry kind {kind}")
@@ -1,12 +1,17 @@
 
-from modules.module.BaseImageMaskModel import BaseImageMaskModel, MaskSample
+from modules.module.BaseImageMaskModel import BaseImageMaskModel
 
 import torch
 from torch import Tensor, nn
 from torchvision.transforms import functional, transforms
 
+from PIL import Image
+
 
 class MaskByColor(BaseImageMaskModel):
+    default_batch_size = 8
+    invert_predicted_mask = True
+
     def __init__(self, device: torch.device, dtype: torch.dtype):
         self.device = device
         self.dtype = dtype
@@ -78,23 +83,16 @@ class MaskByColor(BaseImageMaskModel):
 
         return (0.0, 0.0, 0.0)
 
-    def mask_image(
+    def predict_masks(
             self,
-            filename: str,
+            images: list[Image.Image],
             prompts: list[str],
-            mode: str = 'fill',
-            alpha: float = 1.0,
             threshold: float = 0.3,
             smooth_pixels: int = 5,
-            expand_pixels: int = 10
-    ):
+            expand_pixels: int = 10,
+    ) -> Tensor:
         color = self.__parse_color(prompts[0] if prompts else "")
 
-        mask_sample = MaskSample(filename, self.device)
-
-        if mode == 'fill' and mask_sample.get_mask_tensor() is not None:
-            return
-
         if self.smoothing_kernel_radius != smooth_pixels:
             self.smoothing_kernel = self.__create_average_kernel(smooth_pixels)
             self.smoothing_kernel_radius = smooth_pixels
@@ -103,10 +101,8 @@ class MaskByColor(BaseImageMaskModel):
             self.expand_kernel = self.__create_average_kernel(expand_pixels)
             self.expand_kernel_radius = expand_pixels
 
-        image = mask_sample.get_image()
-        image_tensor = self.image2Tensor(image) \
-            .to(device=self.device, dtype=self.dtype) \
-            .unsqueeze(0)
+        image_tensor = torch.stack([self.image2Tensor(image) for image in images]) \
+            .to(device=self.device, dtype=self.dtype)
 
         color_tensor = torch.tensor(color, dtype=self.dtype, device=self.device).view(1, 3, 1, 1)
         similarity = image_tensor - color_tensor
@@ -115,7 +111,4 @@ class MaskByColor(BaseImageMaskModel):
         similarity = torch.sqrt(similarity)
         output = similarity.to(dtype=torch.float32)
 
-        predicted_mask = self.__process_mask(output, mask_sample.height, mask_sample.width, threshold)
-        mask_sample.apply_mask(mode, predicted_mask, alpha, True)
-
-        mask_sample.save_mask()
+        return self.__process_mask(output, images[0].height, images[0].width, threshold)
@@ -10,6 +10,8 @@ import onnxruntime
 
 
 class WDModel(BaseImageCaptionModel):
+    default_batch_size = 16
+
     def __init__(self, device: torch.device, dtype: torch.dtype):
         self.device = device
         self.dtype = dtype
@@ -42,13 +44,7 @@ class WDModel(BaseImageCaptionModel):
 
                 self.tag_names.append(row["name"])
 
-    def generate_caption(
-            self,
-            caption_sample: CaptionSample,
-            initial_caption: str = "",
-            caption_prefix: str = "",
-            caption_postfix: str = "",
-    ):
+    def __prepare_image(self, caption_sample: CaptionSample):
         _, height, width, _ = self.model.get_inputs()[0].shape
 
         image = caption_sample.get_image()
@@ -56,12 +52,10 @@ class WDModel(BaseImageCaptionModel):
         image = np.asarray(image)
         image = image[:, :, ::-1]  # RGB to BGR
         image = image.astype(np.float32)
-        image = np.expand_dims(image, 0)
+        return image
 
-        input_name = self.model.get_inputs()[0].name
-        label_name = self.model.get_outputs()[0].name
-        probs = self.model.run([label_name], {input_name: image})[0]
-        probs = probs[0].astype(float)
+    def __predict_caption(self, probs, caption_prefix: str, caption_postfix: str) -> str:
+        probs = probs.astype(float)
 
         general_labels = [(self.tag_names[i], probs[i]) for i in self.general_indexes if probs[i] > 0.35]
 
@@ -74,3 +68,38 @@ class WDModel(BaseImageCaptionModel):
         predicted_caption = (caption_prefix + predicted_caption + caption_postfix).strip()
 
         return predicted_caption
+
+    def generate_caption(
+            self,
+            caption_sample: CaptionSample,
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ):
+        image = np.expand_dims(self.__prepare_image(caption_sample), 0)
+
+        input_name = self.model.get_inputs()[0].name
+        label_name = self.model.get_outputs()[0].name
+        probs = self.model.run([label_name], {input_name: image})[0]
+
+        return self.__predict_caption(probs[0], caption_prefix, caption_postfix)
+
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ) -> list[str]:
+        batch_dim = self.model.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim == 1:
+            # exported with a fixed batch size
+            return super().generate_captions(caption_samples, initial_caption, caption_prefix, caption_postfix)
+
+        images = np.stack([self.__prepare_image(caption_sample) for caption_sample in caption_samples])
+
+        input_name = self.model.get_inputs()[0].name
+        label_name = self.model.get_outputs()[0].name
+        probs = self.model.run([label_name], {input_name: images})[0]
+
+        return [self.__predict_caption(sample_probs, caption_prefix, caption_postfix) for sample_probs in probs]
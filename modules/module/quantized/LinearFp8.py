@@ -1,5 +1,7 @@
 from modules.module.quantized.mixin.QuantizedLinearMixin import QuantizedLinearMixin
 from modules.module.quantized.mixin.QuantizedModuleMixin import QuantizedModuleMixin
+from modules.util.DequantizedWeightCache import dequantized_weight_cache
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 
 import torch
 from torch import nn
@@ -12,12 +14,30 @@ class LinearFp8(
 ):
     is_quantized: bool
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+            self,
+            *args,
+            scale_mode: Fp8ScaleMode = Fp8ScaleMode.TENSOR,
+            block_size: int = 128,
+            **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.is_quantized = False
 
         self.fp8_dtype = torch.float8_e4m3fn
-        self._scale = torch.tensor(1.0, dtype=torch.float)
+        self.scale_mode = scale_mode
+        self.block_size = block_size
+
+        # TENSOR: one scale for the whole weight
+        # CHANNEL: one scale per output channel, shape (out_features, 1)
+        # BLOCK: one scale per block_size x block_size tile of the weight
+        if scale_mode == Fp8ScaleMode.CHANNEL:
+            scale_shape = (self.out_features, 1)
+        elif scale_mode == Fp8ScaleMode.BLOCK:
+            scale_shape = (-(-self.out_features // block_size), -(-self.in_features // block_size))
+        else:
+            scale_shape = ()
+        self._scale = torch.ones(scale_shape, dtype=torch.float)
         self.register_buffer("scale", self._scale)
 
         self.compute_dtype = None
@@ -25,11 +45,59 @@ class LinearFp8(
     def original_weight_shape(self) -> tuple[int, ...]:
         return self.weight.shape
 
-    def unquantized_weight(self, dtype: torch.dtype, device: torch.device) -> torch.Tensor:
-        if self._scale is not None:
-            return self.weight.detach().to(dtype) * self._scale.to(dtype=dtype)
+    def __scale_blocks(self, weight: torch.Tensor, scale: torch.Tensor, divide: bool) -> torch.Tensor:
+        out_features, in_features = weight.shape
+        pad_out = -out_features % self.block_size
+        pad_in = -in_features % self.block_size
+        if pad_out > 0 or pad_in > 0:
+            weight = nn.functional.pad(weight, (0, pad_in, 0, pad_out))
+
+        blocks = weight.view(scale.shape[0], self.block_size, scale.shape[1], self.block_size)
+        scale = scale[:, None, :, None]
+        blocks = blocks.div_(scale) if divide else blocks.mul_(scale)
+
+        weight = blocks.view(out_features + pad_out, in_features + pad_in)
+        if pad_out > 0 or pad_in > 0:
+            weight = weight[:out_features, :in_features].contiguous()
+        return weight
+
+    def __apply_scale(self, weight: torch.Tensor, divide: bool = False) -> torch.Tensor:
+        # operates in place on weight, the caller is responsible for passing a copy
+        if divide:
+            # the division is done in float32, the result is only rounded once when it is cast to fp8
+            weight = weight.float()
+        scale = self._scale.to(device=weight.device, dtype=weight.dtype)
+
+        if self.scale_mode == Fp8ScaleMode.BLOCK:
+            return self.__scale_blocks(weight, scale, divide)
+        elif divide:
+            return weight.div_(scale)
+        else:
+            return weight.mul_(scale)
+
+    def __compute_scale(self, weight: torch.Tensor) -> torch.Tensor:
+        abs_weight = weight.abs()
+
+        if self.scale_mode == Fp8ScaleMode.CHANNEL:
+            abs_max = abs_weight.amax(dim=1, keepdim=True)
+        elif self.scale_mode == Fp8ScaleMode.BLOCK:
+            out_features, in_features = weight.shape
+            abs_weight = nn.functional.pad(
+                abs_weight, (0, -in_features % self.block_size, 0, -out_features % self.block_size)
+            )
+            abs_max = abs_weight.view(
+                self._scale.shape[0], self.block_size, self._scale.shape[1], self.block_size
+            ).amax(dim=(1, 3))
         else:
-            return self.weight.detach().to(dtype=dtype)
+            abs_max = abs_weight.max()
+
+        return torch.clamp(abs_max.float(), min=1e-12) / torch.finfo(self.fp8_dtype).max
+
+    def unquantized_weight(self, dtype: torch.dtype, device: torch.device) -> torch.Tensor:
+        weight = self.weight.detach().to(device=device, dtype=dtype)
+        if self.is_quantized:
+            weight = self.__apply_scale(weight)
+        return weight
 
     def quantize(self, device: torch.device | None = None):
         if self.is_quantized:
@@ -42,20 +110,22 @@ class LinearFp8(
             if device is not None:
                 weight = weight.to(device=device)
 
-            abs_max = weight.abs().max()
-            self._scale.copy_(torch.clamp(abs_max, min=1e-12) / torch.finfo(self.fp8_dtype).max)
-            weight = weight.div_(self._scale).to(dtype=self.fp8_dtype)
+            self._scale.data = self.__compute_scale(weight).to(device=self._scale.device)
+            weight = self.__apply_scale(weight, divide=True).to(dtype=self.fp8_dtype)
 
             if device is not None:
                 weight = weight.to(device=orig_device)
         self.weight.data = weight
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        weight = self.weight.detach()
-        weight = weight.to(dtype=self.compute_dtype if self.compute_dtype is not None else x.dtype)
+        dtype = self.compute_dtype if self.compute_dtype is not None else x.dtype
 
-        if self._scale is not None:
-            weight = weight.mul_(self._scale)
+        if self.is_quantized:
+            weight = dequantized_weight_cache.get(
+                self, dtype, self.weight.device, lambda: self.unquantized_weight(dtype, self.weight.device)
+            )
+        else:
+            weight = self.weight.detach().to(dtype=dtype)
         x = nn.functional.linear(x, weight, self.bias)
 
         return x
@@ -1,5 +1,6 @@
 from modules.module.quantized.mixin.QuantizedLinearMixin import QuantizedLinearMixin
 from modules.module.quantized.mixin.QuantizedModuleMixin import QuantizedModuleMixin
+from modules.util.DequantizedWeightCache import dequantized_weight_cache
 
 import torch
 from torch import nn
@@ -69,7 +70,7 @@ class LinearNf4(
 
         weight = self.weight.data
         orig_device = weight.device
-        if weight.dtype != torch.int8:
+        if weight.dtype != torch.uint8:
             if device is not None:
                 weight = weight.to(device=device)
 
@@ -117,5 +118,15 @@ class LinearNf4(
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         orig_dtype = x.dtype
         x = x.to(dtype=self.compute_dtype)
-        x = bnb.matmul_4bit(x, self.weight.t(), bias=self.bias, quant_state=self.quant_state)
+        if dequantized_weight_cache.is_enabled():
+            # With the cache, the whole weight is dequantized once and reused for the recomputation of gradient
+            # checkpointing. bnb.matmul_4bit dequantizes the whole weight on every call as well, except for
+            # single token inputs, where its fused 4 bit kernel is faster. The cached weight uses memory until the
+            # cache is cleared.
+            weight = dequantized_weight_cache.get(
+                self, self.compute_dtype, x.device, lambda: self.unquantized_weight(self.compute_dtype, x.device)
+            )
+            x = nn.functional.linear(x, weight, self.bias)
+        else:
+            x = bnb.matmul_4bit(x, self.weight.t(), bias=self.bias, quant_state=self.quant_state)
         return x.to(dtype=orig_dtype)
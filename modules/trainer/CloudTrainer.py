@@ -64,14 +64,24 @@ class CloudTrainer(BaseTrainer):
 
         self.stop_event=threading.Event()
 
+        def exec_callback() -> bool:
+            try:
+                self.cloud.exec_callback(self.callbacks)
+                return True
+            except Exception:
+                traceback.print_exc()
+                self.callbacks.on_update_status("error: check the console for more information")
+                return False
+
         def callback():
+            #exec_callback waits for new callbacks itself; only wait before retrying after an error:
             while not self.stop_event.is_set():
-                try:
-                    self.cloud.exec_callback(self.callbacks)
-                except Exception:
-                    traceback.print_exc()
-                    self.callbacks.on_update_status("error: check the console for more information")
-                time.sleep(1)
+                if not exec_callback():
+                    time.sleep(1)
+
+            #receive the last callbacks of the trainer:
+            with suppress(Exception):
+                self.cloud.exec_callback(self.callbacks)
 
         self.callback_thread = threading.Thread(target=callback)
         self.callback_thread.start()
@@ -10,21 +10,26 @@ from pathlib import Path
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
 from modules.model.BaseModel import BaseModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
-from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput
+from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput, SampleJob
 from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.trainer.BaseTrainer import BaseTrainer
-from modules.util import create, path_util
+from modules.util import create, distributed_util, path_util
+from modules.util.AsyncCheckpointWriter import AsyncCheckpointWriter
+from modules.util.BackgroundSampler import BackgroundSampler
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
 from modules.util.commands.TrainCommands import TrainCommands
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.DequantizedWeightCache import dequantized_weight_cache
 from modules.util.dtype_util import create_grad_scaler, enable_grad_scaling
 from modules.util.enum.FileType import FileType
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.TimeUnit import TimeUnit
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.GradientReducer import GradientReducer
 from modules.util.memory_util import TorchMemoryRecorder
+from modules.util.quantization_util import set_fp8_scale_mode, set_quantization_cache_dir
 from modules.util.time_util import get_string_timestamp
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -59,25 +64,55 @@ class GenericTrainer(BaseTrainer):
 
     grad_hook_handles: list[RemovableHandle]
 
+    checkpoint_writer: AsyncCheckpointWriter
+
+    gradient_reducer: GradientReducer | None
+
     def __init__(self, config: TrainConfig, callbacks: TrainCallbacks, commands: TrainCommands):
+        if distributed_util.is_launched_externally() and int(os.environ["WORLD_SIZE"]) > 1:
+            # every worker process trains on its own device, the device is selected before it is used anywhere else
+            local_rank = int(os.environ.get("LOCAL_RANK", os.environ["RANK"]))
+            config.train_device = distributed_util.worker_device(
+                config.distributed_devices, config.train_device, local_rank
+            )
+            distributed_util.init_process_group(
+                torch.device(config.train_device),
+                int(os.environ["RANK"]),
+                int(os.environ["WORLD_SIZE"]),
+                config.distributed_port,
+            )
+
         super().__init__(config, callbacks, commands)
 
-        tensorboard_log_dir = os.path.join(config.workspace_dir, "tensorboard")
-        os.makedirs(Path(tensorboard_log_dir).absolute(), exist_ok=True)
-        self.tensorboard = SummaryWriter(os.path.join(tensorboard_log_dir, f"{config.save_filename_prefix}{get_string_timestamp()}"))
-        if config.tensorboard:
-            super()._start_tensorboard()
+        # only rank 0 writes tensorboard logs, samples and saves
+        if distributed_util.is_main_process():
+            tensorboard_log_dir = os.path.join(config.workspace_dir, "tensorboard")
+            os.makedirs(Path(tensorboard_log_dir).absolute(), exist_ok=True)
+            self.tensorboard = SummaryWriter(os.path.join(tensorboard_log_dir, f"{config.save_filename_prefix}{get_string_timestamp()}"))
+            if config.tensorboard:
+                super()._start_tensorboard()
+        else:
+            self.tensorboard = distributed_util.NullSummaryWriter()
 
         self.model = None
         self.one_step_trained = False
 
         self.grad_hook_handles = []
+        self.gradient_reducer = None
+        self.background_sampler = None
+
+        self.checkpoint_writer = AsyncCheckpointWriter(
+            callbacks,
+            incremental=config.incremental_backup,
+            model_names=config.model_names(),
+        )
 
     def start(self):
-        self.__save_config_to_workspace()
+        if distributed_util.is_main_process():
+            self.__save_config_to_workspace()
 
-        if self.config.clear_cache_before_training and self.config.latent_caching:
-            self.__clear_cache()
+            if self.config.clear_cache_before_training and self.config.latent_caching:
+                self.__clear_cache()
 
         if self.config.train_dtype.enable_tf():
             torch.backends.cuda.matmul.allow_tf32 = True
@@ -86,16 +121,24 @@ class GenericTrainer(BaseTrainer):
         self.model_loader = self.create_model_loader()
         self.model_setup = self.create_model_setup()
 
+        set_fp8_scale_mode(self.config.fp8_scale_mode, self.config.fp8_block_size)
+        dequantized_weight_cache.set_max_bytes(int(self.config.dequantized_weight_cache_size * (1024 ** 3)))
+        set_quantization_cache_dir(self.config.quantization_cache_dir if self.config.quantization_cache else None)
+
         self.callbacks.on_update_status("loading the model")
 
         model_names = self.config.model_names()
+        snapshot_backup_path = None
 
         if self.config.continue_last_backup:
             self.callbacks.on_update_status("searching for previous backups")
             last_backup_path = self.config.get_last_backup_path()
 
             if last_backup_path:
-                if self.config.training_method == TrainingMethod.LORA:
+                if AsyncCheckpointWriter.is_snapshot_backup(last_backup_path):
+                    # the model is loaded from the configured model names, the snapshot is applied on top of it
+                    snapshot_backup_path = last_backup_path
+                elif self.config.training_method == TrainingMethod.LORA:
                     model_names.lora = last_backup_path
                 elif self.config.training_method == TrainingMethod.EMBEDDING:
                     model_names.embedding.model_name = last_backup_path
@@ -121,13 +164,18 @@ class GenericTrainer(BaseTrainer):
             weight_dtypes=self.config.weight_dtypes(),
         )
         self.model.train_config = self.config
+        if snapshot_backup_path:
+            AsyncCheckpointWriter.load_snapshot_internal_data(self.model, snapshot_backup_path, model_names)
 
         self.callbacks.on_update_status("running model setup")
 
         self.model_setup.setup_optimizations(self.model, self.config)
-        self.model_setup.setup_train_device(self.model, self.config)
+        self.__setup_train_device()
         self.model_setup.setup_model(self.model, self.config)
-        self.model.to(self.temp_device)
+        if snapshot_backup_path:
+            AsyncCheckpointWriter.load_snapshot_parameters(self.model.parameters.parameters(), snapshot_backup_path)
+        distributed_util.broadcast_parameters(self.model.parameters.parameters())
+        self.__model_to_temp_device()
         self.model.eval()
         torch_gc()
 
@@ -139,15 +187,45 @@ class GenericTrainer(BaseTrainer):
         self.model_saver = self.create_model_saver()
 
         self.model_sampler = self.create_model_sampler(self.model)
+        self.__setup_prompt_embedding_cache()
+        if self.config.background_sampling and distributed_util.is_main_process():
+            self.callbacks.on_update_status("starting the background sampler")
+            self.background_sampler = BackgroundSampler(self.config, self.config.background_sampling_device)
         self.previous_sample_time = -1
         self.sample_queue = []
 
         self.parameters = self.model.parameters.parameters()
-        if self.config.validation:
+        if self.config.validation and distributed_util.is_main_process():
             self.validation_data_loader = self.create_data_loader(
                 self.model, self.model.train_progress, is_validation=True
             )
 
+    def __setup_prompt_embedding_cache(self):
+        prompt_embedding_cache = self.model_sampler.prompt_embedding_cache
+        prompt_embedding_cache.enabled = self.config.sample_prompt_cache
+
+        if self.config.sample_prompt_cache and self.config.sample_prompt_cache_persistent \
+                and distributed_util.is_main_process():
+            # persisted embeddings are only reused if the text encoders are loaded from the same source
+            model_identity = json.dumps({
+                "model_type": str(self.config.model_type),
+                "base_model_name": self.config.base_model_name,
+                "lora_model_name": self.config.lora_model_name,
+                "embedding_model_names": [self.config.embedding.model_name]
+                                         + [embedding.model_name for embedding in self.config.additional_embeddings],
+                "weight_dtypes": [
+                    str(self.config.weight_dtype),
+                    str(self.config.text_encoder.weight_dtype),
+                    str(self.config.text_encoder_2.weight_dtype),
+                    str(self.config.text_encoder_3.weight_dtype),
+                ],
+                "continue_last_backup": self.config.continue_last_backup,
+            })
+            prompt_embedding_cache.set_persistent_path(
+                path_util.canonical_join(self.config.workspace_dir, "cache", "sample_prompt_embeddings.safetensors"),
+                model_identity,
+            )
+
     def __save_config_to_workspace(self):
         path = path_util.canonical_join(self.config.workspace_dir, "config")
         os.makedirs(Path(path).absolute(), exist_ok=True)
@@ -166,12 +244,28 @@ class GenericTrainer(BaseTrainer):
                 if os.path.isdir(path) and (filename.startswith('epoch-') or filename in ['image', 'text']):
                     shutil.rmtree(path)
 
+    def __start_next_epoch(self, data_loader: BaseDataLoader):
+        # Rank 0 populates the shared cache, the other ranks wait for it and read the cached data afterwards.
+        if not distributed_util.is_main_process():
+            distributed_util.barrier()
+
+        data_loader.get_data_set().start_next_epoch()
+
+        if distributed_util.is_main_process():
+            distributed_util.barrier()
+
+    def __epoch_length(self, data_loader: BaseDataLoader) -> int:
+        length = data_loader.get_data_set().approximate_length()
+        if distributed_util.is_enabled():
+            length = distributed_util.shard_length(length)
+        return length
+
     def __prune_backups(self, backups_to_keep: int):
         backup_dirpath = os.path.join(self.config.workspace_dir, "backup")
         if os.path.exists(backup_dirpath):
             backup_directories = sorted(
                 [dirpath for dirpath in os.listdir(backup_dirpath) if
-                 os.path.isdir(os.path.join(backup_dirpath, dirpath))],
+                 os.path.isdir(os.path.join(backup_dirpath, dirpath)) and not dirpath.startswith('.')],
                 reverse=True,
             )
 
@@ -182,6 +276,8 @@ class GenericTrainer(BaseTrainer):
                 except Exception:
                     print(f"Could not delete old rolling backup {dirpath}")
 
+            AsyncCheckpointWriter.remove_unreferenced_objects(backup_dirpath)
+
         return
 
     def __enqueue_sample_during_training(self, fun: Callable):
@@ -192,71 +288,106 @@ class GenericTrainer(BaseTrainer):
             fun()
         self.sample_queue = []
 
-    def __sample_loop(
+    def __create_sample_jobs(
             self,
             train_progress: TrainProgress,
-            train_device: torch.device,
             sample_config_list: list[SampleConfig],
             folder_postfix: str = "",
             is_custom_sample: bool = False,
-    ):
+    ) -> list[SampleJob]:
+        sample_jobs = []
         for i, sample_config in enumerate(sample_config_list):
             if sample_config.enabled:
-                try:
-                    safe_prompt = path_util.safe_filename(sample_config.prompt)
-
-                    if is_custom_sample:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            "custom",
-                        )
-                    else:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            f"{str(i)} - {safe_prompt}{folder_postfix}",
-                        )
+                safe_prompt = path_util.safe_filename(sample_config.prompt)
 
-                    sample_path = os.path.join(
-                        sample_dir,
-                        f"{get_string_timestamp()}-training-sample-{train_progress.filename_string()}"
+                if is_custom_sample:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        "custom",
+                    )
+                else:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        f"{str(i)} - {safe_prompt}{folder_postfix}",
                     )
 
-                    def on_sample_default(sampler_output: ModelSamplerOutput):
-                        if self.config.samples_to_tensorboard and sampler_output.file_type == FileType.IMAGE:
-                            self.tensorboard.add_image(
-                                f"sample{str(i)} - {safe_prompt}", pil_to_tensor(sampler_output.data),  # noqa: B023
-                                train_progress.global_step
-                            )
-                        self.callbacks.on_sample_default(sampler_output)
+                sample_path = os.path.join(
+                    sample_dir,
+                    f"{get_string_timestamp()}-training-sample-{train_progress.filename_string()}"
+                )
 
-                    def on_sample_custom(sampler_output: ModelSamplerOutput):
-                        self.callbacks.on_sample_custom(sampler_output)
+                if is_custom_sample:
+                    on_sample = self.callbacks.on_sample_custom
+                else:
+                    on_sample = self.__create_on_sample_default(train_progress, f"sample{str(i)} - {safe_prompt}")
 
-                    on_sample = on_sample_custom if is_custom_sample else on_sample_default
-                    on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
+                sample_config = copy.copy(sample_config)
+                sample_config.from_train_config(self.config)
 
-                    self.model.to(self.temp_device)
-                    self.model.eval()
+                sample_jobs.append(SampleJob(sample_config, sample_path, on_sample))
 
-                    sample_config = copy.copy(sample_config)
-                    sample_config.from_train_config(self.config)
+        return sample_jobs
 
-                    self.model_sampler.sample(
-                        sample_config=sample_config,
-                        destination=sample_path,
-                        image_format=self.config.sample_image_format,
-                        video_format=self.config.sample_video_format,
-                        audio_format=self.config.sample_audio_format,
-                        on_sample=on_sample,
-                        on_update_progress=on_update_progress,
-                    )
-                except Exception:
-                    traceback.print_exc()
-                    print("Error during sampling, proceeding without sampling")
+    def __model_to_temp_device(self):
+        # dequantized weights are cached per device, copies on the train device would stay alive
+        dequantized_weight_cache.clear()
+        self.model.to(self.temp_device)
 
-                torch_gc()
+    def __setup_train_device(self):
+        dequantized_weight_cache.clear()
+        self.model_setup.setup_train_device(self.model, self.config)
+
+    def __sample_loop(
+            self,
+            train_progress: TrainProgress,
+            train_device: torch.device,
+            sample_config_list: list[SampleConfig],
+            folder_postfix: str = "",
+            is_custom_sample: bool = False,
+    ):
+        sample_jobs = self.__create_sample_jobs(train_progress, sample_config_list, folder_postfix, is_custom_sample)
+        if not sample_jobs:
+            return
+
+        on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
+
+        try:
+            self.__model_to_temp_device()
+            self.model.eval()
+
+            # all samples are created in one call, each sub model is only moved to the train device once
+            self.model_sampler.sample_multiple(
+                sample_jobs=sample_jobs,
+                image_format=self.config.sample_image_format,
+                video_format=self.config.sample_video_format,
+                audio_format=self.config.sample_audio_format,
+                max_batch_size=self.config.sample_batch_size,
+                on_update_progress=on_update_progress,
+            )
+        except Exception:
+            traceback.print_exc()
+            print("Error during sampling, proceeding without sampling")
+
+        # weights dequantized for sampling are not needed by the next training step
+        dequantized_weight_cache.clear()
+        torch_gc()
+
+    def __create_on_sample_default(
+            self,
+            train_progress: TrainProgress,
+            tag: str,
+    ) -> Callable[[ModelSamplerOutput], None]:
+        # background samples arrive after training continued, the step is taken when the sample is requested
+        global_step = train_progress.global_step
+
+        def on_sample_default(sampler_output: ModelSamplerOutput):
+            if self.config.samples_to_tensorboard and sampler_output.file_type == FileType.IMAGE:
+                self.tensorboard.add_image(tag, pil_to_tensor(sampler_output.data), global_step)
+            self.callbacks.on_sample_default(sampler_output)
+
+        return on_sample_default
 
     def __sample_during_training(
             self,
@@ -285,29 +416,32 @@ class GenericTrainer(BaseTrainer):
         else:
             is_custom_sample = True
 
-        if self.model.ema:
-            self.model.ema.copy_ema_to(self.parameters, store_temp=True)
-
-        self.__sample_loop(
-            train_progress=train_progress,
-            train_device=train_device,
-            sample_config_list=sample_params_list,
-            is_custom_sample=is_custom_sample,
-        )
-
-        if self.model.ema:
-            self.model.ema.copy_temp_to(self.parameters)
+        if self.background_sampler is not None and self.background_sampler.is_available():
+            self.__sample_in_background(train_progress, sample_params_list, is_custom_sample)
+        else:
+            if self.model.ema:
+                self.model.ema.copy_ema_to(self.parameters, store_temp=True)
 
-        # ema-less sampling, if an ema model exists
-        if self.model.ema and not is_custom_sample and self.config.non_ema_sampling:
             self.__sample_loop(
                 train_progress=train_progress,
                 train_device=train_device,
                 sample_config_list=sample_params_list,
-                folder_postfix=" - no-ema",
+                is_custom_sample=is_custom_sample,
             )
 
-        self.model_setup.setup_train_device(self.model, self.config)
+            if self.model.ema:
+                self.model.ema.copy_temp_to(self.parameters)
+
+            # ema-less sampling, if an ema model exists
+            if self.model.ema and not is_custom_sample and self.config.non_ema_sampling:
+                self.__sample_loop(
+                    train_progress=train_progress,
+                    train_device=train_device,
+                    sample_config_list=sample_params_list,
+                    folder_postfix=" - no-ema",
+                )
+
+            self.__setup_train_device()
         # Special case for schedule-free optimizers.
         if self.config.optimizer.optimizer.is_schedule_free:
             torch.clear_autocast_cache()
@@ -315,6 +449,46 @@ class GenericTrainer(BaseTrainer):
 
         torch_gc()
 
+    def __sample_in_background(
+            self,
+            train_progress: TrainProgress,
+            sample_config_list: list[SampleConfig],
+            is_custom_sample: bool,
+    ):
+        # the model stays on the train device, only a copy of the trainable parameters is sent to the worker
+        if self.background_sampler.is_busy():
+            print("The background sampler is still busy, skipping this sampling round")
+            return
+
+        on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
+
+        if self.model.ema:
+            self.model.ema.copy_ema_to(self.parameters, store_temp=True)
+
+        sample_jobs = self.__create_sample_jobs(train_progress, sample_config_list, is_custom_sample=is_custom_sample)
+        if sample_jobs:
+            self.background_sampler.submit(
+                train_progress.global_step,
+                self.model.ema.weights_version if self.model.ema else 0,
+                self.parameters,
+                sample_jobs,
+                on_update_progress,
+            )
+
+        if self.model.ema:
+            self.model.ema.copy_temp_to(self.parameters)
+
+            if not is_custom_sample and self.config.non_ema_sampling:
+                sample_jobs = self.__create_sample_jobs(train_progress, sample_config_list, folder_postfix=" - no-ema")
+                if sample_jobs:
+                    self.background_sampler.submit(
+                        train_progress.global_step,
+                        self.model.ema.weights_version,
+                        self.parameters,
+                        sample_jobs,
+                        on_update_progress,
+                    )
+
     def __validate(self, train_progress: TrainProgress):
         if self.__needs_validate(train_progress):
             self.validation_data_loader.get_data_set().start_next_epoch()
@@ -324,7 +498,7 @@ class GenericTrainer(BaseTrainer):
                 return
 
             self.callbacks.on_update_status("calculating validation loss")
-            self.model_setup.setup_train_device(self.model, self.config)
+            self.__setup_train_device()
 
             torch_gc()
 
@@ -441,7 +615,7 @@ class GenericTrainer(BaseTrainer):
             if self.config.rolling_backup:
                 self.__prune_backups(self.config.rolling_backup_count)
 
-        self.model_setup.setup_train_device(self.model, self.config)
+        self.__setup_train_device()
         # Special case for schedule-free optimizers.
         if self.config.optimizer.optimizer.is_schedule_free:
             torch.clear_autocast_cache()
@@ -449,6 +623,46 @@ class GenericTrainer(BaseTrainer):
 
         torch_gc()
 
+    def __backup_snapshot(self, train_progress: TrainProgress, print_msg: bool = True, print_cb: Callable[[str], None] = print):
+        if self.checkpoint_writer.is_busy():
+            print_cb("The previous backup is still being written, skipping this backup")
+            return
+
+        self.callbacks.on_update_status("creating backup snapshot")
+
+        backup_name = f"{get_string_timestamp()}-backup-{train_progress.filename_string()}"
+        backup_path = os.path.join(self.config.workspace_dir, "backup", backup_name)
+
+        # Special case for schedule-free optimizers.
+        if self.config.optimizer.optimizer.is_schedule_free:
+            torch.clear_autocast_cache()
+            self.model.optimizer.eval()
+
+        try:
+            if print_msg:
+                print_cb("Creating Backup " + backup_path)
+
+            snapshot = self.checkpoint_writer.snapshot(self.model, self.parameters)
+        finally:
+            # Special case for schedule-free optimizers.
+            if self.config.optimizer.optimizer.is_schedule_free:
+                torch.clear_autocast_cache()
+                self.model.optimizer.train()
+
+        def on_finish():
+            if self.config.rolling_backup:
+                self.__prune_backups(self.config.rolling_backup_count)
+
+        self.checkpoint_writer.write(
+            snapshot,
+            backup_path,
+            on_prepare=self.__save_backup_config,
+            on_finish=on_finish,
+        )
+
+        if not self.config.async_backup:
+            self.checkpoint_writer.wait()
+
     def save(self, train_progress: TrainProgress, print_msg: bool = True, print_cb: Callable[[str], None] = print):
         torch_gc()
 
@@ -583,11 +797,25 @@ class GenericTrainer(BaseTrainer):
         if self.config.only_cache:
             self.callbacks.on_update_status("caching")
             for _epoch in tqdm(range(train_progress.epoch, self.config.epochs, 1), desc="epoch"):
-                self.data_loader.get_data_set().start_next_epoch()
+                self.__start_next_epoch(self.data_loader)
             return
 
         scaler = create_grad_scaler() if enable_grad_scaling(self.config.train_dtype, self.parameters) else None
 
+        if distributed_util.is_enabled():
+            # the gradient hooks of the reducer have to run before the fused back pass hooks
+            self.gradient_reducer = GradientReducer(
+                self.parameters,
+                bucket_size_bytes=self.config.distributed_bucket_size * (1024 ** 2),
+                synchronous=self.config.optimizer.optimizer.supports_fused_back_pass()
+                            and self.config.optimizer.fused_back_pass,
+            )
+            self.gradient_reducer.register_hooks()
+
+            train_data_loader = distributed_util.shard_data_loader(self.data_loader.get_data_loader())
+        else:
+            train_data_loader = self.data_loader.get_data_loader()
+
         self.__apply_fused_back_pass(scaler)
 
         # False if the model gradients are all None, True otherwise
@@ -602,11 +830,11 @@ class GenericTrainer(BaseTrainer):
             self.callbacks.on_update_status("starting epoch/caching")
 
             if self.config.latent_caching:
-                self.data_loader.get_data_set().start_next_epoch()
-                self.model_setup.setup_train_device(self.model, self.config)
+                self.__start_next_epoch(self.data_loader)
+                self.__setup_train_device()
             else:
-                self.model_setup.setup_train_device(self.model, self.config)
-                self.data_loader.get_data_set().start_next_epoch()
+                self.__setup_train_device()
+                self.__start_next_epoch(self.data_loader)
 
             # Special case for schedule-free optimizers, which need train()
             # called before training. Can and should move this to a callback
@@ -626,14 +854,14 @@ class GenericTrainer(BaseTrainer):
                     num_cycles=self.config.learning_rate_cycles,
                     min_factor=self.config.learning_rate_min_factor,
                     num_epochs=self.config.epochs,
-                    approximate_epoch_length=self.data_loader.get_data_set().approximate_length(),
+                    approximate_epoch_length=self.__epoch_length(self.data_loader),
                     batch_size=self.config.batch_size,
                     gradient_accumulation_steps=self.config.gradient_accumulation_steps,
                     global_step=train_progress.global_step
                 )
 
-            current_epoch_length = self.data_loader.get_data_set().approximate_length()
-            step_tqdm = tqdm(self.data_loader.get_data_loader(), desc="step", total=current_epoch_length,
+            current_epoch_length = self.__epoch_length(self.data_loader)
+            step_tqdm = tqdm(train_data_loader, desc="step", total=current_epoch_length,
                              initial=train_progress.epoch_step)
             for batch in step_tqdm:
                 if self.__needs_sample(train_progress) or self.commands.get_and_reset_sample_default_command():
@@ -660,22 +888,33 @@ class GenericTrainer(BaseTrainer):
                 if self.__needs_gc(train_progress):
                     torch_gc()
 
+                if self.background_sampler is not None:
+                    self.background_sampler.poll()
+                self.checkpoint_writer.poll()
+
                 if not has_gradient:
-                    self.__execute_sample_during_training()
+                    if distributed_util.is_main_process():
+                        self.__execute_sample_during_training()
+                    else:
+                        self.sample_queue = []
                     transferred_to_temp_device = False
 
-                    if self.commands.get_and_reset_backup_command():
-                        self.model.to(self.temp_device)
-                        self.backup(train_progress, True, step_tqdm.write)
-                        transferred_to_temp_device = True
+                    # commands are reset on all ranks, but only executed on rank 0
+                    if self.commands.get_and_reset_backup_command() and distributed_util.is_main_process():
+                        if self.config.async_backup or self.config.incremental_backup:
+                            self.__backup_snapshot(train_progress, True, step_tqdm.write)
+                        else:
+                            self.__model_to_temp_device()
+                            self.backup(train_progress, True, step_tqdm.write)
+                            transferred_to_temp_device = True
 
-                    if self.commands.get_and_reset_save_command():
-                        self.model.to(self.temp_device)
+                    if self.commands.get_and_reset_save_command() and distributed_util.is_main_process():
+                        self.__model_to_temp_device()
                         self.save(train_progress, True, step_tqdm.write)
                         transferred_to_temp_device = True
 
                     if transferred_to_temp_device:
-                        self.model_setup.setup_train_device(self.model, self.config)
+                        self.__setup_train_device()
 
                 self.callbacks.on_update_status("training")
 
@@ -685,6 +924,9 @@ class GenericTrainer(BaseTrainer):
                     loss = self.model_setup.calculate_loss(self.model, batch, model_output_data, self.config)
 
                     loss = loss / self.config.gradient_accumulation_steps
+                    if self.gradient_reducer is not None:
+                        # gradients are only exchanged in the backward pass of update steps
+                        self.gradient_reducer.enabled = self.__is_update_step(train_progress)
                     if scaler:
                         scaler.scale(loss).backward()
                     else:
@@ -694,6 +936,10 @@ class GenericTrainer(BaseTrainer):
                     accumulated_loss += loss.item()
 
                     if self.__is_update_step(train_progress):
+                        if self.gradient_reducer is not None:
+                            self.gradient_reducer.finish()
+                            accumulated_loss = distributed_util.all_reduce_mean(accumulated_loss, train_device)
+
                         if scaler and self.config.optimizer.optimizer.supports_fused_back_pass() and self.config.optimizer.fused_back_pass:
                             scaler.step_after_unscale_parameter_(self.model.optimizer)
                             scaler.update()
@@ -708,10 +954,17 @@ class GenericTrainer(BaseTrainer):
                                 nn.utils.clip_grad_norm_(self.parameters, self.config.clip_grad_norm)
                             self.model.optimizer.step()
 
+                        if self.config.optimizer_offload:
+                            # offloaded updates of the fused back pass run in the background until here
+                            self.model.optimizer.finish_offloaded_steps()
+
                         lr_scheduler.step()  # done before zero_grad, because some lr schedulers need gradients
                         self.model.optimizer.zero_grad(set_to_none=True)
                         has_gradient = False
 
+                        # dequantized weights are only valid for a single step
+                        dequantized_weight_cache.clear()
+
                         self.model_setup.report_to_tensorboard(
                             self.model, self.config, lr_scheduler, self.tensorboard
                         )
@@ -743,7 +996,7 @@ class GenericTrainer(BaseTrainer):
 
                         self.one_step_trained = True
 
-                if self.config.validation:
+                if self.config.validation and distributed_util.is_main_process():
                     self.__validate(train_progress)
 
                 train_progress.next_step(self.config.batch_size)
@@ -759,11 +1012,26 @@ class GenericTrainer(BaseTrainer):
                 return
 
     def end(self):
-        if self.one_step_trained:
-            self.model.to(self.temp_device)
+        dequantized_weight_cache.clear()
+
+        if self.background_sampler is not None:
+            if self.background_sampler.is_busy():
+                self.callbacks.on_update_status("waiting for the background sampler")
+            self.background_sampler.close()
+
+        if self.checkpoint_writer.is_busy():
+            self.callbacks.on_update_status("waiting for the backup to be written")
+        self.checkpoint_writer.wait()
+
+        if self.one_step_trained and distributed_util.is_main_process():
+            self.__model_to_temp_device()
 
             if self.config.backup_before_save:
-                self.backup(self.model.train_progress)
+                if self.config.async_backup or self.config.incremental_backup:
+                    self.__backup_snapshot(self.model.train_progress)
+                    self.checkpoint_writer.wait()
+                else:
+                    self.backup(self.model.train_progress)
             # Special case for schedule-free optimizers.
             if self.config.optimizer.optimizer.is_schedule_free:
                 torch.clear_autocast_cache()
@@ -790,12 +1058,19 @@ class GenericTrainer(BaseTrainer):
                 dtype=self.config.output_dtype.torch_dtype()
             )
         elif self.model is not None:
-            self.model.to(self.temp_device)
+            self.__model_to_temp_device()
 
         self.tensorboard.close()
 
-        if self.config.tensorboard:
+        if self.config.tensorboard and distributed_util.is_main_process():
             super()._stop_tensorboard()
 
         for handle in self.grad_hook_handles:
             handle.remove()
+
+        if self.gradient_reducer is not None:
+            self.gradient_reducer.remove_hooks()
+
+        # the other ranks wait until rank 0 has written the final model
+        distributed_util.barrier()
+        distributed_util.destroy_process_group()
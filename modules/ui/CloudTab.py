@@ -72,6 +72,26 @@ class CloudTab:
                          tooltip="Instead of starting tensorboard locally, make a TCP tunnel to a tensorboard on the cloud")
         components.switch(self.frame, 8, 1, self.ui_state, "cloud.tensorboard_tunnel")
 
+        components.label(self.frame, 9, 0, "Sync streams",
+                         tooltip="Number of directories and large files that are downloaded concurrently during workspace sync")
+        components.entry(self.frame, 9, 1, self.ui_state, "cloud.sync_streams")
+
+        components.label(self.frame, 10, 0, "Chunked transfer size",
+                         tooltip="Files of at least this size in MB are uploaded and downloaded in content addressed chunks. Chunked transfers resume after an interrupted connection, and chunks that already exist on the other side are skipped. 0 to disable")
+        components.entry(self.frame, 10, 1, self.ui_state, "cloud.sync_resume_size")
+
+        components.label(self.frame, 11, 0, "Chunk size",
+                         tooltip="Size of a single chunk in MB")
+        components.entry(self.frame, 11, 1, self.ui_state, "cloud.transfer_chunk_size")
+
+        components.label(self.frame, 12, 0, "Chunk transfer workers",
+                         tooltip="Number of chunks that are transferred concurrently")
+        components.entry(self.frame, 12, 1, self.ui_state, "cloud.transfer_workers")
+
+        components.label(self.frame, 13, 0, "Compress chunks",
+                         tooltip="Compresses uploaded chunks with zstd if it makes them smaller, for example for text or optimizer files. Requires the zstandard package on both sides")
+        components.switch(self.frame, 13, 1, self.ui_state, "cloud.transfer_compression")
+
 
 
         components.label(self.frame, 1, 2, "Remote Directory",
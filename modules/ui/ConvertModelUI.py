@@ -9,6 +9,7 @@ from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ModelNames import EmbeddingName, ModelNames
+from modules.util.quantization_util import set_fp8_scale_mode
 from modules.util.torch_util import torch_gc
 from modules.util.ui import components
 from modules.util.ui.UIState import UIState
@@ -109,6 +110,7 @@ class ConvertModelUI(ctk.CTkToplevel):
     def convert_model(self):
         try:
             self.button.configure(state="disabled")
+            set_fp8_scale_mode(self.convert_model_args.fp8_scale_mode, self.convert_model_args.fp8_block_size)
             model_loader = create.create_model_loader(
                 model_type=self.convert_model_args.model_type,
                 training_method=self.convert_model_args.training_method
@@ -3,6 +3,7 @@ from pathlib import Path
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.ConfigPart import ConfigPart
 from modules.util.enum.DataType import DataType
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ui import components
@@ -238,6 +239,20 @@ class ModelTab:
 
         row += 1
 
+        # float8 scale mode
+        components.label(self.scroll_frame, row, 3, "Float8 Scale Mode",
+                         tooltip="The granularity of the scale used for float8 weights. TENSOR uses one scale for each weight, CHANNEL uses one scale per output channel and BLOCK uses one scale per block of the weight. Finer scales preserve more precision for layers with outliers")
+        components.options(self.scroll_frame, row, 4, [str(x) for x in list(Fp8ScaleMode)],
+                           self.ui_state, "fp8_scale_mode")
+
+        row += 1
+
+        components.label(self.scroll_frame, row, 3, "Float8 Block Size",
+                         tooltip="The size of the square blocks used by the BLOCK float8 scale mode")
+        components.entry(self.scroll_frame, row, 4, self.ui_state, "fp8_block_size")
+
+        row += 1
+
         return row
 
     def __create_base_components(
@@ -65,6 +65,46 @@ class OffloadingWindow(ctk.CTkToplevel):
                          tooltip="Enables offloading of individual layers during training to reduce VRAM usage. Increases training time and uses more RAM. Only available if checkpointing is set to CPU_OFFLOADED. values between 0 and 1, 0=disabled")
         components.entry(frame, 3, 1, self.ui_state, "layer_offload_fraction")
 
+        # automatic layer offloading plan
+        components.label(frame, 4, 0, "Automatic Layer Offload Plan",
+                         tooltip="Measures the compute time of each layer and the transfer bandwidth during the first training step, then decides which layers stay on the GPU and how far ahead offloaded layers are loaded. The plan is saved in the workspace and reused. Requires a layer offload fraction above 0 and async offloading")
+        components.switch(frame, 4, 1, self.ui_state, "layer_offload_auto_plan")
+
+        # layer offloading vram budget
+        components.label(frame, 5, 0, "Layer Offload VRAM Budget (GB)",
+                         tooltip="The VRAM used for layer weights by the automatic layer offload plan. 0 = use the layer offload fraction")
+        components.entry(frame, 5, 1, self.ui_state, "layer_offload_vram_budget")
+
+        # layer offloading disk cache
+        components.label(frame, 6, 0, "Layer Offload Disk Cache Directory",
+                         tooltip="Offloaded layers that are not needed soon are moved from RAM to a memory-mapped file in this directory, and read back ahead of time. Use a fast local SSD. Empty = disabled")
+        components.dir_entry(frame, 6, 1, self.ui_state, "layer_offload_disk_cache_dir")
+
+        # layer offloading host budget
+        components.label(frame, 7, 0, "Layer Offload RAM Budget (GB)",
+                         tooltip="The pinned RAM used for offloaded layers if the layer offload disk cache is enabled. At least two layers are always kept in RAM")
+        components.entry(frame, 7, 1, self.ui_state, "layer_offload_host_budget")
+
+        # optimizer offloading
+        components.label(frame, 8, 0, "Offload Optimizer",
+                         tooltip="Keeps the optimizer state in RAM and runs the optimizer step on the CPU. Gradients are copied to RAM and updated weights are copied back in the background. Combine with fused back pass to overlap the updates with the backward pass. Only available for optimizers that support fused back pass, and not together with layer offloading")
+        components.switch(frame, 8, 1, self.ui_state, "optimizer_offload")
+
+        # optimizer offloading threads
+        components.label(frame, 9, 0, "Optimizer Offload Threads",
+                         tooltip="The number of CPU threads that run optimizer steps in parallel")
+        components.entry(frame, 9, 1, self.ui_state, "optimizer_offload_threads")
+
+        # selective checkpointing
+        components.label(frame, 10, 0, "Checkpoint Every N Blocks",
+                         tooltip="Only applies gradient checkpointing to every Nth transformer block. The other blocks keep their activations, which uses more VRAM but avoids recomputing them during the backward pass. 1 checkpoints every block. Not used together with offloading")
+        components.entry(frame, 10, 1, self.ui_state, "checkpointing_every_n_blocks")
+
+        # checkpointing activation budget
+        components.label(frame, 11, 0, "Checkpointing Activation Budget (GB)",
+                         tooltip="The VRAM that activations of transformer blocks are allowed to use. The activation size of each block is measured during the first step, then only the blocks that don't fit into the budget are checkpointed. 0 disables the budget. Takes precedence over Checkpoint Every N Blocks. Not used together with offloading")
+        components.entry(frame, 11, 1, self.ui_state, "checkpointing_activation_budget")
+
         frame.pack(fill="both", expand=1)
         return frame
 
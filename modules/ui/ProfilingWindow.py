@@ -1,15 +1,19 @@
 import faulthandler
 
+from modules.util.config.TrainConfig import TrainConfig
 from modules.util.ui import components
+from modules.util.ui.UIState import UIState
 
 import customtkinter as ctk
 from scalene import scalene_profiler
 
 
 class ProfilingWindow(ctk.CTkToplevel):
-    def __init__(self, parent, *args, **kwargs):
+    def __init__(self, parent, config: TrainConfig, ui_state: UIState, *args, **kwargs):
         ctk.CTkToplevel.__init__(self, parent, *args, **kwargs)
         self.parent = parent
+        self.config = config
+        self.ui_state = ui_state
 
         self.title("Profiling")
         self.geometry("512x512")
@@ -19,17 +23,21 @@ class ProfilingWindow(ctk.CTkToplevel):
 
         self.grid_rowconfigure(0, weight=0)
         self.grid_rowconfigure(1, weight=0)
-        self.grid_rowconfigure(2, weight=1)
+        self.grid_rowconfigure(2, weight=0)
+        self.grid_rowconfigure(3, weight=1)
         self.grid_columnconfigure(0, weight=1)
 
         components.button(self, 0, 0, "Dump stack", self._dump_stack)
         self._profile_button = components.button(
             self, 1, 0, "Start Profiling", self._start_profiler,
             tooltip="Turns on/off Scalene profiling. Only works when OneTrainer is launched with Scalene!")
+        # Records a timeline of layer and activation offloading during the next training run. Requires async
+        # offloading. The trace and a summary are written when the model is moved off the train device.
+        components.switch(self, 2, 0, self.ui_state, "layer_offload_trace", text="Trace Layer Offloading")
 
         # Bottom bar
         self._bottom_bar = ctk.CTkFrame(master=self, corner_radius=0)
-        self._bottom_bar.grid(row=2, column=0, sticky="sew")
+        self._bottom_bar.grid(row=3, column=0, sticky="sew")
         self._message_label = components.label(self._bottom_bar, 0, 0, "Inactive")
 
         self.protocol("WM_DELETE_WINDOW", self.withdraw)
@@ -12,6 +12,7 @@ from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.EMAMode import EMAMode
 from modules.util.enum.FileType import FileType
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.quantization_util import set_fp8_scale_mode
 from modules.util.time_util import get_string_timestamp
 from modules.util.ui import components
 from modules.util.ui.UIState import UIState
@@ -89,6 +90,8 @@ class SampleWindow(ctk.CTkToplevel):
         components.button(self, 3, 0, "sample", self.__sample)
 
     def __load_model(self) -> BaseModel:
+        set_fp8_scale_mode(self.initial_train_config.fp8_scale_mode, self.initial_train_config.fp8_block_size)
+
         model_loader = create.create_model_loader(
             model_type=self.initial_train_config.model_type,
             training_method=self.initial_train_config.training_method,
@@ -86,7 +86,7 @@ class TrainUI(ctk.CTk):
         self.training_commands = None
 
         # Persistent profiling window.
-        self.profiling_window = ProfilingWindow(self)
+        self.profiling_window = ProfilingWindow(self, self.train_config, self.ui_state)
 
         self.protocol("WM_DELETE_WINDOW", self.__close)
 
@@ -171,6 +171,15 @@ class TrainUI(ctk.CTk):
                          tooltip="The directory where cached data is saved")
         components.dir_entry(frame, 1, 1, self.ui_state, "cache_dir")
 
+        # quantization cache
+        components.label(frame, 1, 2, "Quantization Cache Directory",
+                         tooltip="The directory where pre-quantized model weights are saved. The cache is shared between training runs")
+        components.dir_entry(frame, 1, 3, self.ui_state, "quantization_cache_dir")
+
+        components.label(frame, 2, 2, "Quantization Cache",
+                         tooltip="Saves the quantized weights of nf4 and float8 models after the first load, and loads them from the quantization cache directory in later runs")
+        components.switch(frame, 2, 3, self.ui_state, "quantization_cache")
+
         # continue from previous backup
         components.label(frame, 2, 0, "Continue from last backup",
                          tooltip="Automatically continues training from the last backup saved in <workspace>/backup")
@@ -220,10 +229,18 @@ class TrainUI(ctk.CTk):
                          tooltip="The device used for training. Can be \"cuda\", \"cuda:0\", \"cuda:1\" etc. Default:\"cuda\"")
         components.entry(frame, 11, 1, self.ui_state, "train_device")
 
+        components.label(frame, 11, 2, "Distributed Devices",
+                         tooltip="Comma separated list of devices for multi process data parallel training, for example \"cuda:0,cuda:1\". One worker process is started per device when training with scripts/train.py. Leave empty to train on the train device only")
+        components.entry(frame, 11, 3, self.ui_state, "distributed_devices")
+
         components.label(frame, 12, 0, "Temp Device",
                          tooltip="The device used to temporarily offload models while they are not used. Default:\"cpu\"")
         components.entry(frame, 12, 1, self.ui_state, "temp_device")
 
+        components.label(frame, 12, 2, "Gradient Bucket Size (MB)",
+                         tooltip="Size of the gradient buckets that are exchanged between the worker processes during the backward pass of distributed training")
+        components.entry(frame, 12, 3, self.ui_state, "distributed_bucket_size")
+
         frame.pack(fill="both", expand=1)
         return frame
 
@@ -248,11 +265,28 @@ class TrainUI(ctk.CTk):
                          tooltip="Caching of intermediate training data that can be re-used between epochs")
         components.switch(frame, 1, 1, self.ui_state, "latent_caching")
 
+        components.label(frame, 1, 3, "Caching Batch Size",
+                         tooltip="Number of images or prompts that are encoded by the VAE or text encoders at once during caching. They are encoded by the data loader threads, so the batch size is limited by the number of Dataloader Threads")
+        components.entry(frame, 1, 4, self.ui_state, "caching_batch_size")
+
         # clear cache before training
         components.label(frame, 2, 0, "Clear cache before training",
                          tooltip="Clears the cache directory before starting to train. Only disable this if you want to continue using the same cached data. Disabling this can lead to errors, if other settings are changed during a restart")
         components.switch(frame, 2, 1, self.ui_state, "clear_cache_before_training")
 
+        # latent store
+        components.label(frame, 3, 0, "Shared Latent Store",
+                         tooltip="Stores encoded images in a directory that is shared between training runs. Images with the same content, crop, flip and VAE are not encoded again, even in a different run or for a different model with the same VAE")
+        components.switch(frame, 3, 1, self.ui_state, "latent_store")
+
+        components.label(frame, 4, 0, "Latent Store Directory",
+                         tooltip="The directory of the shared latent store")
+        components.dir_entry(frame, 4, 1, self.ui_state, "latent_store_dir")
+
+        components.label(frame, 4, 3, "Latent Store Size",
+                         tooltip="The maximum size of the shared latent store in GB. If the store grows larger, the least recently used entries are removed")
+        components.entry(frame, 4, 4, self.ui_state, "latent_store_size")
+
         frame.pack(fill="both", expand=1)
         return frame
 
@@ -303,6 +337,26 @@ class TrainUI(ctk.CTk):
                          tooltip="Whether to include sample images in the Tensorboard output.")
         components.switch(sub_frame, 0, 3, self.ui_state, "samples_to_tensorboard")
 
+        components.label(sub_frame, 0, 4, "Sample Batch Size",
+                         tooltip="The maximum number of samples that are created at once. Only samples with the same resolution and number of steps are combined. Not all model types support batched sampling")
+        components.entry(sub_frame, 0, 5, self.ui_state, "sample_batch_size", width=50, sticky="nw")
+
+        components.label(sub_frame, 1, 0, "Cache Prompt Embeddings",
+                         tooltip="Keeps the text encoder outputs of sample prompts in memory, so the text encoders are only loaded if a prompt changed. The cache is not used while text encoders or embeddings are trained")
+        components.switch(sub_frame, 1, 1, self.ui_state, "sample_prompt_cache")
+
+        components.label(sub_frame, 1, 2, "Persist Prompt Embeddings",
+                         tooltip="Saves the cached prompt embeddings in the workspace directory, to reuse them in the next run with the same model")
+        components.switch(sub_frame, 1, 3, self.ui_state, "sample_prompt_cache_persistent")
+
+        components.label(sub_frame, 2, 0, "Background Sampling",
+                         tooltip="Creates samples in a separate process while training continues. The process loads its own copy of the model on the Background Sampling Device, and receives a copy of the trained weights for every sampling round")
+        components.switch(sub_frame, 2, 1, self.ui_state, "background_sampling")
+
+        components.label(sub_frame, 2, 2, "Background Sampling Device",
+                         tooltip="The device used for background sampling, for example cuda:1")
+        components.entry(sub_frame, 2, 3, self.ui_state, "background_sampling_device")
+
         # table
         frame = ctk.CTkFrame(master=master, corner_radius=0)
         frame.grid(row=1, column=0, sticky="nsew")
@@ -340,6 +394,16 @@ class TrainUI(ctk.CTk):
                          tooltip="Create a full backup before saving the final model")
         components.switch(frame, 2, 1, self.ui_state, "backup_before_save")
 
+        # async backup
+        components.label(frame, 2, 3, "Async Backups",
+                         tooltip="Copy the trainable weights, optimizer state and EMA to RAM, and write backups in the background while training continues")
+        components.switch(frame, 2, 4, self.ui_state, "async_backup")
+
+        # incremental backup
+        components.label(frame, 4, 3, "Incremental Backups",
+                         tooltip="Only write the trainable weights, optimizer state and EMA in backups. The base model weights are loaded from the base model again. Trained weights that stopped training, like a text encoder after its Stop Training After setting, are shared between the backups of a workspace. Without those, backups are as large as Async Backups")
+        components.switch(frame, 4, 4, self.ui_state, "incremental_backup")
+
         # save after
         components.label(frame, 3, 0, "Save Every",
                          tooltip="The interval used when automatically saving the model during training")
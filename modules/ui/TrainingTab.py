@@ -318,6 +318,12 @@ class TrainingTab:
         components.entry(frame, row, 1, self.ui_state, "layer_offload_fraction")
         row += 1
 
+        # dequantized weight cache
+        components.label(frame, row, 0, "Dequantized Weight Cache (GB)",
+                         tooltip="Keeps the dequantized weights of float8 and nfloat4 layers in memory for the duration of one training step, so they are not dequantized again when layers are recomputed by gradient checkpointing. Uses up to this amount of VRAM. The cache is cleared after every step, and when the model changes device. With the cache, nfloat4 layers use a regular matrix multiplication with the dequantized weight instead of the bitsandbytes 4 bit kernel. 0=disabled")
+        components.entry(frame, row, 1, self.ui_state, "dequantized_weight_cache_size")
+        row += 1
+
         # model compilation
         components.label(frame, row, 0, "Model Compilation",
                          tooltip="Enable model compilation with torch.compile for faster training")
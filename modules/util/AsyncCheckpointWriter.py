@@ -0,0 +1,575 @@
+import copy
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import traceback
+from collections.abc import Callable
+
+from modules.model.BaseModel import BaseModel
+from modules.util.callbacks.TrainCallbacks import TrainCallbacks
+from modules.util.ModelNames import ModelNames
+from modules.util.TrainProgress import TrainProgress
+
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+SNAPSHOT_FILE_NAME = "snapshot.json"
+SNAPSHOT_FORMAT_VERSION = 1
+INCREMENTAL_SNAPSHOT_FORMAT_VERSION = 2
+
+OBJECT_STORE_DIR_NAME = ".objects"
+BASE_RECORD_DIR_NAME = ".base"
+TENSOR_REFERENCE_KEY = "__tensor__"
+MAX_SHARD_SIZE = 256 * 1024 * 1024
+INCREMENTAL_TENSOR_FILE_NAME = "tensors.safetensors"
+
+
+class CheckpointSnapshot:
+    def __init__(
+            self,
+            parameters: list[Tensor],
+            frozen_parameters: list[bool],
+            optimizer_state_dict: dict | None,
+            ema_state_dict: dict | None,
+            train_progress: TrainProgress,
+            copy_done_event: torch.cuda.Event | None,
+    ):
+        self.parameters = parameters
+        self.frozen_parameters = frozen_parameters
+        self.optimizer_state_dict = optimizer_state_dict
+        self.ema_state_dict = ema_state_dict
+        self.train_progress = train_progress
+        self.copy_done_event = copy_done_event
+
+    def wait_for_copy(self):
+        if self.copy_done_event is not None:
+            self.copy_done_event.synchronize()
+
+
+class AsyncCheckpointWriter:
+    # Writes backups on a background thread, so the training loop only pays for a device to host copy.
+    # A snapshot copies the trainable parameters, the optimizer state and the EMA state into reusable (pinned) host
+    # buffers. Only one snapshot can be in flight at the same time, because these buffers are reused.
+    # Incremental backups store frozen parameters in content addressed shards, that are shared between backups of a
+    # workspace. Trainable parameters, the optimizer state and the EMA state change every step, so they are written
+    # directly into each backup instead of being hashed.
+    # The weights of the base model are never part of a snapshot, they are loaded from the base model again, which
+    # is only recorded to detect changes. Frozen parameters only exist if a part of the model stopped training, for
+    # example a text encoder with stop_training_after. In usual LoRA and fine tuning runs, all parameters are
+    # trainable, and an incremental backup is as large as a non incremental snapshot.
+
+    __buffers: dict[str, Tensor]
+    __thread: threading.Thread | None
+
+    def __init__(
+            self,
+            callbacks: TrainCallbacks,
+            incremental: bool = False,
+            model_names: ModelNames | None = None,
+    ):
+        self.__callbacks = callbacks
+        self.__incremental = incremental
+        self.__base_record = self.create_base_record(model_names) if incremental and model_names is not None else None
+        self.__buffers = {}
+        self.__thread = None
+        # progress updates of the writer thread, passed to the callbacks on the training thread by poll()
+        self.__progress_queue = queue.Queue()
+
+    def is_busy(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def wait(self):
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.poll()
+
+    def poll(self):
+        """
+        Passes the progress updates of the writer thread to the callbacks. Called from the training thread.
+        """
+        while True:
+            try:
+                progress, max_progress = self.__progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.__callbacks.on_update_backup_progress(progress, max_progress)
+
+    def __update_progress(self, progress: int, max_progress: int):
+        self.__progress_queue.put((progress, max_progress))
+
+    def __copy_to_buffer(self, key: str, tensor: Tensor) -> Tensor:
+        tensor = tensor.detach()
+        buffer = self.__buffers.get(key)
+        if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+            buffer = torch.empty(
+                tensor.shape,
+                dtype=tensor.dtype,
+                device="cpu",
+                pin_memory=torch.cuda.is_available(),
+            )
+            self.__buffers[key] = buffer
+
+        buffer.copy_(tensor, non_blocking=True)
+        return buffer
+
+    def __copy_state_to_buffers(self, key: str, data):
+        if isinstance(data, Tensor):
+            return self.__copy_to_buffer(key, data)
+        elif isinstance(data, dict):
+            return {k: self.__copy_state_to_buffers(f"{key}.{k}", v) for k, v in data.items()}
+        elif isinstance(data, list | tuple):
+            return type(data)(self.__copy_state_to_buffers(f"{key}.{i}", v) for i, v in enumerate(data))
+        else:
+            return copy.deepcopy(data)
+
+    def snapshot(
+            self,
+            model: BaseModel,
+            parameters: list[Parameter],
+    ) -> CheckpointSnapshot:
+        snapshot_parameters = [
+            self.__copy_to_buffer(f"parameter.{i}", parameter) for i, parameter in enumerate(parameters)
+        ]
+
+        optimizer_state_dict = None
+        if model.optimizer is not None:
+            optimizer_state_dict = self.__copy_state_to_buffers("optimizer", model.optimizer.state_dict())
+            optimizer_state_dict["param_group_mapping"] = list(model.param_group_mapping)
+            optimizer_state_dict["param_group_optimizer_mapping"] = \
+                [str(model.train_config.optimizer.optimizer) for _ in model.param_group_mapping]
+
+        ema_state_dict = None
+        if model.ema:
+            ema_state_dict = self.__copy_state_to_buffers("ema", model.ema.state_dict())
+
+        copy_done_event = None
+        if torch.cuda.is_available():
+            copy_done_event = torch.cuda.Event()
+            copy_done_event.record()
+
+        return CheckpointSnapshot(
+            parameters=snapshot_parameters,
+            frozen_parameters=[not parameter.requires_grad for parameter in parameters],
+            optimizer_state_dict=optimizer_state_dict,
+            ema_state_dict=ema_state_dict,
+            train_progress=copy.copy(model.train_progress),
+            copy_done_event=copy_done_event,
+        )
+
+
+    def write(
+            self,
+            snapshot: CheckpointSnapshot,
+            destination: str,
+            on_prepare: Callable[[str], None] | None = None,
+            on_finish: Callable[[], None] | None = None,
+    ):
+        if self.is_busy():
+            raise RuntimeError("a backup is already being written")
+
+        self.__thread = threading.Thread(
+            target=self.__write,
+            args=(snapshot, destination, on_prepare, on_finish),
+            daemon=False,
+        )
+        self.__thread.start()
+
+    def __write(
+            self,
+            snapshot: CheckpointSnapshot,
+            destination: str,
+            on_prepare: Callable[[str], None] | None,
+            on_finish: Callable[[], None] | None,
+    ):
+        partial_destination = os.path.join(
+            os.path.dirname(destination), f".{os.path.basename(destination)}.partial"
+        )
+        max_progress = 5
+
+        try:
+            self.__update_progress(0, max_progress)
+            snapshot.wait_for_copy()
+            os.makedirs(partial_destination, exist_ok=True)
+
+            if self.__incremental:
+                manifest = self.__write_incremental(snapshot, partial_destination, max_progress)
+            else:
+                manifest = self.__write_full(snapshot, partial_destination, max_progress)
+
+            # meta
+            with open(os.path.join(partial_destination, "meta.json"), "w") as meta_file:
+                json.dump({
+                    'train_progress': {
+                        'epoch': snapshot.train_progress.epoch,
+                        'epoch_step': snapshot.train_progress.epoch_step,
+                        'epoch_sample': snapshot.train_progress.epoch_sample,
+                        'global_step': snapshot.train_progress.global_step,
+                    },
+                }, meta_file)
+
+            if on_prepare is not None:
+                on_prepare(partial_destination)
+
+            # the tensors of incremental backups are not hashed, reading them again would take as long as writing them
+            manifest['sha256'] = self.__hash_files(
+                partial_destination, excluded=[INCREMENTAL_TENSOR_FILE_NAME] if self.__incremental else [],
+            )
+            with open(os.path.join(partial_destination, SNAPSHOT_FILE_NAME), "w") as snapshot_file:
+                json.dump(manifest, snapshot_file, indent=4)
+            self.__update_progress(4, max_progress)
+
+            os.rename(partial_destination, destination)
+            print(f"Backup written to {destination}")
+        except Exception:
+            traceback.print_exc()
+            print("Could not save backup. Check your disk space!")
+            try:
+                if os.path.isdir(partial_destination):
+                    shutil.rmtree(partial_destination)
+            except Exception:
+                traceback.print_exc()
+                print("Could not delete partial backup")
+        finally:
+            if on_finish is not None:
+                on_finish()
+            self.__update_progress(max_progress, max_progress)
+
+    def __write_full(
+            self,
+            snapshot: CheckpointSnapshot,
+            destination: str,
+            max_progress: int,
+    ) -> dict:
+        # parameters
+        save_file(
+            {str(i): parameter for i, parameter in enumerate(snapshot.parameters)},
+            os.path.join(destination, "parameters.safetensors"),
+        )
+        self.__update_progress(1, max_progress)
+
+        # optimizer
+        if snapshot.optimizer_state_dict is not None:
+            os.makedirs(os.path.join(destination, "optimizer"), exist_ok=True)
+            torch.save(snapshot.optimizer_state_dict, os.path.join(destination, "optimizer", "optimizer.pt"))
+        self.__update_progress(2, max_progress)
+
+        # ema
+        if snapshot.ema_state_dict is not None:
+            os.makedirs(os.path.join(destination, "ema"), exist_ok=True)
+            torch.save(snapshot.ema_state_dict, os.path.join(destination, "ema", "ema.pt"))
+        self.__update_progress(3, max_progress)
+
+        return {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'parameter_count': len(snapshot.parameters),
+        }
+
+    def __write_incremental(
+            self,
+            snapshot: CheckpointSnapshot,
+            destination: str,
+            max_progress: int,
+    ) -> dict:
+        # Frozen parameters are grouped into shards, which are stored in a content addressed object store next to the
+        # backups. Shards that did not change since a previous backup are referenced instead of written again.
+        store_path = os.path.join(os.path.dirname(destination), OBJECT_STORE_DIR_NAME)
+        os.makedirs(store_path, exist_ok=True)
+
+        static_tensors = {}
+        direct_tensors = {}
+        for i, (parameter, frozen) in enumerate(zip(snapshot.parameters, snapshot.frozen_parameters, strict=True)):
+            (static_tensors if frozen else direct_tensors)[f"parameter.{i}"] = parameter
+
+        state = {
+            'optimizer': self.__extract_tensors(snapshot.optimizer_state_dict, "optimizer", direct_tensors),
+            'ema': self.__extract_tensors(snapshot.ema_state_dict, "ema", direct_tensors),
+        }
+
+        shards = []
+        bytes_written = 0
+        bytes_reused = 0
+        for keys in self.__split_shards(static_tensors):
+            object_hash = self.__hash_tensors(static_tensors, keys)
+            object_path = os.path.join(store_path, f"{object_hash}.safetensors")
+            shard_size = sum(static_tensors[key].numel() * static_tensors[key].element_size() for key in keys)
+
+            if os.path.isfile(object_path):
+                bytes_reused += shard_size
+            else:
+                save_file({key: static_tensors[key] for key in keys}, object_path + ".partial")
+                os.replace(object_path + ".partial", object_path)
+                bytes_written += shard_size
+
+            shards.append({
+                'object': object_hash,
+                'keys': keys,
+            })
+        self.__update_progress(1, max_progress)
+
+        # everything else changes between backups
+        if direct_tensors:
+            save_file(direct_tensors, os.path.join(destination, INCREMENTAL_TENSOR_FILE_NAME))
+            bytes_written += sum(tensor.numel() * tensor.element_size() for tensor in direct_tensors.values())
+            shards.append({
+                'file': INCREMENTAL_TENSOR_FILE_NAME,
+                'keys': list(direct_tensors.keys()),
+            })
+        self.__update_progress(2, max_progress)
+
+        # the remaining structure of the optimizer and ema state is small, and can't be stored in safetensors files
+        torch.save(state, os.path.join(destination, "state.pt"))
+        self.__update_progress(3, max_progress)
+
+        print(f"Incremental backup: {bytes_written / 1024 ** 2:.1f} MB written, {bytes_reused / 1024 ** 2:.1f} MB reused")
+
+        return {
+            'format_version': INCREMENTAL_SNAPSHOT_FORMAT_VERSION,
+            'parameter_count': len(snapshot.parameters),
+            'base': self.__write_base_record(os.path.dirname(destination)),
+            'shards': shards,
+        }
+
+    def __write_base_record(self, backup_dirpath: str) -> str | None:
+        if self.__base_record is None:
+            return None
+
+        base_id = self.__base_record_id(self.__base_record)
+        base_path = os.path.join(backup_dirpath, BASE_RECORD_DIR_NAME, f"{base_id}.json")
+        if not os.path.isfile(base_path):
+            os.makedirs(os.path.dirname(base_path), exist_ok=True)
+            with open(base_path, "w") as base_file:
+                json.dump(self.__base_record, base_file, indent=4)
+
+        return base_id
+
+    @staticmethod
+    def __extract_tensors(data, key: str, tensors: dict[str, Tensor]):
+        if isinstance(data, Tensor):
+            tensors[key] = data
+            return {TENSOR_REFERENCE_KEY: key}
+        elif isinstance(data, dict):
+            return {k: AsyncCheckpointWriter.__extract_tensors(v, f"{key}.{k}", tensors) for k, v in data.items()}
+        elif isinstance(data, list | tuple):
+            return type(data)(
+                AsyncCheckpointWriter.__extract_tensors(v, f"{key}.{i}", tensors) for i, v in enumerate(data)
+            )
+        else:
+            return data
+
+    @staticmethod
+    def __insert_tensors(data, tensors: dict[str, Tensor]):
+        if isinstance(data, dict):
+            if len(data) == 1 and TENSOR_REFERENCE_KEY in data:
+                return tensors[data[TENSOR_REFERENCE_KEY]]
+            return {k: AsyncCheckpointWriter.__insert_tensors(v, tensors) for k, v in data.items()}
+        elif isinstance(data, list | tuple):
+            return type(data)(AsyncCheckpointWriter.__insert_tensors(v, tensors) for v in data)
+        else:
+            return data
+
+    @staticmethod
+    def __split_shards(tensors: dict[str, Tensor]) -> list[list[str]]:
+        shards = []
+        keys = []
+        shard_size = 0
+        for key, tensor in tensors.items():
+            tensor_size = tensor.numel() * tensor.element_size()
+            if keys and shard_size + tensor_size > MAX_SHARD_SIZE:
+                shards.append(keys)
+                keys = []
+                shard_size = 0
+            keys.append(key)
+            shard_size += tensor_size
+
+        if keys:
+            shards.append(keys)
+
+        return shards
+
+    @staticmethod
+    def __hash_tensors(tensors: dict[str, Tensor], keys: list[str]) -> str:
+        sha256 = hashlib.sha256()
+        for key in keys:
+            tensor = tensors[key]
+            sha256.update(f"{key}:{tensor.dtype}:{tuple(tensor.shape)};".encode())
+            sha256.update(tensor.reshape(-1).view(torch.uint8).numpy())
+        return sha256.hexdigest()
+
+    @staticmethod
+    def __hash_files(directory: str, excluded: list[str]) -> dict[str, str]:
+        hashes = {}
+        for root, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                relative_path = os.path.relpath(path, directory).replace('\\', '/')
+                if relative_path in excluded:
+                    continue
+                sha256 = hashlib.sha256()
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(16 * 1024 * 1024), b""):
+                        sha256.update(chunk)
+                hashes[relative_path] = sha256.hexdigest()
+        return hashes
+
+    @staticmethod
+    def __fingerprint_path(path: str) -> list | None:
+        # a cheap fingerprint based on file sizes and modification times. hub names can't be fingerprinted locally
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            return [stat.st_size, stat.st_mtime_ns]
+        elif os.path.isdir(path):
+            fingerprint = []
+            for root, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    file_path = os.path.join(root, filename)
+                    stat = os.stat(file_path)
+                    fingerprint.append([os.path.relpath(file_path, path).replace('\\', '/'), stat.st_size, stat.st_mtime_ns])
+            return fingerprint
+        return None
+
+    @staticmethod
+    def create_base_record(model_names: ModelNames) -> dict:
+        names = {
+            'base_model': model_names.base_model,
+            'prior_model': model_names.prior_model,
+            'effnet_encoder_model': model_names.effnet_encoder_model,
+            'decoder_model': model_names.decoder_model,
+            'vae_model': model_names.vae_model,
+            'lora': model_names.lora,
+        }
+        for embedding in model_names.all_embedding():
+            names[f"embedding.{embedding.uuid}"] = embedding.model_name
+
+        return {
+            'names': names,
+            'include_text_encoder': [
+                model_names.include_text_encoder,
+                model_names.include_text_encoder_2,
+                model_names.include_text_encoder_3,
+            ],
+            'fingerprints': {
+                key: AsyncCheckpointWriter.__fingerprint_path(name) for key, name in names.items() if name
+            },
+        }
+
+    @staticmethod
+    def __base_record_id(base_record: dict) -> str:
+        return hashlib.sha256(json.dumps(base_record, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def remove_unreferenced_objects(backup_dirpath: str):
+        store_path = os.path.join(backup_dirpath, OBJECT_STORE_DIR_NAME)
+        if not os.path.isdir(store_path):
+            return
+
+        referenced_objects = set()
+        for dirpath in os.listdir(backup_dirpath):
+            snapshot_path = os.path.join(backup_dirpath, dirpath, SNAPSHOT_FILE_NAME)
+            if os.path.isfile(snapshot_path):
+                with open(snapshot_path, "r") as snapshot_file:
+                    manifest = json.load(snapshot_file)
+                referenced_objects.update(shard['object'] for shard in manifest.get('shards', []) if 'object' in shard)
+
+        for filename in os.listdir(store_path):
+            if filename.removesuffix(".safetensors") not in referenced_objects:
+                try:
+                    os.remove(os.path.join(store_path, filename))
+                except Exception:
+                    print(f"Could not delete unreferenced backup object {filename}")
+
+    @staticmethod
+    def is_snapshot_backup(backup_path: str) -> bool:
+        return os.path.isfile(os.path.join(backup_path, SNAPSHOT_FILE_NAME))
+
+    @staticmethod
+    def __load_manifest(backup_path: str) -> dict:
+        with open(os.path.join(backup_path, SNAPSHOT_FILE_NAME), "r") as snapshot_file:
+            return json.load(snapshot_file)
+
+    @staticmethod
+    def __load_incremental_tensors(backup_path: str, manifest: dict, prefix: str) -> dict[str, Tensor]:
+        store_path = os.path.join(os.path.dirname(os.path.normpath(backup_path)), OBJECT_STORE_DIR_NAME)
+
+        tensors = {}
+        for shard in manifest['shards']:
+            keys = [key for key in shard['keys'] if key.startswith(prefix)]
+            if keys:
+                if 'object' in shard:
+                    shard_path = os.path.join(store_path, f"{shard['object']}.safetensors")
+                else:
+                    shard_path = os.path.join(backup_path, shard['file'])
+                with safe_open(shard_path, framework="pt") as f:
+                    for key in keys:
+                        tensors[key] = f.get_tensor(key)
+        return tensors
+
+    @staticmethod
+    def load_snapshot_internal_data(model: BaseModel, backup_path: str, model_names: ModelNames | None = None):
+        # Needs to be called before the model setup, so the optimizer and EMA are created from the snapshot state
+        with open(os.path.join(backup_path, "meta.json"), "r") as meta_file:
+            meta = json.load(meta_file)
+            model.train_progress = TrainProgress(
+                epoch=meta['train_progress']['epoch'],
+                epoch_step=meta['train_progress']['epoch_step'],
+                epoch_sample=meta['train_progress']['epoch_sample'],
+                global_step=meta['train_progress']['global_step'],
+            )
+
+        manifest = AsyncCheckpointWriter.__load_manifest(backup_path)
+
+        if manifest['format_version'] == INCREMENTAL_SNAPSHOT_FORMAT_VERSION:
+            if model_names is not None and manifest.get('base') is not None \
+                    and manifest['base'] != AsyncCheckpointWriter.__base_record_id(
+                        AsyncCheckpointWriter.create_base_record(model_names)):
+                print(f"Warning: the base model changed since the backup {backup_path} was created")
+
+            state = torch.load(os.path.join(backup_path, "state.pt"), weights_only=True)
+            if state['optimizer'] is not None:
+                tensors = AsyncCheckpointWriter.__load_incremental_tensors(backup_path, manifest, "optimizer.")
+                model.optimizer_state_dict = AsyncCheckpointWriter.__insert_tensors(state['optimizer'], tensors)
+            if state['ema'] is not None:
+                tensors = AsyncCheckpointWriter.__load_incremental_tensors(backup_path, manifest, "ema.")
+                model.ema_state_dict = AsyncCheckpointWriter.__insert_tensors(state['ema'], tensors)
+        else:
+            optimizer_path = os.path.join(backup_path, "optimizer", "optimizer.pt")
+            if os.path.isfile(optimizer_path):
+                model.optimizer_state_dict = torch.load(optimizer_path, weights_only=True)
+
+            ema_path = os.path.join(backup_path, "ema", "ema.pt")
+            if os.path.isfile(ema_path):
+                model.ema_state_dict = torch.load(ema_path, weights_only=True)
+
+    @staticmethod
+    @torch.no_grad()
+    def load_snapshot_parameters(parameters: list[Parameter], backup_path: str):
+        # Needs to be called after the model setup, when the trainable parameters exist
+        manifest = AsyncCheckpointWriter.__load_manifest(backup_path)
+
+        if manifest['format_version'] == INCREMENTAL_SNAPSHOT_FORMAT_VERSION:
+            state_dict = AsyncCheckpointWriter.__load_incremental_tensors(backup_path, manifest, "parameter.")
+            state_dict = {key.removeprefix("parameter."): tensor for key, tensor in state_dict.items()}
+        else:
+            state_dict = load_file(os.path.join(backup_path, "parameters.safetensors"))
+
+        if len(state_dict) != len(parameters):
+            raise RuntimeError(
+                f"backup {backup_path} contains {len(state_dict)} parameters, but the model has {len(parameters)}."
+                " The training config has changed since the backup was created."
+            )
+
+        for i, parameter in enumerate(parameters):
+            tensor = state_dict[str(i)]
+            if tensor.shape != parameter.shape:
+                raise RuntimeError(
+                    f"parameter {i} in backup {backup_path} has shape {tuple(tensor.shape)},"
+                    f" expected {tuple(parameter.shape)}"
+                )
+            parameter.data.copy_(tensor)
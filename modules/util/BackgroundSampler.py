@@ -0,0 +1,226 @@
+import contextlib
+import itertools
+import queue
+import traceback
+from collections.abc import Callable
+
+from modules.modelSampler.BaseModelSampler import ModelSamplerOutput, SampleJob
+from modules.util import create
+from modules.util.config.SampleConfig import SampleConfig
+from modules.util.config.TrainConfig import TrainConfig
+from modules.util.DequantizedWeightCache import dequantized_weight_cache
+from modules.util.quantization_util import set_fp8_scale_mode, set_quantization_cache_dir
+from modules.util.torch_util import torch_gc
+
+import torch
+import torch.multiprocessing as mp
+from torch import Tensor
+
+import huggingface_hub
+
+
+class _BackgroundSampleJob:
+    def __init__(
+            self,
+            on_sample: list[Callable[[ModelSamplerOutput], None]],
+            on_update_progress: Callable[[int, int], None],
+    ):
+        self.on_sample = on_sample
+        self.on_update_progress = on_update_progress
+
+
+def _load_sampler_model(config: TrainConfig, train_device: torch.device, temp_device: torch.device):
+    set_fp8_scale_mode(config.fp8_scale_mode, config.fp8_block_size)
+    dequantized_weight_cache.set_max_bytes(int(config.dequantized_weight_cache_size * (1024 ** 3)))
+    set_quantization_cache_dir(config.quantization_cache_dir if config.quantization_cache else None)
+
+    if config.secrets.huggingface_token != "":
+        with contextlib.suppress(ConnectionError):
+            huggingface_hub.login(
+                token=config.secrets.huggingface_token,
+                new_session=False,
+            )
+
+    model_loader = create.create_model_loader(config.model_type, config.training_method)
+    model_setup = create.create_model_setup(config.model_type, train_device, temp_device, config.training_method)
+
+    model = model_loader.load(
+        model_type=config.model_type,
+        model_names=config.model_names(),
+        weight_dtypes=config.weight_dtypes(),
+    )
+    model.train_config = config
+
+    # the trainable weights are created by the same setup as in the training process, so the parameter order matches
+    model_setup.setup_optimizations(model, config)
+    model_setup.setup_model(model, config)
+    model.to(temp_device)
+    model.eval()
+    torch_gc()
+
+    model_sampler = create.create_model_sampler(
+        train_device, temp_device, model, config.model_type, config.training_method
+    )
+    model_sampler.prompt_embedding_cache.enabled = config.sample_prompt_cache
+
+    return model, model_sampler
+
+
+def _sample_worker(
+        config_dict: dict,
+        device: str,
+        job_queue: mp.Queue,
+        result_queue: mp.Queue,
+):
+    try:
+        config = TrainConfig.default_values().from_dict(config_dict)
+        config.train_device = device
+        train_device = torch.device(device)
+        temp_device = torch.device(config.temp_device)
+
+        model, model_sampler = _load_sampler_model(config, train_device, temp_device)
+        parameters = model.parameters.parameters()
+    except Exception:
+        result_queue.put(("failed", traceback.format_exc()))
+        return
+
+    result_queue.put(("ready",))
+
+    while (job := job_queue.get()) is not None:
+        job_id, global_step, weights_version, parameter_state, sample_definitions = job
+
+        with torch.no_grad():
+            for parameter, value in zip(parameters, parameter_state, strict=True):
+                parameter.copy_(value)
+        model.train_progress.global_step = global_step
+        if model.ema is not None:
+            # the ema and the no-ema round of a step have the same global step, but different weights
+            model.ema.weights_version = weights_version
+        del parameter_state
+
+        def create_on_sample(index: int):
+            def on_sample(sampler_output: ModelSamplerOutput):
+                result_queue.put(("sample", job_id, index, sampler_output))  # noqa: B023
+
+            return on_sample
+
+        sample_jobs = [
+            SampleJob(
+                SampleConfig.default_values().from_dict(sample_config_dict),
+                destination,
+                create_on_sample(index),
+            ) for index, (sample_config_dict, destination) in enumerate(sample_definitions)
+        ]
+
+        try:
+            model_sampler.sample_multiple(
+                sample_jobs=sample_jobs,
+                image_format=config.sample_image_format,
+                video_format=config.sample_video_format,
+                audio_format=config.sample_audio_format,
+                max_batch_size=config.sample_batch_size,
+                on_update_progress=lambda step, total: result_queue.put(("progress", job_id, step, total)),  # noqa: B023
+            )
+        except Exception:
+            result_queue.put(("error", job_id, traceback.format_exc()))
+
+        result_queue.put(("done", job_id))
+        dequantized_weight_cache.clear()
+        torch_gc()
+
+
+class BackgroundSampler:
+    """
+    Creates samples in a separate process, usually on a separate device, while training continues.
+
+    The worker process loads its own copy of the model. For every sampling round, it receives a snapshot of the
+    trainable parameters, which are only the LoRA or embedding weights for PEFT training methods. Samples are
+    written by the worker, and the sampler outputs are passed back to the callbacks of the training process
+    when poll() is called.
+    """
+
+    def __init__(self, config: TrainConfig, device: str):
+        context = mp.get_context("spawn")
+        self.__job_queue = context.Queue()
+        self.__result_queue = context.Queue()
+
+        self.__process = context.Process(
+            target=_sample_worker,
+            args=(config.to_pack_dict(secrets=True), device, self.__job_queue, self.__result_queue),
+            daemon=True,
+        )
+        self.__process.start()
+
+        self.__job_ids = itertools.count()
+        self.__pending_jobs: dict[int, _BackgroundSampleJob] = {}
+        self.__failed = False
+
+    def is_busy(self) -> bool:
+        return len(self.__pending_jobs) > 0
+
+    def is_available(self) -> bool:
+        return not self.__failed and self.__process.is_alive()
+
+    def submit(
+            self,
+            global_step: int,
+            weights_version: int,
+            parameters: list[Tensor],
+            sample_jobs: list[SampleJob],
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        job_id = next(self.__job_ids)
+        parameter_state = [parameter.detach().to(device="cpu", copy=True) for parameter in parameters]
+        sample_definitions = [(job.sample_config.to_dict(), job.destination) for job in sample_jobs]
+
+        self.__pending_jobs[job_id] = _BackgroundSampleJob([job.on_sample for job in sample_jobs], on_update_progress)
+        self.__job_queue.put((job_id, global_step, weights_version, parameter_state, sample_definitions))
+
+    def poll(self, timeout: float = 0.0):
+        """
+        Passes all finished samples to their callbacks. If timeout is set, waits up to timeout seconds for the
+        first message.
+        """
+        block = timeout > 0
+        while True:
+            try:
+                message = self.__result_queue.get(block=block, timeout=timeout if block else None)
+            except queue.Empty:
+                break
+            block = False
+
+            match message[0]:
+                case "ready":
+                    print("Background sampler is ready")
+                case "failed":
+                    print(f"Background sampler could not be started:\n{message[1]}")
+                    self.__failed = True
+                    self.__pending_jobs.clear()
+                case "sample":
+                    _, job_id, index, sampler_output = message
+                    if job_id in self.__pending_jobs:
+                        self.__pending_jobs[job_id].on_sample[index](sampler_output)
+                case "progress":
+                    _, job_id, step, total = message
+                    if job_id in self.__pending_jobs:
+                        self.__pending_jobs[job_id].on_update_progress(step, total)
+                case "error":
+                    print(f"Error during background sampling, proceeding without sampling:\n{message[2]}")
+                case "done":
+                    self.__pending_jobs.pop(message[1], None)
+
+        if not self.__process.is_alive() and self.__pending_jobs:
+            print("Background sampler stopped unexpectedly")
+            self.__failed = True
+            self.__pending_jobs.clear()
+
+    def close(self, wait: bool = True):
+        if wait:
+            while self.is_busy() and self.is_available():
+                self.poll(timeout=1.0)
+
+        if self.__process.is_alive():
+            self.__job_queue.put(None)
+            self.__process.join(timeout=60)
+            if self.__process.is_alive():
+                self.__process.kill()
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import fields, is_dataclass
+from typing import Any
+
+import torch
+from torch import Tensor
+
+
+class _Call:
+    def __init__(self, args: tuple, kwargs: dict):
+        self.args = args
+        self.kwargs = kwargs
+        self.output = None
+        self.error = None
+        self.done = False
+
+
+def split_batch_output(output: Any, index: int, split_leaf: Callable[[Any, int], Any] | None = None) -> Any:
+    """
+    Returns the part of a batched output that belongs to the sample at index. Tensors, dataclasses, tuples and lists
+    are split recursively, other values are returned unchanged. split_leaf can split additional types, it returns
+    None for values it doesn't handle.
+    """
+    if split_leaf is not None and (split_output := split_leaf(output, index)) is not None:
+        return split_output
+    if isinstance(output, Tensor):
+        # outputs are cloned, a view would keep the storage of the whole batch alive
+        return output[index:index + 1].clone()
+    elif is_dataclass(output):
+        return type(output)(**{
+            field.name: split_batch_output(getattr(output, field.name), index, split_leaf)
+            for field in fields(output)
+        })
+    elif isinstance(output, tuple | list):
+        return type(output)(split_batch_output(x, index, split_leaf) for x in output)
+    else:
+        return output
+
+
+class CallBatcher:
+    """
+    Collects calls of fn from several threads, and runs concurrent calls with matching arguments as one batch.
+    Tensor arguments must have a batch size of 1, they are concatenated along the first dimension. Calls only match
+    if their tensors have the same shape, dtype and device, and all other arguments are equal. The output is split
+    again, so every caller receives the same result type as a single call. Calls with arguments that can't be
+    batched are run directly.
+
+    The first caller of a batch waits up to max_wait_time for more calls, then it runs all collected calls. While
+    calls are running, the throughput is printed every report_interval seconds.
+    """
+
+    def __init__(
+            self,
+            fn: Callable,
+            max_batch_size: int,
+            name: str,
+            unit: str,
+            max_wait_time: float = 0.05,
+            report_interval: float = 10.0,
+            split_leaf: Callable[[Any, int], Any] | None = None,
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self.unit = unit
+        self.max_wait_time = max_wait_time
+        self.report_interval = report_interval
+        self.split_leaf = split_leaf
+
+        self.__condition = threading.Condition()
+        self.__pending: dict[tuple, list[_Call]] = {}
+
+        self.__report_start = None
+        self.__report_count = 0
+        self.__last_batch_end = 0.0
+
+    def __call__(self, *args, **kwargs):
+        key = self.__key(args, kwargs)
+        if key is None or self.max_batch_size <= 1:
+            return self.fn(*args, **kwargs)
+
+        call = _Call(args, kwargs)
+        with self.__condition:
+            self.__pending.setdefault(key, []).append(call)
+            self.__condition.notify_all()
+        deadline = time.monotonic() + self.max_wait_time
+
+        while True:
+            batch = None
+            with self.__condition:
+                while not call.done:
+                    pending = self.__pending.get(key, [])
+                    if call in pending:
+                        remaining = deadline - time.monotonic()
+                        if len(pending) >= self.max_batch_size or remaining <= 0:
+                            # the batch is full, or the wait time is over. This caller runs the next batch
+                            batch = self.__take_batch(key)
+                            break
+                        self.__condition.wait(remaining)
+                    else:
+                        # another caller is running the batch that contains this call
+                        self.__condition.wait()
+
+            if batch is None:
+                break
+            self.__run_batch(batch)
+
+        if call.error is not None:
+            raise call.error
+        return call.output
+
+    @staticmethod
+    def __key(args: tuple, kwargs: dict) -> tuple | None:
+        key = []
+        for name, value in [*enumerate(args), *sorted(kwargs.items())]:
+            if isinstance(value, Tensor):
+                if value.dim() == 0 or value.shape[0] != 1:
+                    return None
+                key.append((name, tuple(value.shape), value.dtype, value.device))
+            else:
+                try:
+                    hash(value)
+                except TypeError:
+                    return None
+                key.append((name, value))
+        if not any(isinstance(value, Tensor) for value in [*args, *kwargs.values()]):
+            return None
+        return tuple(key)
+
+    def __take_batch(self, key: tuple) -> list[_Call]:
+        pending = self.__pending[key]
+        batch = pending[:self.max_batch_size]
+        del pending[:self.max_batch_size]
+        if not pending:
+            del self.__pending[key]
+        return batch
+
+    def __run_batch(self, batch: list[_Call]):
+        start_time = time.monotonic()
+        first = batch[0]
+        try:
+            args = [
+                torch.cat([call.args[i] for call in batch], dim=0) if isinstance(arg, Tensor) else arg
+                for i, arg in enumerate(first.args)
+            ]
+            kwargs = {
+                name: torch.cat([call.kwargs[name] for call in batch], dim=0) if isinstance(arg, Tensor) else arg
+                for name, arg in first.kwargs.items()
+            }
+            output = self.fn(*args, **kwargs)
+
+            for i, call in enumerate(batch):
+                call.output = split_batch_output(output, i, self.split_leaf)
+        except Exception as e:
+            for call in batch:
+                call.error = e
+
+        with self.__condition:
+            for call in batch:
+                call.done = True
+            self.__record(start_time, time.monotonic(), len(batch))
+            self.__condition.notify_all()
+
+    def __record(self, start_time: float, end_time: float, count: int):
+        # the time between caching runs is not counted
+        if self.__report_start is None or start_time - self.__last_batch_end > self.report_interval:
+            self.__report_start = start_time
+            self.__report_count = 0
+        self.__report_count += count
+        self.__last_batch_end = max(self.__last_batch_end, end_time)
+
+        if end_time - self.__report_start >= self.report_interval:
+            print(f"{self.name}: {self.__report_count / (end_time - self.__report_start):.1f} {self.unit}/s")
+            self.__report_start = end_time
+            self.__report_count = 0
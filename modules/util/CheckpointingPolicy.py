@@ -0,0 +1,152 @@
+import time
+from collections.abc import Callable
+
+from modules.util.config.TrainConfig import TrainConfig
+
+import torch
+from torch import nn
+
+
+class _BlockCost:
+    def __init__(self, num_bytes: int, compute_time: float):
+        # bytes of the activations autograd saves for the backward pass of the block
+        self.num_bytes = num_bytes
+        # forward pass duration in seconds
+        self.compute_time = compute_time
+
+
+class CheckpointingPolicy:
+    """
+    Decides which blocks of a model are checkpointed, instead of checkpointing all of them.
+
+    During the first step, every block runs one additional forward pass that measures its duration and the size of
+    the activations autograd saves for it. The saved tensors are not kept, so the measurement does not need more memory
+    than a single block without checkpointing. At the start of the second step, the blocks to checkpoint are chosen.
+    If an activation budget is set, the blocks with the most recompute time per byte of activations keep their
+    activations until the budget is used, all other blocks are checkpointed. Otherwise, every Nth block is
+    checkpointed. Until the decision is made, all blocks are checkpointed.
+    """
+
+    def __init__(self, name: str, train_device: torch.device, every_n_blocks: int, activation_budget: float):
+        self.name = name
+        self.__train_device = train_device
+        self.__every_n_blocks = max(every_n_blocks, 1)
+        # in bytes
+        self.__activation_budget = int(activation_budget * (1024 ** 3))
+
+        self.__num_blocks = 0
+        self.__costs = {}
+        self.__checkpointed_blocks = None
+
+    @staticmethod
+    def from_config(name: str, config: TrainConfig) -> 'CheckpointingPolicy | None':
+        if config.checkpointing_activation_budget <= 0 and config.checkpointing_every_n_blocks <= 1:
+            return None
+
+        return CheckpointingPolicy(
+            name,
+            torch.device(config.train_device),
+            config.checkpointing_every_n_blocks,
+            config.checkpointing_activation_budget,
+        )
+
+    def add_block(self) -> int:
+        block_index = self.__num_blocks
+        self.__num_blocks += 1
+        return block_index
+
+    def is_checkpointed(self, block_index: int) -> bool:
+        if self.__checkpointed_blocks is None:
+            return True
+        return block_index in self.__checkpointed_blocks
+
+    def before_block(self, block_index: int, module: nn.Module, fun: Callable, args: tuple, kwargs: dict):
+        # called before every forward pass of a block with gradients enabled
+        if self.__checkpointed_blocks is not None:
+            return
+
+        if block_index in self.__costs:
+            # the block was already measured, so this is the next step
+            self.__decide()
+        else:
+            self.__costs[block_index] = self.__measure(module, fun, args, kwargs)
+
+    def __synchronize(self):
+        if self.__train_device.type == "cuda":
+            torch.cuda.synchronize(self.__train_device)
+
+    def __measure(self, module: nn.Module, fun: Callable, args: tuple, kwargs: dict) -> _BlockCost:
+        # parameters and inputs are stored anyway, they don't count towards the activations of the block
+        excluded_storages = {x.untyped_storage().data_ptr() for x in module.parameters()}
+        excluded_storages.update(x.untyped_storage().data_ptr() for x in module.buffers())
+        excluded_storages.update(
+            x.untyped_storage().data_ptr() for x in [*args, *kwargs.values()] if isinstance(x, torch.Tensor)
+        )
+
+        # saved tensors are referenced until the measurement is done, so freed storages can't be reused and counted
+        # twice
+        saved_tensors = {}
+
+        def pack(tensor: torch.Tensor):
+            storage = tensor.untyped_storage()
+            if storage.data_ptr() not in excluded_storages:
+                saved_tensors[storage.data_ptr()] = tensor
+
+        def unpack(_):
+            raise RuntimeError("activations of a checkpointing policy measurement can't be used in a backward pass")
+
+        rng_devices = [self.__train_device.index or 0] if self.__train_device.type == "cuda" else []
+
+        self.__synchronize()
+        start_time = time.perf_counter()
+        with torch.random.fork_rng(devices=rng_devices), torch.autograd.graph.saved_tensors_hooks(pack, unpack):
+            fun(*args, **kwargs)
+        self.__synchronize()
+        compute_time = time.perf_counter() - start_time
+
+        num_bytes = sum(x.untyped_storage().nbytes() for x in saved_tensors.values())
+        saved_tensors.clear()
+
+        return _BlockCost(num_bytes, compute_time)
+
+    def __decide(self):
+        measured_blocks = list(self.__costs.keys())
+
+        if self.__activation_budget > 0:
+            # blocks that were never executed stay checkpointed
+            kept_blocks = set()
+            kept_bytes = 0
+            for block_index in sorted(
+                    measured_blocks,
+                    key=lambda i: self.__costs[i].compute_time / max(self.__costs[i].num_bytes, 1),
+                    reverse=True,
+            ):
+                num_bytes = self.__costs[block_index].num_bytes
+                if kept_bytes + num_bytes <= self.__activation_budget:
+                    kept_blocks.add(block_index)
+                    kept_bytes += num_bytes
+            self.__checkpointed_blocks = {i for i in range(self.__num_blocks) if i not in kept_blocks}
+        else:
+            self.__checkpointed_blocks = {i for i in range(self.__num_blocks) if i % self.__every_n_blocks == 0}
+
+        print(self.summary())
+
+    def summary(self) -> str:
+        checkpointed_costs = [cost for i, cost in self.__costs.items() if self.is_checkpointed(i)]
+        kept_costs = [cost for i, cost in self.__costs.items() if not self.is_checkpointed(i)]
+
+        kept_bytes = sum(cost.num_bytes for cost in kept_costs)
+        checkpointed_bytes = sum(cost.num_bytes for cost in checkpointed_costs)
+        recompute_time = sum(cost.compute_time for cost in checkpointed_costs)
+        forward_time = sum(cost.compute_time for cost in self.__costs.values())
+        recompute_fraction = recompute_time / forward_time if forward_time > 0 else 0
+
+        num_checkpointed = sum(1 for i in range(self.__num_blocks) if self.is_checkpointed(i))
+
+        return (
+            f"Gradient checkpointing of {self.name}: {num_checkpointed} of {self.__num_blocks} blocks "
+            f"checkpointed, {kept_bytes / (1024 ** 3):.2f} GB of activations kept, "
+            f"{checkpointed_bytes / (1024 ** 3):.2f} GB recomputed. "
+            f"Estimated recompute overhead: {recompute_time * 1000:.1f} ms per step "
+            f"({recompute_fraction * 100:.1f}% of the block forward time, 100% when all blocks are checkpointed)"
+        )
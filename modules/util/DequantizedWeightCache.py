@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from collections.abc import Callable
+
+import torch
+from torch import nn
+
+
+class DequantizedWeightCache:
+    """
+    Keeps dequantized weights of quantized layers alive for the duration of one training step.
+
+    With gradient checkpointing, every layer is called again during the backward pass, which means that the
+    weights are dequantized two or three times per step. The cache is keyed by module, dtype and device and evicts
+    the least recently used weights when the byte budget is exceeded. A budget of 0 disables the cache.
+    """
+
+    max_bytes: int
+    __entries: OrderedDict[tuple[int, torch.dtype, torch.device], torch.Tensor]
+    __bytes: int
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def is_enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def set_max_bytes(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.__evict(0)
+
+    def get(
+            self,
+            module: nn.Module,
+            dtype: torch.dtype,
+            device: torch.device,
+            dequantize_fn: Callable[[], torch.Tensor],
+    ) -> torch.Tensor:
+        if not self.is_enabled():
+            return dequantize_fn()
+
+        key = (id(module), dtype, torch.device(device))
+        weight = self.__entries.get(key)
+        if weight is not None:
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return weight
+
+        self.misses += 1
+        weight = dequantize_fn()
+
+        # the cached tensor is shared between calls, it must not be part of an autograd graph
+        weight = weight.detach()
+        weight_bytes = weight.element_size() * weight.numel()
+        if weight_bytes <= self.max_bytes:
+            self.__evict(weight_bytes)
+            self.__entries[key] = weight
+            self.__bytes += weight_bytes
+
+        return weight
+
+    def __evict(self, required_bytes: int):
+        while self.__entries and self.__bytes + required_bytes > self.max_bytes:
+            _, weight = self.__entries.popitem(last=False)
+            self.__bytes -= weight.element_size() * weight.numel()
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def cached_bytes(self) -> int:
+        return self.__bytes
+
+
+dequantized_weight_cache = DequantizedWeightCache()
@@ -0,0 +1,133 @@
+from modules.util import distributed_util
+
+import torch
+import torch.distributed as dist
+from torch.nn import Parameter
+from torch.utils.hooks import RemovableHandle
+
+
+class GradientReducer:
+    """
+    Averages the gradients of all trainable parameters between the ranks of a distributed training run.
+
+    Parameters are grouped into buckets in reverse order, which roughly matches the order in which the backward pass
+    produces their gradients. As soon as all gradients of a bucket are accumulated, the bucket is flattened and
+    reduced asynchronously, so communication overlaps with the rest of the backward pass. Buckets are always launched
+    in the same order on every rank, because collective operations have to be issued in the same order.
+
+    If the optimizer steps parameters directly in their gradient hook (fused back pass), each gradient is reduced
+    synchronously before the optimizer hook runs.
+    """
+
+    parameters: list[Parameter]
+    enabled: bool
+
+    def __init__(
+            self,
+            parameters: list[Parameter],
+            bucket_size_bytes: int,
+            synchronous: bool = False,
+    ):
+        self.parameters = [parameter for parameter in parameters if parameter.requires_grad]
+        self.synchronous = synchronous
+        self.enabled = False
+
+        self.__buckets = []
+        self.__bucket_index = {}
+        bucket = []
+        bucket_bytes = 0
+        for parameter in reversed(self.parameters):
+            parameter_bytes = parameter.numel() * parameter.element_size()
+            if bucket and (bucket_bytes + parameter_bytes > bucket_size_bytes
+                           or bucket[0].dtype != parameter.dtype or bucket[0].device != parameter.device):
+                self.__buckets.append(bucket)
+                bucket = []
+                bucket_bytes = 0
+
+            self.__bucket_index[id(parameter)] = len(self.__buckets)
+            bucket.append(parameter)
+            bucket_bytes += parameter_bytes
+        if bucket:
+            self.__buckets.append(bucket)
+
+        self.__ready_parameters = [set() for _ in self.__buckets]
+        self.__next_bucket = 0
+        self.__pending = []
+
+        self.__hook_handles: list[RemovableHandle] = []
+
+    def register_hooks(self):
+        # must be called before any other gradient hook is registered, hooks run in registration order
+        for parameter in self.parameters:
+            handle = parameter.register_post_accumulate_grad_hook(self.__on_gradient_ready)
+            self.__hook_handles.append(handle)
+
+    def remove_hooks(self):
+        for handle in self.__hook_handles:
+            handle.remove()
+        self.__hook_handles = []
+
+    def __on_gradient_ready(self, parameter: Parameter):
+        if not self.enabled:
+            return
+
+        if self.synchronous:
+            if parameter.grad is not None:
+                parameter.grad.div_(distributed_util.world_size())
+                dist.all_reduce(parameter.grad)
+            return
+
+        bucket_index = self.__bucket_index[id(parameter)]
+        self.__ready_parameters[bucket_index].add(id(parameter))
+        self.__launch_ready_buckets()
+
+    def __launch_ready_buckets(self):
+        while self.__next_bucket < len(self.__buckets) \
+                and len(self.__ready_parameters[self.__next_bucket]) == len(self.__buckets[self.__next_bucket]):
+            self.__launch_bucket(self.__next_bucket)
+            self.__next_bucket += 1
+
+    def __launch_bucket(self, bucket_index: int):
+        bucket = self.__buckets[bucket_index]
+        # one flag per parameter is reduced after the gradients, to find parameters without a gradient on every rank
+        has_gradient = torch.tensor(
+            [parameter.grad is not None for parameter in bucket], dtype=bucket[0].dtype, device=bucket[0].device
+        )
+        flat_gradients = torch.cat([
+            (parameter.grad if parameter.grad is not None else torch.zeros_like(parameter)).reshape(-1)
+            for parameter in bucket
+        ] + [has_gradient])
+        flat_gradients.div_(distributed_util.world_size())
+        work = dist.all_reduce(flat_gradients, async_op=True)
+        self.__pending.append((work, bucket, flat_gradients))
+
+    def finish(self):
+        """
+        Waits until all gradients are reduced. Must be called after the backward pass of every update step.
+        Parameters that did not receive a gradient on this rank are reduced with a zero gradient. If no rank has a
+        gradient for a parameter, its gradient stays None.
+        """
+        if not self.enabled or self.synchronous:
+            return
+
+        for bucket_index in range(self.__next_bucket, len(self.__buckets)):
+            self.__ready_parameters[bucket_index] = {id(parameter) for parameter in self.__buckets[bucket_index]}
+        self.__launch_ready_buckets()
+
+        for work, bucket, flat_gradients in self.__pending:
+            work.wait()
+
+            has_gradient = flat_gradients[-len(bucket):].ne(0).tolist()
+            offset = 0
+            for parameter, parameter_has_gradient in zip(bucket, has_gradient, strict=True):
+                if parameter_has_gradient:
+                    gradient = flat_gradients[offset:offset + parameter.numel()].view_as(parameter)
+                    if parameter.grad is None:
+                        parameter.grad = gradient.clone()
+                    else:
+                        parameter.grad.copy_(gradient)
+                offset += parameter.numel()
+
+        self.__ready_parameters = [set() for _ in self.__buckets]
+        self.__next_bucket = 0
+        self.__pending = []
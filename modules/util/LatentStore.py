@@ -0,0 +1,111 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+import torch
+
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+INDEX_FILE_NAME = "index.db"
+OBJECT_DIR_NAME = "objects"
+
+
+class LatentStore:
+    """
+    A content addressed store for encoded latents that can be shared between training runs.
+
+    Entries are safetensors files named by their key. A small sqlite index keeps track of the size and the last
+    access time of each entry. When the total size exceeds max_bytes, the least recently used entries are removed.
+    The index can be used by several processes at the same time.
+    """
+
+    def __init__(self, store_dir: str, max_bytes: int):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+
+        os.makedirs(os.path.join(store_dir, OBJECT_DIR_NAME), exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            os.path.join(store_dir, INDEX_FILE_NAME),
+            timeout=60,
+            check_same_thread=False,
+        )
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL)"
+            )
+
+        self.collect_garbage()
+
+    def __object_path(self, key: str) -> str:
+        return os.path.join(self.store_dir, OBJECT_DIR_NAME, key[:2], f"{key}.safetensors")
+
+    def get(self, key: str) -> tuple[dict[str, torch.Tensor], dict[str, str]] | None:
+        path = self.__object_path(key)
+        try:
+            with safe_open(path, framework="pt") as f:
+                tensors = {name: f.get_tensor(name) for name in f.keys()}  # noqa: SIM118
+                metadata = f.metadata() or {}
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # a damaged entry is treated as a miss and replaced by the next put
+            return None
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+
+        return tensors, metadata
+
+    def put(self, key: str, tensors: dict[str, torch.Tensor], metadata: dict[str, str] | None = None):
+        path = self.__object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+        save_file({name: tensor.detach().to(device="cpu").contiguous() for name, tensor in tensors.items()},
+                  partial_path, metadata)
+        os.replace(partial_path, path)
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                (key, os.path.getsize(path), time.time()),
+            )
+            total_bytes = self.__total_bytes()
+
+        if total_bytes > self.max_bytes:
+            self.collect_garbage()
+
+    def __total_bytes(self) -> int:
+        return self.__connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def collect_garbage(self):
+        # entries are removed until the store is 10% below its size limit, to avoid collecting after every put
+        with self.__lock, self.__connection:
+            target_bytes = int(self.max_bytes * 0.9)
+            total_bytes = self.__total_bytes()
+            if total_bytes <= self.max_bytes:
+                return
+
+            removed_keys = []
+            for key, size in self.__connection.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+                if total_bytes <= target_bytes:
+                    break
+                removed_keys.append(key)
+                total_bytes -= size
+
+            self.__connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in removed_keys])
+
+        for key in removed_keys:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.__object_path(key))
@@ -1,9 +1,38 @@
+import bisect
+import concurrent.futures
+import contextlib
 import math
+import mmap
+import os
 import random
+import tempfile
+import time
+import weakref
+from collections.abc import Callable
 from typing import Any
 
 from modules.util.config.TrainConfig import TrainConfig
-from modules.util.quantization_util import get_offload_tensor_bytes, offload_quantized
+from modules.util.LayerOffloadPlanner import (
+    LayerCost,
+    LayerOffloadPlan,
+    load_plan,
+    plan_key,
+    plan_layer_offloading,
+    save_plan,
+    streamed_layers,
+)
+from modules.util.LayerOffloadTracer import (
+    CATEGORY_ALLOCATOR,
+    CATEGORY_COMPUTE,
+    CATEGORY_TRANSFER,
+    CATEGORY_WAIT,
+    TRACK_ACTIVATIONS,
+    TRACK_COMPUTE,
+    TRACK_HOST,
+    TRACK_TRANSFER,
+    LayerOffloadTracer,
+)
+from modules.util.quantization_util import get_offload_tensor_bytes, get_offload_tensors, offload_quantized
 from modules.util.torch_util import (
     create_stream_context,
     device_equals,
@@ -22,6 +51,9 @@ from torch import nn
 
 MESSAGES = []
 
+# number of layers behind the slots of the disk cache that are read ahead by the operating system
+READ_AHEAD_LAYERS = 2
+
 
 def log(msg: str = ''):
     pass
@@ -79,6 +111,7 @@ class StaticLayerTensorAllocator:
                 # move to the first cache tensor
                 cache_tensor_index = 0
                 cache_tensor_allocation_end = 0
+                self.__layer_allocator.trace_wrap(self.__layer_index)
 
             self.__allocation_end = cache_tensor_index * cache_tensor_size + cache_tensor_allocation_end
             self.__layer_allocator.ensure_allocation(cache_tensor_index)
@@ -99,6 +132,7 @@ class StaticLayerTensorAllocator:
                 # move to the first cache tensor
                 cache_tensor_index = len(self.__layer_allocator.cache_tensors) - 1
                 cache_tensor_allocation_start = cache_tensor_size
+                self.__layer_allocator.trace_wrap(self.__layer_index)
 
             new_allocation_start = floor_4(cache_tensor_allocation_start - num_bytes)
             self.__layer_allocator.ensure_allocation(cache_tensor_index)
@@ -133,12 +167,15 @@ class StaticLayerAllocator:
     allocation_end: int  # index of the first unallocated byte
 
     __tensor_allocators: list[StaticLayerTensorAllocator | None]
+    __tracer: LayerOffloadTracer | None
 
     def __init__(
             self,
             device: torch.device,
+            tracer: LayerOffloadTracer | None = None,
     ):
         self.device = device
+        self.__tracer = tracer
         self.__allocate_statically = True
         self.__is_pinned = device.type == "cpu"
 
@@ -220,6 +257,11 @@ class StaticLayerAllocator:
             self.__tensor_allocators[layer_index].deallocate(deallocate_forward)
             self.__tensor_allocators[layer_index] = None
 
+    def trace_wrap(self, layer_index: int):
+        if self.__tracer is not None:
+            self.__tracer.add_instant(
+                TRACK_HOST, f"{self.device} layer cache wrap", CATEGORY_ALLOCATOR, layer=layer_index)
+
 
 class StaticActivationAllocator:
     __device: torch.device
@@ -366,6 +408,9 @@ class SyncEvent:
         log_msg = f"{log_msg}, {self.id}"
         log(log_msg)
 
+    def is_recorded(self) -> bool:
+        return self.__torch_event is not None
+
     def __repr__(self) -> str:
         if self.__torch_event is None:
             return "event(None)"
@@ -373,24 +418,490 @@ class SyncEvent:
             return f"event({self.__log_msg}, done={self.__torch_event.query()})"
 
 
+class DiskLayerCache:
+    """
+    A tier below the pinned host memory. Offloaded layers are kept in a memory-mapped file, and only a bounded number
+    of them are held in pinned host memory slots. Each slot holds one layer with the same byte layout as its region in
+    the file, so moving a layer between a slot and the file is a single copy. Reads and writes run on a background
+    thread, the order in which layers are needed is passed in by the caller.
+    """
+
+    __directory: str
+    __host_budget: int
+
+    __layers: list[nn.Module]
+    __layer_bytes: list[int]
+    __region_offsets: list[int]
+    __region_sizes: list[int]
+
+    __file: Any
+    __mmap: mmap.mmap | None
+    __file_tensor: torch.Tensor | None
+
+    __slot_size: int
+    __num_slots: int
+    __slot_tensor: torch.Tensor | None
+    __free_slots: list[int]
+    __slot_events: list[torch.cuda.Event | None]
+
+    __layer_slots: list[int | None]
+    __is_on_disk: list[bool]  # the tensors of the layer point into its region of the file
+    __is_region_valid: list[bool]  # the region contains the current data of the layer
+    __is_dirty: list[bool]  # the slot contains data that is not yet written to the region
+    __pending: dict[int, tuple[str, concurrent.futures.Future]]
+
+    def __init__(self, directory: str, host_budget: int):
+        self.__directory = directory
+        self.__host_budget = host_budget
+
+        self.__layers = []
+        self.__layer_bytes = []
+        self.__region_offsets = []
+        self.__region_sizes = []
+
+        self.__file = None
+        self.__mmap = None
+        self.__file_tensor = None
+
+        self.__slot_size = 0
+        self.__num_slots = 0
+        self.__slot_tensor = None
+        self.__free_slots = []
+        self.__slot_events = []
+
+        self.__layer_slots = []
+        self.__is_on_disk = []
+        self.__is_region_valid = []
+        self.__is_dirty = []
+        self.__pending = {}
+
+        # the file and the thread are released by close(), or when the cache is garbage collected
+        self.__exit_stack = contextlib.ExitStack()
+        self.__close = weakref.finalize(self, self.__exit_stack.close)
+
+        # a single thread, disk access is sequential
+        self.__executor = self.__exit_stack.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="layer_disk_cache")
+        )
+
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.__total_bytes_read = 0
+        self.__total_bytes_written = 0
+        self.__num_steps = 0
+
+    def allocate(self, layers: list[nn.Module]):
+        if self.__mmap is None:
+            self.__layers = layers
+            self.__layer_bytes = [self.__get_aligned_layer_bytes(layer) for layer in layers]
+
+            offset = 0
+            for num_bytes in self.__layer_bytes:
+                # regions are page aligned to flush and drop them independently
+                size = math.ceil(num_bytes / mmap.PAGESIZE) * mmap.PAGESIZE
+                self.__region_offsets.append(offset)
+                self.__region_sizes.append(size)
+                offset += size
+
+            os.makedirs(self.__directory, exist_ok=True)
+            # the file is removed as soon as it is closed, or immediately on systems that support it
+            self.__file = self.__exit_stack.enter_context(
+                tempfile.TemporaryFile(dir=self.__directory, prefix="layer_offload_")  # noqa: SIM115
+            )
+            self.__file.truncate(max(offset, mmap.PAGESIZE))
+            self.__mmap = mmap.mmap(self.__file.fileno(), max(offset, mmap.PAGESIZE))
+            self.__file_tensor = torch.frombuffer(self.__mmap, dtype=torch.int8)
+
+            self.__layer_slots = [None] * len(layers)
+            self.__is_on_disk = [False] * len(layers)
+            self.__is_region_valid = [False] * len(layers)
+            self.__is_dirty = [False] * len(layers)
+
+            log(f"allocated layer disk cache of {offset:_} bytes in {self.__directory}")
+
+        if self.__slot_tensor is None:
+            self.__slot_size = ceil_4(max(self.__layer_bytes, default=0))
+            self.__num_slots = max(2, self.__host_budget // max(self.__slot_size, 1))
+            self.__num_slots = min(self.__num_slots, max(len(self.__layers), 2))
+
+            torch_gc()
+            self.__slot_tensor = torch.zeros((self.__num_slots * self.__slot_size,), dtype=torch.int8)
+            pin_tensor_(self.__slot_tensor)
+            self.__free_slots = list(range(self.__num_slots))
+            self.__slot_events = [None] * self.__num_slots
+
+            log(f"allocated {self.__num_slots} layer disk cache slots of {self.__slot_size:_} bytes")
+
+    def deallocate_slots(self):
+        # all layers must be on disk or on the train device
+        self.__wait_all()
+        if self.__slot_tensor is not None:
+            unpin_tensor_(self.__slot_tensor)
+        self.__slot_tensor = None
+        self.__free_slots = []
+        self.__slot_events = []
+
+    def close(self):
+        # the mapping stays valid after the file is closed, so the tensors of layers on disk can still be read,
+        # but the cache can't be used anymore
+        self.deallocate_slots()
+        self.__close()
+
+    def is_on_disk(self, layer_index: int) -> bool:
+        return self.__mmap is not None and self.__is_on_disk[layer_index]
+
+    def write_layer(self, layer_index: int):
+        """
+        Moves all offloadable tensors of a layer to its region of the file. The tensors can be on any device.
+        """
+        self.__wait(layer_index)
+
+        slot = self.__layer_slots[layer_index]
+        if slot is not None and not self.__is_dirty[layer_index]:
+            self.__point_tensors(layer_index, self.__get_region(layer_index))
+        elif self.__is_on_disk[layer_index]:
+            # the tensors already point into the region
+            pass
+        elif slot is None and self.__is_region_valid[layer_index] and not self.__is_trainable(layer_index):
+            # a frozen layer on the train device still has the data of its region, it is not written again
+            self.__point_tensors(layer_index, self.__get_region(layer_index))
+        else:
+            allocator = self.__create_allocator(self.__get_region(layer_index))
+            for module in self.__layers[layer_index].modules():
+                offload_quantized(module, torch.device("cpu"), allocator=allocator)
+            self.__drop_pages(layer_index, flush=True)
+            self.bytes_written += self.__layer_bytes[layer_index]
+
+        if slot is not None:
+            self.__release_slot(slot, self.__slot_events[slot])
+        self.__layer_slots[layer_index] = None
+        self.__is_on_disk[layer_index] = True
+        self.__is_region_valid[layer_index] = True
+        self.__is_dirty[layer_index] = False
+
+    def get_allocator(self, layer_index: int, upcoming_layers: list[int]) -> Callable[[torch.Tensor], torch.Tensor]:
+        """
+        Returns an allocator for a layer that is offloaded from the train device into a host slot.
+        """
+        # the slot is only written by the transfer stream, after all previous transfers that use the slot
+        slot = self.__acquire_slot(upcoming_layers, protected_layers=set(), wait_events=False)
+        self.__layer_slots[layer_index] = slot
+        self.__is_on_disk[layer_index] = False
+        return self.__create_allocator(self.__get_slot(slot))
+
+    def after_offload(self, layer_index: int, event: torch.cuda.Event | None):
+        slot = self.__layer_slots[layer_index]
+        self.__slot_events[slot] = event
+        # frozen layers only need to be written once
+        self.__is_dirty[layer_index] = not self.__is_region_valid[layer_index] or self.__is_trainable(layer_index)
+        if self.__is_dirty[layer_index]:
+            self.__is_region_valid[layer_index] = False
+
+    def before_load(self, layer_index: int, upcoming_layers: list[int]):
+        """
+        Ensures that a layer is in a host slot before it is loaded to the train device.
+        """
+        self.__wait(layer_index, keep_in_slot=True)
+
+        if self.__layer_slots[layer_index] is None and self.__is_on_disk[layer_index]:
+            log(f"layer {layer_index} not in a disk cache slot, reading now")
+            slot = self.__acquire_slot(upcoming_layers, protected_layers={layer_index}, wait_events=False)
+            self.__start_read(layer_index, slot)
+            self.__wait(layer_index)
+
+    def after_load(self, layer_index: int, event: torch.cuda.Event | None):
+        slot = self.__layer_slots[layer_index]
+        if slot is not None:
+            # the slot can be reused when the transfer has finished
+            self.__release_slot(slot, event)
+        self.__layer_slots[layer_index] = None
+        self.__is_on_disk[layer_index] = False
+        if self.__is_trainable(layer_index):
+            # the layer can change on the train device
+            self.__is_region_valid[layer_index] = False
+
+    def prefetch(self, upcoming_layers: list[int]):
+        """
+        Reads the next layers into free slots, and writes layers that are not needed soon to the file to free slots.
+        """
+        self.__finish_done()
+
+        # layers on the train device don't need a slot
+        upcoming_layers = [
+            layer_index for layer_index in upcoming_layers
+            if self.__is_on_disk[layer_index] or self.__layer_slots[layer_index] is not None
+        ]
+
+        # one slot is kept free for the next offloaded layer
+        window = upcoming_layers[:self.__num_slots - 1]
+        window_set = set(window)
+        for layer_index in window:
+            if self.__is_on_disk[layer_index] and layer_index not in self.__pending:
+                if len(self.__free_slots) <= 1:
+                    break
+                self.__start_read(layer_index, self.__free_slots.pop(0))
+
+        # read ahead the layers behind the window, they are read into slots soon
+        for layer_index in upcoming_layers[self.__num_slots - 1:self.__num_slots - 1 + READ_AHEAD_LAYERS]:
+            if self.__is_on_disk[layer_index] and layer_index not in self.__pending:
+                self.__read_ahead(layer_index)
+
+        if len(self.__free_slots) == 0 and not any(kind == "write" for kind, _ in self.__pending.values()):
+            victim = self.__choose_victim(upcoming_layers, window_set)
+            if victim is not None:
+                self.__start_write(victim)
+
+    def reset_step_stats(self):
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def end_step(self):
+        if self.bytes_read == 0 and self.bytes_written == 0:
+            return
+
+        log(f"layer disk cache step: read {self.bytes_read:_} bytes, written {self.bytes_written:_} bytes")
+        self.__total_bytes_read += self.bytes_read
+        self.__total_bytes_written += self.bytes_written
+        self.__num_steps += 1
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get_stats(self) -> dict[str, float]:
+        num_steps = max(self.__num_steps, 1)
+        return {
+            "steps": self.__num_steps,
+            "bytes_read_per_step": self.__total_bytes_read / num_steps,
+            "bytes_written_per_step": self.__total_bytes_written / num_steps,
+        }
+
+    def __is_trainable(self, layer_index: int) -> bool:
+        return any(
+            tensor.requires_grad
+            for module in self.__layers[layer_index].modules()
+            for tensor in get_offload_tensors(module)
+        )
+
+    @staticmethod
+    def __get_aligned_layer_bytes(layer: nn.Module) -> int:
+        num_bytes = 0
+        for module in layer.modules():
+            for tensor in get_offload_tensors(module):
+                num_bytes = ceil_4(num_bytes + tensor.numel() * tensor.element_size())
+        return num_bytes
+
+    @staticmethod
+    def __create_allocator(buffer: torch.Tensor) -> Callable[[torch.Tensor], torch.Tensor]:
+        # allocates tensors sequentially, in the same order as they are passed to offload_quantized
+        offset = 0
+
+        def allocate_like(source_tensor: torch.Tensor) -> torch.Tensor:
+            nonlocal offset
+            num_bytes = source_tensor.numel() * source_tensor.element_size()
+            allocated_tensor = buffer[offset:offset + num_bytes]
+            offset = ceil_4(offset + num_bytes)
+            return allocated_tensor.view(dtype=source_tensor.dtype).view(size=source_tensor.shape)
+
+        return allocate_like
+
+    def __point_tensors(self, layer_index: int, buffer: torch.Tensor):
+        # replaces the tensor data of a layer without copying, the buffer must already contain the data
+        allocator = self.__create_allocator(buffer)
+        for module in self.__layers[layer_index].modules():
+            for tensor in get_offload_tensors(module):
+                tensor.data = allocator(tensor)
+
+    def __get_region(self, layer_index: int) -> torch.Tensor:
+        offset = self.__region_offsets[layer_index]
+        return self.__file_tensor[offset:offset + self.__layer_bytes[layer_index]]
+
+    def __get_slot(self, slot: int, num_bytes: int | None = None) -> torch.Tensor:
+        offset = slot * self.__slot_size
+        return self.__slot_tensor[offset:offset + (self.__slot_size if num_bytes is None else num_bytes)]
+
+    def __drop_pages(self, layer_index: int, flush: bool):
+        # removes the region from host memory, so the file does not count against the host memory
+        offset = self.__region_offsets[layer_index]
+        size = self.__region_sizes[layer_index]
+        if size == 0:
+            return
+
+        if flush:
+            self.__mmap.flush(offset, size)
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self.__mmap.madvise(mmap.MADV_DONTNEED, offset, size)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.__file.fileno(), offset, size, os.POSIX_FADV_DONTNEED)
+
+    def __read_ahead(self, layer_index: int):
+        offset = self.__region_offsets[layer_index]
+        size = self.__region_sizes[layer_index]
+        if size == 0:
+            return
+
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.__file.fileno(), offset, size, os.POSIX_FADV_WILLNEED)
+        elif hasattr(mmap, "MADV_WILLNEED"):
+            self.__mmap.madvise(mmap.MADV_WILLNEED, offset, size)
+
+    def __release_slot(self, slot: int, event: torch.cuda.Event | None):
+        self.__slot_events[slot] = event
+        self.__free_slots.append(slot)
+
+    def __acquire_slot(self, upcoming_layers: list[int], protected_layers: set[int], wait_events: bool) -> int:
+        self.__finish_done()
+
+        if len(self.__free_slots) == 0:
+            # wait for a write that was already started, or write the layer that is needed last
+            writes = [layer_index for layer_index, (kind, _) in self.__pending.items() if kind == "write"]
+            if len(writes) > 0:
+                self.__wait(writes[0])
+            else:
+                victim = self.__choose_victim(upcoming_layers, protected_layers)
+                if victim is None:
+                    self.__wait_all()
+                    victim = self.__choose_victim(upcoming_layers, protected_layers)
+                if victim is None:
+                    raise RuntimeError("no layer disk cache slot available, increase the RAM budget")
+                log(f"no free layer disk cache slot, writing layer {victim} now")
+                self.__start_write(victim)
+                self.__wait(victim)
+
+        slot = self.__free_slots.pop(0)
+        if wait_events and self.__slot_events[slot] is not None:
+            self.__slot_events[slot].synchronize()
+        return slot
+
+    def __choose_victim(self, upcoming_layers: list[int], protected_layers: set[int]) -> int | None:
+        positions = {layer_index: position for position, layer_index in enumerate(upcoming_layers)}
+        candidates = [
+            layer_index for layer_index, slot in enumerate(self.__layer_slots)
+            if slot is not None and layer_index not in self.__pending and layer_index not in protected_layers
+        ]
+        if len(candidates) == 0:
+            return None
+        return max(candidates, key=lambda layer_index: positions.get(layer_index, len(upcoming_layers)))
+
+    def __start_read(self, layer_index: int, slot: int):
+        log(f"reading layer {layer_index} into disk cache slot {slot}")
+        self.__layer_slots[layer_index] = slot
+        event = self.__slot_events[slot]
+        self.__slot_events[slot] = None
+        future = self.__executor.submit(self.__read, layer_index, slot, event)
+        self.__pending[layer_index] = ("read", future)
+
+    def __start_write(self, layer_index: int):
+        slot = self.__layer_slots[layer_index]
+        if not self.__is_dirty[layer_index]:
+            # the region is still up to date, the slot can be released immediately
+            self.__point_tensors(layer_index, self.__get_region(layer_index))
+            self.__release_slot(slot, self.__slot_events[slot])
+            self.__layer_slots[layer_index] = None
+            self.__is_on_disk[layer_index] = True
+            return
+
+        log(f"writing layer {layer_index} from disk cache slot {slot}")
+        event = self.__slot_events[slot]
+        self.__slot_events[slot] = None
+        future = self.__executor.submit(self.__write, layer_index, slot, event)
+        self.__pending[layer_index] = ("write", future)
+
+    def __read(self, layer_index: int, slot: int, event: torch.cuda.Event | None):
+        # runs on the background thread
+        if event is not None:
+            event.synchronize()
+        num_bytes = self.__layer_bytes[layer_index]
+        self.__get_slot(slot, num_bytes).copy_(self.__get_region(layer_index))
+        self.__drop_pages(layer_index, flush=False)
+
+    def __write(self, layer_index: int, slot: int, event: torch.cuda.Event | None):
+        # runs on the background thread
+        if event is not None:
+            event.synchronize()
+        num_bytes = self.__layer_bytes[layer_index]
+        self.__get_region(layer_index).copy_(self.__get_slot(slot, num_bytes))
+        self.__drop_pages(layer_index, flush=True)
+
+    def __wait(self, layer_index: int, keep_in_slot: bool = False):
+        pending = self.__pending.pop(layer_index, None)
+        if pending is None:
+            return
+
+        kind, future = pending
+        future.result()
+
+        slot = self.__layer_slots[layer_index]
+        if kind == "read":
+            self.__point_tensors(layer_index, self.__get_slot(slot))
+            self.__is_on_disk[layer_index] = False
+            self.__is_dirty[layer_index] = False
+            self.bytes_read += self.__layer_bytes[layer_index]
+        else:
+            self.__is_region_valid[layer_index] = True
+            self.__is_dirty[layer_index] = False
+            self.bytes_written += self.__layer_bytes[layer_index]
+            if not keep_in_slot:
+                self.__point_tensors(layer_index, self.__get_region(layer_index))
+                self.__release_slot(slot, None)
+                self.__layer_slots[layer_index] = None
+                self.__is_on_disk[layer_index] = True
+
+    def __finish_done(self):
+        for layer_index, (_, future) in list(self.__pending.items()):
+            if future.done():
+                self.__wait(layer_index)
+
+    def __wait_all(self):
+        for layer_index in list(self.__pending.keys()):
+            self.__wait(layer_index)
+
+
 class LayerOffloadStrategy:
     def __init__(
             self,
             layers: list[nn.Module],
             layer_offload_fraction: float,
+            plan: LayerOffloadPlan | None = None,
     ):
         layer_bytes = [sum([get_offload_tensor_bytes(x) for x in layer.modules()]) for layer in layers]
-        total_bytes = sum(layer_bytes)
-        target_loaded_bytes = int(total_bytes * (1.0 - layer_offload_fraction))
+
+        if plan is None:
+            self.resident_layers = []
+            streamed = list(range(len(layers)))
+            window_bytes = [layer_bytes[i] for i in streamed]
+            target_loaded_bytes = int(sum(layer_bytes) * (1.0 - layer_offload_fraction))
+        else:
+            # resident layers are never offloaded. the window of streamed layers is counted in layers, not bytes
+            self.resident_layers = list(plan.resident_layers)
+            streamed = streamed_layers(len(layers), plan.resident_layers)
+            window_bytes = [1] * len(streamed)
+            target_loaded_bytes = plan.prefetch_distance + 1
+
+        streamed_bytes = [layer_bytes[i] for i in streamed]
+        self.__upcoming_layers_cache = {}
+
+        def get_loaded_layers(start_layer: int, is_forward: bool, is_cyclic: bool) -> list[int]:
+            if len(streamed) == 0:
+                return list(self.resident_layers)
+
+            # the position of the next streamed layer in execution order
+            if is_forward:
+                start_position = bisect.bisect_left(streamed, start_layer)
+                if start_position == len(streamed):
+                    start_position = 0 if is_cyclic else len(streamed) - 1
+            else:
+                start_position = max(bisect.bisect_right(streamed, start_layer) - 1, 0)
+
+            positions = self.__get_layers_below(
+                layer_bytes=window_bytes,
+                start_layer=start_position,
+                max_bytes=target_loaded_bytes,
+                is_forward=is_forward,
+                is_cyclic=is_cyclic,
+            )
+            return sorted(self.resident_layers + [streamed[i] for i in positions])
 
         # calculate min number of loaded layers at the start
-        self.initial_loaded_layers = self.__get_layers_below(
-            layer_bytes=layer_bytes,
-            start_layer=0,
-            max_bytes=target_loaded_bytes,
-            is_forward=True,
-            is_cyclic=False,
-        )
+        self.initial_loaded_layers = get_loaded_layers(0, is_forward=True, is_cyclic=False)
 
         # the offloading strategy has 3 cases:
         # case 1, forward pass, followed by a backward pass:
@@ -401,37 +912,36 @@ class LayerOffloadStrategy:
         #     same as case 1, but in reversed order
 
         # calculate a list of loaded layers before execution of each layer
-        self.forward_backward_loaded_layers = [self.__get_layers_below(
-            layer_bytes=layer_bytes,
-            start_layer=i,
-            max_bytes=target_loaded_bytes,
-            is_forward=True,
-            is_cyclic=False,
-        ) for i in range(len(layers))]
-
-        self.forward_forward_loaded_layers = [self.__get_layers_below(
-            layer_bytes=layer_bytes,
-            start_layer=i,
-            max_bytes=target_loaded_bytes,
-            is_forward=True,
-            is_cyclic=True,
-        ) for i in range(len(layers))]
-
-        self.backward_forward_loaded_layers = [self.__get_layers_below(
-            layer_bytes=layer_bytes,
-            start_layer=i,
-            max_bytes=target_loaded_bytes,
-            is_forward=False,
-            is_cyclic=False,
-        ) for i in range(len(layers))]
+        self.forward_backward_loaded_layers = [
+            get_loaded_layers(i, is_forward=True, is_cyclic=False) for i in range(len(layers))
+        ]
+
+        self.forward_forward_loaded_layers = [
+            get_loaded_layers(i, is_forward=True, is_cyclic=True) for i in range(len(layers))
+        ]
+
+        self.backward_forward_loaded_layers = [
+            get_loaded_layers(i, is_forward=False, is_cyclic=False) for i in range(len(layers))
+        ]
 
         all_loaded_layers = self.forward_backward_loaded_layers \
                             + self.forward_forward_loaded_layers \
                             + self.backward_forward_loaded_layers
 
-        self.max_loaded_bytes = max(sum([layer_bytes[i] for i in loaded_layers]) for loaded_layers in all_loaded_layers)
-        min_loaded_bytes = min(sum([layer_bytes[i] for i in loaded_layers]) for loaded_layers in all_loaded_layers)
-        self.max_offloaded_bytes = total_bytes - min_loaded_bytes + max(layer_bytes)
+        # resident layers are not allocated in the layer caches
+        resident_layers = set(self.resident_layers)
+        all_loaded_streamed_bytes = [
+            sum([layer_bytes[i] for i in loaded_layers if i not in resident_layers])
+            for loaded_layers in all_loaded_layers
+        ]
+
+        if len(streamed) == 0:
+            self.max_loaded_bytes = 0
+            self.max_offloaded_bytes = 0
+        else:
+            self.max_loaded_bytes = max(all_loaded_streamed_bytes)
+            min_loaded_bytes = min(all_loaded_streamed_bytes)
+            self.max_offloaded_bytes = sum(streamed_bytes) - min_loaded_bytes + max(streamed_bytes)
 
     @staticmethod
     def __get_layers_below(
@@ -478,6 +988,36 @@ class LayerOffloadStrategy:
                 layers.append(i)
         return sorted(layers)
 
+    def get_upcoming_layers(
+            self,
+            layer_index: int,
+            is_forward: bool,
+            is_next_forward: bool,
+    ) -> list[int]:
+        """
+        Returns all layers in the order they are needed on the train device after layer_index, following the schedule
+        through the rest of the current pass and the next passes.
+        """
+        key = (layer_index, is_forward, is_next_forward)
+        if key not in self.__upcoming_layers_cache:
+            if is_forward and is_next_forward:
+                schedule = self.forward_forward_loaded_layers[layer_index + 1:] \
+                           + self.forward_forward_loaded_layers
+            elif is_forward:
+                schedule = self.forward_backward_loaded_layers[layer_index + 1:] \
+                           + self.backward_forward_loaded_layers[::-1] \
+                           + self.forward_backward_loaded_layers
+            else:
+                schedule = self.backward_forward_loaded_layers[:layer_index][::-1] \
+                           + self.forward_backward_loaded_layers \
+                           + self.backward_forward_loaded_layers[::-1]
+
+            self.__upcoming_layers_cache[key] = list(dict.fromkeys(
+                i for loaded_layers in schedule for i in loaded_layers
+            ))
+
+        return self.__upcoming_layers_cache[key]
+
     def get_layers_to_offload(
             self,
             layer_index: int,
@@ -558,6 +1098,21 @@ class LayerOffloadConductor:
 
     __is_active: bool
 
+    __auto_plan: bool
+    __plan: LayerOffloadPlan | None
+    __plan_path: str
+    __plan_context: tuple
+    __vram_budget: int
+    __is_measuring: bool
+    __layer_compute_events: dict[int, list[torch.cuda.Event]]
+
+    __disk_cache: DiskLayerCache | None
+    __upcoming_layers: list[int]
+
+    __tracer: LayerOffloadTracer | None
+    __trace_dir: str
+    __trace_compute_events: dict[int, torch.cuda.Event | None]
+
     def __init__(
             self,
             module: nn.Module,
@@ -589,8 +1144,16 @@ class LayerOffloadConductor:
             self.__layer_transfer_stream = None
             self.__activations_transfer_stream = None
 
-        self.__train_device_layer_allocator = StaticLayerAllocator(self.__train_device)
-        self.__temp_device_layer_allocator = StaticLayerAllocator(self.__temp_device)
+        # the tracer times the streams with cuda events
+        if config.layer_offload_trace and self.__async_transfer and self.offload_activated():
+            self.__tracer = LayerOffloadTracer(type(module).__name__, self.__train_device)
+        else:
+            self.__tracer = None
+        self.__trace_dir = os.path.join(config.workspace_dir, "offload_traces")
+        self.__trace_compute_events = {}
+
+        self.__train_device_layer_allocator = StaticLayerAllocator(self.__train_device, self.__tracer)
+        self.__temp_device_layer_allocator = StaticLayerAllocator(self.__temp_device, self.__tracer)
         self.__temp_device_activations_allocator = StaticActivationAllocator(self.__temp_device)
 
         self.__layer_train_event_map = []
@@ -606,6 +1169,22 @@ class LayerOffloadConductor:
 
         self.__is_active = False
 
+        # the automatic planner needs cuda events to measure compute and transfer times
+        self.__auto_plan = self.__offload_layers and self.__async_transfer and config.layer_offload_auto_plan
+        self.__plan = None
+        self.__plan_path = os.path.join(config.workspace_dir, "layer_offload_plans.json")
+        self.__plan_context = (config.model_type, config.batch_size, config.resolution, config.train_device)
+        self.__vram_budget = int(config.layer_offload_vram_budget * (1024 ** 3))
+        self.__is_measuring = False
+        self.__layer_compute_events = {}
+
+        if self.__offload_layers and config.layer_offload_disk_cache_dir:
+            self.__disk_cache = DiskLayerCache(
+                config.layer_offload_disk_cache_dir, int(config.layer_offload_host_budget * (1024 ** 3)))
+        else:
+            self.__disk_cache = None
+        self.__upcoming_layers = []
+
     def offload_activated(self) -> bool:
         return self.__offload_activations or self.__offload_layers
 
@@ -621,55 +1200,219 @@ class LayerOffloadConductor:
         if device_equals(device, self.__temp_device):
             log("to temp device")
 
+            if self.__tracer is not None:
+                self.__export_trace()
+
             # deallocate the cache before to take advantage of the gc
             self.__train_device_layer_allocator.deallocate_cache()
             self.__temp_device_layer_allocator.deallocate_cache()
             self.__temp_device_activations_allocator.deallocate_cache()
 
             self.__module_to_device_except_layers(self.__temp_device)
-            for layer_index, layer in enumerate(self.__layers):
-                self.__layers[layer_index].to(self.__temp_device)
-                for module in layer.modules():
-                    offload_quantized(module, self.__temp_device, allocator=clone_tensor_allocator)
-                self.__layer_device_map[layer_index] = None
+            self.__layers_to_temp_device()
+
+            if self.__disk_cache is not None:
+                self.__print_disk_cache_stats()
 
             self.__is_active = False
 
         elif device_equals(device, self.__train_device):
             log("to train device")
 
-            self.__offload_strategy = LayerOffloadStrategy(self.__layers, self.__layer_offload_fraction)
+            if self.__auto_plan and self.__plan is None:
+                self.__plan = load_plan(self.__plan_path, self.__get_plan_key())
+                if self.__plan is not None:
+                    print(f"Using the saved layer offloading plan: {self.__plan}")
+                else:
+                    # measure the first step with the layer_offload_fraction strategy, then create a plan
+                    self.__is_measuring = True
+                    self.__layer_compute_events = {}
+
+            self.__module_to_device_except_layers(self.__train_device)
+            self.__layers_to_train_device()
+
+            if self.__tracer is not None:
+                self.__tracer.start()
+
+            self.__is_active = True
+
+        torch_gc()
+
+    def __layers_to_temp_device(self):
+        for layer_index, layer in enumerate(self.__layers):
+            if self.__disk_cache is not None:
+                # offloadable tensors stay in the file, so they don't use host memory
+                self.__disk_cache.write_layer(layer_index)
+                self.__layers[layer_index].to(self.__temp_device)
+            else:
+                self.__layers[layer_index].to(self.__temp_device)
+                for module in layer.modules():
+                    offload_quantized(module, self.__temp_device, allocator=clone_tensor_allocator)
+            self.__layer_device_map[layer_index] = None
 
+        if self.__disk_cache is not None:
+            self.__disk_cache.deallocate_slots()
+
+    def __layers_to_train_device(self):
+        self.__offload_strategy = LayerOffloadStrategy(self.__layers, self.__layer_offload_fraction, self.__plan)
+
+        if self.__offload_strategy.max_loaded_bytes > 0:
             self.__train_device_layer_allocator.allocate_cache(
                 self.__layers, self.__offload_strategy.max_loaded_bytes)
+        if self.__disk_cache is not None:
+            # offloaded layers are held by the disk cache instead of the temp device cache
+            self.__disk_cache.allocate(self.__layers)
+        elif self.__offload_strategy.max_offloaded_bytes > 0:
             self.__temp_device_layer_allocator.allocate_cache(
                 self.__layers, self.__offload_strategy.max_offloaded_bytes)
-            self.__module_to_device_except_layers(self.__train_device)
 
-            # move all layers to the train device, then move offloadable tensors back to the temp device
-            for layer_index, layer in enumerate(self.__layers):
-                if self.__layer_device_map[layer_index] is None:
-                    log(f"layer {layer_index} to train device")
-                    layer.to(self.__train_device)
-
-                    if layer_index in self.__offload_strategy.initial_loaded_layers:
-                        allocator = self.__train_device_layer_allocator.get_allocator(
-                            layer_index, allocate_forward=True)
-                        for module in layer.modules():
-                            offload_quantized(module, self.__train_device, allocator=allocator.allocate_like)
-                        self.__layer_device_map[layer_index] = self.__train_device
-                    else:
-                        allocator = self.__temp_device_layer_allocator.get_allocator(layer_index, allocate_forward=True)
-                        for module in layer.modules():
-                            offload_quantized(module, self.__temp_device, allocator=allocator.allocate_like)
-                        self.__layer_device_map[layer_index] = self.__temp_device
-
-                    if self.__async_transfer:
-                        event = SyncEvent(self.__train_stream.record_event(), f"train on {self.__train_device}")
-                        self.__layer_train_event_map[layer_index] = event
+        # move all layers to the train device, then move offloadable tensors back to the temp device
+        for layer_index, layer in enumerate(self.__layers):
+            if self.__layer_device_map[layer_index] is None:
+                log(f"layer {layer_index} to train device")
+
+                if self.__disk_cache is not None \
+                        and layer_index not in self.__offload_strategy.resident_layers \
+                        and layer_index not in self.__offload_strategy.initial_loaded_layers:
+                    # offloaded layers are written to the file directly, without a detour over the train device
+                    if not self.__disk_cache.is_on_disk(layer_index):
+                        self.__disk_cache.write_layer(layer_index)
+                    self.__layer_to_device_except_offload_tensors(layer, self.__train_device)
+                    self.__layer_device_map[layer_index] = self.__temp_device
+                    continue
+
+                layer.to(self.__train_device)
+                if self.__disk_cache is not None:
+                    self.__disk_cache.after_load(layer_index, None)
+
+                if layer_index in self.__offload_strategy.resident_layers:
+                    # resident layers are never offloaded, they don't need to be in the layer cache
+                    for module in layer.modules():
+                        offload_quantized(module, self.__train_device)
+                    self.__layer_device_map[layer_index] = self.__train_device
+                elif layer_index in self.__offload_strategy.initial_loaded_layers:
+                    allocator = self.__train_device_layer_allocator.get_allocator(
+                        layer_index, allocate_forward=True)
+                    for module in layer.modules():
+                        offload_quantized(module, self.__train_device, allocator=allocator.allocate_like)
+                    self.__layer_device_map[layer_index] = self.__train_device
+                else:
+                    allocator = self.__temp_device_layer_allocator.get_allocator(layer_index, allocate_forward=True)
+                    for module in layer.modules():
+                        offload_quantized(module, self.__temp_device, allocator=allocator.allocate_like)
+                    self.__layer_device_map[layer_index] = self.__temp_device
+
+                if self.__async_transfer:
+                    event = SyncEvent(self.__train_stream.record_event(), f"train on {self.__train_device}")
+                    self.__layer_train_event_map[layer_index] = event
+
+        if self.__disk_cache is not None:
+            # writes of the initial placement are not part of a training step
+            self.__disk_cache.reset_step_stats()
+
+    def __layer_to_device_except_offload_tensors(self, layer: nn.Module, device: torch.device):
+        offload_tensors = set(sum([get_offload_tensors(x) for x in layer.modules()], []))
 
-            self.__is_active = True
+        def convert(t):
+            if t in offload_tensors:
+                return t
+
+            return t.to(device=device)
+
+        layer._apply(convert)
 
+    def __export_trace(self):
+        if not self.__tracer.has_data():
+            return
+
+        path = self.__tracer.export(self.__trace_dir)
+        print(self.__tracer.summary())
+        print(f"Saved the layer offloading trace to {path}")
+
+    def __print_disk_cache_stats(self):
+        stats = self.__disk_cache.get_stats()
+        if stats["steps"] > 0:
+            print(f"Layer offload disk cache: {stats['bytes_read_per_step'] / (1024 ** 3):.2f} GB read and "
+                  f"{stats['bytes_written_per_step'] / (1024 ** 3):.2f} GB written per step, "
+                  f"averaged over {stats['steps']} steps")
+
+    def __get_layer_bytes(self) -> list[int]:
+        return [sum([get_offload_tensor_bytes(x) for x in layer.modules()]) for layer in self.__layers]
+
+    def __get_vram_budget(self) -> int:
+        if self.__vram_budget > 0:
+            return self.__vram_budget
+        return int(sum(self.__get_layer_bytes()) * (1.0 - self.__layer_offload_fraction))
+
+    def __get_plan_key(self) -> str:
+        return plan_key(
+            self.__get_layer_bytes(),
+            self.__get_vram_budget(),
+            *self.__plan_context,
+            torch.cuda.get_device_name(self.__train_device),
+        )
+
+    def __measure_bandwidth(self) -> tuple[float, float]:
+        # copy a buffer in both directions on the transfer stream, the fastest of a few repetitions is used
+        num_bytes = min(max(self.__get_layer_bytes()), 256 * 1024 * 1024)
+        host_tensor = torch.zeros((num_bytes,), dtype=torch.int8)
+        pin_tensor_(host_tensor)
+        device_tensor = torch.zeros((num_bytes,), dtype=torch.int8, device=self.__train_device)
+
+        load_times = []
+        offload_times = []
+        with create_stream_context(self.__layer_transfer_stream):
+            for _ in range(3):
+                start_event = torch.cuda.Event(enable_timing=True)
+                load_event = torch.cuda.Event(enable_timing=True)
+                offload_event = torch.cuda.Event(enable_timing=True)
+
+                start_event.record()
+                device_tensor.copy_(host_tensor, non_blocking=True)
+                load_event.record()
+                host_tensor.copy_(device_tensor, non_blocking=True)
+                offload_event.record()
+                offload_event.synchronize()
+
+                load_times.append(start_event.elapsed_time(load_event) / 1000)
+                offload_times.append(load_event.elapsed_time(offload_event) / 1000)
+
+        unpin_tensor_(host_tensor)
+        del host_tensor, device_tensor
+
+        return num_bytes / min(load_times), num_bytes / min(offload_times)
+
+    def __create_plan(self):
+        self.__is_measuring = False
+        torch.cuda.synchronize(self.__train_device)
+
+        layer_costs = [
+            LayerCost(num_bytes, start_event.elapsed_time(end_event) / 1000)
+            for num_bytes, (start_event, end_event)
+            in zip(self.__get_layer_bytes(), [self.__layer_compute_events[i] for i in range(len(self.__layers))],
+                   strict=True)
+        ]
+        self.__layer_compute_events = {}
+        load_bandwidth, offload_bandwidth = self.__measure_bandwidth()
+
+        vram_budget = self.__get_vram_budget()
+        plan = plan_layer_offloading(layer_costs, vram_budget, load_bandwidth, offload_bandwidth)
+        if plan is None:
+            print(f"Could not create a layer offloading plan for a budget of {vram_budget / (1024 ** 3):.2f} GB, "
+                  f"using layer_offload_fraction")
+            return
+
+        print(f"Created a layer offloading plan with a transfer bandwidth of {load_bandwidth / (1024 ** 3):.1f} GB/s: "
+              f"{plan}")
+        save_plan(self.__plan_path, self.__get_plan_key(), plan)
+        self.__plan = plan
+
+        # place all layers again according to the new plan
+        self.__train_device_layer_allocator.deallocate_cache()
+        self.__temp_device_layer_allocator.deallocate_cache()
+        self.__layers_to_temp_device()
+        torch_gc()
+        self.__layers_to_train_device()
         torch_gc()
 
     def add_layer(self, layer: nn.Module, included_offload_param_indices: list[int] = None):
@@ -694,6 +1437,16 @@ class LayerOffloadConductor:
         self.__wait_all_layer_transfers()
         self.__clear_activations()
 
+        if self.__disk_cache is not None:
+            self.__disk_cache.end_step()
+
+        if self.__tracer is not None:
+            self.__tracer.start_step()
+
+        if self.__is_measuring and len(self.__layer_compute_events) == len(self.__layers) \
+                and all(len(events) == 2 for events in self.__layer_compute_events.values()):
+            self.__create_plan()
+
         self.__is_forward_pass = True
         self.__keep_graph = keep_graph
 
@@ -740,6 +1493,13 @@ class LayerOffloadConductor:
         if self.__offload_layers:
             self.__wait_layer_transfer(layer_index)
 
+            if self.__disk_cache is not None:
+                self.__upcoming_layers = self.__offload_strategy.get_upcoming_layers(
+                    layer_index=layer_index,
+                    is_forward=self.__is_forward_pass,
+                    is_next_forward=not self.__keep_graph,
+                )
+
             for i in self.__offload_strategy.get_layers_to_offload(
                     layer_index=layer_index,
                     is_forward=self.__is_forward_pass,
@@ -756,6 +1516,19 @@ class LayerOffloadConductor:
             ):
                 self.__schedule_layer_to(i, self.__train_device, is_forward=self.__is_forward_pass)
 
+            if self.__disk_cache is not None:
+                self.__disk_cache.prefetch(self.__upcoming_layers)
+
+        # only training steps are measured, sampling uses different batch sizes
+        if self.__is_measuring and self.__is_forward_pass and self.__keep_graph \
+                and layer_index not in self.__layer_compute_events:
+            start_event = torch.cuda.Event(enable_timing=True)
+            start_event.record(self.__train_stream)
+            self.__layer_compute_events[layer_index] = [start_event]
+
+        if self.__tracer is not None:
+            self.__trace_compute_events[layer_index] = self.__tracer.record(self.__train_stream)
+
         return activations
 
     def after_layer(self, layer_index: int, call_index: int, activations: Any):
@@ -764,6 +1537,18 @@ class LayerOffloadConductor:
         if not self.__is_active:
             return
 
+        if self.__is_measuring and len(self.__layer_compute_events.get(layer_index, [])) == 1:
+            end_event = torch.cuda.Event(enable_timing=True)
+            end_event.record(self.__train_stream)
+            self.__layer_compute_events[layer_index].append(end_event)
+
+        if self.__tracer is not None:
+            self.__tracer.add_span(
+                self.__train_stream, self.__trace_compute_events.pop(layer_index, None),
+                TRACK_COMPUTE, f"layer {layer_index}", CATEGORY_COMPUTE,
+                layer=layer_index, forward=self.__is_forward_pass,
+            )
+
         # record stream
         if self.__async_transfer:
             tensors_record_stream(self.__train_stream, activations)
@@ -815,22 +1600,50 @@ class LayerOffloadConductor:
             self.__wait_activations_transfer(call_index)
 
     def __wait_layer_train(self, layer_index: int):
-        self.__layer_train_event_map[layer_index] \
-            .wait(self.__layer_transfer_stream, f"wait layer train {layer_index}")
+        event = self.__layer_train_event_map[layer_index]
+        start_event = self.__tracer.record(self.__layer_transfer_stream) \
+            if self.__tracer is not None and event.is_recorded() else None
+
+        event.wait(self.__layer_transfer_stream, f"wait layer train {layer_index}")
         self.__layer_train_event_map[layer_index] = SyncEvent()
 
+        if start_event is not None:
+            self.__tracer.add_span(
+                self.__layer_transfer_stream, start_event,
+                TRACK_TRANSFER, f"wait layer train {layer_index}", CATEGORY_WAIT, layer=layer_index,
+            )
+
     def __wait_layer_transfer(self, layer_index: int):
         if self.__async_transfer:
-            self.__layer_transfer_event_map[layer_index] \
-                .wait(self.__train_stream, f"wait layer transfer {layer_index}")
+            event = self.__layer_transfer_event_map[layer_index]
+            start_event = self.__tracer.record(self.__train_stream) \
+                if self.__tracer is not None and event.is_recorded() else None
+
+            event.wait(self.__train_stream, f"wait layer transfer {layer_index}")
             self.__layer_transfer_event_map[layer_index] = SyncEvent()
 
+            if start_event is not None:
+                self.__tracer.add_span(
+                    self.__train_stream, start_event,
+                    TRACK_COMPUTE, f"wait layer transfer {layer_index}", CATEGORY_WAIT, layer=layer_index,
+                )
+
     def __wait_activations_transfer(self, call_index: int):
         event = self.__activations_transfer_event_map.pop(call_index, None)
 
         if event is not None:
+            start_event = self.__tracer.record(self.__train_stream) \
+                if self.__tracer is not None and event.is_recorded() else None
+
             event.wait(self.__train_stream, f"wait activations transfer {call_index}")
 
+            if start_event is not None:
+                self.__tracer.add_span(
+                    self.__train_stream, start_event,
+                    TRACK_COMPUTE, f"wait activations transfer {call_index}", CATEGORY_WAIT,
+                    layer=self.__call_index_layer_index_map.get(call_index),
+                )
+
     def __schedule_layer_to(
             self,
             layer_index: int,
@@ -842,32 +1655,67 @@ class LayerOffloadConductor:
             log(f"schedule layer {layer_index} to {str(device)}, skipping")
             return
 
+        to_train_device = device_equals(device, self.__train_device)
+
         layer_deallocator = self.__temp_device_layer_allocator \
-            if device_equals(device, self.__train_device) \
+            if to_train_device \
             else self.__train_device_layer_allocator
 
         layer_allocator = self.__train_device_layer_allocator \
-            if device_equals(device, self.__train_device) \
+            if to_train_device \
             else self.__temp_device_layer_allocator
-        allocator = layer_allocator.get_allocator(layer_index, is_forward)
 
-        allocator_fn = allocator.allocate_like if allocator is not None else None
+        if self.__disk_cache is not None and to_train_device:
+            # the disk cache releases the host slot after the transfer
+            start_time = time.perf_counter()
+            self.__disk_cache.before_load(layer_index, self.__upcoming_layers)
+            layer_deallocator = None
+
+            if self.__tracer is not None:
+                self.__tracer.add_host_span(
+                    start_time, TRACK_HOST, f"disk cache read layer {layer_index}", CATEGORY_WAIT, layer=layer_index)
+
+        if self.__disk_cache is not None and not to_train_device:
+            allocator_fn = self.__disk_cache.get_allocator(layer_index, self.__upcoming_layers)
+        else:
+            allocator = layer_allocator.get_allocator(layer_index, is_forward)
+            allocator_fn = allocator.allocate_like if allocator is not None else None
 
         with create_stream_context(self.__layer_transfer_stream):
             self.__wait_layer_train(layer_index)
+            trace_start_event = self.__tracer.record(self.__layer_transfer_stream) \
+                if self.__tracer is not None else None
+
             layer = self.__layers[layer_index]
             for module in layer.modules():
                 offload_quantized(module, device, non_blocking=self.__async_transfer, allocator=allocator_fn)
 
-            layer_deallocator.deallocate_layer(layer_index, deallocate_forward=is_forward)
+            if trace_start_event is not None:
+                direction = "load" if to_train_device else "offload"
+                self.__tracer.add_span(
+                    self.__layer_transfer_stream, trace_start_event,
+                    TRACK_TRANSFER, f"{direction} layer {layer_index}", CATEGORY_TRANSFER,
+                    layer=layer_index, direction=direction,
+                    bytes=sum(get_offload_tensor_bytes(x) for x in layer.modules()),
+                )
+
+            if layer_deallocator is not None:
+                layer_deallocator.deallocate_layer(layer_index, deallocate_forward=is_forward)
 
+            torch_event = None
             if self.__async_transfer:
-                event = SyncEvent(self.__layer_transfer_stream.record_event(), f"transfer to {device}")
+                torch_event = self.__layer_transfer_stream.record_event()
+                event = SyncEvent(torch_event, f"transfer to {device}")
                 self.__layer_transfer_event_map[layer_index] = event
                 log(f"schedule layer {layer_index} to {str(device)}, {event}")
             else:
                 log(f"schedule layer {layer_index} to {str(device)}")
 
+            if self.__disk_cache is not None and to_train_device:
+                self.__disk_cache.after_load(layer_index, torch_event)
+            elif self.__disk_cache is not None:
+                self.__disk_cache.after_offload(layer_index, torch_event)
+
             self.__layer_device_map[layer_index] = device
 
     def __schedule_activations_to_device(
@@ -895,12 +1743,23 @@ class LayerOffloadConductor:
 
             if event is not None:
                 event.wait(self.__activations_transfer_stream)
+            trace_start_event = self.__tracer.record(self.__activations_transfer_stream) \
+                if self.__tracer is not None else None
 
             tensors = get_tensor_data(activations, tensor_indices)
             if activations_allocator is not None:
                 activations_allocator.reserve_cache(tensors)
             tensors_to_device_(activations, device, tensor_indices, non_blocking=self.__async_transfer, allocator=allocator_fn)
 
+            if trace_start_event is not None:
+                direction = "offload" if activations_allocator is not None else "load"
+                self.__tracer.add_span(
+                    self.__activations_transfer_stream, trace_start_event,
+                    TRACK_ACTIVATIONS, f"{direction} activations {call_index}", CATEGORY_TRANSFER,
+                    layer=layer_index, direction=direction,
+                    bytes=sum(tensor.element_size() * tensor.numel() for tensor in tensors),
+                )
+
             if self.__async_transfer:
                 tensors_record_stream(self.__activations_transfer_stream, tensors)
                 self.__activations_transfer_event_map[call_index] = \
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+
+# a checkpointed layer is executed again during the backward pass, and its backward pass takes about twice as long as
+# the forward pass
+BACKWARD_COMPUTE_FACTOR = 3.0
+
+
+class LayerCost:
+    def __init__(self, num_bytes: int, compute_time: float):
+        self.num_bytes = num_bytes
+        # forward pass duration in seconds
+        self.compute_time = compute_time
+
+
+class LayerOffloadPlan:
+    """
+    Layers in resident_layers stay on the train device. All other layers are streamed in execution order, with up to
+    prefetch_distance layers loaded ahead of the one that is currently executed.
+    """
+
+    def __init__(self, resident_layers: list[int], prefetch_distance: int, step_time: float = 0.0):
+        self.resident_layers = sorted(resident_layers)
+        self.prefetch_distance = prefetch_distance
+        # the simulated duration of one forward and backward pass of all layers, in seconds
+        self.step_time = step_time
+
+    def to_dict(self) -> dict:
+        return {
+            "resident_layers": self.resident_layers,
+            "prefetch_distance": self.prefetch_distance,
+            "step_time": self.step_time,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'LayerOffloadPlan':
+        return LayerOffloadPlan(data["resident_layers"], data["prefetch_distance"], data.get("step_time", 0.0))
+
+    def __repr__(self) -> str:
+        return f"LayerOffloadPlan(resident_layers={self.resident_layers}, prefetch_distance={self.prefetch_distance}, step_time={self.step_time:.4f}s)"
+
+
+def streamed_layers(num_layers: int, resident_layers: list[int]) -> list[int]:
+    resident_layers = set(resident_layers)
+    return [i for i in range(num_layers) if i not in resident_layers]
+
+
+def required_bytes(layer_costs: list[LayerCost], resident_layers: list[int], prefetch_distance: int) -> int:
+    """
+    Returns the bytes needed on the train device for the resident layers and the largest window of streamed layers.
+    """
+    resident_bytes = sum(layer_costs[i].num_bytes for i in resident_layers)
+    streamed = streamed_layers(len(layer_costs), resident_layers)
+    if len(streamed) == 0:
+        return resident_bytes
+
+    window = min(prefetch_distance + 1, len(streamed))
+    streamed_bytes = [layer_costs[i].num_bytes for i in streamed]
+    # windows wrap around from the last layers to the first ones between two forward passes
+    max_window_bytes = max(
+        sum(streamed_bytes[(start + j) % len(streamed)] for j in range(window))
+        for start in range(len(streamed))
+    )
+    return resident_bytes + max_window_bytes
+
+
+def simulate_step(
+        layer_costs: list[LayerCost],
+        resident_layers: list[int],
+        prefetch_distance: int,
+        load_bandwidth: float,
+        offload_bandwidth: float,
+        backward_compute_factor: float = BACKWARD_COMPUTE_FACTOR,
+) -> float:
+    """
+    Simulates one forward and backward pass, and returns its duration in seconds.
+
+    Layers are executed one after the other on the compute stream. Transfers run on a single transfer stream in
+    parallel to the compute stream. When a streamed layer has finished, it is offloaded and the streamed layer
+    prefetch_distance + 1 positions ahead is loaded into its slot. A layer can only be executed when its transfer
+    has finished.
+    """
+    streamed = streamed_layers(len(layer_costs), resident_layers)
+    is_streamed = set(streamed)
+    window = min(prefetch_distance + 1, len(streamed))
+
+    compute_free = 0.0
+    transfer_free = 0.0
+    # the first window is still loaded from the backward pass of the previous step
+    load_end = dict.fromkeys(streamed[:window], 0.0)
+
+    for order, factor in [
+        (list(range(len(layer_costs))), 1.0),
+        (list(range(len(layer_costs) - 1, -1, -1)), backward_compute_factor),
+    ]:
+        streamed_order = [i for i in order if i in is_streamed]
+        next_load = window
+
+        for layer in order:
+            start = compute_free
+            if layer in is_streamed:
+                start = max(start, load_end[layer])
+            compute_free = start + layer_costs[layer].compute_time * factor
+
+            if layer in is_streamed and next_load < len(streamed_order):
+                next_layer = streamed_order[next_load]
+                transfer_start = max(transfer_free, compute_free)
+                transfer_free = transfer_start \
+                    + layer_costs[layer].num_bytes / offload_bandwidth \
+                    + layer_costs[next_layer].num_bytes / load_bandwidth
+                load_end[next_layer] = transfer_free
+                next_load += 1
+
+    return compute_free
+
+
+def plan_layer_offloading(
+        layer_costs: list[LayerCost],
+        vram_budget: int,
+        load_bandwidth: float,
+        offload_bandwidth: float,
+        backward_compute_factor: float = BACKWARD_COMPUTE_FACTOR,
+) -> LayerOffloadPlan | None:
+    """
+    Chooses the resident layers and the prefetch distance with the shortest simulated step time that fit into
+    vram_budget bytes. Starting from streaming all layers with the smallest window, the best single change is applied
+    until no change makes the step faster. Returns None if not even the smallest window fits.
+    """
+
+    def simulate(resident_layers: list[int], prefetch_distance: int) -> float:
+        return simulate_step(
+            layer_costs, resident_layers, prefetch_distance,
+            load_bandwidth, offload_bandwidth, backward_compute_factor,
+        )
+
+    num_layers = len(layer_costs)
+    if sum(cost.num_bytes for cost in layer_costs) <= vram_budget:
+        all_layers = list(range(num_layers))
+        return LayerOffloadPlan(all_layers, 0, simulate(all_layers, 0))
+
+    resident_layers = []
+    prefetch_distance = 1
+    if required_bytes(layer_costs, resident_layers, prefetch_distance) > vram_budget:
+        return None
+    step_time = simulate(resident_layers, prefetch_distance)
+
+    while True:
+        num_streamed = num_layers - len(resident_layers)
+        candidates = []
+        if prefetch_distance + 1 < num_streamed:
+            candidates.append((resident_layers, prefetch_distance + 1))
+        if num_streamed > 2:
+            candidates.extend(
+                ([*resident_layers, layer], min(prefetch_distance, num_streamed - 2))
+                for layer in streamed_layers(num_layers, resident_layers)
+            )
+
+        best = None
+        for candidate_resident_layers, candidate_prefetch_distance in candidates:
+            if required_bytes(layer_costs, candidate_resident_layers, candidate_prefetch_distance) > vram_budget:
+                continue
+            candidate_step_time = simulate(candidate_resident_layers, candidate_prefetch_distance)
+            if best is None or candidate_step_time < best[0]:
+                best = (candidate_step_time, candidate_resident_layers, candidate_prefetch_distance)
+
+        if best is None or best[0] >= step_time * (1.0 - 1e-6):
+            break
+        step_time, resident_layers, prefetch_distance = best
+
+    return LayerOffloadPlan(resident_layers, prefetch_distance, step_time)
+
+
+def plan_key(layer_bytes: list[int], vram_budget: int, *context) -> str:
+    """
+    Identifies the situation a plan was created for. Plans are only reused if the layers, the budget and the
+    context (batch size, resolution, device, ...) are the same.
+    """
+    data = json.dumps([layer_bytes, vram_budget, [str(x) for x in context]])
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def load_plan(path: str, key: str) -> LayerOffloadPlan | None:
+    try:
+        with open(path, "r") as f:
+            plans = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    data = plans.get(key)
+    return LayerOffloadPlan.from_dict(data) if data is not None else None
+
+
+def save_plan(path: str, key: str, plan: LayerOffloadPlan):
+    try:
+        with open(path, "r") as f:
+            plans = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        plans = {}
+
+    plans[key] = plan.to_dict()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".partial", "w") as f:
+        json.dump(plans, f, indent=4)
+    os.replace(path + ".partial", path)
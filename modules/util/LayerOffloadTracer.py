@@ -0,0 +1,238 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import torch
+
+# only the first steps after the model is moved to the train device are traced, to keep the overhead low
+MAX_TRACED_STEPS = 20
+
+TRACK_COMPUTE = "compute"
+TRACK_TRANSFER = "transfer"
+TRACK_ACTIVATIONS = "activations"
+TRACK_HOST = "host"
+TRACKS = [TRACK_COMPUTE, TRACK_TRANSFER, TRACK_ACTIVATIONS, TRACK_HOST]
+
+CATEGORY_COMPUTE = "compute"
+CATEGORY_TRANSFER = "transfer"
+CATEGORY_WAIT = "wait"
+CATEGORY_ALLOCATOR = "allocator"
+
+
+class LayerOffloadTracer:
+    """
+    Records a timeline of the layer offloading of one conductor.
+
+    Compute, transfers and stream waits are timed with cuda events on the stream they are executed on, so recording
+    them does not synchronize. The events are only resolved when the trace is exported. Host side events, like
+    blocking waits and allocator wraps, are timed with the host clock, aligned to the cuda timeline at the start of
+    the trace.
+    """
+
+    def __init__(self, name: str, device: torch.device):
+        self.name = name
+        self.__device = device
+
+        self.__reference_event = None
+        self.__reference_time = 0.0
+        self.__num_steps = 0
+
+        # (track, name, category, start event, end event, args)
+        self.__spans = []
+        # (track, name, category, start time, end time, args)
+        self.__host_spans = []
+        # (track, name, category, time, args)
+        self.__instants = []
+
+    @property
+    def is_active(self) -> bool:
+        return self.__reference_event is not None and self.__num_steps <= MAX_TRACED_STEPS
+
+    def start(self):
+        self.__spans = []
+        self.__host_spans = []
+        self.__instants = []
+        self.__num_steps = 0
+
+        self.__reference_event = torch.cuda.Event(enable_timing=True)
+        self.__reference_event.record(torch.cuda.current_stream(self.__device))
+        self.__reference_event.synchronize()
+        self.__reference_time = time.perf_counter()
+
+    def start_step(self):
+        if self.__reference_event is not None:
+            self.__num_steps += 1
+
+    def has_data(self) -> bool:
+        return len(self.__spans) > 0 or len(self.__host_spans) > 0
+
+    def record(self, stream: torch.Stream) -> torch.cuda.Event | None:
+        if not self.is_active:
+            return None
+
+        event = torch.cuda.Event(enable_timing=True)
+        event.record(stream)
+        return event
+
+    def add_span(
+            self,
+            stream: torch.Stream,
+            start_event: torch.cuda.Event | None,
+            track: str,
+            name: str,
+            category: str,
+            **args,
+    ):
+        # ends a span that was started with record() on the same stream
+        if start_event is None or not self.is_active:
+            return
+
+        end_event = self.record(stream)
+        self.__spans.append((track, name, category, start_event, end_event, args))
+
+    def add_host_span(self, start_time: float, track: str, name: str, category: str, **args):
+        if not self.is_active:
+            return
+
+        self.__host_spans.append((track, name, category, start_time, time.perf_counter(), args))
+
+    def add_instant(self, track: str, name: str, category: str, **args):
+        if not self.is_active:
+            return
+
+        self.__instants.append((track, name, category, time.perf_counter(), args))
+
+    def __resolve(self) -> list[tuple[str, str, str, float, float, dict]]:
+        # returns (track, name, category, start ms, duration ms, args) for all spans
+        torch.cuda.synchronize(self.__device)
+
+        spans = []
+        for track, name, category, start_event, end_event, args in self.__spans:
+            start = self.__reference_event.elapsed_time(start_event)
+            spans.append((track, name, category, start, self.__reference_event.elapsed_time(end_event) - start, args))
+        for track, name, category, start_time, end_time, args in self.__host_spans:
+            start = (start_time - self.__reference_time) * 1000
+            spans.append((track, name, category, start, (end_time - start_time) * 1000, args))
+        return spans
+
+    def export(self, directory: str) -> str:
+        """
+        Writes the trace in the Chrome trace event format, which can be opened in Perfetto or chrome://tracing.
+        """
+        spans = self.__resolve()
+
+        events = []
+        for tid, track in enumerate(TRACKS):
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": track}})
+        events.append({"name": "process_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": self.name}})
+
+        for track, name, category, start, duration, args in spans:
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1000,
+                "dur": max(duration, 0.0) * 1000,
+                "pid": 0,
+                "tid": TRACKS.index(track),
+                "args": args,
+            })
+        for track, name, category, instant_time, args in self.__instants:
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "i",
+                "s": "t",
+                "ts": (instant_time - self.__reference_time) * 1_000_000,
+                "pid": 0,
+                "tid": TRACKS.index(track),
+                "args": args,
+            })
+
+        os.makedirs(directory, exist_ok=True)
+        file_name = f"{self.name}-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+        path = os.path.join(directory, file_name)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        return path
+
+    def summary(self, num_worst_layers: int = 5) -> str:
+        spans = self.__resolve()
+
+        compute_spans = [x for x in spans if x[0] == TRACK_COMPUTE and x[2] == CATEGORY_COMPUTE]
+        train_wait_spans = [x for x in spans if x[0] == TRACK_COMPUTE and x[2] == CATEGORY_WAIT]
+        transfer_spans = [x for x in spans if x[0] == TRACK_TRANSFER and x[2] == CATEGORY_TRANSFER]
+        host_wait_spans = [x for x in spans if x[0] == TRACK_HOST and x[2] == CATEGORY_WAIT]
+
+        compute_time = sum(x[4] for x in compute_spans)
+        train_wait_time = sum(x[4] for x in train_wait_spans)
+        transfer_time = sum(x[4] for x in transfer_spans)
+        host_wait_time = sum(x[4] for x in host_wait_spans)
+
+        lines = [f"Layer offloading trace of {self.name}, {min(self.__num_steps, MAX_TRACED_STEPS)} steps:"]
+
+        train_stream_time = compute_time + train_wait_time
+        blocked_fraction = train_wait_time / train_stream_time if train_stream_time > 0 else 0
+        lines.append(f"  train stream blocked: {train_wait_time:.1f} ms ({blocked_fraction * 100:.1f}%), "
+                     f"compute: {compute_time:.1f} ms, host blocked: {host_wait_time:.1f} ms")
+
+        overlap_time = _intersection_length(
+            [(x[3], x[3] + x[4]) for x in transfer_spans],
+            [(x[3], x[3] + x[4]) for x in compute_spans],
+        )
+        overlap_fraction = overlap_time / transfer_time if transfer_time > 0 else 0
+        lines.append(f"  transfers: {transfer_time:.1f} ms, {overlap_fraction * 100:.1f}% overlapped with compute")
+
+        for direction in ["load", "offload"]:
+            direction_spans = [x for x in transfer_spans if x[5].get("direction") == direction]
+            num_bytes = sum(x[5].get("bytes", 0) for x in direction_spans)
+            duration = sum(x[4] for x in direction_spans)
+            if duration > 0:
+                lines.append(f"  {direction} bandwidth: {num_bytes / (duration / 1000) / (1024 ** 3):.2f} GB/s "
+                             f"({num_bytes / (1024 ** 3):.2f} GB in {len(direction_spans)} transfers)")
+
+        layer_wait_times = {}
+        for span in train_wait_spans:
+            layer_index = span[5].get("layer")
+            if layer_index is not None:
+                layer_wait_times[layer_index] = layer_wait_times.get(layer_index, 0.0) + span[4]
+        worst_layers = sorted(layer_wait_times.items(), key=lambda x: x[1], reverse=True)[:num_worst_layers]
+        worst_layers = [x for x in worst_layers if x[1] > 0]
+        if worst_layers:
+            lines.append("  layers the train stream waited for the longest: "
+                         + ", ".join(f"{layer_index} ({wait_time:.1f} ms)" for layer_index, wait_time in worst_layers))
+
+        num_wraps = sum(1 for x in self.__instants if x[2] == CATEGORY_ALLOCATOR)
+        lines.append(f"  layer cache wraps: {num_wraps}")
+
+        return "\n".join(lines)
+
+
+def _merge_intervals(intervals: list[tuple[float, float]]) -> list[tuple[float, float]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _intersection_length(intervals_a: list[tuple[float, float]], intervals_b: list[tuple[float, float]]) -> float:
+    intervals_a = _merge_intervals(intervals_a)
+    intervals_b = _merge_intervals(intervals_b)
+
+    length = 0.0
+    i = 0
+    j = 0
+    while i < len(intervals_a) and j < len(intervals_b):
+        start = max(intervals_a[i][0], intervals_b[j][0])
+        end = min(intervals_a[i][1], intervals_b[j][1])
+        length += max(end - start, 0.0)
+        if intervals_a[i][1] < intervals_b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return length
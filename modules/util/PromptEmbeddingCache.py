@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+from torch import Tensor
+
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class PromptEmbeddingCache:
+    """
+    Keeps the text encoder outputs of sample prompts on the CPU, so that sampling can skip the text encoders if
+    none of the prompts changed.
+
+    Entries are keyed by the prompt and all settings that change the text encoder output. Every entry also belongs to
+    a weights version. If the version changes, because text encoders or embeddings are trained or the ema weights
+    are swapped in, all entries are dropped. If a persistent path is set, entries of version 0 (untrained text encoders) are written to that file,
+    and are loaded again in the next run, as long as the model identity did not change.
+    """
+
+    enabled: bool
+
+    def __init__(self):
+        self.enabled = True
+
+        self.__entries: dict[str, tuple[Tensor | None, ...]] = {}
+        self.__version: int | tuple[int, int] = 0
+
+        self.__persistent_path = None
+        self.__model_identity = None
+        self.__dirty = False
+
+    @staticmethod
+    def __key_string(key: tuple) -> str:
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def set_persistent_path(self, path: str | None, model_identity: str = ""):
+        self.__persistent_path = path
+        self.__model_identity = model_identity
+
+        if path is not None and os.path.isfile(path):
+            self.__load()
+
+    def get(self, key: tuple, version: int | tuple[int, int]) -> tuple[Tensor | None, ...] | None:
+        if not self.enabled:
+            return None
+
+        self.__set_version(version)
+        return self.__entries.get(self.__key_string(key))
+
+    def put(self, key: tuple, version: int | tuple[int, int], outputs: tuple[Tensor | None, ...]):
+        if not self.enabled:
+            return
+
+        self.__set_version(version)
+        self.__entries[self.__key_string(key)] = tuple(
+            output.detach().to(device="cpu") if output is not None else None for output in outputs
+        )
+        self.__dirty = True
+
+    def clear(self):
+        self.__entries.clear()
+        self.__dirty = False
+
+    def __set_version(self, version: int | tuple[int, int]):
+        if version != self.__version:
+            self.clear()
+            self.__version = version
+
+    def save(self):
+        if self.__persistent_path is None or not self.__dirty or self.__version != 0:
+            return
+
+        tensors = {}
+        structure = {}
+        for key, outputs in self.__entries.items():
+            structure[key] = [output is not None for output in outputs]
+            for i, output in enumerate(outputs):
+                if output is not None:
+                    tensors[f"{key}.{i}"] = output.contiguous()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.__persistent_path)), exist_ok=True)
+        partial_path = self.__persistent_path + ".partial"
+        save_file(tensors, partial_path, {
+            "model_identity": self.__model_identity,
+            "structure": json.dumps(structure),
+        })
+        os.replace(partial_path, self.__persistent_path)
+        self.__dirty = False
+
+    def __load(self):
+        try:
+            with safe_open(self.__persistent_path, framework="pt") as f:
+                metadata = f.metadata() or {}
+                if metadata.get("model_identity") != self.__model_identity:
+                    return
+
+                structure = json.loads(metadata["structure"])
+                for key, present in structure.items():
+                    self.__entries[key] = tuple(
+                        f.get_tensor(f"{key}.{i}") if is_present else None
+                        for i, is_present in enumerate(present)
+                    )
+        except Exception:
+            # the cache is only an optimization, a broken file is ignored and overwritten later
+            self.__entries.clear()
+            print(f"Could not load the prompt embedding cache {self.__persistent_path}")
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -0,0 +1,52 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+
+
+class BenchmarkEmbeddingLookupArgs(BaseArgs):
+    device: str
+    vocab_size: int
+    embedding_dim: int
+    additional_tokens: int
+    batch_size: int
+    sequence_length: int
+    iterations: int
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super().__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'BenchmarkEmbeddingLookupArgs':
+        parser = argparse.ArgumentParser(description="One Trainer Embedding Lookup Benchmark Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--device", type=str, required=False, default="cuda", dest="device", help="The device to run the lookups on")
+        parser.add_argument("--vocab-size", type=int, required=False, default=32128, dest="vocab_size", help="The number of tokens of the original embedding matrix")
+        parser.add_argument("--embedding-dim", type=int, required=False, default=4096, dest="embedding_dim", help="The size of a single embedding vector")
+        parser.add_argument("--additional-tokens", type=int, required=False, default=8, dest="additional_tokens", help="The number of trained additional embedding tokens")
+        parser.add_argument("--batch-size", type=int, required=False, default=4, dest="batch_size", help="The number of prompts per lookup")
+        parser.add_argument("--sequence-length", type=int, required=False, default=512, dest="sequence_length", help="The number of tokens per prompt")
+        parser.add_argument("--iterations", type=int, required=False, default=50, dest="iterations", help="The number of forward and backward passes")
+
+        # @formatter:on
+
+        args = BenchmarkEmbeddingLookupArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values() -> 'BenchmarkEmbeddingLookupArgs':
+        data = []
+
+        # name, default value, data type, nullable
+        data.append(("device", "cuda", str, False))
+        data.append(("vocab_size", 32128, int, False))
+        data.append(("embedding_dim", 4096, int, False))
+        data.append(("additional_tokens", 8, int, False))
+        data.append(("batch_size", 4, int, False))
+        data.append(("sequence_length", 512, int, False))
+        data.append(("iterations", 50, int, False))
+
+        return BenchmarkEmbeddingLookupArgs(data)
@@ -0,0 +1,53 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+from modules.util.enum.DataType import DataType
+
+
+class BenchmarkFp8ScalingArgs(BaseArgs):
+    device: str
+    in_features: int
+    out_features: int
+    block_size: int
+    tokens: int
+    dtype: DataType
+    iterations: int
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super().__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'BenchmarkFp8ScalingArgs':
+        parser = argparse.ArgumentParser(description="One Trainer Float8 Scaling Benchmark Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--device", type=str, required=False, default="cuda", dest="device", help="The device to run the layers on")
+        parser.add_argument("--in-features", type=int, required=False, default=3072, dest="in_features", help="The number of input features of the layer")
+        parser.add_argument("--out-features", type=int, required=False, default=12288, dest="out_features", help="The number of output features of the layer")
+        parser.add_argument("--block-size", type=int, required=False, default=128, dest="block_size", help="The block size of the block scale mode")
+        parser.add_argument("--tokens", type=int, required=False, default=4096, dest="tokens", help="The number of input tokens of a forward pass")
+        parser.add_argument("--dtype", type=DataType, required=False, default=DataType.BFLOAT_16, dest="dtype", help="The compute data type", choices=list(DataType))
+        parser.add_argument("--iterations", type=int, required=False, default=20, dest="iterations", help="The number of forward passes")
+
+        # @formatter:on
+
+        args = BenchmarkFp8ScalingArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values() -> 'BenchmarkFp8ScalingArgs':
+        data = []
+
+        # name, default value, data type, nullable
+        data.append(("device", "cuda", str, False))
+        data.append(("in_features", 3072, int, False))
+        data.append(("out_features", 12288, int, False))
+        data.append(("block_size", 128, int, False))
+        data.append(("tokens", 4096, int, False))
+        data.append(("dtype", DataType.BFLOAT_16, DataType, False))
+        data.append(("iterations", 20, int, False))
+
+        return BenchmarkFp8ScalingArgs(data)
@@ -0,0 +1,44 @@
+import argparse
+from typing import Any
+
+from modules.util.args.BaseArgs import BaseArgs
+from modules.util.enum.DataType import DataType
+
+
+class BenchmarkModelLoadingArgs(BaseArgs):
+    num_layers: int
+    hidden_size: int
+    dtype: DataType
+    max_shard_size: str
+
+    def __init__(self, data: list[(str, Any, type, bool)]):
+        super().__init__(data)
+
+    @staticmethod
+    def parse_args() -> 'BenchmarkModelLoadingArgs':
+        parser = argparse.ArgumentParser(description="One Trainer Model Loading Benchmark Script.")
+
+        # @formatter:off
+
+        parser.add_argument("--num-layers", type=int, required=False, default=12, dest="num_layers", help="The number of layers of the synthetic text encoder")
+        parser.add_argument("--hidden-size", type=int, required=False, default=2048, dest="hidden_size", help="The hidden size of the synthetic text encoder")
+        parser.add_argument("--dtype", type=DataType, required=False, default=DataType.BFLOAT_16, dest="dtype", help="The data type the float32 checkpoint is loaded in", choices=list(DataType))
+        parser.add_argument("--max-shard-size", type=str, required=False, default="500MB", dest="max_shard_size", help="The maximum size of a single safetensors shard of the checkpoint")
+
+        # @formatter:on
+
+        args = BenchmarkModelLoadingArgs.default_values()
+        args.from_dict(vars(parser.parse_args()))
+        return args
+
+    @staticmethod
+    def default_values() -> 'BenchmarkModelLoadingArgs':
+        data = []
+
+        # name, default value, data type, nullable
+        data.append(("num_layers", 12, int, False))
+        data.append(("hidden_size", 2048, int, False))
+        data.append(("dtype", DataType.BFLOAT_16, DataType, False))
+        data.append(("max_shard_size", "500MB", str, False))
+
+        return BenchmarkModelLoadingArgs(data)
@@ -7,6 +7,8 @@ from modules.util.args.BaseArgs import BaseArgs
 class CalculateLossArgs(BaseArgs):
     config_path: str
     output_path: str
+    batch_size: int
+    timesteps: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super().__init__(data)
@@ -19,6 +21,8 @@ class CalculateLossArgs(BaseArgs):
 
         parser.add_argument("--config-path", type=str, required=True, dest="config_path", help="The path to the config file")
         parser.add_argument("--output-path", type=str, required=True, dest="output_path", help="The path to the output file")
+        parser.add_argument("--batch-size", type=int, required=False, default=None, dest="batch_size", help="The batch size. Defaults to the batch size of the config")
+        parser.add_argument("--timesteps", type=int, required=False, default=1, dest="timesteps", help="The number of random timesteps the loss of each sample is averaged over. 1 uses a fixed timestep")
 
         # @formatter:on
 
@@ -33,5 +37,7 @@ class CalculateLossArgs(BaseArgs):
         # name, default value, data type, nullable
         data.append(("config_path", None, str, True))
         data.append(("output_path", "losses.json", str, False))
+        data.append(("batch_size", None, int, True))
+        data.append(("timesteps", 1, int, False))
 
         return CalculateLossArgs(data)
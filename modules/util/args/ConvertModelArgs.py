@@ -3,6 +3,7 @@ from typing import Any
 
 from modules.util.args.BaseArgs import BaseArgs
 from modules.util.enum.DataType import DataType
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.TrainingMethod import TrainingMethod
@@ -17,6 +18,8 @@ class ConvertModelArgs(BaseArgs):
     output_dtype: DataType
     output_model_format: ModelFormat
     output_model_destination: str
+    fp8_scale_mode: Fp8ScaleMode
+    fp8_block_size: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super().__init__(data)
@@ -43,6 +46,8 @@ class ConvertModelArgs(BaseArgs):
         parser.add_argument("--output-dtype", type=DataType, required=False, default=DataType.FLOAT_16, dest="output_dtype", help="The data type to save the output model", choices=list(DataType))
         parser.add_argument("--output-model-format", type=ModelFormat, required=False, default=ModelFormat.SAFETENSORS, dest="output_model_format", help="The format to save the final output model", choices=list(ModelFormat))
         parser.add_argument("--output-model-destination", type=str, required=True, dest="output_model_destination", help="The destination to save the final output model")
+        parser.add_argument("--fp8-scale-mode", type=Fp8ScaleMode, required=False, default=Fp8ScaleMode.TENSOR, dest="fp8_scale_mode", help="The granularity of the scales of float8 weights", choices=list(Fp8ScaleMode))
+        parser.add_argument("--fp8-block-size", type=int, required=False, default=128, dest="fp8_block_size", help="The block size of float8 weights with the block scale mode")
 
         # @formatter:on
 
@@ -60,5 +65,7 @@ class ConvertModelArgs(BaseArgs):
         data.append(("output_dtype", DataType.FLOAT_16, DataType, False))
         data.append(("output_model_format", ModelFormat.SAFETENSORS, ModelFormat, False))
         data.append(("output_model_destination", "", str, False))
+        data.append(("fp8_scale_mode", Fp8ScaleMode.TENSOR, Fp8ScaleMode, False))
+        data.append(("fp8_block_size", 128, int, False))
 
         return ConvertModelArgs(data)
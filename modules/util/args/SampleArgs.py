@@ -3,6 +3,7 @@ from typing import Any
 
 from modules.util.args.BaseArgs import BaseArgs
 from modules.util.enum.DataType import DataType
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 from modules.util.enum.ModelType import ModelType
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ModelNames import EmbeddingName, ModelNames
@@ -23,6 +24,8 @@ class SampleArgs(BaseArgs):
     sample_inpainting: bool
     base_image_path:str
     mask_image_path:str
+    fp8_scale_mode: Fp8ScaleMode
+    fp8_block_size: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super().__init__(data)
@@ -56,6 +59,8 @@ class SampleArgs(BaseArgs):
         parser.add_argument("--sample-inpainting", action="store_true", required=False, default=False, dest="sample_inpainting", help="Enables inpainting sampling. Only available when sampling from an inpainting model.")
         parser.add_argument("--base-image-path", type=str, required=False, default="", dest="base_image_path", help="The base image used when inpainting")
         parser.add_argument("--mask-image-path", type=str, required=False, default="", dest="mask_image_path", help="The mask used when inpainting.")
+        parser.add_argument("--fp8-scale-mode", type=Fp8ScaleMode, required=False, default=Fp8ScaleMode.TENSOR, dest="fp8_scale_mode", help="The granularity of the scales of float8 weights", choices=list(Fp8ScaleMode))
+        parser.add_argument("--fp8-block-size", type=int, required=False, default=128, dest="fp8_block_size", help="The block size of float8 weights with the block scale mode")
 
         # @formatter:on
 
@@ -81,5 +86,7 @@ class SampleArgs(BaseArgs):
         data.append(("sample_inpainting", False, bool, False))
         data.append(("base_image_path", "", str, False))
         data.append(("mask_image_path", "", str, False))
+        data.append(("fp8_scale_mode", Fp8ScaleMode.TENSOR, Fp8ScaleMode, False))
+        data.append(("fp8_block_size", 128, int, False))
 
         return SampleArgs(data)
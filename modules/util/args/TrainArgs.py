@@ -19,8 +19,8 @@ class TrainArgs(BaseArgs):
 
         parser.add_argument("--config-path", type=str, required=True, dest="config_path", help="The path to the config file")
         parser.add_argument("--secrets-path", type=str, required=False, dest="secrets_path", help="The path to the secrets file")
-        parser.add_argument("--callback-path", type=str, required=False, dest="callback_path", help="The path to the callback pickle file")
-        parser.add_argument("--command-path", type=str, required=False, dest="command_path", help="The path to the command pickle file")
+        parser.add_argument("--callback-path", type=str, required=False, dest="callback_path", help="The path to the callback stream file")
+        parser.add_argument("--command-path", type=str, required=False, dest="command_path", help="The path to the command stream file")
 
         # @formatter:on
 
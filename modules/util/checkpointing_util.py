@@ -2,6 +2,7 @@ import inspect
 from collections.abc import Callable
 from typing import Any
 
+from modules.util.CheckpointingPolicy import CheckpointingPolicy
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.LayerOffloadConductor import LayerOffloadConductor
 from modules.util.torch_util import add_dummy_grad_fn_, has_grad_fn
@@ -66,6 +67,7 @@ def create_checkpointed_forward(
         include_from_offload_param_names: list[str] = None,
         conductor: LayerOffloadConductor | None = None,
         layer_index: int = 0,
+        policy: CheckpointingPolicy | None = None,
 ) -> Callable:
     orig_forward = orig_module.forward
     if include_from_offload_param_names is None:
@@ -143,11 +145,19 @@ def create_checkpointed_forward(
                 **kwargs,
             )
 
+        bound_policy = policy
+        bound_block_index = policy.add_block() if policy is not None else 0
+
         def forward(
                 *args,
                 **kwargs
         ):
             if torch.is_grad_enabled():
+                if bound_policy is not None:
+                    bound_policy.before_block(bound_block_index, orig_module, orig_forward, args, kwargs)
+                    if not bound_policy.is_checkpointed(bound_block_index):
+                        return orig_forward(*args, **kwargs)
+
                 dummy = torch.zeros((1,), device=train_device)
                 dummy.requires_grad_(True)
 
@@ -170,6 +180,7 @@ def enable_checkpointing_for_basic_transformer_blocks(
         offload_enabled: bool,
 ) -> LayerOffloadConductor:
     conductor = LayerOffloadConductor(orig_module, config)
+    policy = CheckpointingPolicy.from_config(type(orig_module).__name__, config)
 
     layer_index = 0
     for child_module in orig_module.modules():
@@ -179,13 +190,19 @@ def enable_checkpointing_for_basic_transformer_blocks(
                     child_module, torch.device(config.train_device),
                     [],
                     conductor, layer_index,
+                    policy,
                 )
             else:
                 child_module.forward = create_checkpointed_forward(
                     child_module, torch.device(config.train_device),
                     [],
+                    policy=policy,
                 )
             layer_index += 1
+        elif policy is not None and getattr(child_module, "gradient_checkpointing", False) \
+                and isinstance(getattr(child_module, "transformer_blocks", None), nn.ModuleList):
+            # the built-in checkpointing of the parent would recompute the blocks the policy doesn't checkpoint
+            child_module.gradient_checkpointing = False
 
     return conductor
 
@@ -297,6 +314,7 @@ def enable_checkpointing_for_stable_diffusion_3_transformer(
         config: TrainConfig,
 ) -> LayerOffloadConductor:
     conductor = LayerOffloadConductor(orig_module, config)
+    policy = CheckpointingPolicy.from_config(type(orig_module).__name__, config)
 
     layer_index = 0
     for child_module in orig_module.modules():
@@ -305,6 +323,7 @@ def enable_checkpointing_for_stable_diffusion_3_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states", "encoder_hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -316,6 +335,7 @@ def enable_checkpointing_for_flux_transformer(
         config: TrainConfig,
 ) -> LayerOffloadConductor:
     conductor = LayerOffloadConductor(orig_module, config)
+    policy = CheckpointingPolicy.from_config(type(orig_module).__name__, config)
 
     layer_index = 0
     for child_module in orig_module.modules():
@@ -324,6 +344,7 @@ def enable_checkpointing_for_flux_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states", "encoder_hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -333,6 +354,7 @@ def enable_checkpointing_for_flux_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -343,6 +365,7 @@ def enable_checkpointing_for_sana_transformer(
         config: TrainConfig,
 ) -> LayerOffloadConductor:
     conductor = LayerOffloadConductor(orig_module, config)
+    policy = CheckpointingPolicy.from_config(type(orig_module).__name__, config)
 
     layer_index = 0
     for child_module in orig_module.modules():
@@ -351,6 +374,7 @@ def enable_checkpointing_for_sana_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -361,6 +385,7 @@ def enable_checkpointing_for_hunyuan_video_transformer(
         config: TrainConfig,
 ) -> LayerOffloadConductor:
     conductor = LayerOffloadConductor(orig_module, config)
+    policy = CheckpointingPolicy.from_config(type(orig_module).__name__, config)
 
     layer_index = 0
     for child_module in orig_module.modules():
@@ -369,6 +394,7 @@ def enable_checkpointing_for_hunyuan_video_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -378,6 +404,7 @@ def enable_checkpointing_for_hunyuan_video_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states", "encoder_hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -387,6 +414,7 @@ def enable_checkpointing_for_hunyuan_video_transformer(
                 child_module, torch.device(config.train_device),
                 ["hidden_states"],
                 conductor, layer_index,
+                policy,
             )
             layer_index += 1
 
@@ -34,6 +34,12 @@ class CloudConfig(BaseConfig):
     enabled: bool
     type: CloudType
     file_sync : CloudFileSync
+    sync_streams: int
+    sync_resume_size: int
+    transfer_chunk_size: int
+    transfer_workers: int
+    transfer_compression: bool
+    transfer_cache_dir: str
     create : bool
     name: str
     tensorboard_tunnel: bool
@@ -70,6 +76,12 @@ class CloudConfig(BaseConfig):
         data.append(("enabled", False, bool, False))
         data.append(("type", CloudType.RUNPOD, CloudType, False))
         data.append(("file_sync", CloudFileSync.NATIVE_SCP, CloudFileSync, False))
+        data.append(("sync_streams", 4, int, False))
+        data.append(("sync_resume_size", 64, int, False))
+        data.append(("transfer_chunk_size", 16, int, False))
+        data.append(("transfer_workers", 4, int, False))
+        data.append(("transfer_compression", True, bool, False))
+        data.append(("transfer_cache_dir", "workspace-cache/chunks", str, False))
         data.append(("create", True, bool, False))
         data.append(("name", "OneTrainer", str, False))
         data.append(("tensorboard_tunnel", True, bool, False))
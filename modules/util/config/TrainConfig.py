@@ -14,6 +14,7 @@ from modules.util.enum.CompilationMode import CompilationMode
 from modules.util.enum.ConfigPart import ConfigPart
 from modules.util.enum.DataType import DataType
 from modules.util.enum.EMAMode import EMAMode
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 from modules.util.enum.GradientCheckpointingMethod import GradientCheckpointingMethod
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.LearningRateScaler import LearningRateScaler
@@ -263,7 +264,24 @@ class TrainConfig(BaseConfig):
     enable_async_offloading: bool
     enable_activation_offloading: bool
     layer_offload_fraction: float
+    layer_offload_auto_plan: bool
+    layer_offload_vram_budget: float
+    layer_offload_disk_cache_dir: str
+    layer_offload_host_budget: float
+    layer_offload_trace: bool
+    optimizer_offload: bool
+    optimizer_offload_threads: int
+    checkpointing_every_n_blocks: int
+    checkpointing_activation_budget: float
+    dequantized_weight_cache_size: float
+    distributed_devices: str
+    distributed_bucket_size: int
+    distributed_port: int
     force_circular_padding: bool
+    fp8_scale_mode: Fp8ScaleMode
+    fp8_block_size: int
+    quantization_cache: bool
+    quantization_cache_dir: str
 
     # compilation settings
     compilation_mode: CompilationMode
@@ -276,6 +294,10 @@ class TrainConfig(BaseConfig):
     concepts: list[ConceptConfig]
     aspect_ratio_bucketing: bool
     latent_caching: bool
+    caching_batch_size: int
+    latent_store: bool
+    latent_store_dir: str
+    latent_store_size: float
     clear_cache_before_training: bool
 
     # training settings
@@ -401,6 +423,11 @@ class TrainConfig(BaseConfig):
     sample_image_format: ImageFormat
     sample_video_format: VideoFormat
     sample_audio_format: AudioFormat
+    sample_batch_size: int
+    sample_prompt_cache: bool
+    sample_prompt_cache_persistent: bool
+    background_sampling: bool
+    background_sampling_device: str
     samples_to_tensorboard: bool
     non_ema_sampling: bool
 
@@ -413,6 +440,8 @@ class TrainConfig(BaseConfig):
     rolling_backup: bool
     rolling_backup_count: int
     backup_before_save: bool
+    async_backup: bool
+    incremental_backup: bool
     save_every: int
     save_every_unit: TimeUnit
     save_skip_first: int
@@ -669,7 +698,7 @@ class TrainConfig(BaseConfig):
         if os.path.exists(backups_path):
             backup_paths = sorted(
                 [path for path in os.listdir(backups_path) if
-                 os.path.isdir(os.path.join(backups_path, path))],
+                 os.path.isdir(os.path.join(backups_path, path)) and not path.startswith('.')],
                 reverse=True,
             )
 
@@ -750,7 +779,24 @@ class TrainConfig(BaseConfig):
         data.append(("enable_async_offloading", True, bool, False))
         data.append(("enable_activation_offloading", True, bool, False))
         data.append(("layer_offload_fraction", 0.0, float, False))
+        data.append(("layer_offload_auto_plan", False, bool, False))
+        data.append(("layer_offload_vram_budget", 0.0, float, False))
+        data.append(("layer_offload_disk_cache_dir", "", str, False))
+        data.append(("layer_offload_host_budget", 0.0, float, False))
+        data.append(("layer_offload_trace", False, bool, False))
+        data.append(("optimizer_offload", False, bool, False))
+        data.append(("optimizer_offload_threads", 4, int, False))
+        data.append(("checkpointing_every_n_blocks", 1, int, False))
+        data.append(("checkpointing_activation_budget", 0.0, float, False))
+        data.append(("dequantized_weight_cache_size", 0.0, float, False))
+        data.append(("distributed_devices", "", str, False))
+        data.append(("distributed_bucket_size", 25, int, False))
+        data.append(("distributed_port", 29500, int, False))
         data.append(("force_circular_padding", False, bool, False))
+        data.append(("fp8_scale_mode", Fp8ScaleMode.TENSOR, Fp8ScaleMode, False))
+        data.append(("fp8_block_size", 128, int, False))
+        data.append(("quantization_cache", False, bool, False))
+        data.append(("quantization_cache_dir", "workspace-cache/quantization", str, False))
 
         # compilation settings
         data.append(("compilation_mode", CompilationMode.NONE, CompilationMode, False))
@@ -763,6 +809,10 @@ class TrainConfig(BaseConfig):
         data.append(("concepts", None, list[ConceptConfig], True))
         data.append(("aspect_ratio_bucketing", True, bool, False))
         data.append(("latent_caching", True, bool, False))
+        data.append(("caching_batch_size", 1, int, False))
+        data.append(("latent_store", False, bool, False))
+        data.append(("latent_store_dir", "workspace-cache/latents", str, False))
+        data.append(("latent_store_size", 50.0, float, False))
         data.append(("clear_cache_before_training", True, bool, False))
 
         # training settings
@@ -930,6 +980,11 @@ class TrainConfig(BaseConfig):
         data.append(("sample_image_format", ImageFormat.JPG, ImageFormat, False))
         data.append(("sample_video_format", VideoFormat.MP4, VideoFormat, False))
         data.append(("sample_audio_format", AudioFormat.MP3, AudioFormat, False))
+        data.append(("sample_batch_size", 1, int, False))
+        data.append(("sample_prompt_cache", True, bool, False))
+        data.append(("sample_prompt_cache_persistent", False, bool, False))
+        data.append(("background_sampling", False, bool, False))
+        data.append(("background_sampling_device", "cuda:1", str, False))
         data.append(("samples_to_tensorboard", True, bool, False))
         data.append(("non_ema_sampling", True, bool, False))
 
@@ -939,6 +994,8 @@ class TrainConfig(BaseConfig):
         data.append(("rolling_backup", False, bool, False))
         data.append(("rolling_backup_count", 3, int, False))
         data.append(("backup_before_save", True, bool, False))
+        data.append(("async_backup", False, bool, False))
+        data.append(("incremental_backup", False, bool, False))
         data.append(("save_every", 0, int, False))
         data.append(("save_every_unit", TimeUnit.NEVER, TimeUnit, False))
         data.append(("save_skip_first", 0, int, False))
@@ -1,3 +1,5 @@
+import bisect
+
 from modules.util.DiffusionScheduleCoefficients import DiffusionScheduleCoefficients
 
 import torch
@@ -24,23 +26,94 @@ def map_wb(in_states: dict[str, Tensor], out_prefix: str, in_prefix: str) -> dic
     return out_states
 
 
+class IndexedStateDict(dict):
+    """
+    A state dict that keeps a sorted index of its keys, so prefix lookups don't need to scan every key.
+    The index is built on the first lookup, and rebuilt after the keys have changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__sorted_keys = None
+
+    def keys_with_prefix(self, prefix: str) -> list[str]:
+        if self.__sorted_keys is None:
+            self.__sorted_keys = sorted(self.keys())
+        start = bisect.bisect_left(self.__sorted_keys, prefix)
+        end = start
+        while end < len(self.__sorted_keys) and self.__sorted_keys[end].startswith(prefix):
+            end += 1
+        return self.__sorted_keys[start:end]
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.__sorted_keys = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.__sorted_keys = None
+        super().__delitem__(key)
+
+    def __ior__(self, other):
+        self.__sorted_keys = None
+        return super().__ior__(other)
+
+    def pop(self, *args):
+        self.__sorted_keys = None
+        return super().pop(*args)
+
+    def popitem(self):
+        self.__sorted_keys = None
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.__sorted_keys = None
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.__sorted_keys = None
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self.__sorted_keys = None
+        super().clear()
+
+
+def indexed(in_states: dict[str, Tensor] | None) -> IndexedStateDict | None:
+    """
+    Wraps the input state dict of a converter, so its prefix lookups don't scan every key. The tensors are not copied,
+    and keys popped by the converter are only removed from the wrapper.
+    """
+    if in_states is None or isinstance(in_states, IndexedStateDict):
+        return in_states
+    return IndexedStateDict(in_states)
+
+
+def keys_with_prefix(in_states: dict[str, Tensor], prefix: str) -> list[str]:
+    if isinstance(in_states, IndexedStateDict):
+        return in_states.keys_with_prefix(prefix)
+    return [key for key in in_states if key.startswith(prefix)]
+
+
+def has_prefix(in_states: dict[str, Tensor], prefix: str) -> bool:
+    if isinstance(in_states, IndexedStateDict):
+        return len(in_states.keys_with_prefix(prefix)) > 0
+    return any(key.startswith(prefix) for key in in_states)
+
+
 def map_prefix(in_states: dict[str, Tensor], out_prefix: str, in_prefix: str) -> dict[str, Tensor]:
     out_states = {}
 
-    for key in in_states:
-        if key.startswith(in_prefix):
-            out_key = out_prefix + key.removeprefix(in_prefix)
-            out_states[out_key] = in_states[key]
+    for key in keys_with_prefix(in_states, in_prefix):
+        out_key = out_prefix + key.removeprefix(in_prefix)
+        out_states[out_key] = in_states[key]
 
     return out_states
 
 
 def pop_prefix(in_states: dict[str, Tensor], in_prefix: str):
-    keys = list(in_states.keys())
-
-    for key in keys:
-        if key.startswith(in_prefix):
-            in_states.pop(key)
+    for key in keys_with_prefix(in_states, in_prefix):
+        in_states.pop(key)
 
 
 def map_noise_scheduler(noise_scheduler: DDIMScheduler) -> dict:
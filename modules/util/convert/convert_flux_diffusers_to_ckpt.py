@@ -94,14 +94,14 @@ def __map_transformer(in_states: dict, out_prefix: str, in_prefix: str) -> dict:
     out_states |= util.map_wb(in_states, util.combine(out_prefix, "img_in"), util.combine(in_prefix, "x_embedder"))
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"transformer_blocks.{i}")) for key in in_states):
-        is_last = not any(key.startswith(util.combine(in_prefix, f"transformer_blocks.{i+1}")) for key in in_states)
+    while util.has_prefix(in_states, util.combine(in_prefix, f"transformer_blocks.{i}")):
+        is_last = not util.has_prefix(in_states, util.combine(in_prefix, f"transformer_blocks.{i+1}"))
         out_states |= __map_double_transformer_block(in_states, util.combine(out_prefix, f"double_blocks.{i}"), util.combine(in_prefix, f"transformer_blocks.{i}"), is_last)
         i += 1
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"single_transformer_blocks.{i}")) for key in in_states):
-        is_last = not any(key.startswith(util.combine(in_prefix, f"single_transformer_blocks.{i+1}")) for key in in_states)
+    while util.has_prefix(in_states, util.combine(in_prefix, f"single_transformer_blocks.{i}")):
+        is_last = not util.has_prefix(in_states, util.combine(in_prefix, f"single_transformer_blocks.{i+1}"))
         out_states |= __map_single_transformer_block(in_states, util.combine(out_prefix, f"single_blocks.{i}"), util.combine(in_prefix, f"single_transformer_blocks.{i}"), is_last)
         i += 1
 
@@ -113,6 +113,6 @@ def convert_flux_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= __map_transformer(transformer_state_dict, "", "")
+    state_dict |= __map_transformer(util.indexed(transformer_state_dict), "", "")
 
     return state_dict
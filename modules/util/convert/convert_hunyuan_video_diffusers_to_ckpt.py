@@ -122,17 +122,17 @@ def __map_transformer(in_states: dict, out_prefix: str, in_prefix: str) -> dict:
     out_states |= util.map_wb(in_states, util.combine(out_prefix, "img_in.proj"), util.combine(in_prefix, "x_embedder.proj"))
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"context_embedder.token_refiner.refiner_blocks.{i}")) for key in in_states):
+    while util.has_prefix(in_states, util.combine(in_prefix, f"context_embedder.token_refiner.refiner_blocks.{i}")):
         out_states |= __map_token_refiner_block(in_states, util.combine(out_prefix, f"txt_in.individual_token_refiner.blocks.{i}"), util.combine(in_prefix, f"context_embedder.token_refiner.refiner_blocks.{i}"))
         i += 1
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"transformer_blocks.{i}")) for key in in_states):
+    while util.has_prefix(in_states, util.combine(in_prefix, f"transformer_blocks.{i}")):
         out_states |= __map_double_transformer_block(in_states, util.combine(out_prefix, f"double_blocks.{i}"), util.combine(in_prefix, f"transformer_blocks.{i}"))
         i += 1
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"single_transformer_blocks.{i}")) for key in in_states):
+    while util.has_prefix(in_states, util.combine(in_prefix, f"single_transformer_blocks.{i}")):
         out_states |= __map_single_transformer_block(in_states, util.combine(out_prefix, f"single_blocks.{i}"), util.combine(in_prefix, f"single_transformer_blocks.{i}"))
         i += 1
 
@@ -144,6 +144,6 @@ def convert_hunyuan_video_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= __map_transformer(transformer_state_dict, "model.model", "")
+    state_dict |= __map_transformer(util.indexed(transformer_state_dict), "model.model", "")
 
     return state_dict
@@ -105,6 +105,6 @@ def convert_pixart_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= __map_transformer(transformer_state_dict, "", "", model_type)
+    state_dict |= __map_transformer(util.indexed(transformer_state_dict), "", "", model_type)
 
     return state_dict
@@ -100,8 +100,8 @@ def __map_transformer(in_states: dict, out_prefix: str, in_prefix: str) -> dict:
     out_states |= util.map_wb(in_states, util.combine(out_prefix, "y_embedder.mlp.2"), util.combine(in_prefix, "time_text_embed.text_embedder.linear_2"))
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"transformer_blocks.{i}")) for key in in_states):
-        is_last = not any(key.startswith(util.combine(in_prefix, f"transformer_blocks.{i+1}")) for key in in_states)
+    while util.has_prefix(in_states, util.combine(in_prefix, f"transformer_blocks.{i}")):
+        is_last = not util.has_prefix(in_states, util.combine(in_prefix, f"transformer_blocks.{i+1}"))
         out_states |= __map_transformer_block(in_states, util.combine(out_prefix, f"joint_blocks.{i}"), util.combine(in_prefix, f"transformer_blocks.{i}"), is_last)
         i += 1
 
@@ -165,13 +165,13 @@ def convert_sd3_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= util.map_vae(vae_state_dict, "first_stage_model", "")
-    state_dict |= __map_transformer(transformer_state_dict, "model.diffusion_model", "")
+    state_dict |= util.map_vae(util.indexed(vae_state_dict), "first_stage_model", "")
+    state_dict |= __map_transformer(util.indexed(transformer_state_dict), "model.diffusion_model", "")
     if text_encoder_1_state_dict is not None:
-        state_dict |= __map_clip_text_encoder(text_encoder_1_state_dict, "text_encoders.clip_l.transformer", "")
+        state_dict |= __map_clip_text_encoder(util.indexed(text_encoder_1_state_dict), "text_encoders.clip_l.transformer", "")
     if text_encoder_2_state_dict is not None:
-        state_dict |= __map_clip_text_encoder(text_encoder_2_state_dict, "text_encoders.clip_g.transformer", "")
+        state_dict |= __map_clip_text_encoder(util.indexed(text_encoder_2_state_dict), "text_encoders.clip_g.transformer", "")
     if text_encoder_3_state_dict is not None:
-        state_dict |= __map_t5_text_encoder(text_encoder_3_state_dict, "text_encoders.t5xxl.transformer", "")
+        state_dict |= __map_t5_text_encoder(util.indexed(text_encoder_3_state_dict), "text_encoders.t5xxl.transformer", "")
 
     return state_dict
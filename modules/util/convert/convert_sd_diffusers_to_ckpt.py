@@ -153,9 +153,9 @@ def convert_sd_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= util.map_vae(vae_state_dict, "first_stage_model", "")
-    state_dict |= __map_unet(unet_state_dict, "model.diffusion_model", "")
-    state_dict |= __map_text_encoder(text_encoder_state_dict, "cond_stage_model", "text_model", model_type.is_sd_v2())
+    state_dict |= util.map_vae(util.indexed(vae_state_dict), "first_stage_model", "")
+    state_dict |= __map_unet(util.indexed(unet_state_dict), "model.diffusion_model", "")
+    state_dict |= __map_text_encoder(util.indexed(text_encoder_state_dict), "cond_stage_model", "text_model", model_type.is_sd_v2())
     state_dict |= util.map_noise_scheduler(noise_scheduler)
 
     return state_dict
@@ -153,10 +153,10 @@ def convert_sdxl_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= util.map_vae(vae_state_dict, "first_stage_model", "")
-    state_dict |= __map_unet(unet_state_dict, "model.diffusion_model", "")
-    state_dict |= __map_text_encoder_1(text_encoder_1_state_dict, "conditioner.embedders.0.transformer", "")
-    state_dict |= __map_text_encoder_2(text_encoder_2_state_dict, "conditioner.embedders.1", "text_model")
+    state_dict |= util.map_vae(util.indexed(vae_state_dict), "first_stage_model", "")
+    state_dict |= __map_unet(util.indexed(unet_state_dict), "model.diffusion_model", "")
+    state_dict |= __map_text_encoder_1(util.indexed(text_encoder_1_state_dict), "conditioner.embedders.0.transformer", "")
+    state_dict |= __map_text_encoder_2(util.indexed(text_encoder_2_state_dict), "conditioner.embedders.1", "text_model")
     state_dict |= util.map_noise_scheduler(noise_scheduler)
     state_dict |= __map_vpred(noise_scheduler)
 
@@ -7,7 +7,7 @@ def __map_unet_blocks(in_states: dict, out_prefix: str, in_prefix: str) -> dict:
     out_states = {}
 
     i = 0
-    while any(key.startswith(util.combine(in_prefix, f"{i}")) for key in in_states):
+    while util.has_prefix(in_states, util.combine(in_prefix, f"{i}")):
         if i % 3 == 0:
             # resblock
             out_states[util.combine(out_prefix, f"{i}.channelwise.0.weight")] = in_states[util.combine(in_prefix, f"{i}.channelwise.0.weight")]
@@ -75,6 +75,6 @@ def convert_stable_cascade_diffusers_to_ckpt(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= __map_prior(prior_state_dict, "", "")
+    state_dict |= __map_prior(util.indexed(prior_state_dict), "", "")
 
     return state_dict
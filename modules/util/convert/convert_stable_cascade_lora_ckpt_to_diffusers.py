@@ -5,7 +5,7 @@ def __map_unet_blocks(in_states: dict, out_prefix: str, in_prefix: str) -> dict:
     out_states = {}
 
     i = 2
-    while any(key.startswith(in_prefix + f"_{i}") for key in in_states):
+    while util.has_prefix(in_states, in_prefix + f"_{i}"):
         # attention block
         out_states |= util.map_prefix(in_states, out_prefix + f"_{i}_attention_to_q", in_prefix + f"_{i}_attention_attn_to_q")
         out_states |= util.map_prefix(in_states, out_prefix + f"_{i}_attention_to_k", in_prefix + f"_{i}_attention_attn_to_k")
@@ -36,6 +36,6 @@ def convert_stable_cascade_lora_ckpt_to_diffusers(
 ) -> dict:
     state_dict = {}
 
-    state_dict |= __map_prior(prior_state_dict, "", "")
+    state_dict |= __map_prior(util.indexed(prior_state_dict), "", "")
 
     return state_dict
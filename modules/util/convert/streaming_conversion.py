@@ -0,0 +1,534 @@
+"""
+Streaming conversion of safetensors models, without instantiating the model.
+
+Input files are memory mapped, and their tensors are only described by meta tensors created from the safetensors
+headers. A diffusers to checkpoint converter is traced once on these meta tensors, which records a conversion plan:
+for every output key, the input tensors and the operations (renames, concatenations, reshapes, ...) it is computed
+from. The plan is then executed one output tensor at a time. Each tensor is cast to the output dtype and written
+directly to the output file, so the peak memory usage is about the size of the largest tensor.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import struct
+from collections.abc import Callable
+
+from modules.modelLoader.stableDiffusion.StableDiffusionModelLoader import StableDiffusionModelLoader
+from modules.modelLoader.stableDiffusionXL.StableDiffusionXLModelLoader import StableDiffusionXLModelLoader
+from modules.modelSaver.mixin.DtypeModelSaverMixin import DtypeModelSaverMixin
+from modules.util import create
+from modules.util.convert.convert_diffusers_to_ckpt_util import IndexedStateDict
+from modules.util.convert.convert_flux_diffusers_to_ckpt import convert_flux_diffusers_to_ckpt
+from modules.util.convert.convert_hunyuan_video_diffusers_to_ckpt import convert_hunyuan_video_diffusers_to_ckpt
+from modules.util.convert.convert_pixart_diffusers_to_ckpt import convert_pixart_diffusers_to_ckpt
+from modules.util.convert.convert_sd3_diffusers_to_ckpt import convert_sd3_diffusers_to_ckpt
+from modules.util.convert.convert_sd_diffusers_to_ckpt import convert_sd_diffusers_to_ckpt
+from modules.util.convert.convert_sdxl_diffusers_to_ckpt import convert_sdxl_diffusers_to_ckpt
+from modules.util.enum.ModelFormat import ModelFormat
+from modules.util.enum.ModelType import ModelType
+from modules.util.enum.NoiseScheduler import NoiseScheduler
+
+import torch
+from torch import Tensor
+from torch.overrides import TorchFunctionMode
+
+from diffusers import DDIMScheduler
+
+import yaml
+from safetensors import safe_open
+from tqdm import tqdm
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+SAFETENSORS_DTYPE_NAMES = {dtype: name for name, dtype in SAFETENSORS_DTYPES.items()}
+
+DIFFUSERS_WEIGHT_FILE_NAMES = ["diffusion_pytorch_model.safetensors", "model.safetensors"]
+WEIGHT_FILE_EXTENSIONS = [".safetensors", ".bin", ".pt", ".pth", ".ckpt"]
+
+# keys that transformers removes from saved files if the weights are tied
+TIED_KEYS = {
+    "encoder.embed_tokens.weight": "shared.weight",
+}
+
+PLACEHOLDER_HASH = "0x" + "0" * 64
+
+
+class _Node:
+    pass
+
+
+class _Leaf(_Node):
+    def __init__(self, file_name: str, key: str):
+        self.file_name = file_name
+        self.key = key
+
+
+class _Constant(_Node):
+    def __init__(self, tensor: Tensor):
+        self.tensor = tensor
+
+
+class _Op(_Node):
+    def __init__(self, func: Callable, args: tuple, kwargs: dict):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _Item(_Node):
+    def __init__(self, parent: _Op, index: int):
+        self.parent = parent
+        self.index = index
+
+
+def _map_structure(value, fn: Callable):
+    if isinstance(value, list):
+        return [_map_structure(x, fn) for x in value]
+    elif type(value) is tuple:
+        return tuple(_map_structure(x, fn) for x in value)
+    elif isinstance(value, dict):
+        return {k: _map_structure(v, fn) for k, v in value.items()}
+    else:
+        return fn(value)
+
+
+class _ConversionTracer(TorchFunctionMode):
+    """
+    Records the operations that create each tensor, starting from the meta tensors of a SafetensorsSource.
+    """
+
+    def __init__(self, nodes: dict[int, _Node]):
+        super().__init__()
+        self.nodes = nodes
+        # keeps all traced tensors alive, so their ids stay unique
+        self.tensors = []
+
+    def __track(self, tensor: Tensor, node: _Node):
+        # functions that return their input (like contiguous) don't change the recorded plan
+        if id(tensor) not in self.nodes:
+            self.nodes[id(tensor)] = node
+            self.tensors.append(tensor)
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        result = func(*args, **kwargs)
+
+        tracked = False
+
+        def to_node(value):
+            nonlocal tracked
+            if isinstance(value, Tensor) and id(value) in self.nodes:
+                tracked = True
+                return self.nodes[id(value)]
+            return value
+
+        op = _Op(func, _map_structure(args, to_node), _map_structure(kwargs, to_node))
+
+        if isinstance(result, Tensor):
+            # tensors created on the meta device are replayed, other new tensors are constants
+            if tracked or result.is_meta:
+                self.__track(result, op)
+        elif isinstance(result, tuple | list) and tracked:
+            for i, value in enumerate(result):
+                if isinstance(value, Tensor):
+                    self.__track(value, _Item(op, i))
+
+        return result
+
+
+class SafetensorsSource:
+    """
+    A set of memory mapped safetensors files.
+    """
+
+    def __init__(self):
+        self.nodes: dict[int, _Node] = {}
+        self.__files = {}
+        self.__tensors = []
+
+    def __open(self, file_name: str):
+        if file_name not in self.__files:
+            self.__files[file_name] = safe_open(file_name, framework="pt", device="cpu")
+        return self.__files[file_name]
+
+    def metadata(self, file_name: str) -> dict[str, str]:
+        return self.__open(file_name).metadata() or {}
+
+    def meta_state_dict(self, file_names: list[str], add_tied_keys: bool = False) -> IndexedStateDict:
+        """
+        Returns a state dict of meta tensors for all tensors in the given files, without reading any tensor data.
+        If add_tied_keys is set, tied weights that were removed from the files are added back, like in state_dict().
+        """
+        state_dict = IndexedStateDict()
+        for file_name in file_names:
+            f = self.__open(file_name)
+            for key in f.keys():  # noqa: SIM118
+                tensor_slice = f.get_slice(key)
+                tensor = torch.empty(
+                    tensor_slice.get_shape(), dtype=SAFETENSORS_DTYPES[tensor_slice.get_dtype()], device="meta"
+                )
+                self.nodes[id(tensor)] = _Leaf(file_name, key)
+                self.__tensors.append(tensor)
+                state_dict[key] = tensor
+
+        if add_tied_keys:
+            for key, tied_key in TIED_KEYS.items():
+                if key not in state_dict and tied_key in state_dict:
+                    state_dict[key] = state_dict[tied_key]
+
+        return state_dict
+
+    def get_tensor(self, leaf: _Leaf) -> Tensor:
+        return self.__open(leaf.file_name).get_tensor(leaf.key)
+
+    def close(self):
+        self.__files.clear()
+
+
+class ConversionPlan:
+    """
+    Maps every output key to the node it is computed from, together with its shape and dtype before casting.
+    """
+
+    def __init__(self, source: SafetensorsSource, entries: dict[str, tuple[_Node, torch.Size, torch.dtype]]):
+        self.source = source
+        self.entries = entries
+
+    @staticmethod
+    def identity(source: SafetensorsSource, file_names: list[str]) -> 'ConversionPlan':
+        state_dict = source.meta_state_dict(file_names)
+        return ConversionPlan.__from_state_dict(source, state_dict)
+
+    @staticmethod
+    def trace(source: SafetensorsSource, convert: Callable[..., dict], *args) -> 'ConversionPlan':
+        """
+        Traces the converter on meta state dicts created by source. Any other arguments are passed through.
+        """
+        tracer = _ConversionTracer(source.nodes)
+        with tracer:
+            state_dict = convert(*args)
+        return ConversionPlan.__from_state_dict(source, state_dict)
+
+    @staticmethod
+    def __from_state_dict(source: SafetensorsSource, state_dict: dict[str, Tensor]) -> 'ConversionPlan':
+        entries = {}
+        for key, tensor in state_dict.items():
+            node = source.nodes.get(id(tensor))
+            if node is None:
+                if tensor.is_meta:
+                    raise RuntimeError(f"could not trace the conversion of {key}")
+                node = _Constant(tensor)
+            entries[key] = (node, tensor.shape, tensor.dtype)
+        return ConversionPlan(source, entries)
+
+    @staticmethod
+    def __output_dtype(in_dtype: torch.dtype, dtype: torch.dtype | None) -> torch.dtype:
+        if dtype is not None and in_dtype.is_floating_point:
+            return dtype
+        return in_dtype
+
+    def output_size(self, dtype: torch.dtype | None) -> int:
+        size = 0
+        for _, shape, in_dtype in self.entries.values():
+            size += shape.numel() * self.__output_dtype(in_dtype, dtype).itemsize
+        return size
+
+    def __evaluate(self, node: _Node, cache: dict[int, Tensor]) -> Tensor:
+        if id(node) in cache:
+            return cache[id(node)]
+
+        if isinstance(node, _Leaf):
+            value = self.source.get_tensor(node)
+        elif isinstance(node, _Constant):
+            value = node.tensor
+        elif isinstance(node, _Item):
+            value = self.__evaluate(node.parent, cache)[node.index]
+        else:
+            def resolve(arg):
+                if isinstance(arg, _Node):
+                    return self.__evaluate(arg, cache)
+                if isinstance(arg, torch.device) and arg.type == "meta":
+                    return torch.device("cpu")
+                return arg
+
+            value = node.func(*_map_structure(node.args, resolve), **_map_structure(node.kwargs, resolve))
+
+        cache[id(node)] = value
+        return value
+
+    def tensor(self, key: str, dtype: torch.dtype | None) -> Tensor:
+        node, _, in_dtype = self.entries[key]
+        # the cache only lives for a single output tensor, intermediate results are not kept
+        tensor = self.__evaluate(node, {})
+        return tensor.to(dtype=self.__output_dtype(in_dtype, dtype)).contiguous()
+
+    def write(
+            self,
+            file_name: str,
+            dtype: torch.dtype | None,
+            metadata: dict[str, str] | None = None,
+            create_metadata: Callable[[str], dict[str, str]] | None = None,
+    ):
+        """
+        Writes the converted tensors to a safetensors file, one tensor at a time.
+
+        If create_metadata is set, it is called with the sha256 hash of all tensors in the format of the model spec.
+        The hash is only known after all tensors are written, so the header is written again at the end.
+        """
+        keys = sorted(self.entries.keys())
+
+        header = {}
+        offset = 0
+        for key in keys:
+            _, shape, in_dtype = self.entries[key]
+            out_dtype = self.__output_dtype(in_dtype, dtype)
+            size = shape.numel() * out_dtype.itemsize
+            header[key] = {
+                "dtype": SAFETENSORS_DTYPE_NAMES[out_dtype],
+                "shape": list(shape),
+                "data_offsets": [offset, offset + size],
+            }
+            offset += size
+
+        def encode_header(header_metadata: dict[str, str] | None, length: int | None = None) -> bytes:
+            data = ({"__metadata__": header_metadata} if header_metadata else {}) | header
+            encoded = json.dumps(data, separators=(",", ":")).encode()
+            if length is None:
+                length = (len(encoded) + 7) // 8 * 8
+            elif len(encoded) > length:
+                raise RuntimeError("safetensors header changed size")
+            return struct.pack("<Q", length) + encoded + b" " * (length - len(encoded))
+
+        if create_metadata is not None:
+            metadata = create_metadata(PLACEHOLDER_HASH)
+        encoded_header = encode_header(metadata)
+
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        sha256_hash = hashlib.sha256()
+        with open(file_name + ".partial", "wb") as f:
+            f.write(encoded_header)
+            for key in tqdm(keys, desc=os.path.basename(file_name)):
+                tensor = self.tensor(key, dtype)
+                data = tensor.reshape(-1).view(torch.uint8).numpy()
+                f.write(data)
+                sha256_hash.update(data)
+                del tensor, data
+
+            if create_metadata is not None:
+                metadata = create_metadata(f"0x{sha256_hash.hexdigest()}")
+                f.seek(0)
+                f.write(encode_header(metadata, len(encoded_header) - 8))
+
+        os.replace(file_name + ".partial", file_name)
+
+
+def _component_files(directory: str) -> list[str] | None:
+    """
+    Returns the safetensors files of a diffusers or transformers component, or None if there are none.
+    """
+    index_files = glob.glob(os.path.join(directory, "*.safetensors.index.json"))
+    if len(index_files) == 1:
+        with open(index_files[0], "r") as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(directory, file_name) for file_name in sorted(set(weight_map.values()))]
+
+    for file_name in DIFFUSERS_WEIGHT_FILE_NAMES:
+        if os.path.isfile(os.path.join(directory, file_name)):
+            return [os.path.join(directory, file_name)]
+
+    return None
+
+
+def _is_diffusers_directory(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "model_index.json"))
+
+
+def _load_noise_scheduler(input_name: str) -> DDIMScheduler:
+    noise_scheduler = DDIMScheduler.from_pretrained(
+        input_name,
+        subfolder="scheduler",
+    )
+    return create.create_noise_scheduler(
+        noise_scheduler=NoiseScheduler.DDIM,
+        original_noise_scheduler=noise_scheduler,
+    )
+
+
+def _trace_diffusers(source: SafetensorsSource, model_type: ModelType, input_name: str) -> ConversionPlan | None:
+    def component(name: str, required: bool = True) -> IndexedStateDict | None:
+        file_names = _component_files(os.path.join(input_name, name))
+        if file_names is None:
+            if required:
+                raise FileNotFoundError(f"no safetensors files found in {name}")
+            return None
+        return source.meta_state_dict(file_names, add_tied_keys=True)
+
+    if model_type.is_stable_diffusion():
+        return ConversionPlan.trace(
+            source, convert_sd_diffusers_to_ckpt,
+            model_type,
+            component("vae"),
+            component("unet"),
+            component("text_encoder"),
+            _load_noise_scheduler(input_name),
+        )
+    elif model_type.is_stable_diffusion_xl():
+        return ConversionPlan.trace(
+            source, convert_sdxl_diffusers_to_ckpt,
+            component("vae"),
+            component("unet"),
+            component("text_encoder"),
+            component("text_encoder_2"),
+            _load_noise_scheduler(input_name),
+        )
+    elif model_type.is_stable_diffusion_3():
+        return ConversionPlan.trace(
+            source, convert_sd3_diffusers_to_ckpt,
+            component("vae"),
+            component("transformer"),
+            component("text_encoder", required=False),
+            component("text_encoder_2", required=False),
+            component("text_encoder_3", required=False),
+        )
+    elif model_type.is_flux():
+        return ConversionPlan.trace(source, convert_flux_diffusers_to_ckpt, component("transformer"))
+    elif model_type.is_pixart():
+        return ConversionPlan.trace(source, convert_pixart_diffusers_to_ckpt, model_type, component("transformer"))
+    elif model_type.is_hunyuan_video():
+        return ConversionPlan.trace(source, convert_hunyuan_video_diffusers_to_ckpt, component("transformer"))
+    else:
+        return None
+
+
+def _write_sd_config(model_type: ModelType, input_name: str, destination: str):
+    if model_type.is_stable_diffusion():
+        sd_config = StableDiffusionModelLoader()._load_sd_config(model_type, input_name)
+    elif model_type.is_stable_diffusion_xl():
+        sd_config = StableDiffusionXLModelLoader()._load_sd_config(model_type, input_name)
+    else:
+        return
+
+    yaml_name = os.path.splitext(destination)[0] + '.yaml'
+    with open(yaml_name, 'w', encoding='utf8') as f:
+        yaml.dump(sd_config, f, default_flow_style=False, allow_unicode=True)
+
+
+def _convert_to_safetensors(
+        model_type: ModelType,
+        input_name: str,
+        destination: str,
+        dtype: torch.dtype | None,
+) -> bool:
+    source = SafetensorsSource()
+    try:
+        if os.path.isfile(input_name) and input_name.endswith(".safetensors"):
+            model_spec_file_name = input_name
+            plan = ConversionPlan.identity(source, [input_name])
+        elif _is_diffusers_directory(input_name):
+            model_spec_file_name = None
+            try:
+                plan = _trace_diffusers(source, model_type, input_name)
+            except (OSError, KeyError, RuntimeError) as e:
+                print(f"Streaming conversion is not possible ({e}), falling back to loading the model")
+                return False
+            if plan is None:
+                return False
+        else:
+            return False
+
+        model_loader = create.create_model_loader(model_type)
+        model_spec = model_loader._load_default_model_spec(model_type, model_spec_file_name)
+
+        plan.write(
+            destination,
+            dtype,
+            create_metadata=lambda hash_sha256: DtypeModelSaverMixin.create_safetensors_metadata(
+                model_type, model_spec, hash_sha256,
+            ),
+        )
+        _write_sd_config(model_type, input_name, destination)
+        return True
+    finally:
+        source.close()
+
+
+def _convert_to_diffusers(
+        input_name: str,
+        destination: str,
+        dtype: torch.dtype | None,
+) -> bool:
+    if not _is_diffusers_directory(input_name):
+        return False
+
+    # collect everything before writing, so nothing is written if a component can't be streamed
+    weight_files = set()
+    for directory, _, file_names in os.walk(input_name):
+        component_files = _component_files(directory)
+        if component_files is not None:
+            weight_files.update(component_files)
+        elif any(os.path.splitext(file_name)[1] in WEIGHT_FILE_EXTENSIONS for file_name in file_names):
+            return False
+
+    source = SafetensorsSource()
+    try:
+        for directory, _, file_names in os.walk(input_name):
+            out_directory = os.path.join(destination, os.path.relpath(directory, input_name))
+            os.makedirs(out_directory, exist_ok=True)
+
+            for file_name in file_names:
+                in_path = os.path.join(directory, file_name)
+                out_path = os.path.join(out_directory, file_name)
+                if in_path in weight_files:
+                    plan = ConversionPlan.identity(source, [in_path])
+                    plan.write(out_path, dtype, metadata=source.metadata(in_path))
+                elif file_name.endswith(".safetensors.index.json"):
+                    with open(in_path, "r") as f:
+                        index = json.load(f)
+                    index.setdefault("metadata", {})["total_size"] = sum(
+                        ConversionPlan.identity(source, [os.path.join(directory, weight_file_name)]).output_size(dtype)
+                        for weight_file_name in sorted(set(index["weight_map"].values()))
+                    )
+                    with open(out_path, "w") as f:
+                        json.dump(index, f, indent=2)
+                elif os.path.splitext(file_name)[1] not in WEIGHT_FILE_EXTENSIONS:
+                    # configs, tokenizers, ... other weight files are unused variants
+                    shutil.copy2(in_path, out_path)
+        return True
+    finally:
+        source.close()
+
+
+def convert_streaming(
+        model_type: ModelType,
+        input_name: str,
+        output_model_format: ModelFormat,
+        output_model_destination: str,
+        dtype: torch.dtype | None,
+) -> bool:
+    """
+    Converts a fine tuned model without loading it. Supported are single safetensors files to safetensors,
+    diffusers directories with safetensors weights to diffusers, and diffusers directories to safetensors for model
+    types with a diffusers to checkpoint converter.
+
+    Returns False if the conversion is not supported. In that case, nothing was written.
+    """
+    if output_model_format == ModelFormat.SAFETENSORS:
+        return _convert_to_safetensors(model_type, input_name, output_model_destination, dtype)
+    elif output_model_format == ModelFormat.DIFFUSERS:
+        return _convert_to_diffusers(input_name, output_model_destination, dtype)
+    else:
+        return False
@@ -120,6 +120,7 @@ from modules.util.NamedParameterGroup import NamedParameterGroupCollection
 from modules.util.optimizer.adafactor_extensions import patch_adafactor
 from modules.util.optimizer.adam_extensions import patch_adam
 from modules.util.optimizer.adamw_extensions import patch_adamw
+from modules.util.optimizer.optimizer_offload import patch_optimizer_offload
 from modules.util.TrainProgress import TrainProgress
 
 import torch
@@ -417,6 +418,13 @@ def create_optimizer(
                 and config.training_method == TrainingMethod.FINE_TUNE:
             raise RuntimeError('layer offloading can only be used for fine tuning when using an optimizer that supports "fused_back_pass"')
 
+    if config.optimizer_offload:
+        if not optimizer_config.optimizer.supports_fused_back_pass():
+            raise RuntimeError('optimizer offloading can only be used with an optimizer that supports "fused_back_pass"')
+        if config.gradient_checkpointing.offload() and config.layer_offload_fraction > 0:
+            # offloaded layers are moved while the updated weights are copied back
+            raise RuntimeError('optimizer offloading can not be combined with layer offloading')
+
     parameters = parameter_group_collection.parameters_for_optimizer(config)
 
     match config.optimizer.optimizer:
@@ -457,6 +465,9 @@ def create_optimizer(
                     and (optimizer_config.fused or optimizer_config.foreach):
                 raise RuntimeError('"fused_back_pass" is only allowed when "fused" and "foreach" are disabled')
 
+            if config.optimizer_offload and (optimizer_config.fused or optimizer_config.foreach):
+                raise RuntimeError('optimizer offloading is only allowed when "fused" and "foreach" are disabled')
+
             optimizer = torch.optim.Adam(
                 params=parameters,
                 lr=config.learning_rate,
@@ -472,7 +483,7 @@ def create_optimizer(
                 fused=optimizer_config.fused if optimizer_config.fused is not None else False,
             )
 
-            if optimizer_config.stochastic_rounding or optimizer_config.fused_back_pass:
+            if optimizer_config.stochastic_rounding or optimizer_config.fused_back_pass or config.optimizer_offload:
                 patch_adam(optimizer, optimizer_config.stochastic_rounding)
 
         # ADAMW Optimizer
@@ -485,6 +496,9 @@ def create_optimizer(
                     and (optimizer_config.fused or optimizer_config.foreach):
                 raise RuntimeError('"fused_back_pass" is only allowed when "fused" and "foreach" are disabled')
 
+            if config.optimizer_offload and (optimizer_config.fused or optimizer_config.foreach):
+                raise RuntimeError('optimizer offloading is only allowed when "fused" and "foreach" are disabled')
+
             optimizer = torch.optim.AdamW(
                 params=parameters,
                 lr=config.learning_rate,
@@ -500,7 +514,7 @@ def create_optimizer(
                 fused=optimizer_config.fused if optimizer_config.fused is not None else False,
             )
 
-            if optimizer_config.stochastic_rounding or optimizer_config.fused_back_pass:
+            if optimizer_config.stochastic_rounding or optimizer_config.fused_back_pass or config.optimizer_offload:
                 patch_adamw(optimizer, optimizer_config.stochastic_rounding)
 
         # ADAM_8BIT Optimizer
@@ -1019,6 +1033,9 @@ def create_optimizer(
 
         optimizer.load_state_dict(state_dict)
 
+    if config.optimizer_offload:
+        patch_optimizer_offload(optimizer, torch.device(config.train_device), config.optimizer_offload_threads)
+
     return optimizer
 
 
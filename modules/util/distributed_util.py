@@ -0,0 +1,145 @@
+import datetime
+import os
+from collections.abc import Iterator
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader, Sampler
+
+# Rank 0 caches the data set, samples and saves while the other ranks wait in the next collective operation.
+# These phases can take much longer than the default timeout of torch.distributed.
+PROCESS_GROUP_TIMEOUT = datetime.timedelta(hours=24)
+
+
+def parse_devices(devices: str) -> list[str]:
+    return [device.strip() for device in devices.split(",") if device.strip()]
+
+
+def worker_device(devices: str, train_device: str, local_rank: int) -> str:
+    device_list = parse_devices(devices)
+    if device_list:
+        return device_list[local_rank % len(device_list)]
+
+    device = torch.device(train_device)
+    if device.type == "cuda" and device.index is None:
+        return f"cuda:{local_rank}"
+    return train_device
+
+
+def is_enabled() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank() -> int:
+    return dist.get_rank() if is_enabled() else 0
+
+
+def world_size() -> int:
+    return dist.get_world_size() if is_enabled() else 1
+
+
+def is_main_process() -> bool:
+    return rank() == 0
+
+
+def is_launched_externally() -> bool:
+    # torchrun and similar launchers set these variables for every worker process
+    return "RANK" in os.environ and "WORLD_SIZE" in os.environ
+
+
+def init_process_group(device: torch.device, rank: int, world_size: int, port: int):
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", str(port))
+
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+        backend = "nccl"
+    else:
+        backend = "gloo"
+
+    dist.init_process_group(
+        backend=backend,
+        rank=rank,
+        world_size=world_size,
+        timeout=PROCESS_GROUP_TIMEOUT,
+    )
+
+
+def destroy_process_group():
+    if is_enabled():
+        dist.destroy_process_group()
+
+
+def barrier():
+    if is_enabled():
+        dist.barrier()
+
+
+def broadcast_parameters(parameters: list[torch.Tensor]):
+    # trainable weights like LoRA layers are initialized randomly, all ranks have to start from the same state
+    if is_enabled():
+        with torch.no_grad():
+            for parameter in parameters:
+                dist.broadcast(parameter.data, src=0)
+
+
+def all_reduce_mean(value: float, device: torch.device) -> float:
+    if not is_enabled():
+        return value
+
+    tensor = torch.tensor(value, dtype=torch.float64, device=device)
+    dist.all_reduce(tensor)
+    return tensor.item() / world_size()
+
+
+def shard_seed(seed: int) -> int:
+    # gives every rank different noise and timesteps, while keeping the seed of single process training unchanged
+    return seed * world_size() + rank()
+
+
+def shard_length(length: int) -> int:
+    # every rank trains on the same number of batches, the remaining batches of an epoch are dropped
+    return length // world_size()
+
+
+class RankBatchSampler(Sampler[list[int]]):
+    """
+    Distributes the batches of a data set between all ranks. Batches are kept together, because MGDS sorts
+    the samples so that every batch_size consecutive samples share the same resolution.
+    """
+
+    def __init__(self, data_set, batch_size: int):
+        super().__init__()
+        self.data_set = data_set
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[list[int]]:
+        batch_count = shard_length(len(self.data_set) // self.batch_size) * world_size()
+        for batch_index in range(rank(), batch_count, world_size()):
+            start = batch_index * self.batch_size
+            yield list(range(start, start + self.batch_size))
+
+    def __len__(self) -> int:
+        return shard_length(len(self.data_set) // self.batch_size)
+
+
+def shard_data_loader(data_loader: DataLoader) -> DataLoader:
+    return DataLoader(
+        data_loader.dataset,
+        batch_sampler=RankBatchSampler(data_loader.dataset, data_loader.batch_size),
+        collate_fn=data_loader.collate_fn,
+        num_workers=data_loader.num_workers,
+        pin_memory=data_loader.pin_memory,
+    )
+
+
+class NullSummaryWriter:
+    """
+    Replaces the tensorboard SummaryWriter on all ranks except rank 0.
+    """
+
+    def __getattr__(self, name):
+        def ignore(*args, **kwargs):
+            pass
+
+        return ignore
@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class Fp8ScaleMode(Enum):
+    TENSOR = 'TENSOR'
+    CHANNEL = 'CHANNEL'
+    BLOCK = 'BLOCK'
+
+    def __str__(self):
+        return self.value
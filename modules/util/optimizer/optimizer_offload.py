@@ -0,0 +1,156 @@
+import concurrent.futures
+
+import torch
+from torch import Tensor
+from torch.nn import Parameter
+
+
+class _HostStateView(dict):
+    # resolves the state of a host parameter to the state of its train device parameter, so the optimizer state
+    # stays keyed by the original parameters and can be saved and loaded as usual
+    def __init__(self, optimizer: torch.optim.Optimizer, parameters: dict[int, Parameter]):
+        super().__init__()
+        self.__optimizer = optimizer
+        self.__parameters = parameters
+
+    def __getitem__(self, host_parameter: Parameter) -> dict:
+        return self.__optimizer.state[self.__parameters[id(host_parameter)]]
+
+
+class OptimizerOffloader:
+    """
+    Runs the parameter updates of an optimizer on the CPU, so the optimizer state never uses train device memory.
+
+    Every parameter has a host copy in pinned memory. When step_parameter is called, the gradient and the current
+    weight are copied to the host on a separate stream, and the update is applied to the host copy on a thread pool.
+    The updated weights are then copied back to the train device on another stream. Copying the weight every step
+    keeps changes made to the train device weights between steps, like embedding normalization. With
+    fused_back_pass, the updates overlap with the rest of the backward pass. finish() has to be called before the
+    weights are used again.
+
+    The update runs the same step_parameter function of the optimizer, only on the host copy of the parameter.
+    """
+
+    def __init__(self, optimizer: torch.optim.Optimizer, train_device: torch.device, num_threads: int):
+        self.__optimizer = optimizer
+        self.__train_device = train_device
+        self.__step_parameter = optimizer.step_parameter.__func__
+
+        # (host parameter, train device parameter) by id of the host parameter
+        self.__parameters = {}
+        # host parameter by id of the train device parameter
+        self.__host_parameters = {}
+
+        # Optimizer.__getstate__ only keeps some attributes, copying __dict__ keeps patched ones like
+        # stochastic_rounding
+        self.__host_optimizer = object.__new__(type(optimizer))
+        self.__host_optimizer.__dict__.update(optimizer.__dict__)
+        self.__host_optimizer.state = _HostStateView(optimizer, self.__parameters)
+
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(num_threads, 1), thread_name_prefix="optimizer_offload")
+        self.__pending = []
+
+        if train_device.type == "cuda":
+            self.__gradient_stream = torch.cuda.Stream(train_device)
+            self.__weight_stream = torch.cuda.Stream(train_device)
+        else:
+            self.__gradient_stream = None
+            self.__weight_stream = None
+
+    def __get_host_parameter(self, parameter: Parameter) -> Parameter:
+        host_parameter = self.__host_parameters.get(id(parameter))
+        if host_parameter is None:
+            pin_memory = self.__gradient_stream is not None
+            host_parameter = Parameter(
+                torch.empty(parameter.shape, dtype=parameter.dtype, pin_memory=pin_memory),
+                requires_grad=parameter.requires_grad,
+            )
+            host_parameter.grad = torch.empty(parameter.shape, dtype=parameter.dtype, pin_memory=pin_memory)
+
+            self.__host_parameters[id(parameter)] = host_parameter
+            self.__parameters[id(host_parameter)] = parameter
+        return host_parameter
+
+    def step_parameter(self, parameter: Parameter, group: dict, i: int):
+        if parameter.grad is None:
+            return
+
+        host_parameter = self.__get_host_parameter(parameter)
+        gradient = parameter.grad
+        weight = parameter.data
+
+        if self.__gradient_stream is not None:
+            # waiting for the train stream also ensures that all kernels reading the old weights have finished
+            # before the updated weights are written back
+            self.__gradient_stream.wait_stream(torch.cuda.current_stream(self.__train_device))
+            with torch.cuda.stream(self.__gradient_stream):
+                host_parameter.grad.copy_(gradient, non_blocking=True)
+                host_parameter.data.copy_(weight, non_blocking=True)
+                gradient.record_stream(self.__gradient_stream)
+                event = self.__gradient_stream.record_event()
+        else:
+            host_parameter.grad.copy_(gradient)
+            host_parameter.data.copy_(weight)
+            event = None
+
+        future = self.__executor.submit(self.__step, host_parameter, weight, group, i, event)
+        self.__pending.append(future)
+
+    @torch.no_grad()
+    def __step(
+            self,
+            host_parameter: Parameter,
+            weight: Tensor,
+            group: dict,
+            i: int,
+            event: torch.cuda.Event | None,
+    ):
+        # runs on the thread pool
+        if event is not None:
+            event.synchronize()
+
+        self.__step_parameter(self.__host_optimizer, host_parameter, group, i)
+
+        if self.__weight_stream is not None:
+            with torch.cuda.stream(self.__weight_stream):
+                weight.copy_(host_parameter.data, non_blocking=True)
+        else:
+            weight.copy_(host_parameter.data)
+
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.__optimizer.param_groups:
+            for i, parameter in enumerate(group["params"]):
+                self.step_parameter(parameter, group, i)
+        self.finish()
+
+        return loss
+
+    def finish(self):
+        """
+        Waits until all updates are applied and copied back to the train device.
+        """
+        pending = self.__pending
+        self.__pending = []
+        for future in pending:
+            future.result()
+
+        if self.__weight_stream is not None:
+            torch.cuda.current_stream(self.__train_device).wait_stream(self.__weight_stream)
+
+
+def patch_optimizer_offload(
+        optimizer: torch.optim.Optimizer,
+        train_device: torch.device,
+        num_threads: int,
+) -> OptimizerOffloader:
+    offloader = OptimizerOffloader(optimizer, train_device, num_threads)
+    optimizer.step_parameter = offloader.step_parameter
+    optimizer.step = offloader.step
+    optimizer.finish_offloaded_steps = offloader.finish
+    return offloader
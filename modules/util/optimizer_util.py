@@ -56,7 +56,9 @@ def init_model_parameters(
 
     model.optimizer = create.create_optimizer(parameters, model.optimizer_state_dict, model.train_config)
     if model.optimizer is not None:
-        optimizer_to_device_(model.optimizer, train_device)
+        # offloaded optimizer states are updated on the cpu
+        optimizer_device = torch.device("cpu") if model.train_config.optimizer_offload else train_device
+        optimizer_to_device_(model.optimizer, optimizer_device)
     model.optimizer_state_dict = None
 
     model.ema = create.create_ema(parameters.parameters(), model.ema_state_dict, model.train_config)
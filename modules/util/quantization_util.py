@@ -1,13 +1,21 @@
+import hashlib
+import json
+import os
 from collections.abc import Callable
 
 from modules.module.quantized.LinearFp8 import LinearFp8
 from modules.module.quantized.mixin.QuantizedLinearMixin import QuantizedLinearMixin
 from modules.module.quantized.mixin.QuantizedModuleMixin import QuantizedModuleMixin
+from modules.util.DequantizedWeightCache import dequantized_weight_cache
 from modules.util.enum.DataType import DataType
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
 
 import torch
 from torch import Tensor, nn
 
+from safetensors import safe_open
+from safetensors.torch import save_file
+
 try:
     from modules.module.quantized.LinearNf4 import LinearNf4
 
@@ -16,6 +24,14 @@ except ImportError:
     bnb = None
     LinearNf4 = None
 
+# bump this version if the quantized storage format of any layer changes
+QUANTIZATION_CACHE_VERSION = 1
+
+__quantization_cache_dir: str | None = None
+
+__fp8_scale_mode: Fp8ScaleMode = Fp8ScaleMode.TENSOR
+__fp8_block_size: int = 128
+
 
 def __create_nf4_linear_layer(module: nn.Linear, copy_parameters: bool) -> nn.Module:
     bias = module.bias is not None
@@ -59,6 +75,8 @@ def __create_fp8_linear_layer(module: nn.Linear, copy_parameters: bool) -> nn.Mo
         in_features=module.in_features,
         out_features=module.out_features,
         bias=bias,
+        scale_mode=__fp8_scale_mode,
+        block_size=__fp8_block_size,
     )
 
     if copy_parameters:
@@ -179,7 +197,10 @@ def is_quantized_parameter(
             return parameter_name == "weight"
 
     if isinstance(module, LinearFp8):
-        return parameter_name == "weight"
+        return parameter_name in [
+            "weight",
+            "scale",
+        ]
 
     return False
 
@@ -191,9 +212,132 @@ def quantize_layers(module: nn.Module, device: torch.device, train_dtype: DataTy
                 child_module.compute_dtype = train_dtype.torch_dtype()
                 child_module.quantize(device)
 
+        cache_path = getattr(module, "quantization_cache_path", None)
+        if cache_path is not None:
+            save_quantization_cache(module, cache_path)
+            module.quantization_cache_path = None
+
+
+def set_fp8_scale_mode(scale_mode: Fp8ScaleMode, block_size: int = 128):
+    global __fp8_scale_mode, __fp8_block_size
+    __fp8_scale_mode = scale_mode
+    __fp8_block_size = block_size
+
+
+def set_quantization_cache_dir(cache_dir: str | None):
+    global __quantization_cache_dir
+    __quantization_cache_dir = cache_dir if cache_dir else None
+
+
+def get_quantization_cache_path(
+        module: nn.Module,
+        dtype: DataType,
+        train_dtype: DataType,
+        keep_in_fp32_modules: list[str],
+        filenames: list[str],
+        subfolder: str | None,
+) -> str | None:
+    # int8 layers are quantized by bitsandbytes when they are moved to the device, they can't be cached
+    if __quantization_cache_dir is None or not (dtype.quantize_nf4() or dtype.quantize_fp8()):
+        return None
+
+    # Hub downloads are resolved to a path that contains the commit hash, so the revision is part of the filenames.
+    # Local files are identified by their size and modification time.
+    files = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        files.append([os.path.abspath(filename), stat.st_size, stat.st_mtime_ns])
+
+    key = json.dumps({
+        'version': QUANTIZATION_CACHE_VERSION,
+        'module_type': type(module).__name__,
+        'files': files,
+        'subfolder': subfolder,
+        'dtype': str(dtype),
+        'train_dtype': str(train_dtype),
+        'keep_in_fp32_modules': sorted(keep_in_fp32_modules),
+        'fp8_scale_mode': str(__fp8_scale_mode) if dtype.quantize_fp8() else None,
+        'fp8_block_size': __fp8_block_size if dtype.quantize_fp8() else None,
+    }, sort_keys=True)
+
+    return os.path.join(__quantization_cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.safetensors")
+
+
+def save_quantization_cache(module: nn.Module, cache_path: str):
+    if os.path.isfile(cache_path):
+        return
+
+    state_dict = {}
+    aliases = {}
+    tensor_keys = {}
+    for key, tensor in module.state_dict(keep_vars=False).items():
+        if tensor is None or tensor.device.type == "meta":
+            continue
+
+        # tied weights are stored once, and restored from the same tensor
+        tensor_id = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tensor.shape, tensor.dtype)
+        if tensor_id in tensor_keys:
+            aliases[key] = tensor_keys[tensor_id]
+        else:
+            tensor_keys[tensor_id] = key
+            state_dict[key] = tensor.detach().to(device="cpu").contiguous()
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        save_file(state_dict, cache_path + ".partial", metadata={"aliases": json.dumps(aliases)})
+        os.replace(cache_path + ".partial", cache_path)
+        print(f"Saved quantized weights to cache {cache_path}")
+    except Exception:
+        print(f"Could not save quantized weights to cache {cache_path}")
+        if os.path.isfile(cache_path + ".partial"):
+            os.remove(cache_path + ".partial")
+
+
+def load_quantization_cache(module: nn.Module, cache_path: str):
+    # Quantized layers are skipped by quantize(), because their weights are already stored in the quantized dtype.
+    with safe_open(cache_path, framework="pt", device="cpu") as file:
+        aliases = json.loads(file.metadata().get("aliases", "{}"))
+
+        # keys that share the tensor of a stored key
+        keys_by_alias_key = {}
+        for key, alias_key in aliases.items():
+            keys_by_alias_key.setdefault(alias_key, []).append(key)
+
+        for key in file.keys():  # noqa: SIM118
+            tensor = file.get_tensor(key)
+            __assign_cached_tensor(module, key, tensor)
+            for aliased_key in keys_by_alias_key.get(key, []):
+                __assign_cached_tensor(module, aliased_key, tensor)
+
+
+def __assign_cached_tensor(module: nn.Module, key: str, value: Tensor):
+    key_splits = key.split(".")
+    for split in key_splits[:-1]:
+        module = getattr(module, split)
+    tensor_name = key_splits[-1]
+
+    if tensor_name in module._buffers:
+        if module._buffers[tensor_name] is None:
+            module._buffers[tensor_name] = value
+        else:
+            # some layers keep a separate reference to their buffers, the tensor object has to stay the same
+            module._buffers[tensor_name].data = value
+    elif tensor_name in module._parameters:
+        parameter = module._parameters[tensor_name]
+        if parameter is None:
+            module._parameters[tensor_name] = nn.Parameter(value, requires_grad=False)
+        else:
+            # the parameter keeps its type and requires_grad, like in quantize(). Only integer storage can't
+            # require grads
+            if parameter.requires_grad and not value.is_floating_point():
+                parameter.requires_grad_(False)
+            parameter.data = value
+
 
 def get_unquantized_weight(module: nn.Module, dtype: torch.dtype, device: torch.device) -> Tensor:
     if isinstance(module, QuantizedLinearMixin):
+        if getattr(module, "is_quantized", False):
+            return dequantized_weight_cache.get(module, dtype, device, lambda: module.unquantized_weight(dtype, device))
         return module.unquantized_weight(dtype, device)
 
     return module.weight.detach().to(dtype=dtype)
@@ -215,6 +359,8 @@ def get_offload_tensors(module: nn.Module) -> list[torch.Tensor]:
     if bnb is not None:
         if isinstance(module, LinearNf4):
             tensors += [module.quant_state.absmax]
+    if isinstance(module, LinearFp8):
+        tensors += [module._scale]
     if isinstance(module, nn.Linear | nn.Conv2d):
         tensors += [module.weight]
     if isinstance(module, nn.Linear) and module.bias is not None:
@@ -0,0 +1,80 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import time
+
+from modules.model.BaseModel import BaseModelEmbedding
+from modules.module.AdditionalEmbeddingWrapper import AdditionalEmbeddingWrapper
+from modules.util.args.BenchmarkEmbeddingLookupArgs import BenchmarkEmbeddingLookupArgs
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from util.benchmark_util import print_results, run_isolated
+
+
+class _Tokenizer:
+    # AdditionalEmbeddingWrapper only needs the number of tokens of the tokenizer
+    def __init__(self, token_count: int):
+        self.token_count = token_count
+
+    def __len__(self):
+        return self.token_count
+
+
+def concatenated_forward(wrapper: AdditionalEmbeddingWrapper, x: torch.Tensor) -> torch.Tensor:
+    # the lookup before it was split: the full embedding matrix is concatenated on every call
+    orig_module_weight = wrapper.orig_module.weight[0:wrapper.original_token_count]
+    weight = torch.cat([orig_module_weight] + [embedding.vector for embedding in wrapper.embeddings], dim=0)
+    return F.embedding(input=x, weight=weight)
+
+
+def run_lookups(args: BenchmarkEmbeddingLookupArgs, concatenated: bool) -> tuple[float, int | None]:
+    device = torch.device(args.device)
+    token_count = args.vocab_size + args.additional_tokens
+
+    orig_module = nn.Embedding(args.vocab_size, args.embedding_dim, device=device).requires_grad_(False)
+    vector = torch.randn(args.additional_tokens, args.embedding_dim, device=device, requires_grad=True)
+    embedding = BaseModelEmbedding(
+        uuid="benchmark", placeholder="<benchmark>", vector=vector, is_output_embedding=False,
+    )
+    wrapper = AdditionalEmbeddingWrapper(_Tokenizer(token_count), orig_module, [embedding])
+    x = torch.randint(0, token_count, (args.batch_size, args.sequence_length), device=device)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+
+    start_time = time.perf_counter()
+    for _ in range(args.iterations):
+        output = concatenated_forward(wrapper, x) if concatenated else wrapper.forward(x)
+        output.sum().backward()
+        vector.grad = None
+
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        return time.perf_counter() - start_time, torch.cuda.max_memory_allocated(device)
+    return time.perf_counter() - start_time, None
+
+
+def main():
+    args = BenchmarkEmbeddingLookupArgs.parse_args()
+
+    print(f"Running {args.iterations} embedding lookups with {args.additional_tokens} additional tokens on {args.device}")
+    results = {
+        "before": run_isolated(run_lookups, args, True),
+        "after": run_isolated(run_lookups, args, False),
+    }
+    print_results(results)
+
+    for name, (_, _, _, (lookup_time, peak_device_memory)) in results.items():
+        line = f"{name:>8}: {lookup_time / args.iterations * 1000:8.3f} ms per forward and backward pass"
+        if peak_device_memory is not None:
+            line += f", peak device memory {peak_device_memory / (1024 ** 3):6.2f} GB"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import time
+
+from modules.module.quantized.LinearFp8 import LinearFp8
+from modules.util.args.BenchmarkFp8ScalingArgs import BenchmarkFp8ScalingArgs
+from modules.util.enum.Fp8ScaleMode import Fp8ScaleMode
+
+import torch
+
+from util.benchmark_util import print_results, run_isolated
+
+
+def create_weight(args: BenchmarkFp8ScalingArgs) -> torch.Tensor:
+    # real weights have channels of very different magnitudes and a few large outliers,
+    # a single scale for the whole weight wastes most of the fp8 range on them
+    generator = torch.Generator().manual_seed(0)
+    weight = torch.randn(args.out_features, args.in_features, generator=generator)
+    weight *= torch.empty(args.out_features, 1).log_normal_(std=1.0, generator=generator)
+    outliers = torch.randint(0, weight.numel(), (weight.numel() // 10000 + 1,), generator=generator)
+    weight.view(-1)[outliers] *= 50.0
+    return weight
+
+
+def relative_error(actual: torch.Tensor, expected: torch.Tensor) -> float:
+    return ((actual.float() - expected.float()).norm() / expected.float().norm()).item()
+
+
+def run_scale_mode(args: BenchmarkFp8ScalingArgs, scale_mode: Fp8ScaleMode) -> tuple[float, float, float, float]:
+    device = torch.device(args.device)
+    dtype = args.dtype.torch_dtype()
+    weight = create_weight(args).to(device=device)
+
+    layer = LinearFp8(
+        args.in_features, args.out_features, bias=False, device=device,
+        scale_mode=scale_mode, block_size=args.block_size,
+    ).requires_grad_(False)
+    layer.weight.data.copy_(weight)
+
+    start_time = time.perf_counter()
+    layer.quantize()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    quantize_time = time.perf_counter() - start_time
+
+    weight_error = relative_error(layer.unquantized_weight(torch.float32, device), weight)
+
+    x = torch.randn(args.tokens, args.in_features, generator=torch.Generator().manual_seed(1)).to(device=device)
+    with torch.no_grad():
+        output_error = relative_error(layer(x.to(dtype=dtype)), x @ weight.T)
+
+        # the dequantized weight cache is disabled by default, every forward pass dequantizes the weight
+        layer(x.to(dtype=dtype))
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        start_time = time.perf_counter()
+        for _ in range(args.iterations):
+            layer(x.to(dtype=dtype))
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        forward_time = time.perf_counter() - start_time
+
+    return weight_error, output_error, quantize_time, forward_time
+
+
+def main():
+    args = BenchmarkFp8ScalingArgs.parse_args()
+
+    print(
+        f"Quantizing a {args.out_features}x{args.in_features} weight to float8 and running {args.iterations} "
+        f"forward passes with {args.tokens} tokens on {args.device}"
+    )
+    results = {
+        str(scale_mode): run_isolated(run_scale_mode, args, scale_mode)
+        for scale_mode in Fp8ScaleMode
+    }
+    print_results(results)
+
+    for name, (_, _, _, (weight_error, output_error, quantize_time, forward_time)) in results.items():
+        print(
+            f"{name:>8}: weight error {weight_error:.5f}, output error {output_error:.5f}, "
+            f"quantize {quantize_time * 1000:8.3f} ms, {forward_time / args.iterations * 1000:8.3f} ms per forward pass"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import json
+import os
+import tempfile
+
+from modules.modelLoader.mixin.HFModelLoaderMixin import HFModelLoaderMixin
+from modules.util.args.BenchmarkModelLoadingArgs import BenchmarkModelLoadingArgs
+from modules.util.enum.DataType import DataType
+
+import torch
+
+from transformers import T5Config, T5EncoderModel
+
+import accelerate
+from safetensors.torch import load_file
+from util.benchmark_util import print_results, run_isolated
+
+
+def save_checkpoint(path: str, args: BenchmarkModelLoadingArgs):
+    config = T5Config(
+        vocab_size=32128,
+        d_model=args.hidden_size,
+        d_kv=64,
+        d_ff=args.hidden_size * 4,
+        num_layers=args.num_layers,
+        num_heads=args.hidden_size // 64,
+    )
+    T5EncoderModel(config).save_pretrained(path, max_shard_size=args.max_shard_size)
+
+
+def load_merged(path: str, dtype: DataType):
+    # the loading code before tensors were streamed: all shards are merged into a single state dict first
+    with accelerate.init_empty_weights():
+        sub_module = T5EncoderModel(T5Config.from_pretrained(path))
+    keep_in_fp32_modules = T5EncoderModel._keep_in_fp32_modules or []
+    train_dtype = DataType.FLOAT_32
+
+    index_filename = os.path.join(path, "model.safetensors.index.json")
+    if os.path.isfile(index_filename):
+        with open(index_filename, "r") as f:
+            filenames = sorted(set(json.load(f)["weight_map"].values()))
+    else:
+        filenames = ["model.safetensors"]
+
+    state_dict = {}
+    for f in filenames:
+        state_dict |= load_file(os.path.join(path, f))
+
+    for key, value in state_dict.items():
+        module = sub_module
+        module_name = None
+        key_splits = key.split(".")
+        for split in key_splits[:-1]:
+            module = getattr(module, split)
+            module_name = split
+        tensor_name = key_splits[-1]
+
+        if tensor_name not in module._parameters:
+            continue
+
+        if dtype.is_quantized() or module_name in keep_in_fp32_modules:
+            value = value.to(dtype=train_dtype.torch_dtype())
+        else:
+            value = value.to(dtype=dtype.torch_dtype())
+        module._parameters[tensor_name] = torch.nn.Parameter(value)
+
+    del state_dict
+
+
+def load_streamed(path: str, dtype: DataType):
+    HFModelLoaderMixin()._load_transformers_sub_module(T5EncoderModel, dtype, DataType.FLOAT_32, path)
+
+
+def main():
+    args = BenchmarkModelLoadingArgs.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        print("Saving a synthetic float32 checkpoint to " + path)
+        save_checkpoint(path, args)
+
+        print(f"Loading the checkpoint as {args.dtype}")
+        print_results({
+            "before": run_isolated(load_merged, path, args.dtype),
+            "after": run_isolated(load_streamed, path, args.dtype),
+        })
+
+
+if __name__ == '__main__':
+    main()
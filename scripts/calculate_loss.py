@@ -16,7 +16,7 @@ def main():
     with open(args.config_path, "r") as f:
         train_config.from_dict(json.load(f))
 
-    trainer = GenerateLossesModel(train_config, args.output_path)
+    trainer = GenerateLossesModel(train_config, args.output_path, args.batch_size, args.timesteps)
     trainer.start()
 
 
@@ -6,12 +6,26 @@ from uuid import uuid4
 
 from modules.util import create
 from modules.util.args.ConvertModelArgs import ConvertModelArgs
+from modules.util.convert.streaming_conversion import convert_streaming
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ModelNames import EmbeddingName, ModelNames
+from modules.util.quantization_util import set_fp8_scale_mode
 
 
 def main():
     args = ConvertModelArgs.parse_args()
+    set_fp8_scale_mode(args.fp8_scale_mode, args.fp8_block_size)
+
+    if args.training_method == TrainingMethod.FINE_TUNE:
+        print("Converting model " + args.input_name + " to " + args.output_model_destination)
+        if convert_streaming(
+                model_type=args.model_type,
+                input_name=args.input_name,
+                output_model_format=args.output_model_format,
+                output_model_destination=args.output_model_destination,
+                dtype=args.output_dtype.torch_dtype(),
+        ):
+            return
 
     model_loader = create.create_model_loader(model_type=args.model_type, training_method=args.training_method)
     model_saver = create.create_model_saver(model_type=args.model_type, training_method=args.training_method)
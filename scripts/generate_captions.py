@@ -29,7 +29,8 @@ def main():
         caption_postfix=args.caption_postfix,
         mode=args.mode,
         error_callback=lambda filename: print("Error while processing image " + filename),
-        include_subdirectories=args.include_subdirectories
+        include_subdirectories=args.include_subdirectories,
+        batch_size=args.batch_size,
     )
 
 
@@ -34,7 +34,8 @@ def main():
         expand_pixels=args.expand_pixels,
         alpha=args.alpha,
         error_callback=lambda filename: print("Error while processing image " + filename),
-        include_subdirectories=args.include_subdirectories
+        include_subdirectories=args.include_subdirectories,
+        batch_size=args.batch_size,
     )
 
 
@@ -10,12 +10,14 @@ from modules.util.enum.EMAMode import EMAMode
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ModelNames import ModelNames
+from modules.util.quantization_util import set_fp8_scale_mode
 from modules.util.torch_util import default_device
 
 
 def main():
     args = SampleArgs.parse_args()
     device = default_device
+    set_fp8_scale_mode(args.fp8_scale_mode, args.fp8_block_size)
 
     training_method = TrainingMethod.FINE_TUNE
     train_config = TrainConfig.default_values()
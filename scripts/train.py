@@ -3,32 +3,23 @@ from util.import_util import script_imports
 script_imports()
 
 import json
+import os
 
 from modules.trainer.GenericTrainer import GenericTrainer
+from modules.util import distributed_util
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
 from modules.util.commands.TrainCommands import TrainCommands
 from modules.util.config.SecretsConfig import SecretsConfig
 from modules.util.config.TrainConfig import TrainConfig
 
+import torch
 
-def main():
-    args = TrainArgs.parse_args()
+
+def train(train_config: TrainConfig):
     callbacks = TrainCallbacks()
     commands = TrainCommands()
 
-    train_config = TrainConfig.default_values()
-    with open(args.config_path, "r") as f:
-        train_config.from_dict(json.load(f))
-
-    try:
-        with open("secrets.json" if args.secrets_path is None else args.secrets_path, "r") as f:
-            secrets_dict=json.load(f)
-            train_config.secrets = SecretsConfig.default_values().from_dict(secrets_dict)
-    except FileNotFoundError:
-        if args.secrets_path is not None:
-            raise
-
     trainer = GenericTrainer(train_config, callbacks, commands)
 
     trainer.start()
@@ -43,5 +34,40 @@ def main():
         trainer.end()
 
 
+def train_worker(rank: int, world_size: int, train_config_dict: dict):
+    os.environ["RANK"] = str(rank)
+    os.environ["LOCAL_RANK"] = str(rank)
+    os.environ["WORLD_SIZE"] = str(world_size)
+
+    train(TrainConfig.default_values().from_dict(train_config_dict))
+
+
+def main():
+    args = TrainArgs.parse_args()
+
+    train_config = TrainConfig.default_values()
+    with open(args.config_path, "r") as f:
+        train_config.from_dict(json.load(f))
+
+    try:
+        with open("secrets.json" if args.secrets_path is None else args.secrets_path, "r") as f:
+            secrets_dict=json.load(f)
+            train_config.secrets = SecretsConfig.default_values().from_dict(secrets_dict)
+    except FileNotFoundError:
+        if args.secrets_path is not None:
+            raise
+
+    world_size = len(distributed_util.parse_devices(train_config.distributed_devices))
+    if world_size > 1 and not distributed_util.is_launched_externally():
+        # one worker process per device, each worker runs the full training loop on its own shard of the data
+        torch.multiprocessing.spawn(
+            train_worker,
+            args=(world_size, train_config.to_pack_dict(secrets=True)),
+            nprocs=world_size,
+        )
+    else:
+        train(train_config)
+
+
 if __name__ == '__main__':
     main()
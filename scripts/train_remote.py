@@ -3,12 +3,11 @@ from util.import_util import script_imports
 script_imports()
 
 import json
-import os
 import pickle
 import threading
 import traceback
-from contextlib import suppress
 
+from modules.cloud import callback_stream
 from modules.trainer.GenericTrainer import GenericTrainer
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
@@ -17,58 +16,52 @@ from modules.util.config.SecretsConfig import SecretsConfig
 from modules.util.config.TrainConfig import TrainConfig
 
 
-def write_request(filename,name, *params):
+def write_message(writer : callback_stream.StreamWriter,kind : int,name : str, *params):
     try:
-        with suppress(FileNotFoundError):
-            os.rename(filename,filename+'.write')
-        with open(filename+'.write', 'ab') as f:
-            pickle.dump(name,f)
-            pickle.dump(params,f)
-        os.rename(filename+'.write',filename)
+        writer.write(kind,name,pickle.dumps(params))
     except Exception:
         #TrainCallbacks is suppressing all exceptions; at least print them:
         traceback.print_exc()
         raise
 
-def close_pipe(filename):
-    with open(filename, 'wb'): #send EOF by closing
-        os.remove(filename)
-
 
 
 def command_thread_function(commands: TrainCommands,filename : str,stop_event):
-    while not stop_event.is_set():
-        try:
-            with open(filename, 'rb') as f:
-                remote_commands=pickle.load(f)
-        except FileNotFoundError:
-            break
-        except EOFError:
-            continue
-
-        if remote_commands.get_stop_command():
-            commands.stop()
-        for entry in remote_commands.get_and_reset_sample_custom_commands():
-            commands.sample_custom(entry)
-        if remote_commands.get_and_reset_sample_default_command():
-            commands.sample_default()
-        if remote_commands.get_and_reset_backup_command():
-            commands.backup()
-        if remote_commands.get_and_reset_save_command():
-            commands.save()
+    #commands are appended to this file by the callback stream of the client:
+    with callback_stream.StreamReader(filename) as reader:
+        while not stop_event.wait(callback_stream.POLL_INTERVAL):
+            for frame in reader.read():
+                if frame.kind != callback_stream.KIND_COMMAND:
+                    continue
+                remote_commands=pickle.loads(frame.payload)
+
+                if remote_commands.get_stop_command():
+                    commands.stop()
+                for entry in remote_commands.get_and_reset_sample_custom_commands():
+                    commands.sample_custom(entry)
+                if remote_commands.get_and_reset_sample_default_command():
+                    commands.sample_default()
+                if remote_commands.get_and_reset_backup_command():
+                    commands.backup()
+                if remote_commands.get_and_reset_save_command():
+                    commands.save()
 
 
 
 def main():
     args = TrainArgs.parse_args()
+    writer=None
     if args.callback_path:
+        writer=callback_stream.StreamWriter(args.callback_path)
+        progress,status,sample=callback_stream.KIND_PROGRESS,callback_stream.KIND_STATUS,callback_stream.KIND_SAMPLE
         callbacks = TrainCallbacks(
-            on_update_train_progress=lambda *fargs:write_request(args.callback_path,"on_update_train_progress",*fargs),
-            on_update_status=lambda *fargs:write_request(args.callback_path,"on_update_status",*fargs),
-            on_sample_default=lambda *fargs:write_request(args.callback_path,"on_sample_default",*fargs),
-            on_update_sample_default_progress=lambda *fargs:write_request(args.callback_path,"on_update_sample_default_progress",*fargs),
-            on_sample_custom=lambda *fargs:write_request(args.callback_path,"on_sample_custom",*fargs),
-            on_update_sample_custom_progress=lambda *fargs:write_request(args.callback_path,"on_update_sample_custom_progress",*fargs),
+            on_update_train_progress=lambda *fargs:write_message(writer,progress,"on_update_train_progress",*fargs),
+            on_update_status=lambda *fargs:write_message(writer,status,"on_update_status",*fargs),
+            on_sample_default=lambda *fargs:write_message(writer,sample,"on_sample_default",*fargs),
+            on_update_sample_default_progress=lambda *fargs:write_message(writer,progress,"on_update_sample_default_progress",*fargs),
+            on_sample_custom=lambda *fargs:write_message(writer,sample,"on_sample_custom",*fargs),
+            on_update_sample_custom_progress=lambda *fargs:write_message(writer,progress,"on_update_sample_custom_progress",*fargs),
+            on_update_backup_progress=lambda *fargs:write_message(writer,progress,"on_update_backup_progress",*fargs),
         )
     else:
         callbacks = TrainCallbacks()
@@ -100,11 +93,13 @@ def main():
     finally:
         if args.command_path:
             stop_event.set()
-            close_pipe(args.command_path)
             command_thread.join()
 
         trainer.end()
 
+        if writer:
+            writer.close()
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,53 @@
+import multiprocessing
+import sys
+import time
+from collections.abc import Callable
+from typing import Any
+
+
+def peak_rss() -> int:
+    """
+    Returns the peak resident set size of the current process in bytes.
+    """
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _measure(fn: Callable, args: tuple, result_queue):
+    baseline_rss = peak_rss()
+    start_time = time.perf_counter()
+    result = fn(*args)
+    wall_time = time.perf_counter() - start_time
+    result_queue.put((wall_time, baseline_rss, peak_rss(), result))
+
+
+def run_isolated(fn: Callable, *args) -> tuple[float, int, int, Any]:
+    """
+    Runs fn(*args) in a fresh process, so the peak memory of one run doesn't hide the peak of the next run.
+    fn must be defined at the top level of a module.
+
+    Returns the wall time in seconds, the peak RSS before and after calling fn in bytes, and the result of fn.
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_measure, args=(fn, args, result_queue))
+    process.start()
+    # the result is small enough to fit into the pipe buffer, so the process can exit before it is read
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"benchmark process exited with code {process.exitcode}")
+    return result_queue.get()
+
+
+def print_results(results: dict[str, tuple[float, int, int, Any]]):
+    for name, (wall_time, baseline_rss, rss, _) in results.items():
+        print(
+            f"{name:>8}: {wall_time:8.3f} s, peak RSS {rss / (1024 ** 3):6.2f} GB "
+            f"({(rss - baseline_rss) / (1024 ** 3):+6.2f} GB during the run)"
+        )
@@ -0,0 +1,163 @@
+import os
+import random
+from pathlib import Path
+
+from modules.cloud import chunk_store
+from modules.cloud.ChunkedFileTransfer import ChunkedFileTransfer, LocalChunkRemote
+
+import pytest
+
+CHUNK_SIZE = 1024
+
+
+class _CountingRemote(LocalChunkRemote):
+    def __init__(self, can_compress: bool = True, corrupt_reads: bool = False):
+        super().__init__(can_compress)
+        self.corrupt_reads = corrupt_reads
+        self.put_paths = []
+        self.read_offsets = []
+
+    def put_bytes(self, data: bytes, remote_path: str):
+        self.put_paths.append(remote_path)
+        super().put_bytes(data, remote_path)
+
+    def read_range(self, remote_path: str, offset: int, length: int) -> bytes:
+        self.read_offsets.append(offset)
+        data = super().read_range(remote_path, offset, length)
+        if self.corrupt_reads:
+            data = bytes([data[0] ^ 0xFF]) + data[1:]
+        return data
+
+
+def _random_bytes(seed: int, size: int) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def _create_transfer(tmp_path: Path, remote: LocalChunkRemote, compress: bool = False) -> ChunkedFileTransfer:
+    return ChunkedFileTransfer(
+        remote=remote,
+        remote_chunk_dir=str(tmp_path / "remote" / ".chunks"),
+        local_chunk_dir=str(tmp_path / "local_chunks"),
+        chunk_size=CHUNK_SIZE,
+        workers=4,
+        compress=compress,
+    )
+
+
+def _chunk_upload_count(remote: _CountingRemote) -> int:
+    # the manifest is uploaded as well
+    return sum(1 for path in remote.put_paths if not path.endswith(".json"))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path: Path, compress: bool):
+    if compress and not chunk_store.can_compress():
+        pytest.skip("zstandard is not installed")
+
+    # compressible and incompressible chunks, and a partial last chunk
+    data = _random_bytes(0, 5 * CHUNK_SIZE) + bytes(3 * CHUNK_SIZE) + _random_bytes(1, 100)
+    local_file = tmp_path / "local" / "file.bin"
+    local_file.parent.mkdir()
+    local_file.write_bytes(data)
+    remote_file = tmp_path / "remote" / "file.bin"
+    downloaded_file = tmp_path / "downloaded" / "file.bin"
+
+    transfer = _create_transfer(tmp_path, _CountingRemote(), compress)
+    transfer.upload(local_file, remote_file)
+    assert remote_file.read_bytes() == data
+
+    transfer.download(downloaded_file, remote_file)
+    assert downloaded_file.read_bytes() == data
+
+    # chunks are removed on both sides after the transfer
+    assert chunk_store.list_chunks(transfer.remote_chunk_dir) == []
+    assert chunk_store.list_chunks(transfer.local_chunk_dir) == []
+
+
+def test_duplicate_chunks_are_transferred_once(tmp_path: Path):
+    chunk = _random_bytes(0, CHUNK_SIZE)
+    data = chunk * 6 + _random_bytes(1, CHUNK_SIZE)
+    local_file = tmp_path / "file.bin"
+    local_file.write_bytes(data)
+    remote_file = tmp_path / "remote" / "file.bin"
+    downloaded_file = tmp_path / "downloaded.bin"
+
+    remote = _CountingRemote()
+    transfer = _create_transfer(tmp_path, remote)
+    transfer.upload(local_file, remote_file)
+    transfer.download(downloaded_file, remote_file)
+
+    assert _chunk_upload_count(remote) == 2
+    assert sorted(remote.read_offsets) == [0, 6 * CHUNK_SIZE]
+    assert remote_file.read_bytes() == data
+    assert downloaded_file.read_bytes() == data
+
+
+def test_upload_resumes_with_chunks_present_on_the_remote(tmp_path: Path):
+    data = _random_bytes(0, 8 * CHUNK_SIZE)
+    local_file = tmp_path / "file.bin"
+    local_file.write_bytes(data)
+    remote_file = tmp_path / "remote" / "file.bin"
+
+    remote = _CountingRemote()
+    transfer = _create_transfer(tmp_path, remote)
+
+    # an interrupted upload left the first half of the chunks on the remote
+    os.makedirs(transfer.remote_chunk_dir)
+    for i in range(4):
+        chunk_store.write_chunk(transfer.remote_chunk_dir, data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE], compress=False)
+
+    transfer.upload(local_file, remote_file)
+
+    assert _chunk_upload_count(remote) == 4
+    assert remote_file.read_bytes() == data
+
+
+def test_download_resumes_with_chunks_present_locally(tmp_path: Path):
+    data = _random_bytes(0, 8 * CHUNK_SIZE)
+    remote_file = tmp_path / "remote" / "file.bin"
+    remote_file.parent.mkdir()
+    remote_file.write_bytes(data)
+    downloaded_file = tmp_path / "downloaded.bin"
+
+    remote = _CountingRemote()
+    transfer = _create_transfer(tmp_path, remote)
+
+    # an interrupted download left the last chunks in the local chunk directory
+    os.makedirs(transfer.local_chunk_dir)
+    for i in range(5, 8):
+        chunk_store.write_chunk(transfer.local_chunk_dir, data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE], compress=False)
+
+    transfer.download(downloaded_file, remote_file)
+
+    assert sorted(remote.read_offsets) == [i * CHUNK_SIZE for i in range(5)]
+    assert downloaded_file.read_bytes() == data
+
+
+def test_corrupted_chunks_are_rejected(tmp_path: Path):
+    data = _random_bytes(0, 4 * CHUNK_SIZE)
+    remote_file = tmp_path / "remote" / "file.bin"
+    remote_file.parent.mkdir()
+    remote_file.write_bytes(data)
+    downloaded_file = tmp_path / "downloaded.bin"
+
+    transfer = _create_transfer(tmp_path, _CountingRemote(corrupt_reads=True))
+
+    with pytest.raises(ValueError, match="damaged"):
+        transfer.download(downloaded_file, remote_file)
+
+    assert not downloaded_file.exists()
+    assert chunk_store.list_chunks(transfer.local_chunk_dir) == []
+
+
+def test_damaged_stored_chunks_are_rejected(tmp_path: Path):
+    chunk_dir = str(tmp_path / "chunks")
+    os.makedirs(chunk_dir)
+    name = chunk_store.write_chunk(chunk_dir, _random_bytes(0, CHUNK_SIZE), compress=False)
+    with open(os.path.join(chunk_dir, name), "r+b") as f:
+        first_byte = f.read(1)
+        f.seek(0)
+        f.write(bytes([first_byte[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError, match="damaged"):
+        chunk_store.assemble_file(chunk_dir, [name], str(tmp_path / "assembled.bin"))
@@ -0,0 +1,101 @@
+from modules.util.optimizer.adamw_extensions import patch_adamw
+from modules.util.optimizer.optimizer_offload import patch_optimizer_offload
+
+import torch
+from torch.nn import Parameter
+from torch.optim import AdamW
+
+NUM_STEPS = 4
+
+
+def _create_parameters() -> list[Parameter]:
+    generator = torch.Generator().manual_seed(42)
+    return [
+        Parameter(torch.randn((64, 32), generator=generator)),
+        Parameter(torch.randn((32,), generator=generator)),
+        Parameter(torch.randn((16, 16), generator=generator).to(torch.bfloat16)),
+    ]
+
+
+def _create_gradients(parameters: list[Parameter], step: int) -> list[torch.Tensor]:
+    generator = torch.Generator().manual_seed(step)
+    return [torch.randn(p.shape, generator=generator).to(p.dtype) for p in parameters]
+
+
+def _create_optimizer(parameters: list[Parameter], offload: bool) -> AdamW:
+    optimizer = AdamW(parameters, lr=1e-2, weight_decay=1e-2, foreach=False, fused=False)
+    patch_adamw(optimizer, stochastic_rounding=False)
+    if offload:
+        patch_optimizer_offload(optimizer, torch.device("cpu"), num_threads=2)
+    return optimizer
+
+
+def _assert_equal(direct_parameters, offloaded_parameters, direct_optimizer, offloaded_optimizer):
+    for direct_parameter, offloaded_parameter in zip(direct_parameters, offloaded_parameters, strict=True):
+        assert torch.equal(direct_parameter, offloaded_parameter)
+
+        direct_state = direct_optimizer.state[direct_parameter]
+        offloaded_state = offloaded_optimizer.state[offloaded_parameter]
+        assert direct_state.keys() == offloaded_state.keys()
+        for key in direct_state:
+            assert torch.equal(direct_state[key], offloaded_state[key])
+
+
+def test_offloaded_step_matches_direct_step():
+    direct_parameters = _create_parameters()
+    offloaded_parameters = _create_parameters()
+    direct_optimizer = _create_optimizer(direct_parameters, offload=False)
+    offloaded_optimizer = _create_optimizer(offloaded_parameters, offload=True)
+
+    for step in range(NUM_STEPS):
+        for parameters in [direct_parameters, offloaded_parameters]:
+            for parameter, gradient in zip(parameters, _create_gradients(parameters, step), strict=True):
+                parameter.grad = gradient.clone()
+
+        direct_optimizer.step()
+        offloaded_optimizer.step()
+
+        _assert_equal(direct_parameters, offloaded_parameters, direct_optimizer, offloaded_optimizer)
+
+
+def test_offloaded_step_parameter_matches_direct_step_parameter():
+    # the fused back pass calls step_parameter for each parameter, and finishes the step before the next one
+    direct_parameters = _create_parameters()
+    offloaded_parameters = _create_parameters()
+    direct_optimizer = _create_optimizer(direct_parameters, offload=False)
+    offloaded_optimizer = _create_optimizer(offloaded_parameters, offload=True)
+
+    for step in range(NUM_STEPS):
+        for parameters, optimizer in [
+            (direct_parameters, direct_optimizer),
+            (offloaded_parameters, offloaded_optimizer),
+        ]:
+            for i, (parameter, gradient) in enumerate(zip(parameters, _create_gradients(parameters, step), strict=True)):
+                parameter.grad = gradient.clone()
+                optimizer.step_parameter(parameter, optimizer.param_groups[0], i)
+
+        offloaded_optimizer.finish_offloaded_steps()
+
+        _assert_equal(direct_parameters, offloaded_parameters, direct_optimizer, offloaded_optimizer)
+
+
+def test_offloaded_step_keeps_weight_changes_between_steps():
+    # weights changed in place after a step, like normalized embeddings, must be used by the next step
+    direct_parameters = _create_parameters()
+    offloaded_parameters = _create_parameters()
+    direct_optimizer = _create_optimizer(direct_parameters, offload=False)
+    offloaded_optimizer = _create_optimizer(offloaded_parameters, offload=True)
+
+    for step in range(NUM_STEPS):
+        for parameters in [direct_parameters, offloaded_parameters]:
+            for parameter, gradient in zip(parameters, _create_gradients(parameters, step), strict=True):
+                parameter.grad = gradient.clone()
+
+        direct_optimizer.step()
+        offloaded_optimizer.step()
+
+        with torch.no_grad():
+            for parameter in direct_parameters + offloaded_parameters:
+                parameter.mul_(0.5)
+
+        _assert_equal(direct_parameters, offloaded_parameters, direct_optimizer, offloaded_optimizer)
@@ -0,0 +1,109 @@
+import threading
+from dataclasses import dataclass
+
+from modules.util.CallBatcher import CallBatcher
+
+import torch
+from torch import Tensor
+
+import pytest
+
+NUM_THREADS = 4
+
+
+@dataclass
+class _Output:
+    hidden_states: tuple[Tensor, ...]
+    pooled: Tensor | None
+
+
+class _Encoder:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, x: Tensor, scale: float = 1.0) -> _Output:
+        with self.lock:
+            self.batch_sizes.append(x.shape[0])
+        if self.fail:
+            raise ValueError("encoding failed")
+        return _Output((x * scale, x + scale), None)
+
+
+def _call_concurrently(batcher: CallBatcher, inputs: list[tuple[tuple, dict]]) -> list:
+    results = [None] * len(inputs)
+    barrier = threading.Barrier(len(inputs))
+
+    def run(index: int):
+        args, kwargs = inputs[index]
+        barrier.wait()
+        try:
+            results[index] = batcher(*args, **kwargs)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _batcher(encoder: _Encoder) -> CallBatcher:
+    return CallBatcher(encoder, NUM_THREADS, "test", "items", max_wait_time=0.5)
+
+
+def test_concurrent_calls_are_batched():
+    encoder = _Encoder()
+    inputs = [((torch.full((1, 3), float(i)),), {"scale": 2.0}) for i in range(NUM_THREADS)]
+
+    results = _call_concurrently(_batcher(encoder), inputs)
+
+    assert encoder.batch_sizes == [NUM_THREADS]
+    for (args, _), result in zip(inputs, results, strict=True):
+        assert isinstance(result, _Output)
+        assert torch.equal(result.hidden_states[0], args[0] * 2.0)
+        assert torch.equal(result.hidden_states[1], args[0] + 2.0)
+        assert result.pooled is None
+        # outputs don't share the storage of the batch
+        assert result.hidden_states[0].untyped_storage().nbytes() == args[0].untyped_storage().nbytes()
+
+
+def test_calls_with_different_arguments_are_not_batched():
+    encoder = _Encoder()
+    inputs = [
+        ((torch.ones(1, 3),), {"scale": 1.0}),
+        ((torch.ones(1, 3),), {"scale": 2.0}),
+        ((torch.ones(1, 4),), {"scale": 1.0}),
+        ((torch.ones(1, 4),), {"scale": 1.0}),
+    ]
+
+    results = _call_concurrently(_batcher(encoder), inputs)
+
+    assert sorted(encoder.batch_sizes) == [1, 1, 2]
+    for (args, kwargs), result in zip(inputs, results, strict=True):
+        assert torch.equal(result.hidden_states[0], args[0] * kwargs["scale"])
+
+
+def test_calls_that_cant_be_batched_run_directly():
+    encoder = _Encoder()
+    batcher = _batcher(encoder)
+
+    result = batcher(torch.ones(2, 3))
+
+    assert encoder.batch_sizes == [2]
+    assert torch.equal(result.hidden_states[0], torch.ones(2, 3))
+
+
+def test_errors_are_raised_in_every_caller():
+    inputs = [((torch.ones(1, 3),), {}) for _ in range(NUM_THREADS)]
+
+    results = _call_concurrently(_batcher(_Encoder(fail=True)), inputs)
+
+    for result in results:
+        assert isinstance(result, ValueError)
+
+    with pytest.raises(ValueError, match="encoding failed"):
+        _batcher(_Encoder(fail=True))(torch.ones(1, 3))
@@ -0,0 +1,126 @@
+from modules.util.LayerOffloadPlanner import (
+    BACKWARD_COMPUTE_FACTOR,
+    LayerCost,
+    LayerOffloadPlan,
+    load_plan,
+    plan_key,
+    plan_layer_offloading,
+    required_bytes,
+    save_plan,
+    simulate_step,
+)
+
+import pytest
+
+NUM_LAYERS = 8
+LAYER_BYTES = 100
+LAYER_COMPUTE_TIME = 0.01
+# transferring a layer in one direction takes twice as long as its forward pass, so transfers can't be hidden
+# completely behind compute
+BANDWIDTH = LAYER_BYTES / LAYER_COMPUTE_TIME / 2
+
+
+def _layer_costs() -> list[LayerCost]:
+    return [LayerCost(LAYER_BYTES, LAYER_COMPUTE_TIME) for _ in range(NUM_LAYERS)]
+
+
+def _compute_time(layer_costs: list[LayerCost]) -> float:
+    return sum(cost.compute_time for cost in layer_costs) * (1.0 + BACKWARD_COMPUTE_FACTOR)
+
+
+def test_required_bytes():
+    layer_costs = _layer_costs()
+    layer_costs[3] = LayerCost(300, LAYER_COMPUTE_TIME)
+
+    # all layers resident
+    assert required_bytes(layer_costs, list(range(NUM_LAYERS)), 0) == 1000
+    # two resident layers, and the largest window of 3 streamed layers contains the large layer
+    assert required_bytes(layer_costs, [0, 1], 2) == 200 + 500
+
+
+def test_simulate_step_without_transfer_cost():
+    layer_costs = _layer_costs()
+
+    # infinite bandwidth, the step only consists of compute
+    step_time = simulate_step(layer_costs, [], 1, float("inf"), float("inf"))
+    assert step_time == pytest.approx(_compute_time(layer_costs))
+
+
+def test_simulate_step_with_slow_transfers():
+    layer_costs = _layer_costs()
+    streamed_step_time = simulate_step(layer_costs, [], 1, BANDWIDTH, BANDWIDTH)
+    resident_step_time = simulate_step(layer_costs, list(range(NUM_LAYERS)), 0, BANDWIDTH, BANDWIDTH)
+
+    assert resident_step_time == pytest.approx(_compute_time(layer_costs))
+    assert streamed_step_time > resident_step_time
+
+
+def test_plan_keeps_all_layers_if_they_fit():
+    layer_costs = _layer_costs()
+
+    plan = plan_layer_offloading(layer_costs, NUM_LAYERS * LAYER_BYTES, 1000.0, 1000.0)
+
+    assert plan.resident_layers == list(range(NUM_LAYERS))
+    assert plan.prefetch_distance == 0
+    assert plan.step_time == pytest.approx(_compute_time(layer_costs))
+
+
+def test_plan_returns_none_if_the_smallest_window_does_not_fit():
+    assert plan_layer_offloading(_layer_costs(), 2 * LAYER_BYTES - 1, 1000.0, 1000.0) is None
+
+
+@pytest.mark.parametrize("budget_layers", [2, 3, 5, 7])
+def test_plan_fits_into_the_budget(budget_layers: int):
+    layer_costs = _layer_costs()
+    vram_budget = budget_layers * LAYER_BYTES
+
+    plan = plan_layer_offloading(layer_costs, vram_budget, BANDWIDTH, BANDWIDTH)
+
+    assert plan is not None
+    assert required_bytes(layer_costs, plan.resident_layers, plan.prefetch_distance) <= vram_budget
+    assert plan.step_time == pytest.approx(
+        simulate_step(layer_costs, plan.resident_layers, plan.prefetch_distance, BANDWIDTH, BANDWIDTH)
+    )
+    # the plan is never slower than streaming all layers with the smallest window
+    assert plan.step_time <= simulate_step(layer_costs, [], 1, BANDWIDTH, BANDWIDTH)
+
+
+def test_larger_budget_is_not_slower():
+    layer_costs = _layer_costs()
+
+    step_times = [
+        plan_layer_offloading(layer_costs, budget_layers * LAYER_BYTES, BANDWIDTH, BANDWIDTH).step_time
+        for budget_layers in range(2, NUM_LAYERS + 1)
+    ]
+
+    assert all(a >= b - 1e-9 for a, b in zip(step_times, step_times[1:], strict=False))
+
+
+def test_plan_round_trip(tmp_path):
+    path = str(tmp_path / "plans.json")
+    key = plan_key([LAYER_BYTES] * NUM_LAYERS, 3 * LAYER_BYTES, "cuda", 1)
+    plan = LayerOffloadPlan([2, 0], 1, 0.5)
+
+    assert load_plan(path, key) is None
+
+    save_plan(path, key, plan)
+    loaded_plan = load_plan(path, key)
+
+    assert loaded_plan.resident_layers == [0, 2]
+    assert loaded_plan.prefetch_distance == 1
+    assert loaded_plan.step_time == 0.5
+    assert load_plan(path, plan_key([LAYER_BYTES] * NUM_LAYERS, 4 * LAYER_BYTES, "cuda", 1)) is None
+
+
+def test_plan_keeps_expensive_transfers_resident():
+    # one layer is as large as all other layers together, streaming it would stall the compute stream
+    layer_costs = _layer_costs()
+    layer_costs[4] = LayerCost(8 * LAYER_BYTES, LAYER_COMPUTE_TIME)
+    vram_budget = 11 * LAYER_BYTES
+
+    plan = plan_layer_offloading(layer_costs, vram_budget, BANDWIDTH, BANDWIDTH)
+
+    assert plan.resident_layers == [4]
+    assert plan.prefetch_distance == 2
+    # peak memory: the resident layer, and a window of 3 streamed layers
+    assert required_bytes(layer_costs, plan.resident_layers, plan.prefetch_distance) == 11 * LAYER_BYTES